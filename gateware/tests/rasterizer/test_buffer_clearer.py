@@ -1,18 +1,26 @@
 from amaranth.sim import *
 from zynq_gpu.rasterizer.buffer_clearer import BufferClearer
+from zynq_gpu.rasterizer.types import PixelFormat
 import unittest
 from ..utils import wait_until, AxiEmulator
 
 
 class BufferClearerTest(unittest.TestCase):
     def test(self):
+        self._test(PixelFormat.RGB888, bytes([0xAA, 0xBB, 0xCC] * 48))
+
+    def test_xrgb8888(self):
+        self._test(PixelFormat.XRGB8888, bytes([0xAA, 0xBB, 0xCC, 0x00] * 36))
+
+    def test_rgb565(self):
+        self._test(PixelFormat.RGB565, bytes([0xAA, 0xBB] * 72))
+
+    @staticmethod
+    def _test(pixel_format: PixelFormat, data: bytes):
         dut = BufferClearer()
 
         base_addr = 0x4000_0000
 
-        data = bytes([
-             0xAA, 0xBB, 0xCC
-        ] * 48)
         mem = bytearray(len(data))
 
         def write(addr, _, value, mask):
@@ -30,6 +38,7 @@ class BufferClearerTest(unittest.TestCase):
                 yield dut.control.payload.base_addr.eq(base_addr >> 7)
                 yield dut.control.payload.words.eq(len(data) // 8)
                 yield dut.control.payload.pattern.eq(0xCCBBAA)
+                yield dut.control.payload.format.eq(pixel_format.value)
                 yield dut.control.valid.eq(1)
                 yield
                 yield dut.control.valid.eq(0)
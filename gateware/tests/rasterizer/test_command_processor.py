@@ -2,8 +2,11 @@ from dataclasses import dataclass
 import random
 import struct
 
+from amaranth import Module
+from amaranth.lib import wiring
 from amaranth.sim import *
 from zynq_gpu.rasterizer.command_processor import Command, CommandProcessor
+from zynq_gpu.rasterizer.rasterizer_pipelined import Rasterizer as PipelinedRasterizer
 import unittest
 from .utils import Vertex
 from ..utils import wait_until, AxiEmulator, make_testbench_process
@@ -24,10 +27,11 @@ class BufferClear:
     pattern: int
     addr: int
     words: int
+    format: int = 0
 
 
 def pack_vertex(v: Vertex):
-    return v.x | (v.y << 11) | (v.z << 22) | (v.r << 38) | (v.g << 46) | (v.b << 54)
+    return (v.x & 0xFFF) | ((v.y & 0xFFF) << 12) | (v.z << 24) | (v.r << 40) | (v.g << 48) | (v.b << 56)
 
 
 def pack_read_texture(r: ReadTexture):
@@ -63,6 +67,7 @@ def pack_read_texture(r: ReadTexture):
 def pack_buffer_clear(c: BufferClear):
     cmd = (
         Command.CLEAR_BUFFER.value |
+        (c.format << 6) |
         (c.pattern << 8)
     )
     return struct.pack("<3I", cmd, c.addr, c.words)
@@ -73,6 +78,9 @@ def check_triangle(dut, i, triangle):
     texture_buffer = (yield dut.triangles.payload.texture_buffer)
     assert texture_enable == int(triangle[3])
     assert texture_buffer == triangle[4]
+    # Depth flags, only given by some tests
+    depth = (yield dut.triangles.payload.depth.as_value())
+    assert depth == (triangle[5] if len(triangle) > 5 else 0), f"{depth} / {triangle}"
     for sig, v in [("v0", triangle[0]), ("v1", triangle[1]), ("v2", triangle[2])]:
         p_v = getattr(dut.triangles.payload, sig)
         for attr in "xyzrgb":
@@ -95,6 +103,7 @@ class CommandProcessorTest(unittest.TestCase):
                 Vertex(0xD, 0xE, 0xF, 0x0, 0x1, 0x2),
                 False,
                 0b00,
+                0b0000,
             ),
             (
                 Vertex(0x3, 0x4, 0x5, 0x6, 0x7, 0x8),
@@ -102,6 +111,7 @@ class CommandProcessorTest(unittest.TestCase):
                 Vertex(0xF, 0x0, 0x1, 0x2, 0x3, 0x4),
                 True,
                 0b11,
+                0b11111,
             ),
             (
                 Vertex(0x7FF, 0,     0,      0, 0, 0),
@@ -109,6 +119,7 @@ class CommandProcessorTest(unittest.TestCase):
                 Vertex(0,     0,     0xFFFF, 0, 0, 0),
                 False,
                 0b11,
+                0b0110,
             ),
             (
                 Vertex(0, 0, 0, 0xFF, 0,    0),
@@ -116,24 +127,35 @@ class CommandProcessorTest(unittest.TestCase):
                 Vertex(0, 0, 0, 0,    0,    0xFF),
                 True,
                 0b00,
+                0b1001,
+            ),
+            (
+                Vertex(-0x800, -1,     0, 0, 0, 0),
+                Vertex(-1,     -0x800, 0, 0, 0, 0),
+                Vertex(0x7FF,  -0x7FF, 0, 0, 0, 0),
+                False,
+                0b00,
+                0b0000,
             ),
         ]
         for _ in range(10):
             def rand_vert():
                 return Vertex(
-                    random.randrange(1 << 11),
-                    random.randrange(1 << 11),
+                    random.randrange(-(1 << 11), 1 << 11),
+                    random.randrange(-(1 << 11), 1 << 11),
                     random.randrange(1 << 16),
                     random.randrange(1 << 8),
                     random.randrange(1 << 8),
                     random.randrange(1 << 8),
                 )
-            triangles += [(rand_vert(), rand_vert(), rand_vert(), random.randrange(2), random.randrange(4))]
+            triangles += [(rand_vert(), rand_vert(), rand_vert(), random.randrange(2), random.randrange(4),
+                          random.randrange(32))]
 
         command_mem = bytes()
         for triangle in triangles:
             command_mem += bytes([
-                *struct.pack("<I", Command.DRAW_TRIANGLE.value | (int(triangle[3]) << 6) | (triangle[4] << 7)),
+                *struct.pack("<I", Command.DRAW_TRIANGLE.value | (int(triangle[3]) << 6) | (triangle[4] << 7) |
+                                   (triangle[5] << 9)),
                 *struct.pack("<3Q", *[pack_vertex(v) for v in triangle[:3]]),
             ])
 
@@ -168,6 +190,268 @@ class CommandProcessorTest(unittest.TestCase):
         sim.add_clock(1e-6)
         sim.run()
 
+    def test_triangle_queue(self):
+        dut = CommandProcessor(triangle_queue_depth=4)
+
+        base_addr = 0x4000_0000
+
+        rng = random.Random(20)
+        triangles = []
+        for _ in range(8):
+            vertices = [Vertex(rng.randrange(1 << 11), rng.randrange(1 << 11), rng.randrange(1 << 16),
+                               rng.randrange(1 << 8), rng.randrange(1 << 8), rng.randrange(1 << 8)) for _ in range(3)]
+            triangles.append((*vertices, rng.randrange(2), rng.randrange(4), rng.randrange(32)))
+
+        command_mem = bytes()
+        for triangle in triangles:
+            command_mem += struct.pack("<I", Command.DRAW_TRIANGLE.value | (int(triangle[3]) << 6) |
+                                       (triangle[4] << 7) | (triangle[5] << 9))
+            command_mem += struct.pack("<3Q", *[pack_vertex(v) for v in triangle[:3]])
+        command_mem += struct.pack("<I", Command.FAST_CLEAR_DEPTH.value)
+
+        def read(addr, _):
+            off = addr - base_addr
+            return struct.unpack("<I", command_mem[off:off+4])[0]
+
+        emulator = AxiEmulator(dut.axi, read, None)
+
+        def control():
+            yield dut.rasterizer_idle.eq(1)
+            yield dut.control.base_addr.eq(base_addr >> 6)
+            yield dut.control.words.eq(len(command_mem) // 4)
+            yield dut.control.trigger.eq(1)
+            yield
+            yield dut.control.trigger.eq(0)
+
+        def check():
+            # The rasterizer is busy, triangles are decoded until the queue is full
+            full = 0
+            for _ in range(300):
+                full += (yield dut.triangle_queue_full)
+                assert not (yield dut.depth_fast_clear)
+                yield
+            assert full > 0
+            assert not (yield dut.idle)
+
+            yield dut.triangles.ready.eq(1)
+            for i, t in enumerate(triangles):
+                yield from wait_until(dut.triangles.valid)
+                yield from check_triangle(dut, i, t)
+                # Queued triangles are drawn before the depth buffer is cleared
+                assert not (yield dut.depth_fast_clear)
+                yield
+
+            pulses = 0
+            for _ in range(10):
+                yield Settle()
+                pulses += (yield dut.depth_fast_clear)
+                yield
+            assert pulses == 1, pulses
+            assert (yield dut.idle)
+
+        sim = Simulator(dut)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_sync_process(make_testbench_process(check))
+        sim.add_clock(1e-6)
+        sim.run()
+
+    def test_call(self):
+        dut = CommandProcessor()
+
+        base_addr = 0x4000_0000
+        secondary_addrs = [0x4100_0000, 0x4100_1000]
+
+        rng = random.Random(24)
+        triangles = []
+        for _ in range(7):
+            vertices = [Vertex(rng.randrange(1 << 11), rng.randrange(1 << 11), rng.randrange(1 << 16),
+                               rng.randrange(1 << 8), rng.randrange(1 << 8), rng.randrange(1 << 8)) for _ in range(3)]
+            triangles.append((*vertices, rng.randrange(2), rng.randrange(4), rng.randrange(32)))
+
+        def pack_triangle(triangle):
+            return struct.pack("<I", Command.DRAW_TRIANGLE.value | (int(triangle[3]) << 6) | (triangle[4] << 7) |
+                               (triangle[5] << 9)) + struct.pack("<3Q", *[pack_vertex(v) for v in triangle[:3]])
+
+        def pack_call(addr, mem):
+            return struct.pack("<3I", Command.CALL.value, addr, len(mem) // 4)
+
+        # Ends with its last command
+        secondary_mem_0 = pack_triangle(triangles[1]) + pack_triangle(triangles[2])
+        # Returns early, the last triangle is skipped
+        secondary_mem_1 = pack_triangle(triangles[4]) + struct.pack("<I", Command.RETURN.value) + \
+            pack_triangle(triangles[6])
+        command_mem = pack_triangle(triangles[0]) + pack_call(secondary_addrs[0], secondary_mem_0) + \
+            pack_triangle(triangles[3]) + pack_call(secondary_addrs[1], secondary_mem_1) + \
+            struct.pack("<I", Command.RETURN.value) + pack_triangle(triangles[5])
+        expected = triangles[:6]
+
+        buffers = [
+            (base_addr, command_mem),
+            (secondary_addrs[0], secondary_mem_0),
+            (secondary_addrs[1], secondary_mem_1),
+        ]
+
+        def read(addr, _):
+            for buffer_addr, mem in buffers:
+                if buffer_addr <= addr < buffer_addr + len(mem):
+                    off = addr - buffer_addr
+                    return struct.unpack("<I", mem[off:off+4])[0]
+            assert False, f"Read outside of command buffers at {hex(addr)}"
+
+        emulator = AxiEmulator(dut.axi, read, None)
+
+        def control():
+            yield dut.control.base_addr.eq(base_addr >> 6)
+            yield dut.control.words.eq(len(command_mem) // 4)
+            yield dut.control.trigger.eq(1)
+            yield
+            yield dut.control.trigger.eq(0)
+
+        def check():
+            yield dut.triangles.ready.eq(1)
+            for i, t in enumerate(expected):
+                yield from wait_until(dut.triangles.valid)
+                yield from check_triangle(dut, i, t)
+                yield
+            yield from wait_until(dut.idle)
+            for _ in range(20):
+                assert not (yield dut.triangles.valid)
+                yield
+
+        sim = Simulator(dut)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_sync_process(make_testbench_process(check))
+        sim.add_clock(1e-6)
+        sim.run()
+
+    def test_fence(self):
+        dut = CommandProcessor()
+
+        base_addr = 0x4000_0000
+        fence_addr = 0x4200_0010
+
+        triangle = (Vertex(1, 2, 3, 4, 5, 6), Vertex(7, 8, 9, 10, 11, 12), Vertex(13, 14, 15, 16, 17, 18), 0, 0, 0)
+        command_mem = struct.pack("<I", Command.DRAW_TRIANGLE.value) + \
+            struct.pack("<3Q", *[pack_vertex(v) for v in triangle[:3]]) + \
+            struct.pack("<3I", Command.FENCE.value | (1 << 6), fence_addr, 0x1234_5678)
+
+        def read(addr, _):
+            off = addr - base_addr
+            return struct.unpack("<I", command_mem[off:off+4])[0]
+
+        writes = []
+
+        def write(addr, bytes_per_beat, value, strb):
+            assert bytes_per_beat == 4
+            assert strb == 0b1111
+            writes.append((addr, value))
+
+        emulator = AxiEmulator(dut.axi, read, write)
+
+        def control():
+            yield dut.clearer_idle.eq(1)
+            yield dut.control.base_addr.eq(base_addr >> 6)
+            yield dut.control.words.eq(len(command_mem) // 4)
+            yield dut.control.trigger.eq(1)
+            yield
+            yield dut.control.trigger.eq(0)
+
+        def check():
+            yield dut.triangles.ready.eq(1)
+            yield from wait_until(dut.triangles.valid)
+            yield from check_triangle(dut, 0, triangle)
+            yield
+
+            # Not written while the triangle is still being drawn
+            for _ in range(100):
+                assert not (yield dut.fence_irq)
+                yield
+            assert writes == []
+
+            yield dut.rasterizer_idle.eq(1)
+            yield from wait_until(dut.fence_irq)
+            assert writes == [(fence_addr, 0x1234_5678)], writes
+            yield
+            yield from wait_until(dut.idle)
+            assert not (yield dut.fence_irq)
+
+        sim = Simulator(dut)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_sync_process(make_testbench_process(check))
+        sim.add_clock(1e-6)
+        sim.run()
+
+    def test_fence_after_draw(self):
+        self._test_fence_after_draw(0)
+        self._test_fence_after_draw(16)
+
+    @staticmethod
+    def _test_fence_after_draw(triangle_queue_depth):
+        # With the real rasterizer, whose idle only follows its pipeline a few cycles late
+        m = Module()
+        m.submodules.dut = dut = CommandProcessor(triangle_queue_depth=triangle_queue_depth)
+        m.submodules.rasterizer = rasterizer = PipelinedRasterizer()
+        wiring.connect(m, dut.triangles, rasterizer.triangles)
+        m.d.comb += dut.rasterizer_idle.eq(rasterizer.idle)
+
+        width = 64
+        height = 16
+        base_addr = 0x4000_0000
+        fence_addr = 0x4200_0010
+        fb_base = 0x1000_0000
+        z_base = fb_base + width * height * 3
+
+        triangle = (Vertex(0, 0, 0xFF03, 0xFF, 0, 0), Vertex(10, 0, 0xFF03, 0, 0xFF, 0),
+                    Vertex(0, 10, 0xFF03, 0, 0, 0xFF))
+        command_mem = struct.pack("<I", Command.DRAW_TRIANGLE.value) + \
+            struct.pack("<3Q", *[pack_vertex(v) for v in triangle]) + \
+            struct.pack("<3I", Command.FENCE.value | (1 << 6), fence_addr, 0x1234_5678)
+
+        def read(addr, _):
+            off = addr - base_addr
+            return struct.unpack("<I", command_mem[off:off+4])[0]
+
+        # Memory writes of both, in order
+        writes = []
+
+        def write(addr, bytes_per_beat, value, strb):
+            writes.append(addr)
+
+        emulator = AxiEmulator(dut.axi, read, write)
+        emulator_framebuffer = AxiEmulator(rasterizer.axi, None, write, aw_buffer=4, w_buffer=4, write_latency=2)
+        emulator_z_buffer = AxiEmulator(rasterizer.axi2, lambda addr, _: 0, write, ar_buffer=8, aw_buffer=4,
+                                        w_buffer=4, read_latency=2, write_latency=2)
+
+        def control():
+            yield rasterizer.width.eq(width)
+            yield rasterizer.fb_base.eq(fb_base)
+            yield rasterizer.z_base.eq(z_base)
+            yield rasterizer.scissor_max.x.eq(width - 1)
+            yield rasterizer.scissor_max.y.eq(height - 1)
+            yield dut.clearer_idle.eq(1)
+            yield dut.control.base_addr.eq(base_addr >> 6)
+            yield dut.control.words.eq(len(command_mem) // 4)
+            yield dut.control.trigger.eq(1)
+            yield
+            yield dut.control.trigger.eq(0)
+
+            yield from wait_until(dut.fence_irq, 100_000)
+            assert writes[-1] == fence_addr, writes
+            pixels = [addr for addr in writes if fb_base <= addr < z_base]
+            assert pixels, writes
+            assert fence_addr not in writes[:-1], writes
+
+        sim = Simulator(m)
+        emulator.add_to_sim(sim)
+        emulator_framebuffer.add_to_sim(sim)
+        emulator_z_buffer.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_clock(1e-6)
+        sim.run()
+
     def test_texture(self):
         dut = CommandProcessor()
 
@@ -262,6 +546,7 @@ class CommandProcessorTest(unittest.TestCase):
         clears = [
             BufferClear(0xFFFFFF, 0x1AABBCC, 0x69420),
             BufferClear(0x010203, 0x1694200, 0x1234),
+            BufferClear(0x00BEEF, 0x1000000, 0x4321, 2),
         ]
         triangle = (
             Vertex(0x1, 0x2, 0x3, 0x4, 0x5, 0x6),
@@ -302,9 +587,11 @@ class CommandProcessorTest(unittest.TestCase):
                 act_pattern = (yield dut.buffer_clears.payload.pattern)
                 act_base = (yield dut.buffer_clears.payload.base_addr)
                 act_words = (yield dut.buffer_clears.payload.words)
+                act_format = (yield dut.buffer_clears.payload.format)
                 assert act_pattern == clear.pattern, f"{act_pattern:06X} / {clear.pattern:06X}"
                 assert act_base == clear.addr, f"{act_base:08X} / {clear.addr:08X}"
                 assert act_words == clear.words, f"{act_words} / {clear.words}"
+                assert act_format == clear.format, f"{act_format} / {clear.format}"
                 yield
             yield dut.triangles.ready.eq(1)
             yield from wait_until(dut.triangles.valid)
@@ -317,3 +604,94 @@ class CommandProcessorTest(unittest.TestCase):
         sim.add_sync_process(make_testbench_process(check))
         sim.add_clock(1e-6)
         sim.run()
+
+    def test_tile_control(self):
+        dut = CommandProcessor()
+
+        base_addr = 0x4000_0000
+
+        # (flush, load, store_depth, clear_color)
+        controls = [
+            (0, 1, 0, 0x123456),
+            (1, 0, 1, 0),
+            (0, 0, 0, 0xFFFFFF),
+            (1, 0, 0, 0),
+        ]
+        command_mem = bytes()
+        for flush, load, store_depth, clear_color in controls:
+            if flush:
+                command_mem += struct.pack("<I", Command.FLUSH_TILES.value | (store_depth << 6))
+            else:
+                command_mem += struct.pack("<I", Command.TILE_SETUP.value | (load << 6) | (clear_color << 8))
+
+        def read(addr, _):
+            off = addr - base_addr
+            return struct.unpack("<I", command_mem[off:off+4])[0]
+
+        emulator = AxiEmulator(dut.axi, read, None)
+
+        def control():
+            yield dut.control.base_addr.eq(base_addr >> 6)
+            yield dut.control.words.eq(len(command_mem) // 4)
+            yield dut.control.trigger.eq(1)
+            yield
+            yield dut.control.trigger.eq(0)
+
+            while (yield dut.control.idle):
+                yield
+            yield from wait_until(dut.control.idle, 1000)
+
+        def check():
+            yield dut.tile_control.ready.eq(1)
+            for flush, load, store_depth, clear_color in controls:
+                yield from wait_until(dut.tile_control.valid)
+                assert (yield dut.tile_control.payload.flush) == flush
+                if flush:
+                    assert (yield dut.tile_control.payload.store_depth) == store_depth
+                else:
+                    assert (yield dut.tile_control.payload.load) == load
+                    assert (yield dut.tile_control.payload.clear_color) == clear_color
+                yield
+
+        sim = Simulator(dut)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_sync_process(make_testbench_process(check))
+        sim.add_clock(1e-6)
+        sim.run()
+
+    def test_fast_clear_depth(self):
+        dut = CommandProcessor()
+
+        base_addr = 0x4000_0000
+        command_mem = struct.pack("<2I", Command.FAST_CLEAR_DEPTH.value, Command.FAST_CLEAR_DEPTH.value)
+
+        def read(addr, _):
+            off = addr - base_addr
+            return struct.unpack("<I", command_mem[off:off+4])[0]
+
+        emulator = AxiEmulator(dut.axi, read, None)
+
+        def control():
+            yield dut.control.base_addr.eq(base_addr >> 6)
+            yield dut.control.words.eq(len(command_mem) // 4)
+            yield dut.control.trigger.eq(1)
+            yield
+            yield dut.control.trigger.eq(0)
+
+            pulses = 0
+            for cycle in range(100):
+                # Nothing is cleared while the rasterizer is busy
+                yield dut.rasterizer_idle.eq(cycle >= 50)
+                yield Settle()
+                pulses += (yield dut.depth_fast_clear)
+                if cycle == 49:
+                    assert pulses == 0, pulses
+                yield
+            assert pulses == 2, pulses
+
+        sim = Simulator(dut)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_clock(1e-6)
+        sim.run()
@@ -1,8 +1,9 @@
 from amaranth.sim import *
-from zynq_gpu.rasterizer import EdgeWalker
+from zynq_gpu.rasterizer import EdgeWalker, Traversal
+import random
 import unittest
 from ..utils import wait_until, make_testbench_process
-from .utils import points, points_recip, Vertex
+from .utils import orient2d, points, points_recip, points_raster, Vertex
 
 
 def p2d(xy):
@@ -23,10 +24,11 @@ def submit_triangle(s, v0: Vertex, v1: Vertex, v2: Vertex):
 
 class EdgeWalkerTest(unittest.TestCase):
     @staticmethod
-    def _test_coordinates(triangles, count, *, div_unroll: int = 1, use_fifo: bool = False):
+    def _test_coordinates(triangles, count, *, div_unroll: int = 1, use_fifo: bool = False, size: int = 10,
+                          **kwargs):
         triangles = [[p2d(xy) for xy in t] for t in triangles]
 
-        dut = EdgeWalker(True, div_unroll=div_unroll, use_fifo=use_fifo)
+        dut = EdgeWalker(True, div_unroll=div_unroll, use_fifo=use_fifo, **kwargs)
 
         submit_done = False
 
@@ -39,8 +41,8 @@ class EdgeWalkerTest(unittest.TestCase):
             submit_done = True
 
         def point_read():
-            st = [[False]*10 for _ in range(10)]
-            exp_st = [[False]*10 for _ in range(10)]
+            st = [[False]*size for _ in range(size)]
+            exp_st = [[False]*size for _ in range(size)]
 
             for v0, v1, v2 in triangles:
                 for c in points(v0, v1, v2):
@@ -48,8 +50,8 @@ class EdgeWalkerTest(unittest.TestCase):
 
             def print_state(name, s):
                 print(f"{name}:")
-                print("  | 0 1 2 3 4 5 6 7 8 9")
-                print("----------------------")
+                print("  |", " ".join(str(i % 10) for i in range(size)))
+                print("-" * (2 * size + 2))
                 for i, row in enumerate(s):
                     print(i, "|", end="")
                     for p in row:
@@ -88,10 +90,10 @@ class EdgeWalkerTest(unittest.TestCase):
         sim.run()
 
     @staticmethod
-    def _test_interpolation(triangles, recip: bool, *, div_unroll: int = 1, use_fifo: bool = False):
+    def _test_interpolation(triangles, recip: bool, *, div_unroll: int = 1, use_fifo: bool = False, **kwargs):
         triangles = [[p2d(xy) for xy in t] for t in triangles]
 
-        dut = EdgeWalker(recip, div_unroll=div_unroll, use_fifo=use_fifo)
+        dut = EdgeWalker(recip, div_unroll=div_unroll, use_fifo=use_fifo, **kwargs)
 
         submit_done = False
 
@@ -136,6 +138,259 @@ class EdgeWalkerTest(unittest.TestCase):
         sim.add_clock(1e-6)
         sim.run()
 
+    @staticmethod
+    def _test_attributes(triangles, **kwargs):
+        dut = EdgeWalker(False, attributes=4, **kwargs)
+
+        submit_done = False
+
+        def trig_feed():
+            nonlocal submit_done
+            yield Passive()
+            for vs in triangles:
+                for i, v in enumerate(vs):
+                    for j, attr in enumerate("rgbz"):
+                        yield dut.attributes[j][i].eq(getattr(v, attr))
+                yield from submit_triangle(dut.triangle, *vs)
+            submit_done = True
+
+        def point_read():
+            st = {}
+            exp_st = {}
+
+            for vs in triangles:
+                for v in points_raster(*vs):
+                    exp_st[(v.x, v.y)] = (v.r, v.g, v.b, v.z)
+
+            yield dut.points.ready.eq(1)
+            while True:
+                yield from wait_until(dut.points.valid | dut.idle)
+                if not (yield dut.points.valid) and (yield dut.idle):
+                    if submit_done:
+                        break
+                    yield
+                    continue
+                x, y = (yield dut.points.payload.p.x), (yield dut.points.payload.p.y)
+                attrs = []
+                for j in range(4):
+                    attrs.append((yield dut.point_attributes[j]))
+                st[(x, y)] = tuple(attrs)
+                yield
+
+            assert st.keys() == exp_st.keys(), f"{sorted(st.keys() ^ exp_st.keys())}"
+            for k, exp_v in exp_st.items():
+                assert exp_v == st[k], f"[{k}]: expected {exp_v}, got {st[k]}"
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(trig_feed))
+        sim.add_sync_process(make_testbench_process(point_read))
+        sim.add_clock(1e-6)
+        sim.run()
+
+    @staticmethod
+    def _test_quads(triangles, recip: bool, **kwargs):
+        triangles = [[p2d(xy) for xy in t] for t in triangles]
+
+        dut = EdgeWalker(recip, quad=True, prenormalize=recip, **kwargs)
+
+        submit_done = False
+
+        def trig_feed():
+            nonlocal submit_done
+            yield Passive()
+            for v0, v1, v2 in triangles:
+                yield from submit_triangle(dut.triangle, v0, v1, v2)
+            submit_done = True
+
+        def quad_read():
+            st = {}
+            exp_st = {}
+
+            for v0, v1, v2 in triangles:
+                for c in (points_recip if recip else points)(v0, v1, v2):
+                    exp_st[(c.x, c.y)] = (c.w0, c.w1, c.w2)
+
+            yield dut.quads.ready.eq(1)
+            while True:
+                yield from wait_until(dut.quads.valid | dut.idle)
+                if not (yield dut.quads.valid) and (yield dut.idle):
+                    if submit_done:
+                        break
+                    yield
+                    continue
+                x, y = (yield dut.quads.payload.p.x), (yield dut.quads.payload.p.y)
+                assert x % 2 == 0 and y % 2 == 0, f"unaligned quad at {(x, y)}"
+                mask = yield dut.quads.payload.mask
+                assert mask != 0, f"empty quad at {(x, y)}"
+                for i in range(4):
+                    if not mask & (1 << i):
+                        continue
+                    lane = dut.quads.payload.lanes[i]
+                    st[(x + i % 2, y + i // 2)] = ((yield lane.w0), (yield lane.w1), (yield lane.w2))
+                yield
+
+            assert st.keys() == exp_st.keys(), f"{sorted(st.keys() ^ exp_st.keys())}"
+            for k, exp_v in exp_st.items():
+                v = st[k]
+                if not recip:
+                    v = tuple(w - (1 << 24) if w >= (1 << 23) else w for w in v)
+                assert exp_v == v, f"[{k}]: expected {exp_v}, got {v}"
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(trig_feed))
+        sim.add_sync_process(make_testbench_process(quad_read))
+        sim.add_clock(1e-6)
+        sim.run()
+
+    @staticmethod
+    def _walk(triangles, clip=None, **kwargs) -> dict[tuple[int, int], tuple[int, int, int]]:
+        """Weights of every point output for `triangles`, by coordinates"""
+        triangles = [[p2d(xy) for xy in t] for t in triangles]
+
+        dut = EdgeWalker(True, clip=clip is not None, **kwargs)
+        quad = kwargs.get("quad", False)
+        out = dut.quads if quad else dut.points
+
+        st = {}
+        submit_done = False
+
+        def trig_feed():
+            nonlocal submit_done
+            yield Passive()
+            if clip is not None:
+                (min_x, min_y), (max_x, max_y) = clip
+                yield dut.clip_min.x.eq(min_x)
+                yield dut.clip_min.y.eq(min_y)
+                yield dut.clip_max.x.eq(max_x)
+                yield dut.clip_max.y.eq(max_y)
+            for v0, v1, v2 in triangles:
+                yield from submit_triangle(dut.triangle, v0, v1, v2)
+            submit_done = True
+
+        def point_read():
+            yield out.ready.eq(1)
+            while True:
+                yield from wait_until(out.valid | dut.idle)
+                if not (yield out.valid) and (yield dut.idle):
+                    if submit_done:
+                        break
+                    yield
+                    continue
+                x, y = (yield out.payload.p.x), (yield out.payload.p.y)
+                if quad:
+                    mask = yield out.payload.mask
+                    for i in range(4):
+                        if mask & (1 << i):
+                            lane = out.payload.lanes[i]
+                            k = (x + i % 2, y + i // 2)
+                            st[k] = ((yield lane.w0), (yield lane.w1), (yield lane.w2))
+                else:
+                    st[(x, y)] = ((yield out.payload.w0), (yield out.payload.w1), (yield out.payload.w2))
+                yield
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(trig_feed))
+        sim.add_sync_process(make_testbench_process(point_read))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        return st
+
+    @staticmethod
+    def _test_interleaved(triangles, interleave: int, **kwargs):
+        exp_st = {}
+        for t in triangles:
+            for c in points_recip(*(p2d(xy) for xy in t)):
+                exp_st[(c.x, c.y)] = (c.w0, c.w1, c.w2)
+
+        rows = 2 if kwargs.get("quad") else 1
+        st = {}
+        for phase in range(interleave):
+            points = EdgeWalkerTest._walk(triangles, interleave=interleave, phase=phase, **kwargs)
+            for (x, y), v in points.items():
+                assert (y // rows) % interleave == phase, f"{(x, y)} output by walker {phase}/{interleave}"
+                st[(x, y)] = v
+
+        assert st.keys() == exp_st.keys(), f"{sorted(st.keys() ^ exp_st.keys())}"
+        for k, exp_v in exp_st.items():
+            assert exp_v == st[k], f"[{k}]: expected {exp_v}, got {st[k]}"
+
+    @staticmethod
+    def _test_clipped(triangles, clip, **kwargs):
+        (min_x, min_y), (max_x, max_y) = clip
+        exp_st = {}
+        for t in triangles:
+            for c in points_recip(*(p2d(xy) for xy in t)):
+                if min_x <= c.x <= max_x and min_y <= c.y <= max_y:
+                    exp_st[(c.x, c.y)] = (c.w0, c.w1, c.w2)
+
+        st = EdgeWalkerTest._walk(triangles, clip, **kwargs)
+        assert st == exp_st, f"{sorted(st)} / {sorted(exp_st)}"
+
+    @staticmethod
+    def _count_walk_cycles(triangles, **kwargs):
+        triangles = [[p2d(xy) for xy in t] for t in triangles]
+
+        dut = EdgeWalker(True, **kwargs)
+        out = dut.quads if kwargs.get("quad") else dut.points
+
+        cycles = 0
+
+        def trig_feed():
+            for v0, v1, v2 in triangles:
+                yield from submit_triangle(dut.triangle, v0, v1, v2)
+            yield from wait_until(dut.idle, 100_000)
+
+        def count_cycles():
+            nonlocal cycles
+
+            yield Passive()
+            yield out.ready.eq(1)
+            while True:
+                if not (yield dut.idle):
+                    cycles += 1
+                yield
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(trig_feed))
+        sim.add_sync_process(make_testbench_process(count_cycles))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        return cycles
+
+    @staticmethod
+    def _count_searching_cycles(triangles, **kwargs):
+        triangles = [[p2d(xy) for xy in t] for t in triangles]
+
+        dut = EdgeWalker(True, **kwargs)
+
+        searching = 0
+
+        def trig_feed():
+            for v0, v1, v2 in triangles:
+                yield from submit_triangle(dut.triangle, v0, v1, v2)
+            yield from wait_until(dut.idle, 100_000)
+
+        def count_searching():
+            nonlocal searching
+
+            yield Passive()
+            yield dut.points.ready.eq(1)
+            while True:
+                # Same condition as the `walker_searching` performance counter
+                if not (yield dut.idle) and not (yield dut.points.valid) and (yield dut.points.ready):
+                    searching += 1
+                yield
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(trig_feed))
+        sim.add_sync_process(make_testbench_process(count_searching))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        return searching
+
     @staticmethod
     def _test_raw_interpolation_factors(v0, v1, v2):
         EdgeWalkerTest._test_interpolation([(v0, v1, v2)], False)
@@ -170,3 +425,247 @@ class EdgeWalkerTest(unittest.TestCase):
 
     def test_reciprocals_dont_mix(self):
         self._test_interpolation([((2, 2), (3, 2), (2, 3)), ((4, 4), (8, 4), (4, 8))], True)
+
+    def test_tiled_triangle(self):
+        for tile_size in [2, 4, 8]:
+            self._test_coordinates([((2, 2), (8, 2), (2, 8))], 7 + 6 + 5 + 4 + 3 + 2 + 1,
+                                   traversal=Traversal.TILED, tile_size=tile_size)
+
+    def test_tiled_wrong_vertex_order(self):
+        self._test_coordinates([((2, 2), (2, 8), (8, 2))], 0, traversal=Traversal.TILED, tile_size=2)
+
+    def test_tiled_square(self):
+        self._test_coordinates([((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8))], 7 * 7,
+                               traversal=Traversal.TILED, tile_size=4)
+
+    def test_tiled_diagonal(self):
+        self._test_coordinates([((0, 0), (19, 17), (17, 19))], 39, size=20, traversal=Traversal.TILED, tile_size=4)
+
+    def test_tiled_square_interp(self):
+        self._test_interpolation([((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8))], True,
+                                 traversal=Traversal.TILED, tile_size=2)
+
+    def test_tiled_skips_empty_tiles(self):
+        triangle = [((0, 0), (63, 60), (60, 63))]
+        raster = self._count_searching_cycles(triangle)
+        tiled = self._count_searching_cycles(triangle, traversal=Traversal.TILED, tile_size=8)
+        print(f"searching cycles: raster={raster}, tiled={tiled}")
+        assert tiled * 3 < raster, f"{tiled} / {raster}"
+
+    def test_serpentine_triangle(self):
+        self._test_coordinates([((2, 2), (8, 2), (2, 8))], 7 + 6 + 5 + 4 + 3 + 2 + 1, traversal=Traversal.SERPENTINE)
+
+    def test_serpentine_wrong_vertex_order(self):
+        self._test_coordinates([((2, 2), (2, 8), (8, 2))], 0, traversal=Traversal.SERPENTINE)
+
+    def test_serpentine_square(self):
+        self._test_coordinates([((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8))], 7 * 7,
+                               traversal=Traversal.SERPENTINE)
+
+    def test_serpentine_spans_move(self):
+        # Covered spans of consecutive rows don't overlap, and some rows are empty
+        self._test_coordinates([((0, 0), (19, 7), (18, 7))], 6, size=20, traversal=Traversal.SERPENTINE)
+        self._test_coordinates([((19, 0), (1, 7), (0, 7))], 6, size=20, traversal=Traversal.SERPENTINE)
+
+    def test_serpentine_diagonal(self):
+        self._test_coordinates([((0, 0), (19, 17), (17, 19))], 39, size=20, traversal=Traversal.SERPENTINE)
+        self._test_coordinates([((19, 0), (2, 19), (0, 17))], 39, size=20, traversal=Traversal.SERPENTINE)
+
+    def test_serpentine_square_interp(self):
+        self._test_interpolation([((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8))], True,
+                                 traversal=Traversal.SERPENTINE)
+
+    def test_serpentine_skips_empty_pixels(self):
+        triangle = [((0, 0), (63, 60), (60, 63))]
+        raster = self._count_searching_cycles(triangle)
+        serpentine = self._count_searching_cycles(triangle, traversal=Traversal.SERPENTINE)
+        print(f"searching cycles: raster={raster}, serpentine={serpentine}")
+        assert serpentine * 3 < raster, f"{serpentine} / {raster}"
+
+    def test_fifo_triangle(self):
+        self._test_coordinates([((2, 2), (8, 2), (2, 8))], 7 + 6 + 5 + 4 + 3 + 2 + 1, use_fifo=True)
+
+    def test_fifo_wrong_vertex_order(self):
+        self._test_coordinates([((2, 2), (2, 8), (8, 2)), ((2, 2), (8, 2), (2, 8))], 7 + 6 + 5 + 4 + 3 + 2 + 1,
+                               use_fifo=True)
+
+    def test_fifo_square_interp(self):
+        self._test_interpolation([((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8))], True, use_fifo=True)
+
+    def test_fifo_reciprocals_dont_mix(self):
+        self._test_interpolation([((2, 2), (3, 2), (2, 3)), ((4, 4), (8, 4), (4, 8))], True, use_fifo=True)
+
+    def test_back_to_back_interp(self):
+        triangles = [((x, 0), (x + 1, 0), (x, 1 + x % 3)) for x in range(0, 16, 2)]
+        self._test_interpolation(triangles, True)
+        self._test_interpolation(triangles, True, use_fifo=True)
+        self._test_interpolation(triangles, True, use_fifo=True, traversal=Traversal.SERPENTINE)
+
+    def test_fifo_overlaps_divider(self):
+        triangles = [((x, 0), (x + 4, 0), (x, 4)) for x in range(0, 64, 8)] * 2
+        serial = self._count_searching_cycles(triangles)
+        overlapped = self._count_searching_cycles(triangles, use_fifo=True)
+        print(f"searching cycles: serial={serial}, overlapped={overlapped}")
+        assert overlapped * 2 < serial, f"{overlapped} / {serial}"
+
+    def test_pipelined_recip_interp(self):
+        self._test_interpolation([((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8))], True, pipelined_recip=True)
+
+    def test_pipelined_recip_fifo_interp(self):
+        triangles = [((x, 0), (x + 1, 0), (x, 1 + x % 3)) for x in range(0, 16, 2)]
+        triangles += [((0, 4), (19, 4), (0, 19)), ((19, 4), (19, 19), (0, 19))]
+        self._test_interpolation(triangles, True, use_fifo=True, pipelined_recip=True)
+
+    def test_pipelined_recip_setup_rate(self):
+        triangles = [((x, 0), (x + 1, 0), (x, 1)) for x in range(0, 64, 2)]
+        divider = self._count_searching_cycles(triangles, use_fifo=True)
+        pipelined = self._count_searching_cycles(triangles, use_fifo=True, pipelined_recip=True)
+        print(f"searching cycles: divider={divider}, pipelined={pipelined}")
+        assert pipelined * 3 < divider * 2, f"{pipelined} / {divider}"
+
+    def test_prenormalized_interp(self):
+        triangles = [((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8))]
+        for kwargs in [{}, dict(pipelined_recip=True), dict(traversal=Traversal.SERPENTINE),
+                       dict(traversal=Traversal.TILED, tile_size=4)]:
+            self._test_interpolation(triangles, True, prenormalize=True, **kwargs)
+
+    def test_prenormalized_matches_points_recip(self):
+        # Normalizing the steps once per triangle must give exactly the weights of scaling every point
+        rng = random.Random(1234)
+        triangles = [((0, 0), (250, 0), (0, 2)), ((1, 5), (2, 5), (1, 6))]
+        for i in range(12):
+            ox, oy = (i % 4) * 24, 8 + (i // 4) * 24
+            vs = [(ox + rng.randrange(24), oy + rng.randrange(24)) for _ in range(3)]
+            if orient2d(*(p2d(v) for v in vs)) < 0:
+                vs[1], vs[2] = vs[2], vs[1]
+            triangles.append(vs)
+        self._test_interpolation(triangles, True, prenormalize=True, pipelined_recip=True)
+
+    def test_quad_triangle(self):
+        self._test_quads([((2, 2), (8, 2), (2, 8))], False)
+        self._test_quads([((3, 1), (8, 3), (2, 8))], True)
+
+    def test_quad_square(self):
+        self._test_quads([((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8))], True)
+        self._test_quads([((1, 1), (7, 1), (1, 7)), ((7, 1), (7, 7), (1, 7))], True)
+
+    def test_quad_single_pixel_rows(self):
+        # Odd bounding boxes, the quads stick out of them
+        self._test_quads([((0, 0), (9, 0), (0, 1)), ((5, 3), (6, 3), (5, 4))], True)
+
+    def test_quad_random(self):
+        rng = random.Random(4321)
+        triangles = []
+        for i in range(12):
+            ox, oy = (i % 4) * 24, (i // 4) * 24
+            vs = [(ox + rng.randrange(24), oy + rng.randrange(24)) for _ in range(3)]
+            if orient2d(*(p2d(v) for v in vs)) < 0:
+                vs[1], vs[2] = vs[2], vs[1]
+            triangles.append(vs)
+        self._test_quads(triangles, True, pipelined_recip=True)
+
+    def test_quad_walk_rate(self):
+        triangles = [((0, 0), (40, 0), (0, 40)), ((40, 0), (40, 40), (0, 40))]
+        single = self._count_walk_cycles(triangles, prenormalize=True)
+        quad = self._count_walk_cycles(triangles, prenormalize=True, quad=True)
+        print(f"walk cycles: single={single}, quad={quad}")
+        assert quad * 3 < single, f"{quad} / {single}"
+
+    def test_interleaved(self):
+        triangles = [((2, 2), (8, 2), (2, 8)), ((8, 2), (8, 8), (2, 8)), ((3, 11), (9, 12), (4, 19)),
+                     ((0, 20), (1, 20), (0, 21))]
+        for interleave in [2, 4]:
+            self._test_interleaved(triangles, interleave)
+            self._test_interleaved(triangles, interleave, use_fifo=True, pipelined_recip=True)
+            self._test_interleaved(triangles, interleave, prenormalize=True, quad=True)
+
+    def test_plane_attributes(self):
+        self._test_attributes([
+            (Vertex(2, 2, 0xFF00, 0xFF, 0x00, 0x00), Vertex(8, 2, 0x1234, 0x00, 0xFF, 0x00),
+             Vertex(2, 8, 0x0000, 0x00, 0x00, 0xFF)),
+        ])
+
+    def test_plane_attributes_square(self):
+        v0 = Vertex(0, 0, 0xFF03, 0xFF, 0x00, 0x00)
+        v1 = Vertex(10, 0, 0xFF03, 0x00, 0xFF, 0x00)
+        v2 = Vertex(0, 10, 0xFF03, 0x00, 0x00, 0xFF)
+        v3 = Vertex(10, 10, 0xFF03, 0xFF, 0x00, 0x00)
+        for kwargs in [{}, dict(pipelined_recip=True), dict(traversal=Traversal.SERPENTINE),
+                       dict(traversal=Traversal.TILED, tile_size=4)]:
+            self._test_attributes([(v0, v1, v2), (v1, v3, v2)], **kwargs)
+
+    def test_plane_attributes_random(self):
+        rng = random.Random(42)
+        triangles = []
+        for i in range(12):
+            ox, oy = (i % 4) * 24, (i // 4) * 24
+            vs = [Vertex(ox + rng.randrange(24), oy + rng.randrange(24), rng.randrange(1 << 16),
+                         rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(3)]
+            if orient2d(*vs) < 0:
+                vs[1], vs[2] = vs[2], vs[1]
+            triangles.append(vs)
+        self._test_attributes(triangles, pipelined_recip=True)
+        self._test_attributes(triangles, traversal=Traversal.SERPENTINE)
+
+    def test_clipped(self):
+        triangles = [((0, 0), (20, 0), (0, 20)), ((20, 0), (20, 20), (0, 20)), ((3, 5), (17, 9), (8, 19))]
+        for clip in [((0, 0), (7, 7)), ((8, 0), (15, 7)), ((8, 8), (15, 15)), ((16, 16), (23, 23)),
+                     ((5, 3), (5, 3)), ((21, 0), (30, 30)), ((0, 21), (30, 30))]:
+            self._test_clipped(triangles, clip)
+            self._test_clipped(triangles, clip, use_fifo=True, pipelined_recip=True)
+
+    def test_clipped_quads(self):
+        triangles = [((0, 0), (20, 0), (0, 20)), ((3, 5), (17, 9), (8, 19))]
+        for clip in [((0, 0), (7, 7)), ((3, 5), (12, 10)), ((5, 3), (5, 3)), ((9, 9), (30, 30))]:
+            self._test_clipped(triangles, clip, quad=True, prenormalize=True)
+
+    def test_guard_band(self):
+        triangles = [((-40, -30), (20, -5), (-10, 25)), ((-2048, 0), (10, -2048), (6, 9))]
+        self._test_clipped(triangles, ((0, 0), (2047, 2047)))
+        self._test_clipped(triangles, ((2, 1), (9, 7)))
+        self._test_clipped(triangles, ((0, 0), (2047, 2047)), quad=True, prenormalize=True)
+        self._test_clipped(triangles, ((3, 3), (8, 8)), quad=True, prenormalize=True)
+
+    def test_small_triangles(self):
+        # Degenerate ones cover nothing
+        self._test_coordinates([((4, 5), (5, 5), (5, 5)), ((8, 8), (8, 8), (8, 8)), ((2, 2), (3, 3), (2, 2))], 0,
+                               small_triangles=True)
+
+        # Both orientations, mixed with triangles that take the regular setup
+        triangles = [((2, 2), (3, 2), (2, 3)), ((3, 2), (3, 3), (2, 3)), ((6, 2), (6, 3), (7, 2)),
+                     ((0, 6), (9, 6), (0, 15)), ((11, 1), (11, 0), (10, 1)), ((1, 0), (1, 1), (0, 0)),
+                     ((9, 9), (10, 9), (10, 10))]
+        for kwargs in [{}, dict(use_fifo=True, pipelined_recip=True), dict(prenormalize=True),
+                       dict(traversal=Traversal.SERPENTINE), dict(traversal=Traversal.TILED, tile_size=4)]:
+            self._test_interpolation(triangles, True, small_triangles=True, **kwargs)
+        self._test_interpolation(triangles, False, small_triangles=True)
+        self._test_quads(triangles, True, small_triangles=True)
+        self._test_interleaved(triangles, 2, small_triangles=True, use_fifo=True, pipelined_recip=True)
+        self._test_interleaved(triangles, 2, small_triangles=True, prenormalize=True, quad=True)
+        self._test_clipped(triangles, ((3, 2), (9, 9)), small_triangles=True, use_fifo=True, pipelined_recip=True)
+
+    def test_small_triangles_attributes(self):
+        self._test_attributes([
+            (Vertex(2, 2, 0xFF00, 0xFF, 0x00, 0x00), Vertex(3, 2, 0x1234, 0x00, 0xFF, 0x00),
+             Vertex(2, 3, 0x0000, 0x00, 0x00, 0xFF)),
+            (Vertex(3, 2, 0x1234, 0x00, 0xFF, 0x00), Vertex(3, 3, 0xFFFF, 0x80, 0x80, 0x80),
+             Vertex(2, 3, 0x0000, 0x00, 0x00, 0xFF)),
+            (Vertex(4, 4, 0x4321, 0x12, 0x34, 0x56), Vertex(12, 4, 0x8000, 0x78, 0x9A, 0xBC),
+             Vertex(4, 12, 0x0001, 0xDE, 0xF0, 0x01)),
+            (Vertex(7, 1, 0x0F0F, 0x01, 0x02, 0x03), Vertex(7, 0, 0xF0F0, 0x04, 0x05, 0x06),
+             Vertex(6, 1, 0x5555, 0x07, 0x08, 0x09)),
+        ], pipelined_recip=True, small_triangles=True)
+
+    def test_small_triangle_rate(self):
+        # Mesh with two triangles per pixel, each covering three pixels
+        triangles = []
+        for y in range(4):
+            for x in range(8):
+                triangles.append(((x, y), (x + 1, y), (x, y + 1)))
+                triangles.append(((x + 1, y), (x + 1, y + 1), (x, y + 1)))
+        for kwargs in [dict(prenormalize=True, pipelined_recip=True), dict(prenormalize=True, quad=True),
+                       dict(div_unroll=2)]:
+            regular = self._count_walk_cycles(triangles, **kwargs)
+            small = self._count_walk_cycles(triangles, small_triangles=True, **kwargs)
+            print(f"walk cycles ({kwargs}): regular={regular}, small={small}")
+            assert small * 2 < regular, f"{small} / {regular}"
@@ -0,0 +1,117 @@
+import random
+from amaranth.sim import *
+from zynq_gpu.rasterizer.rasterizer_pipelined import RasterizerFastClear
+import unittest
+from ..utils import make_testbench_process
+
+
+class FastClearTest(unittest.TestCase):
+    BASE = 0x1000_0000
+
+    @classmethod
+    def _run(cls, dut, commands: list[tuple], seed: int = 0):
+        """
+        Runs ("clear",), ("read", p_offsets) and ("write", [(p_offset, z), ...]) commands, returns whether every read
+        was of a cleared pixel and the (addr, data, strb) writes sent.
+        """
+        rng = random.Random(seed)
+
+        reads = []
+        writes = []
+
+        # One process, so inputs are taken in the same cycle as the outputs that free them up
+        def process():
+            yield dut.base.eq(cls.BASE)
+            since_write = 0
+            for cmd, *args in commands:
+                if cmd == "clear":
+                    yield dut.clear.eq(1)
+                    yield
+                    yield dut.clear.eq(0)
+                    items = []
+                else:
+                    items = list(args[0])
+                idle_cycles = 0
+                while items or idle_cycles < 8:
+                    read_ready = rng.randrange(4) != 0
+                    write_ready = rng.randrange(4) != 0
+                    yield dut.out_read_ready.eq(read_ready)
+                    yield dut.out_write_ready.eq(write_ready)
+                    # The writer is idle a few cycles after its last write
+                    yield dut.writer_idle.eq(since_write > 4)
+                    yield dut.in_read_valid.eq(bool(items) and cmd == "read")
+                    yield dut.in_write_valid.eq(bool(items) and cmd == "write")
+                    if items and cmd == "read":
+                        yield dut.in_read_p_offset.eq(items[0])
+                    elif items and cmd == "write":
+                        yield dut.in_write_p_offset.eq(items[0][0])
+                        yield dut.in_write_z.eq(items[0][1])
+                    yield Settle()
+
+                    if read_ready and (yield dut.out_read_valid):
+                        reads.append((yield dut.out_read_cleared))
+                    if write_ready and (yield dut.out_write_valid):
+                        writes.append((
+                            (yield dut.out_write_addr),
+                            (yield dut.out_write_data),
+                            (yield dut.out_write_strb),
+                        ))
+                        since_write = 0
+                    else:
+                        since_write += 1
+                    if items and (yield dut.in_read_ready if cmd == "read" else dut.in_write_ready):
+                        items.pop(0)
+                    idle_cycles = idle_cycles + 1 if (yield dut.idle) else 0
+                    yield
+                yield dut.in_read_valid.eq(0)
+                yield dut.in_write_valid.eq(0)
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(process))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        return reads, writes
+
+    @classmethod
+    def _fill(cls, block: int):
+        return [(cls.BASE + block * 128 + 8 * i, 0, 0xFF) for i in range(16)]
+
+    @classmethod
+    def _pixel(cls, p_offset: int, z: int):
+        return cls.BASE + p_offset * 2, z * 0x0001_0001_0001_0001, 0b11 << (2 * (p_offset % 4))
+
+    def test_fill(self):
+        dut = RasterizerFastClear(max_height=4)
+
+        pixels = [(5, 0x1234), (6, 0x2345), (70, 0x3456), (193, 0x4567), (7, 0x5678)]
+        commands = [
+            ("clear",),
+            ("read", [0, 64, 128, 192]),
+            ("write", pixels),
+            ("read", [0, 64, 128, 192, 8191]),
+        ]
+        reads, writes = self._run(dut, commands, 1234)
+
+        assert reads == [1, 1, 1, 1, 0, 0, 1, 0, 1], reads
+        assert writes == (
+            self._fill(0) + [self._pixel(*pixels[0]), self._pixel(*pixels[1])] +
+            self._fill(1) + [self._pixel(*pixels[2])] +
+            self._fill(3) + [self._pixel(*pixels[3]), self._pixel(*pixels[4])]
+        ), writes
+
+    def test_pending(self):
+        # More blocks filled than can be tracked, and reads of every one of them
+        dut = RasterizerFastClear(max_height=4, pending_fills=2)
+        rng = random.Random(2345)
+
+        blocks = rng.sample(range(128), 6)
+        pixels = [(block * 64 + rng.randrange(64), rng.randrange(1 << 16)) for block in blocks]
+        commands = [("clear",), ("write", pixels), ("read", [p for p, _ in pixels]), ("clear",), ("read", [0])]
+        reads, writes = self._run(dut, commands, 3456)
+
+        assert reads == [0] * len(pixels) + [1], reads
+        expected = []
+        for block, pixel in zip(blocks, pixels):
+            expected += self._fill(block) + [self._pixel(*pixel)]
+        assert writes == expected, writes
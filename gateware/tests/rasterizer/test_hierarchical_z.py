@@ -0,0 +1,116 @@
+import random
+from amaranth.sim import *
+from zynq_gpu.rasterizer.rasterizer_pipelined import RasterizerHierarchicalZ
+import unittest
+from ..utils import wait_until, make_testbench_process
+
+
+class HierarchicalZTest(unittest.TestCase):
+    @staticmethod
+    def _run(dut, fragments: list[tuple[int, int, int]], invalidate_at: int | None = None, seed: int = 0):
+        """Sends (x, y, z) fragments, returns the indexes of the ones that weren't rejected."""
+        rng = random.Random(seed)
+        passed = []
+
+        def feed():
+            for i, (x, y, z) in enumerate(fragments):
+                if i == invalidate_at:
+                    yield from wait_until(dut.idle)
+                    yield dut.invalidate.eq(1)
+                    for _ in range(3):
+                        yield
+                    yield dut.invalidate.eq(0)
+                    # Sweep of every tile
+                    for _ in range(256 * 2 + 4):
+                        yield
+                yield dut.in_p.x.eq(x)
+                yield dut.in_p.y.eq(y)
+                yield dut.in_z.eq(z)
+                yield dut.in_p_offset.eq(i)
+                yield dut.in_valid.eq(1)
+                yield from wait_until(dut.in_ready)
+                yield
+                yield dut.in_valid.eq(0)
+            yield from wait_until(dut.idle)
+
+        def collect():
+            yield Passive()
+            while True:
+                ready = rng.randrange(4) != 0
+                yield dut.out_ready.eq(ready)
+                if ready and (yield dut.out_valid):
+                    passed.append((yield dut.out_p_offset))
+                yield
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(feed))
+        sim.add_sync_process(make_testbench_process(collect))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        assert passed == sorted(passed), passed
+        return set(passed)
+
+    def test_covered_tile(self):
+        dut = RasterizerHierarchicalZ(max_height=16)
+
+        tile = [(x, y) for y in range(8) for x in range(8)]
+        fragments = [(x, y, 0x5000) for x, y in tile]
+        # Covered, only in front of the bound passes
+        fragments += [(3, 4, 0x4000), (7, 7, 0x5000), (0, 0, 0x5001)]
+        # Not covered
+        fragments += [(8, 0, 0x1000)]
+        # Covered by 2 triangles
+        fragments += [(x, y + 8, 0x7000) for x, y in tile if x > y]
+        fragments += [(x, y + 8, 0x6000) for x, y in tile if x <= y]
+        fragments += [(1, 9, 0x5F00), (1, 9, 0x6001)]
+        # All but one pixel of a tile
+        fragments += [(x + 16, y, 0x5000) for x, y in tile[1:]]
+        fragments += [(17, 1, 0x1000)]
+
+        passed = self._run(dut, fragments)
+        rejected = set(range(len(fragments))) - passed
+
+        assert rejected == {64, 65, 132}, sorted(rejected)
+
+    def test_invalidate(self):
+        dut = RasterizerHierarchicalZ(max_height=16)
+
+        fragments = [(x, y, 0x5000) for y in range(8) for x in range(8)]
+        fragments += [(3, 4, 0x4000), (3, 4, 0x4000)]
+
+        passed = self._run(dut, fragments, invalidate_at=65)
+        assert set(range(len(fragments))) - passed == {64}, sorted(passed)
+
+    def _test_conservative(self, seed: int, **kwargs):
+        dut = RasterizerHierarchicalZ(max_height=16, **kwargs)
+        interleave = kwargs.get("interleave", 1)
+        phase = kwargs.get("phase", 0)
+        quad = kwargs.get("quad", False)
+        rng = random.Random(seed)
+
+        rows = [y for y in range(16) if (y >> quad) % interleave == phase]
+        depth = {}
+        fragments = []
+        expected_pass = set()
+        for i in range(40):
+            # Draws over a whole tile at a time, further behind every time
+            tile_x = rng.randrange(0, 3)
+            tile_y = rng.randrange(0, 2)
+            pixels = [(tile_x * 8 + x, y) for x in range(8) for y in rows if y // 8 == tile_y]
+            rng.shuffle(pixels)
+            for x, y in pixels:
+                z = rng.randrange((40 - i) * 0x500, (40 - i) * 0x500 + 0x1000)
+                if depth.get((x, y), 0) < z:
+                    depth[(x, y)] = z
+                    expected_pass.add(len(fragments))
+                fragments.append((x, y, z))
+
+        passed = self._run(dut, fragments, seed=seed)
+        assert expected_pass <= passed, sorted(expected_pass - passed)
+        assert len(passed) < len(fragments), "Nothing was rejected"
+
+    def test_conservative(self):
+        self._test_conservative(1234)
+        self._test_conservative(2345, interleave=2, phase=1)
+        self._test_conservative(3456, interleave=2, phase=0, quad=True)
@@ -1,6 +1,7 @@
+import random
 from amaranth.sim import *
 from dataclasses import dataclass
-from zynq_gpu.rasterizer import PixelWriter
+from zynq_gpu.rasterizer import PixelWriter, CoalescingPixelWriter
 from zynq_gpu.zynq_ifaces import SAxiHP
 import unittest
 from ..utils import wait_until, AxiEmulator, make_testbench_process
@@ -84,3 +85,95 @@ class PixelWriterTest(unittest.TestCase):
             Write(0xFF8, 0xCC << 56, 0b1000_0000),
             Write(0x1000, 0xAABB, 0b0000_0011),
         )
+
+
+class CoalescingPixelWriterTest(unittest.TestCase):
+    @staticmethod
+    def _test(spans: list[tuple[int, int]], seed: int, bpp: int = 3):
+        """Writes spans of (addr, count) pixels, checks memory and returns how many bursts were sent."""
+        rng = random.Random(seed)
+
+        iface = SAxiHP.create()
+        dut = CoalescingPixelWriter(bpp)
+        dut.axi_addr = iface.write_address
+        dut.axi_data = iface.write_data
+        dut.axi_resp = iface.write_response
+
+        mem = bytearray(0x3000)
+        expected = bytearray(len(mem))
+        pixels = []
+        for addr, count in spans:
+            for i in range(count):
+                value = rng.randrange(1 << (8 * bpp))
+                pixels.append((addr + bpp * i, value))
+                expected[addr + bpp * i:addr + bpp * (i + 1)] = value.to_bytes(bpp, "little")
+
+        def write(addr, size, value, mask):
+            assert size == 8
+            for i in range(8):
+                if mask & (1 << i):
+                    mem[addr + i] = (value >> (8 * i)) & 0xFF
+
+        # Never full, so the address channel is always ready
+        emulator = AxiEmulator(iface, None, write, aw_buffer=64, w_buffer=4, write_latency=3)
+
+        bursts = 0
+
+        def aw_monitor():
+            nonlocal bursts
+            yield Passive()
+            while True:
+                if (yield iface.write_address.valid):
+                    bursts += 1
+                yield
+
+        def pixel_feed():
+            for addr, value in pixels:
+                yield dut.pixel_valid.eq(1)
+                yield dut.pixel_addr.eq(addr)
+                yield dut.pixel_data.eq(value)
+                yield from wait_until(dut.pixel_ready)
+                yield
+                yield dut.pixel_valid.eq(0)
+            yield dut.flush.eq(1)
+            yield from wait_until(dut.idle)
+            # Extra cycles for AXI latency
+            for _ in range(8):
+                yield
+
+        sim = Simulator(dut)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(pixel_feed))
+        sim.add_sync_process(make_testbench_process(aw_monitor))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        for i in range(len(mem)):
+            assert mem[i] == expected[i], f"{hex(i)}: expected {expected[i]:02X}, got {mem[i]:02X}"
+
+        return bursts
+
+    def test_span(self):
+        # 126 bytes, 16 beats
+        assert self._test([(0x100, 42)], 1234) == 1
+        # Partial words at both ends
+        assert self._test([(0x105, 20)], 2345) == 1
+
+    def test_cross_4KiB(self):
+        assert self._test([(0xFF1, 10)], 3456) == 2
+
+    def test_random(self):
+        rng = random.Random(4567)
+        spans = [(rng.randrange(0, 0x2F00), rng.randrange(1, 60)) for _ in range(20)]
+        pixels = sum(count for _, count in spans)
+        assert self._test(spans, 5678) < pixels // 4
+
+    def test_xrgb8888(self):
+        # 2 pixels per word
+        assert self._test([(0x100, 32)], 6789, 4) == 1
+        assert self._test([(0xFF0, 8)], 7890, 4) == 2
+
+    def test_rgb565(self):
+        # 4 pixels per word, partial words at both ends
+        assert self._test([(0x102, 61)], 8901, 2) == 1
+        assert self._test([(0xFF8, 8)], 9012, 2) == 2
@@ -1,9 +1,12 @@
 import functools
+import random
 import struct
 from dataclasses import dataclass
 from amaranth.sim import *
 from zynq_gpu.rasterizer.rasterizer_sequential import Rasterizer as SequentialRasterizer
 from zynq_gpu.rasterizer.rasterizer_pipelined import Rasterizer as PipelinedRasterizer
+from zynq_gpu.rasterizer.rasterizer_parallel import Rasterizer as ParallelRasterizer
+from zynq_gpu.rasterizer.types import DepthFunc, PixelFormat
 import unittest
 from .utils import points_raster, Vertex
 from ..utils import wait_until, AxiEmulator, make_testbench_process
@@ -14,6 +17,10 @@ class Triangle:
     v0: Vertex
     v1: Vertex
     v2: Vertex
+    depth_func: DepthFunc = DepthFunc.GREATER
+    no_depth_test: bool = False
+    no_depth_write: bool = False
+    no_color_write: bool = False
 
 
 class RasterizerTest(unittest.TestCase):
@@ -23,21 +30,127 @@ class RasterizerTest(unittest.TestCase):
     def test_pipelined(self):
         self._test(PipelinedRasterizer)
 
+    def test_pipelined_plane(self):
+        self._test(PipelinedRasterizer, plane_interpolation=True)
+
+    def test_pipelined_prenormalized(self):
+        self._test(PipelinedRasterizer, prenormalize=True)
+
+    def test_pipelined_quad(self):
+        self._test(PipelinedRasterizer, quad=True)
+
+    def test_pipelined_hierarchical_z(self):
+        self._test(PipelinedRasterizer, hierarchical_z=True)
+        self._test(PipelinedRasterizer, quad=True, hierarchical_z=True)
+
+    def test_pipelined_xrgb8888(self):
+        self._test(PipelinedRasterizer, pixel_format=PixelFormat.XRGB8888)
+
+    def test_pipelined_fast_clear(self):
+        self._test(PipelinedRasterizer, fast_clear=True)
+        self._test(PipelinedRasterizer, quad=True, hierarchical_z=True, fast_clear=True)
+
+    def test_pipelined_depth_flags(self):
+        self._test(PipelinedRasterizer, depth_flags=True)
+        self._test(PipelinedRasterizer, quad=True, hierarchical_z=True, depth_flags=True)
+        self._test(PipelinedRasterizer, fast_clear=True, depth_flags=True)
+
+    def test_pipelined_culled(self):
+        self._test(PipelinedRasterizer, culled=True)
+        self._test(PipelinedRasterizer, quad=True, culled=True)
+        self._test(PipelinedRasterizer, plane_interpolation=True, culled=True)
+
+    def test_sequential_scissor(self):
+        self._test(SequentialRasterizer, scissor=((3, 2), (12, 7)))
+
+    def test_pipelined_scissor(self):
+        self._test(PipelinedRasterizer, scissor=((3, 2), (12, 7)))
+        self._test(PipelinedRasterizer, quad=True, hierarchical_z=True, scissor=((3, 2), (12, 7)))
+
+    def test_parallel(self):
+        self._test(ParallelRasterizer, 2)
+        self._test(ParallelRasterizer, 4, quad=True)
+        self._test(ParallelRasterizer, 2, fast_clear=True)
+
+    def test_idle(self):
+        self._test_idle(PipelinedRasterizer)
+        self._test_idle(ParallelRasterizer, 2)
+
+    @staticmethod
+    def _test_idle(mod, *args, **kwargs):
+        # Busy from the cycle a triangle is offered, even before it reaches an edge walker
+        dut = mod(*args, **kwargs)
+
+        width = 64
+        height = 16
+
+        emulator_framebuffer = AxiEmulator(dut.axi, None, lambda *_: None, aw_buffer=4, w_buffer=4)
+        emulator_z_buffer = AxiEmulator(dut.axi2, lambda *_: 0, lambda *_: None, ar_buffer=8, aw_buffer=4,
+                                        w_buffer=4)
+
+        def submit_trig():
+            yield dut.width.eq(width)
+            yield dut.fb_base.eq(0x1000_0000)
+            yield dut.z_base.eq(0x1000_0000 + width*height*3)
+            yield dut.scissor_max.x.eq(width - 1)
+            yield dut.scissor_max.y.eq(height - 1)
+            for v, (x, y) in zip(["v0", "v1", "v2"], [(0, 0), (10, 0), (0, 10)]):
+                yield getattr(dut.triangles.payload, v).x.eq(x)
+                yield getattr(dut.triangles.payload, v).y.eq(y)
+                yield getattr(dut.triangles.payload, v).z.eq(0xFF03)
+            yield from wait_until(dut.idle)
+
+            yield dut.triangles.valid.eq(1)
+            assert not (yield dut.idle)
+            yield from wait_until(dut.triangles.ready)
+            yield
+            yield dut.triangles.valid.eq(0)
+
+            for _ in range(20):
+                assert not (yield dut.idle)
+                yield
+            yield from wait_until(dut.idle)
+
+        sim = Simulator(dut)
+        emulator_framebuffer.add_to_sim(sim)
+        emulator_z_buffer.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(submit_trig))
+        sim.add_clock(1/1e6)
+        sim.run()
+
     @staticmethod
     def _test(mod, *args, **kwargs):
         width = 1920
         height = 1080
 
+        # Also draws triangles with every depth function and flag
+        depth_flags = kwargs.pop("depth_flags", False)
+        # Also draws a triangle with vertices outside of the screen
+        scissor = kwargs.pop("scissor", None)
+        # Also draws a back facing triangle between two drawn ones
+        culled = kwargs.pop("culled", False)
+        (scissor_min_x, scissor_min_y), (scissor_max_x, scissor_max_y) = scissor or ((0, 0), (width - 1, height - 1))
+
         dut = mod(*args, **kwargs)
+        # Only formats with whole bytes of color, the padding byte is always 0
+        bpp = kwargs.get("pixel_format", PixelFormat.RGB888).bytes_per_pixel
+        assert bpp >= 3
 
-        mem = bytearray(width * height * 3 + width * height * 2)
+        mem = bytearray(width * height * bpp + width * height * 2)
         fb_base = 0x1000_0000
-        fb_end = 0x1000_0000 + width * height * 3
+        fb_end = 0x1000_0000 + width * height * bpp
         z_base = fb_end
         z_end = z_base + width * height * 2
 
         expected_mem = bytearray(len(mem))
-        expected_z_off = width * height * 3
+        expected_z_off = width * height * bpp
+
+        # Depth is garbage until cleared, and blocks of 64 pixels are only written once drawn to
+        fast_clear = kwargs.get("fast_clear", False)
+        filled = set()
+        if fast_clear:
+            mem[expected_z_off:] = random.Random(1234).randbytes(width * height * 2)
+            expected_mem[expected_z_off:] = mem[expected_z_off:]
 
         def read(lo, hi, addr, _):
             assert lo <= addr < hi, f"{hex(lo)} <= {hex(addr)} < {hex(hi)}"
@@ -76,17 +189,37 @@ class RasterizerTest(unittest.TestCase):
 
         def submit_trig(t: Triangle):
             for v in points_raster(t.v0, t.v1, t.v2):
+                if not (scissor_min_x <= v.x <= scissor_max_x and scissor_min_y <= v.y <= scissor_max_y):
+                    continue
                 off = width*v.y + v.x
                 z_off = expected_z_off + off*2
                 z_actual = struct.unpack("<H", expected_mem[z_off:z_off+2])[0]
-                if z_actual < v.z:
-                    expected_mem[z_off:z_off+2] = struct.pack("<H", v.z)
-                    expected_mem[off*3:(off + 1)*3] = bytes([v.b, v.g, v.r])
+                block = off // 64
+                if fast_clear and block not in filled:
+                    z_actual = 0
+                passed = t.no_depth_test or {
+                    DepthFunc.GREATER: z_actual < v.z,
+                    DepthFunc.LESS: z_actual > v.z,
+                    DepthFunc.EQUAL: z_actual == v.z,
+                    DepthFunc.ALWAYS: True,
+                }[t.depth_func]
+                if passed:
+                    if not t.no_depth_test and not t.no_depth_write:
+                        if fast_clear and block not in filled:
+                            filled.add(block)
+                            expected_mem[expected_z_off + block*128:expected_z_off + (block + 1)*128] = bytes(128)
+                        expected_mem[z_off:z_off+2] = struct.pack("<H", v.z)
+                    if not t.no_color_write:
+                        expected_mem[off*bpp:(off + 1)*bpp] = bytes([v.b, v.g, v.r]).ljust(bpp, b"\0")
 
             for v in ["v0", "v1", "v2"]:
                 d = getattr(dut.triangles.payload, v)
                 for n in "xyzrgb":
                     yield getattr(d, n).eq(getattr(getattr(t, v), n))
+            yield dut.triangles.payload.depth.func.eq(t.depth_func.value)
+            yield dut.triangles.payload.depth.no_test.eq(t.no_depth_test)
+            yield dut.triangles.payload.depth.no_write.eq(t.no_depth_write)
+            yield dut.triangles.payload.depth.no_color.eq(t.no_color_write)
             yield dut.triangles.valid.eq(1)
             yield from wait_until(dut.triangles.ready, 100_000_000)
             yield
@@ -95,7 +228,15 @@ class RasterizerTest(unittest.TestCase):
         def submit_trigs():
             yield dut.width.eq(width)
             yield dut.fb_base.eq(0x1000_0000)
-            yield dut.z_base.eq(0x1000_0000 + width*height*3)
+            yield dut.z_base.eq(0x1000_0000 + width*height*bpp)
+            yield dut.scissor_min.x.eq(scissor_min_x)
+            yield dut.scissor_min.y.eq(scissor_min_y)
+            yield dut.scissor_max.x.eq(scissor_max_x)
+            yield dut.scissor_max.y.eq(scissor_max_y)
+            if fast_clear:
+                yield dut.depth_fast_clear.eq(1)
+                yield
+                yield dut.depth_fast_clear.eq(0)
 
             n = 10
             v0 = Vertex(0, 0, 0xFF00 | 3, 0xFF, 0x00, 0x00)
@@ -109,8 +250,69 @@ class RasterizerTest(unittest.TestCase):
             b3 = Vertex(0, 3, 0xFF00 | 2, 0xFF, 0xFF, 0xFF)
 
             yield from submit_trig(Triangle(v0, v1, v2))
+            if culled:
+                # Its attributes must not replace the ones of the triangle before it while that one is walked
+                yield from submit_trig(Triangle(v0, v2, v1))
+                yield from submit_trig(Triangle(
+                    Vertex(40, 0, 0xFF03, 0x09, 0x09, 0x09),
+                    Vertex(50, 0, 0xFF03, 0x09, 0x09, 0x09),
+                    Vertex(40, 10, 0xFF03, 0x09, 0x09, 0x09),
+                ))
             yield from submit_trig(Triangle(v1, v3, v2))
             yield from submit_trig(Triangle(b1, b2, b3))
+
+            if depth_flags:
+                def vertex(x, y, z, color):
+                    return Vertex(x, y, z, color >> 16, (color >> 8) & 0xFF, color & 0xFF)
+
+                # In front of the region, then behind it but in front of that
+                yield from submit_trig(Triangle(
+                    vertex(0, 5, 0xFF01, 0x00FFFF), vertex(5, 5, 0xFF01, 0x00FFFF), vertex(0, 10, 0xFF01, 0x00FFFF),
+                    depth_func=DepthFunc.LESS,
+                ))
+                yield from submit_trig(Triangle(
+                    vertex(0, 5, 0xFF02, 0xFF00FF), vertex(3, 5, 0xFF02, 0xFF00FF), vertex(0, 8, 0xFF02, 0xFF00FF),
+                ))
+                # Only where the region wasn't drawn over
+                yield from submit_trig(Triangle(
+                    vertex(4, 0, 0xFF03, 0xFFFF00), vertex(12, 0, 0xFF03, 0xFFFF00), vertex(12, 8, 0xFF03, 0xFFFF00),
+                    depth_func=DepthFunc.EQUAL,
+                ))
+                # Drawn without changing the depth, then hidden again
+                yield from submit_trig(Triangle(
+                    vertex(6, 6, 0, 0x123456), vertex(9, 6, 0, 0x123456), vertex(6, 9, 0, 0x123456),
+                    depth_func=DepthFunc.ALWAYS, no_depth_write=True,
+                ))
+                yield from submit_trig(Triangle(
+                    vertex(5, 5, 0xFF04, 0x654321), vertex(8, 5, 0xFF04, 0x654321), vertex(5, 8, 0xFF04, 0x654321),
+                ))
+                # Overlay, whatever the depth
+                yield from submit_trig(Triangle(
+                    vertex(2, 2, 0, 0xABCDEF), vertex(16, 2, 0, 0xABCDEF), vertex(2, 16, 0, 0xABCDEF),
+                    no_depth_test=True,
+                ))
+                # Always in front, with depth written
+                yield from submit_trig(Triangle(
+                    vertex(14, 0, 0, 0x0F0F0F), vertex(18, 0, 0, 0x0F0F0F), vertex(14, 4, 0, 0x0F0F0F),
+                    depth_func=DepthFunc.ALWAYS,
+                ))
+                # Depth prepass of two overlapping triangles, then only the front one is colored where they overlap
+                back = [vertex(20, 0, 0xFF05, 0x336699), vertex(30, 0, 0xFF05, 0x336699),
+                        vertex(20, 10, 0xFF05, 0x336699)]
+                front = [vertex(24, 2, 0xFF06, 0x996633), vertex(34, 2, 0xFF06, 0x996633),
+                         vertex(24, 12, 0xFF06, 0x996633)]
+                yield from submit_trig(Triangle(*back, no_color_write=True))
+                yield from submit_trig(Triangle(*front, no_color_write=True))
+                yield from submit_trig(Triangle(*back, depth_func=DepthFunc.EQUAL, no_depth_write=True))
+                yield from submit_trig(Triangle(*front, depth_func=DepthFunc.EQUAL, no_depth_write=True))
+
+            if scissor is not None:
+                yield from submit_trig(Triangle(
+                    Vertex(-20, -20, 0xFF10, 0x10, 0x20, 0x30),
+                    Vertex(15, -3, 0xFF10, 0x40, 0x50, 0x60),
+                    Vertex(-3, 15, 0xFF10, 0x70, 0x80, 0x90),
+                ))
+
             yield from wait_until(dut.idle, 100_000_000)
             # Give it a few more cycles to finish writing, idle goes high too early
             if mod is SequentialRasterizer:
@@ -156,7 +358,7 @@ class RasterizerTest(unittest.TestCase):
         if expected_mem != mem:
             for idx in range(len(expected_mem)):
                 if expected_mem[idx] != mem[idx]:
-                    offset, tp = ((idx - expected_z_off) // 2, "z") if idx >= expected_z_off else (idx // 3, "rgb")
+                    offset, tp = ((idx - expected_z_off) // 2, "z") if idx >= expected_z_off else (idx // bpp, "rgb")
                     y = offset // width
                     x = offset % width
                     print(f"Mismatch @ {tp}[{x},{y}/{hex(idx + 0x1000_0000)}/"
@@ -167,9 +369,9 @@ class RasterizerTest(unittest.TestCase):
             with open("actual.ppm", "wb") as f:
                 f.write(f"P6\n{size} {size}\n255\n".encode())
                 for y in range(size):
-                    line = mem[y * width*3:(y + 1) * width*3]
+                    line = mem[y * width*bpp:(y + 1) * width*bpp]
                     for x in range(size):
-                        pix = line[x * 3:(x + 1) * 3]
+                        pix = line[x * bpp:x * bpp + 3]
                         tmp = pix[0]
                         pix[0] = pix[2]
                         pix[2] = tmp
@@ -177,9 +379,9 @@ class RasterizerTest(unittest.TestCase):
             with open("expected.ppm", "wb") as f:
                 f.write(f"P6\n{size} {size}\n255\n".encode())
                 for y in range(size):
-                    line = expected_mem[y * width*3:(y + 1) * width*3]
+                    line = expected_mem[y * width*bpp:(y + 1) * width*bpp]
                     for x in range(size):
-                        pix = line[x * 3:(x + 1) * 3]
+                        pix = line[x * bpp:x * bpp + 3]
                         tmp = pix[0]
                         pix[0] = pix[2]
                         pix[2] = tmp
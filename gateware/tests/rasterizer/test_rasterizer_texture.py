@@ -24,6 +24,12 @@ class RasterizerTextureTest(unittest.TestCase):
     def test_pipelined(self):
         self._test(PipelinedRasterizer)
 
+    def test_pipelined_plane(self):
+        self._test(PipelinedRasterizer, plane_interpolation=True)
+
+    def test_pipelined_quad(self):
+        self._test(PipelinedRasterizer, quad=True)
+
     @staticmethod
     def _test(mod, *args, **kwargs):
         width = 1920
@@ -118,6 +124,8 @@ class RasterizerTextureTest(unittest.TestCase):
             yield dut.width.eq(width)
             yield dut.fb_base.eq(0x1000_0000)
             yield dut.z_base.eq(0x1000_0000 + width*height*3)
+            yield dut.scissor_max.x.eq(width - 1)
+            yield dut.scissor_max.y.eq(height - 1)
 
             n = 10
             v0 = Vertex(0, 0, 0xFF00 | 3, 0xFF, 0x00, 0x00)
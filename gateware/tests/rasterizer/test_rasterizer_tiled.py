@@ -0,0 +1,153 @@
+import random
+import struct
+from amaranth.sim import *
+from zynq_gpu.rasterizer.rasterizer_tiled import Rasterizer as TiledRasterizer
+from zynq_gpu.rasterizer.types import PixelFormat
+import unittest
+from .utils import points_raster, orient2d, Vertex
+from ..utils import wait_until, AxiEmulator, make_testbench_process
+
+
+class TiledRasterizerTest(unittest.TestCase):
+    def test_clear(self):
+        self._test(load=False, store_depth=True, seed=1234)
+
+    def test_load(self):
+        self._test(load=True, store_depth=True, seed=2345)
+
+    def test_no_depth_store(self):
+        self._test(load=False, store_depth=False, seed=3456)
+
+    def test_batch_overflow(self):
+        self._test(load=False, store_depth=True, seed=4567, batch_size=3)
+        self._test(load=True, store_depth=True, seed=5678, batch_size=4)
+
+    def test_xrgb8888(self):
+        self._test(load=False, store_depth=True, seed=6789, pixel_format=PixelFormat.XRGB8888)
+
+    def test_rgb565(self):
+        self._test(load=True, store_depth=True, seed=7890, pixel_format=PixelFormat.RGB565)
+
+    @staticmethod
+    def _pack(pixel_format: PixelFormat, r: int, g: int, b: int) -> bytes:
+        match pixel_format:
+            case PixelFormat.RGB888:
+                return bytes([b, g, r])
+            case PixelFormat.XRGB8888:
+                return bytes([b, g, r, 0])
+            case PixelFormat.RGB565:
+                return struct.pack("<H", ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3))
+
+    @classmethod
+    def _test(cls, *, load: bool, store_depth: bool, seed: int, batch_size: int = 32, count: int = 10,
+              pixel_format: PixelFormat = PixelFormat.RGB888):
+        # Partial tiles at the right and bottom edges
+        width = 72
+        height = 40
+        rng = random.Random(seed)
+
+        dut = TiledRasterizer(tile_size=16, batch_size=batch_size, pixel_format=pixel_format)
+        bpp = pixel_format.bytes_per_pixel
+
+        base = 0x1000_0000
+        fb_size = width * height * bpp
+        z_size = width * height * 2
+        mem = bytearray(rng.randbytes(fb_size + z_size))
+        initial_mem = bytearray(mem)
+
+        def read(addr, _):
+            assert base <= addr < base + len(mem), hex(addr)
+            off = addr - base
+            return struct.unpack("<Q", mem[off:off+8])[0]
+
+        def write(addr, _, value, mask):
+            assert base <= addr < base + len(mem), hex(addr)
+            off = addr - base
+            for i in range(8):
+                if mask & (1 << i):
+                    mem[off + i] = (value >> (8 * i)) & 0xFF
+
+        emulator_framebuffer = AxiEmulator(dut.axi, read, write, ar_buffer=8, aw_buffer=64, w_buffer=64,
+                                           read_latency=3, write_latency=3)
+        emulator_z_buffer = AxiEmulator(dut.axi2, read, write, ar_buffer=8, aw_buffer=64, w_buffer=64,
+                                        read_latency=3, write_latency=3)
+
+        clear_color = rng.randrange(0, 1 << 24)
+        if load:
+            expected_fb = bytearray(initial_mem[:fb_size])
+            expected_z = bytearray(initial_mem[fb_size:])
+        else:
+            clear_pixel = cls._pack(pixel_format, clear_color >> 16, (clear_color >> 8) & 0xFF, clear_color & 0xFF)
+            expected_fb = bytearray(clear_pixel * (width * height))
+            expected_z = bytearray(z_size)
+
+        triangles = []
+        for _ in range(count):
+            vs = [Vertex(
+                rng.randrange(0, width),
+                rng.randrange(0, height),
+                rng.randrange(0, 1 << 16),
+                rng.randrange(0, 256),
+                rng.randrange(0, 256),
+                rng.randrange(0, 256),
+            ) for _ in range(3)]
+            if orient2d(*vs) < 0:
+                vs[1], vs[2] = vs[2], vs[1]
+            triangles.append(vs)
+
+            for v in points_raster(*vs):
+                off = width*v.y + v.x
+                z_actual = struct.unpack("<H", expected_z[off*2:(off + 1)*2])[0]
+                if z_actual < v.z:
+                    expected_z[off*2:(off + 1)*2] = struct.pack("<H", v.z)
+                    expected_fb[off*bpp:(off + 1)*bpp] = cls._pack(pixel_format, v.r, v.g, v.b)
+
+        def control(**kwargs):
+            for name, value in kwargs.items():
+                yield getattr(dut.tile_control.payload, name).eq(value)
+            yield dut.tile_control.valid.eq(1)
+            yield from wait_until(dut.tile_control.ready, 100_000)
+            yield
+            yield dut.tile_control.valid.eq(0)
+
+        def process():
+            yield dut.width.eq(width)
+            yield dut.height.eq(height)
+            yield dut.fb_base.eq(base)
+            yield dut.z_base.eq(base + fb_size)
+            yield dut.scissor_max.x.eq(width - 1)
+            yield dut.scissor_max.y.eq(height - 1)
+
+            yield from control(flush=0, load=load, clear_color=clear_color)
+            for vs in triangles:
+                for i, v in enumerate(vs):
+                    d = getattr(dut.triangles.payload, f"v{i}")
+                    for n in "xyzrgb":
+                        yield getattr(d, n).eq(getattr(v, n))
+                yield dut.triangles.valid.eq(1)
+                yield from wait_until(dut.triangles.ready, 100_000)
+                yield
+                yield dut.triangles.valid.eq(0)
+            yield from control(flush=1, store_depth=store_depth)
+            yield
+            yield from wait_until(dut.idle, 100_000)
+
+        sim = Simulator(dut)
+        emulator_framebuffer.add_to_sim(sim)
+        emulator_z_buffer.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(process))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        for idx in range(fb_size):
+            offset = idx // bpp
+            assert mem[idx] == expected_fb[idx], \
+                f"rgb[{offset % width},{offset // width}]: expected {expected_fb[idx]:02X}, got {mem[idx]:02X}"
+        if store_depth:
+            for idx in range(z_size):
+                offset = idx // 2
+                assert mem[fb_size + idx] == expected_z[idx], \
+                    f"z[{offset % width},{offset // width}]: " \
+                    f"expected {expected_z[idx]:02X}, got {mem[fb_size + idx]:02X}"
+        else:
+            assert mem[fb_size:] == initial_mem[fb_size:]
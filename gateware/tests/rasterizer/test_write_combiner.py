@@ -0,0 +1,111 @@
+import random
+from amaranth.sim import *
+from zynq_gpu.rasterizer import WriteCombiner
+from zynq_gpu.zynq_ifaces import SAxiHP
+import unittest
+from ..utils import wait_until, AxiEmulator, make_testbench_process
+
+
+class WriteCombinerTest(unittest.TestCase):
+    @staticmethod
+    def _test(writes: list[tuple[int, int]], *, flush_at: set[int] = frozenset(), seed: int = 0) -> int:
+        """Writes (addr, z) pairs like the depth store does, checks memory and returns how many bursts were sent."""
+        rng = random.Random(seed)
+
+        iface = SAxiHP.create()
+        dut = WriteCombiner()
+        dut.write_address = iface.write_address
+        dut.write_data = iface.write_data
+        dut.write_response = iface.write_response
+
+        mem = bytearray(0x3000)
+        expected = bytearray(len(mem))
+        for addr, z in writes:
+            expected[addr:addr+2] = z.to_bytes(2, "little")
+
+        def write(addr, size, value, mask):
+            assert size == 8
+            for i in range(8):
+                if mask & (1 << i):
+                    mem[addr + i] = (value >> (8 * i)) & 0xFF
+
+        # Never full, so the address channel is always ready
+        emulator = AxiEmulator(iface, None, write, aw_buffer=64, w_buffer=4, write_latency=3)
+
+        bursts_started = 0
+
+        def aw_monitor():
+            nonlocal bursts_started
+            yield Passive()
+            while True:
+                if (yield iface.write_address.valid):
+                    bursts_started += 1
+                yield
+
+        def feed():
+            for i, (addr, z) in enumerate(writes):
+                if i in flush_at:
+                    yield dut.flush.eq(1)
+                    yield from wait_until(dut.idle)
+                    yield dut.flush.eq(0)
+                yield dut.addr.eq(addr)
+                yield dut.data.eq(z * 0x0001_0001_0001_0001)
+                yield dut.strb.eq(0b11 << (addr & 0b110))
+                yield dut.valid.eq(1)
+                yield from wait_until(dut.ready)
+                yield
+                yield dut.valid.eq(0)
+                for _ in range(rng.choice([0, 0, 0, 1, 2])):
+                    yield
+            # Sent after the timeout
+            yield from wait_until(dut.idle)
+            for _ in range(20):
+                yield
+
+        sim = Simulator(dut)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(feed))
+        sim.add_sync_process(make_testbench_process(aw_monitor))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        for i in range(len(mem)):
+            assert mem[i] == expected[i], f"{hex(i)}: expected {expected[i]:02X}, got {mem[i]:02X}"
+
+        return bursts_started
+
+    def test_span(self):
+        rng = random.Random(1234)
+        # 64 consecutive pixels, 16 words
+        writes = [(0x100 + 2 * x, rng.randrange(1 << 16)) for x in range(64)]
+        assert self._test(writes, seed=1) == 1
+
+    def test_partial(self):
+        rng = random.Random(2345)
+        # Every other pixel, and one a word further
+        writes = [(0x100 + 4 * x, rng.randrange(1 << 16)) for x in range(8)]
+        writes += [(0x130, rng.randrange(1 << 16))]
+        assert self._test(writes, seed=2) == 2
+
+    def test_long_span(self):
+        rng = random.Random(3456)
+        # Split at 16 beats and at the 4KiB boundary
+        writes = [(0xF00 + 2 * x, rng.randrange(1 << 16)) for x in range(200)]
+        assert self._test(writes, seed=3) == 4
+
+    def test_flush(self):
+        rng = random.Random(4567)
+        writes = [(0x100 + 2 * x, rng.randrange(1 << 16)) for x in range(16)]
+        assert self._test(writes, flush_at={4, 9}, seed=4) == 3
+
+    def test_random(self):
+        rng = random.Random(5678)
+        writes = []
+        for _ in range(30):
+            start = rng.randrange(0, 0x2F00) & ~1
+            for x in range(rng.randrange(1, 40)):
+                writes.append((start + 2 * x, rng.randrange(1 << 16)))
+            # Overwrites part of the span
+            if rng.randrange(2):
+                writes.append((start, rng.randrange(1 << 16)))
+        assert self._test(writes, seed=5) < len(writes) // 3
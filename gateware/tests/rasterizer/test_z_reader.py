@@ -0,0 +1,183 @@
+import random
+import struct
+from amaranth.sim import *
+from zynq_gpu.rasterizer.rasterizer_pipelined import ZReader
+import unittest
+from ..utils import wait_until, make_testbench_process
+
+
+class ZReaderTest(unittest.TestCase):
+    @staticmethod
+    def _run(dut, mem: bytearray, commands: list[tuple], seed: int = 0):
+        """
+        Runs ("read", addrs), ("read_cleared", addrs), ("write", addr, z), ("poke", addr, data) and ("invalidate",)
+        commands, returns the depth of every read and how many hits, misses and evictions there were.
+        """
+        rng = random.Random(seed)
+
+        reads = []
+
+        counts = {"hit": 0, "miss": 0, "evict": 0}
+
+        def feed():
+            for cmd, *args in commands:
+                if cmd in ("read", "read_cleared"):
+                    for addr in args[0]:
+                        yield dut.in_addr.eq(addr)
+                        yield dut.in_cleared.eq(cmd == "read_cleared")
+                        yield dut.in_addr_valid.eq(1)
+                        yield from wait_until(dut.in_addr_ready)
+                        yield
+                        yield dut.in_addr_valid.eq(0)
+                    yield from wait_until(dut.idle)
+                elif cmd == "write":
+                    addr, z = args
+                    mem[addr:addr+2] = struct.pack("<H", z)
+                    yield dut.write_addr.eq(addr)
+                    yield dut.write_z.eq(z)
+                    yield dut.write_valid.eq(1)
+                    yield
+                    yield dut.write_valid.eq(0)
+                    yield
+                elif cmd == "poke":
+                    addr, data = args
+                    mem[addr:addr+len(data)] = data
+                else:
+                    yield dut.invalidate.eq(1)
+                    yield
+                    yield dut.invalidate.eq(0)
+                    yield
+
+        def memory():
+            # Answers reads after a few cycles and takes depth out, in one process so both see the same cycle
+            yield Passive()
+            pending = []
+            while True:
+                yield dut.read_address.ready.eq(1)
+                ready = rng.randrange(4) != 0
+                yield dut.out_z_ready.eq(ready)
+                if pending and pending[0][0] <= 0:
+                    yield dut.read.valid.eq(1)
+                    yield dut.read.data.eq(struct.unpack("<Q", mem[pending[0][1]:pending[0][1]+8])[0])
+                else:
+                    yield dut.read.valid.eq(0)
+                yield Settle()
+
+                if (yield dut.read_address.valid):
+                    pending.append([5, (yield dut.read_address.addr)])
+                if (yield dut.read.valid) and (yield dut.read.ready):
+                    pending.pop(0)
+                if ready and (yield dut.out_z_valid):
+                    reads.append((yield dut.out_z))
+                for name in counts:
+                    counts[name] += (yield getattr(dut, name))
+                for p in pending:
+                    p[0] -= 1
+                yield
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(feed))
+        sim.add_sync_process(make_testbench_process(memory))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        return reads, counts
+
+    @staticmethod
+    def _depths(mem: bytearray, addrs: list[int]) -> list[int]:
+        return [struct.unpack("<H", mem[addr:addr+2])[0] for addr in addrs]
+
+    def test_rows(self):
+        dut = ZReader(sets=16)
+        rng = random.Random(1234)
+        mem = bytearray(rng.randbytes(0x1000))
+
+        # Two rows of 32 pixels, 128 bytes apart, read twice
+        row = [0x200 + 2 * x for x in range(32)]
+        addrs = row + [addr + 0x80 for addr in row]
+        expected = self._depths(mem, addrs) * 2
+
+        reads, counts = self._run(dut, mem, [("read", addrs), ("read", addrs)])
+
+        assert reads == expected
+        assert counts == {"hit": 16, "miss": 16, "evict": 0}, counts
+
+    def test_eviction(self):
+        dut = ZReader(sets=16)
+        rng = random.Random(2345)
+        mem = bytearray(rng.randbytes(0x1000))
+
+        # 3 words in the same set, the least recently used one is replaced
+        addrs = [0x000, 0x080, 0x000, 0x100, 0x080, 0x000]
+        expected = self._depths(mem, addrs)
+
+        reads, counts = self._run(dut, mem, [("read", [addr]) for addr in addrs])
+
+        assert reads == expected
+        assert counts == {"hit": 1, "miss": 5, "evict": 3}, counts
+
+    def test_quads(self):
+        dut = ZReader(sets=16)
+        rng = random.Random(5678)
+        mem = bytearray(rng.randbytes(0x1000))
+
+        # Lanes of quads alternate between the words of two rows, which are in the same set
+        addrs = []
+        for x in range(0, 16, 2):
+            for y in range(2):
+                addrs += [0x200 + 0x80 * y + 2 * x, 0x200 + 0x80 * y + 2 * x + 2]
+        expected = self._depths(mem, addrs)
+
+        reads, counts = self._run(dut, mem, [("read", addrs)])
+
+        assert reads == expected
+        assert counts == {"hit": 8, "miss": 8, "evict": 0}, counts
+
+    def test_write_through(self):
+        dut = ZReader(sets=16)
+        rng = random.Random(3456)
+        mem = bytearray(rng.randbytes(0x1000))
+
+        addrs = [0x400 + 2 * x for x in range(8)]
+        commands = [("read", addrs)]
+        for addr in addrs[::3] + [0x800]:
+            commands.append(("write", addr, rng.randrange(1 << 16)))
+        commands.append(("read", addrs + [0x800]))
+
+        before = self._depths(mem, addrs)
+        reads, counts = self._run(dut, mem, commands)
+
+        assert reads == before + self._depths(mem, addrs + [0x800])
+        assert counts == {"hit": 2, "miss": 3, "evict": 0}, counts
+
+    def test_invalidate(self):
+        dut = ZReader(sets=16)
+        rng = random.Random(4567)
+        mem = bytearray(rng.randbytes(0x1000))
+
+        addrs = [0x600, 0x608]
+        before = self._depths(mem, addrs)
+        # Written by something else after the first read
+        after = rng.randbytes(16)
+        commands = [("read", addrs), ("poke", 0x600, after), ("invalidate",), ("read", addrs)]
+
+        reads, counts = self._run(dut, mem, commands)
+
+        assert reads == before + self._depths(mem, addrs)
+        assert mem[0x600:0x610] == after
+        assert counts == {"hit": 0, "miss": 4, "evict": 0}, counts
+
+    def test_cleared(self):
+        dut = ZReader(sets=16)
+        rng = random.Random(5678)
+        mem = bytearray(rng.randbytes(0x1000))
+
+        addrs = [0x200 + 2 * x for x in range(8)]
+        # Neither read from memory nor cached
+        cleared = [0x300 + 2 * x for x in range(8)]
+        commands = [("read", addrs), ("read_cleared", cleared), ("read", addrs)]
+
+        reads, counts = self._run(dut, mem, commands)
+
+        assert reads == self._depths(mem, addrs) + [0] * len(cleared) + self._depths(mem, addrs)
+        assert counts == {"hit": 2, "miss": 2, "evict": 0}, counts
@@ -0,0 +1,89 @@
+from amaranth import *
+from amaranth.lib import wiring
+from amaranth.sim import *
+from zynq_gpu.axi_arbiter import AxiArbiter
+from zynq_gpu.rasterizer import PixelWriter
+import random
+import unittest
+from .utils import wait_until, AxiEmulator, make_testbench_process
+
+
+class AxiArbiterTest(unittest.TestCase):
+    @staticmethod
+    def _test(n: int, count: int, seed: int):
+        rng = random.Random(seed)
+
+        m = Module()
+        m.submodules.arbiter = arbiter = AxiArbiter(n)
+        writers = []
+        for i in range(n):
+            m.submodules[f"writer_{i}"] = writer = PixelWriter()
+            wiring.connect(m, arbiter.masters[i].write_address, writer.axi_addr)
+            wiring.connect(m, arbiter.masters[i].write_data, writer.axi_data)
+            wiring.connect(m, arbiter.masters[i].write_response, writer.axi_resp)
+            writers.append(writer)
+
+        # Each writer gets its own region, with pixels that sometimes need 2 beats or cross a 4KiB boundary
+        region = 0x2000
+        mem = bytearray(region * n)
+        expected = bytearray(len(mem))
+
+        def write(addr, size, value, mask):
+            assert size == 8
+            for i in range(8):
+                if mask & (1 << i):
+                    mem[addr + i] = (value >> (8 * i)) & 0xFF
+
+        # Big enough queues that the emulator never stalls, its address and data channels don't see each other's ready
+        # in the same cycle
+        emulator = AxiEmulator(arbiter.bus, None, write, aw_buffer=1024, w_buffer=1024, write_latency=3)
+
+        def feed(i: int, pixels: list[tuple[int, int]]):
+            writer = writers[i]
+            gaps = random.Random(seed + i)
+
+            def process():
+                for addr, value in pixels:
+                    # All at once, the emulator runs in the same cycle and might only see some of them otherwise
+                    yield Cat(writer.pixel_valid, writer.pixel_addr, writer.pixel_data).eq(
+                        Cat(C(1, 1), C(addr, 32), C(value, 24))
+                    )
+                    yield from wait_until(writer.pixel_ready)
+                    yield
+                    gap = gaps.randrange(0, 3)
+                    if gap:
+                        yield writer.pixel_valid.eq(0)
+                        for _ in range(gap):
+                            yield
+                yield writer.pixel_valid.eq(0)
+                yield from wait_until(writer.idle)
+                # Extra cycles for AXI latency
+                for _ in range(50):
+                    yield
+
+            return process
+
+        sim = Simulator(m)
+        emulator.add_to_sim(sim)
+        for i in range(n):
+            pixels = []
+            for _ in range(count):
+                addr = region * i + rng.choice([rng.randrange(0, region - 3), 0xFFD, 0xFFE, 0xFFF])
+                value = rng.randrange(0, 1 << 24)
+                pixels.append((addr, value))
+                expected[addr:addr + 3] = value.to_bytes(3, "little")
+            sim.add_sync_process(make_testbench_process(feed(i, pixels)))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        for i in range(len(mem)):
+            assert mem[i] == expected[i], f"{hex(i)}: expected {expected[i]:02X}, got {mem[i]:02X}"
+
+    def test_single(self):
+        self._test(1, 100, 1234)
+
+    def test_two(self):
+        self._test(2, 100, 2345)
+
+    def test_three(self):
+        self._test(3, 100, 3456)
@@ -1,5 +1,7 @@
 from amaranth.sim import *
 from zynq_gpu.axifb import PixelAdapter, AxiFramebuffer
+from zynq_gpu.rasterizer.types import PixelFormat
+import random
 import struct
 import unittest
 from .utils import wait_until, AxiEmulator, make_testbench_process
@@ -7,8 +9,8 @@ from .utils import wait_until, AxiEmulator, make_testbench_process
 
 class PixelAdapterTests(unittest.TestCase):
     @staticmethod
-    def _do_test(slow_memory: bool, slow_read: bool):
-        dut = PixelAdapter()
+    def _do_test(slow_memory: bool, slow_read: bool, pixel_format: PixelFormat = PixelFormat.RGB888):
+        dut = PixelAdapter(pixel_format)
 
         data = bytes([
             0x11, 0x11, 0x11,
@@ -20,6 +22,17 @@ class PixelAdapterTests(unittest.TestCase):
             0xFF, 0xFF, 0x11,
             0xFF, 0xFF, 0xFF,
         ] * 32)
+        pixels = [int.from_bytes(p, "little") for p in zip(*([iter(data)] * 3), strict=True)]
+        if pixel_format == PixelFormat.XRGB8888:
+            data = b"".join(p.to_bytes(3, "little") + b"\xAA" for p in pixels)
+        elif pixel_format == PixelFormat.RGB565:
+            rng = random.Random(1234)
+            words = [rng.randrange(0, 1 << 16) for _ in range(len(pixels))]
+            data = b"".join(w.to_bytes(2, "little") for w in words)
+            pixels = []
+            for w in words:
+                b, g, r = w & 0x1F, (w >> 5) & 0x3F, w >> 11
+                pixels.append(((b << 3) | (b >> 2)) | (((g << 2) | (g >> 4)) << 8) | (((r << 3) | (r >> 2)) << 16))
         assert len(data) % 8 == 0
 
         def axi_feed():
@@ -37,8 +50,7 @@ class PixelAdapterTests(unittest.TestCase):
 
         def pixel_read():
             yield dut.pixel_stream.ready.eq(1)
-            for pixel_bytes in zip(*([iter(data)] * 3), strict=True):
-                pixel = (pixel_bytes[0] << 0) | (pixel_bytes[1] << 8) | (pixel_bytes[2] << 16)
+            for pixel in pixels:
                 yield from wait_until(dut.pixel_stream.valid)
                 actual = yield dut.pixel_stream.pixel
                 assert actual == pixel, f"Mismatched pixel, expected {hex(pixel)}, got {hex(actual)}"
@@ -67,6 +79,14 @@ class PixelAdapterTests(unittest.TestCase):
     def test_slow_memory_slow_reads(self):
         self._do_test(True, True)
 
+    def test_xrgb8888(self):
+        self._do_test(False, False, PixelFormat.XRGB8888)
+        self._do_test(True, True, PixelFormat.XRGB8888)
+
+    def test_rgb565(self):
+        self._do_test(False, False, PixelFormat.RGB565)
+        self._do_test(True, True, PixelFormat.RGB565)
+
 
 class AxiFramebufferTests(unittest.TestCase):
     @staticmethod
@@ -1,5 +1,7 @@
+from amaranth import *
+from amaranth.lib import wiring
 from amaranth.sim import *
-from zynq_gpu.dma import DMAFifo, DMAControl, DMA
+from zynq_gpu.dma import DMAFifo, DMAControl, DMA, DMARing, DMAScatterGather
 from zynq_gpu.zynq_ifaces import SAxiHP, SAxiGP, SAxiACP
 import random
 import struct
@@ -176,6 +178,62 @@ class DMAControlTests(unittest.TestCase):
     def test_slow_axi_gp(self):
         self._do_test(SAxiGP, 1337, True)
 
+    def test_queued_transfers(self):
+        dut = DMAControl(axi_iface_sig=SAxiGP, max_pending_bursts=64)
+
+        transfers = [(0x4000_0000, 40), (0x4100_0000, 16), (0x4200_0000, 7)]
+        expected = []
+        for base_addr, count in transfers:
+            for done in range(0, count, 16):
+                expected.append((base_addr + done * 4, min(count - done, 16)))
+
+        transfers_done = 0
+
+        def control():
+            for base_addr, count in transfers:
+                yield from wait_until(dut.control.queue_space)
+                yield dut.control.base_addr.eq(base_addr >> 6)
+                yield dut.control.words.eq(count)
+                yield dut.control.trigger.eq(1)
+                yield
+                yield dut.control.trigger.eq(0)
+            yield from wait_until(dut.control.idle)
+            assert transfers_done == len(transfers), \
+                f"Wrong completed transfers, expected {len(transfers)}, got {transfers_done}"
+
+        def axi_read():
+            yield dut.axi_address.ready.eq(1)
+            for expected_addr, expected_burst_len in expected:
+                yield from wait_until(dut.axi_address.valid)
+                actual_addr = (yield dut.axi_address.addr)
+                assert expected_addr == actual_addr, \
+                    f"Wrong address, expected {hex(expected_addr)}, got {hex(actual_addr)}"
+                actual_burst_len = (yield dut.axi_address.len) + 1
+                assert expected_burst_len == actual_burst_len, \
+                    f"Wrong burst length, expected {expected_burst_len}, got {actual_burst_len}"
+                yield
+            yield dut.axi_address.ready.eq(0)
+
+        def burst_ends():
+            nonlocal transfers_done
+
+            for _ in expected:
+                for _ in range(20):
+                    yield
+                yield dut.burst_end.eq(1)
+                yield Settle()
+                if (yield dut.control.transfer_done):
+                    transfers_done += 1
+                yield
+                yield dut.burst_end.eq(0)
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_sync_process(make_testbench_process(axi_read))
+        sim.add_sync_process(make_testbench_process(burst_ends))
+        sim.add_clock(1e-6)
+        sim.run()
+
 
 class DMATest(unittest.TestCase):
     @staticmethod
@@ -249,3 +307,112 @@ class DMATest(unittest.TestCase):
 
     def test_slow_read_acp(self):
         return self._do_test(SAxiACP, True)
+
+
+class DMARingTest(unittest.TestCase):
+    def test_wraparound(self):
+        m = Module()
+        m.submodules.dma = dma = DMA(axi_iface_sig=SAxiGP)
+        m.submodules.ring = ring = DMARing()
+        wiring.connect(m, dma.control, ring.dma)
+        m.d.comb += ring.burst_end.eq(dma.burst_end)
+
+        base_addr = 0x4000_0000
+        blocks = 4
+
+        def read(addr, bytes_per_beat):
+            assert base_addr <= addr < base_addr + blocks * 64, f"Read outside of the ring at {hex(addr)}"
+            return addr
+
+        emulator = AxiEmulator(dma.axi, read, None)
+
+        # Ends past the end of the ring, starting again from its base
+        expected = [base_addr + i * 4 for i in range(3 * 16)] + \
+                   [base_addr + i * 4 for i in range(3 * 16, 4 * 16)] + \
+                   [base_addr + i * 4 for i in range(16)]
+
+        def control():
+            yield ring.ring.base_addr.eq(base_addr >> 6)
+            yield ring.ring.blocks.eq(blocks)
+            yield ring.ring.enable.eq(1)
+            yield ring.ring.write_ptr.eq(3)
+            yield
+            yield from wait_until(ring.ring.read_ptr == 3)
+            yield from wait_until(ring.control.idle)
+            yield ring.ring.write_ptr.eq(1)
+            yield
+            assert not (yield ring.control.idle)
+            yield from wait_until(ring.ring.read_ptr == 1)
+            yield from wait_until(ring.control.idle)
+
+        def data_read():
+            yield dma.data_stream.ready.eq(1)
+            for word in expected:
+                yield from wait_until(dma.data_stream.valid)
+                actual = yield dma.data_stream.data
+                assert actual == word, f"Mismatched word, expected {hex(word)}, got {hex(actual)}"
+                yield
+
+        sim = Simulator(m)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_sync_process(make_testbench_process(data_read))
+        sim.add_clock(1e-6)
+        sim.run()
+
+
+class DMAScatterGatherTest(unittest.TestCase):
+    def test_chain(self):
+        m = Module()
+        m.submodules.dma = dma = DMA(axi_iface_sig=SAxiGP)
+        m.submodules.scatter_gather = scatter_gather = DMAScatterGather()
+        wiring.connect(m, dma.control, scatter_gather.dma)
+        wiring.connect(m, scatter_gather.dma_stream, dma.data_stream)
+
+        # (descriptor address, data address, words)
+        chain = [
+            (0x4000_0000, 0x4100_0000, 20),
+            (0x4000_1000, 0x4200_0000, 5),
+            (0x4000_0040, 0x4100_1000, 33),
+        ]
+        memory = {}
+        expected = []
+        for i, (descriptor_addr, data_addr, words) in enumerate(chain):
+            next_addr = chain[i + 1][0] if i + 1 < len(chain) else 0
+            for j, word in enumerate([data_addr, words, next_addr, 0]):
+                memory[descriptor_addr + j * 4] = word
+            for j in range(words):
+                memory[data_addr + j * 4] = (i << 16) | j
+                expected.append((i << 16) | j)
+
+        def read(addr, bytes_per_beat):
+            assert addr in memory, f"Read outside of the chain at {hex(addr)}"
+            return memory[addr]
+
+        emulator = AxiEmulator(dma.axi, read, None)
+
+        def control():
+            yield scatter_gather.chain.addr.eq(chain[0][0] >> 6)
+            yield scatter_gather.chain.trigger.eq(1)
+            yield
+            yield scatter_gather.chain.trigger.eq(0)
+            yield
+            assert not (yield scatter_gather.chain.idle)
+            assert not (yield scatter_gather.control.idle)
+            yield from wait_until(scatter_gather.chain.idle)
+            yield from wait_until(scatter_gather.control.idle)
+
+        def data_read():
+            yield scatter_gather.data_stream.ready.eq(1)
+            for word in expected:
+                yield from wait_until(scatter_gather.data_stream.valid)
+                actual = yield scatter_gather.data_stream.data
+                assert actual == word, f"Mismatched word, expected {hex(word)}, got {hex(actual)}"
+                yield
+
+        sim = Simulator(m)
+        emulator.add_to_sim(sim)
+        sim.add_sync_process(make_testbench_process(control))
+        sim.add_sync_process(make_testbench_process(data_read))
+        sim.add_clock(1e-6)
+        sim.run()
@@ -0,0 +1,71 @@
+from amaranth.sim import *
+from zynq_gpu.utils import Reciprocal
+import random
+import unittest
+from .utils import make_testbench_process
+
+
+class ReciprocalTest(unittest.TestCase):
+    @staticmethod
+    def _test(values, gap: int = 0):
+        dut = Reciprocal()
+
+        results = []
+
+        def feed():
+            for v in values:
+                yield dut.d.eq(v)
+                yield dut.trigger.eq(1)
+                yield
+                yield dut.trigger.eq(0)
+                for _ in range(gap):
+                    yield
+            for _ in range(Reciprocal.LATENCY + 1):
+                yield
+
+        def check():
+            yield Passive()
+            while True:
+                if (yield dut.done):
+                    results.append((yield dut.o))
+                yield
+
+        sim = Simulator(dut)
+        sim.add_sync_process(make_testbench_process(feed))
+        sim.add_sync_process(make_testbench_process(check))
+        sim.add_clock(1e-6)
+        sim.run()
+
+        assert len(results) == len(values), f"{len(results)} / {len(values)}"
+        for v, r in zip(values, results):
+            exp = 0xFFFFFF // v if v != 0 else 0xFFFFFF
+            assert exp == r, f"0xFFFFFF / {v}: expected {exp}, got {r}"
+
+    def test_edges(self):
+        values = [0, 1, 2, 3, 0xFFFFFF, 0xFFFFFE, 0x7FFFFF, 0x800000, 0x800001, 0xFFF, 0x1000, 0x1001]
+        values += [(1 << i) + d for i in range(24) for d in (-1, 0, 1) if 0 < (1 << i) + d < (1 << 24)]
+        self._test(values)
+
+    def test_random(self):
+        rng = random.Random(1234)
+        self._test([rng.randrange(1, 1 << rng.randrange(1, 25)) for _ in range(2000)])
+
+    def test_throughput(self):
+        rng = random.Random(5678)
+        for gap in range(3):
+            self._test([rng.randrange(1, 1 << 24) for _ in range(20)], gap)
+
+    def test_seed_table_model(self):
+        # Same arithmetic as the gateware, checked for every divisor in a few ranges
+        table = Reciprocal.seed_table(24)
+        frac = 26
+        for d in [*range(1, 1 << 14), *range((1 << 24) - (1 << 14), 1 << 24)]:
+            lz = 24 - d.bit_length()
+            dn = d << lz
+            x = table[(dn >> (23 - Reciprocal.SEED_INDEX_BITS)) & ((1 << Reciprocal.SEED_INDEX_BITS) - 1)]
+            x <<= frac + 1 - Reciprocal.SEED_BITS
+            for _ in range(2):
+                t = (dn * x) >> 24
+                x = (x * ((1 << (frac + 1)) - t)) >> frac
+            q = ((0xFFFFFF * x) << lz) >> (frac + 24)
+            assert 0 <= 0xFFFFFF // d - q <= 1, f"{d}: {q} / {0xFFFFFF // d}"
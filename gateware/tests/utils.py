@@ -203,6 +203,8 @@ class AxiEmulator:
                 yield r.data.eq(value)
                 yield r.last.eq(i == op.burst_length - 1)
                 while True:
+                    # ready may depend on the ID when shared through an arbiter
+                    yield Settle()
                     done = (yield r.ready)
                     yield
                     if done:
@@ -251,5 +253,9 @@ class AxiEmulator:
                 self._write(addr, op.bytes_per_beat, data.data, data.strb)
             yield b.valid.eq(1)
             yield b.id.eq(op.id)
-            while not (yield b.ready):
+            while True:
+                yield Settle()
+                done = (yield b.ready)
                 yield
+                if done:
+                    break
@@ -6,6 +6,7 @@ from board import ebaz4205
 from zynq_gpu import axi_to_wishbone
 from zynq_gpu.hdmi import HDMITx, VideoMode
 from zynq_gpu.ps7 import PS7
+from zynq_gpu.rasterizer.types import PixelFormat
 from zynq_gpu.soc import Framebuffer, Raster
 from zynq_gpu.wb_cdc import WishboneCDC
 from zynq_gpu.zynq_ifaces import MAxiGP
@@ -17,6 +18,7 @@ configs = {
 }
 
 mode, (divclk_divide, clkfbout_mult_f, clkout0_divide_f, clkout1_divide, clkout2_divide), = configs["720_60"]
+pixel_format = PixelFormat.RGB888
 
 mmcm_in_domain, clkin1_period = "clk100", 10.0
 actual_pixel_clock = (1_000_000_000 / clkin1_period) * clkfbout_mult_f / divclk_divide / clkout0_divide_f
@@ -28,8 +30,8 @@ class Peripherals(Elaboratable):
     def __init__(self):
         self.axi = MAxiGP.create()
 
-        self.video = Framebuffer(mode)
-        self.rasterizer = Raster(mode.width)
+        self.video = Framebuffer(mode, pixel_format=pixel_format)
+        self.rasterizer = Raster(mode.width, pixel_format=pixel_format)
 
     def elaborate(self, platform):
         m = Module()
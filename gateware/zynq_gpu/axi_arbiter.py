@@ -0,0 +1,145 @@
+from amaranth import *
+from amaranth.lib.wiring import Component, In, Out, Signature
+from amaranth.utils import log2_int
+from .zynq_ifaces import SAxiHP
+
+
+__all__ = ["AxiArbiter"]
+
+
+class AxiArbiter(Component):
+    """
+    Shares an AXI port (HP by default) between `n` masters.
+
+    Each address channel is granted to one master at a time, which sees the ready signals of the port as they are,
+    so masters that wait for ready before asserting valid still work. The grant moves round-robin after every
+    transaction, or when the granted master has nothing to send. The ID of each transaction is replaced by the index
+    of the master that issued it, which is then used to route read data and write responses back, so masters can't
+    use IDs themselves. Write transactions are granted whole (address and every data beat), so write data is never
+    interleaved.
+    """
+
+    def __init__(self, n: int, axi_iface_sig=SAxiHP):
+        if n < 1:
+            raise ValueError(f"Master count must be at least 1, not {n!r}")
+        self._n = n
+        self._axi_iface_sig = axi_iface_sig
+        self._id_bits = max(1, log2_int(n, need_pow2=False))
+        super().__init__()
+
+    @property
+    def signature(self):
+        return Signature({
+            "masters": In(self._axi_iface_sig).array(self._n),
+            "bus": Out(self._axi_iface_sig),
+        })
+
+    def _round_robin(self, m, name: str, requests: Value, last: Value) -> Value:
+        # First requesting master after `last`, or the one right after it if none are requesting
+        pick = Signal(range(self._n), name=f"{name}_pick")
+        with m.Switch(last):
+            for i in range(self._n):
+                with m.Case(i):
+                    m.d.comb += pick.eq((i + 1) % self._n)
+                    for offset in reversed(range(1, self._n + 1)):
+                        with m.If(requests[(i + offset) % self._n]):
+                            m.d.comb += pick.eq((i + offset) % self._n)
+        return pick
+
+    def _forward(self, m, channel: str, sel: Value, skip: set[str]):
+        bus = getattr(self.bus, channel)
+        ports = [getattr(master, channel) for master in self.masters]
+        for name, member in bus.signature.members.items():
+            if name in skip:
+                continue
+            if member.flow == Out:
+                m.d.comb += getattr(bus, name).eq(Array(getattr(port, name) for port in ports)[sel])
+            else:
+                for port in ports:
+                    m.d.comb += getattr(port, name).eq(getattr(bus, name))
+
+    def _route(self, m, channel: str):
+        # Responses go to the master the ID belongs to
+        bus = getattr(self.bus, channel)
+        ports = [getattr(master, channel) for master in self.masters]
+        dest = bus.id[:self._id_bits]
+        for name, member in bus.signature.members.items():
+            if name in ("valid", "ready", "id"):
+                continue
+            if member.flow == In:
+                for port in ports:
+                    m.d.comb += getattr(port, name).eq(getattr(bus, name))
+        for i, port in enumerate(ports):
+            m.d.comb += port.valid.eq(bus.valid & (dest == i))
+        m.d.comb += bus.ready.eq(Array(port.ready for port in ports)[dest])
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.d.comb += self.bus.aclk.eq(ClockSignal())
+        for master in self.masters:
+            m.d.comb += master.reset_n.eq(self.bus.reset_n)
+
+        # Read address, the grant is held while valid is waiting for ready since the address can't change then
+
+        ar_grant = Signal(range(self._n))
+        ar_next = self._round_robin(m, "ar", Cat(master.read_address.valid for master in self.masters), ar_grant)
+
+        self._forward(m, "read_address", ar_grant, {"ready", "id"})
+        m.d.comb += self.bus.read_address.id.eq(ar_grant)
+        for i, master in enumerate(self.masters):
+            m.d.comb += master.read_address.ready.eq(self.bus.read_address.ready & (ar_grant == i))
+
+        with m.If(~self.bus.read_address.valid | self.bus.read_address.ready):
+            m.d.sync += ar_grant.eq(ar_next)
+
+        self._route(m, "read")
+
+        # Write address and data, granted together until both are done
+
+        w_grant = Signal(range(self._n))
+        aw_done = Signal()
+        w_done = Signal()
+        w_next = self._round_robin(m, "w", Cat(
+            master.write_address.valid | master.write_data.valid for master in self.masters
+        ), w_grant)
+
+        self._forward(m, "write_address", w_grant, {"ready", "valid", "id"})
+        self._forward(m, "write_data", w_grant, {"ready", "valid", "id"})
+        m.d.comb += [
+            self.bus.write_address.id.eq(w_grant),
+            self.bus.write_address.valid.eq(
+                Array(master.write_address.valid for master in self.masters)[w_grant] & ~aw_done
+            ),
+            self.bus.write_data.id.eq(w_grant),
+            self.bus.write_data.valid.eq(Array(master.write_data.valid for master in self.masters)[w_grant] & ~w_done),
+        ]
+        for i, master in enumerate(self.masters):
+            m.d.comb += [
+                master.write_address.ready.eq(self.bus.write_address.ready & ~aw_done & (w_grant == i)),
+                master.write_data.ready.eq(self.bus.write_data.ready & ~w_done & (w_grant == i)),
+            ]
+
+        aw_finished = Signal()
+        w_finished = Signal()
+        m.d.comb += [
+            aw_finished.eq(aw_done | (self.bus.write_address.valid & self.bus.write_address.ready)),
+            w_finished.eq(w_done | (self.bus.write_data.valid & self.bus.write_data.ready & self.bus.write_data.last)),
+        ]
+        with m.If(aw_finished & w_finished):
+            m.d.sync += [
+                w_grant.eq(w_next),
+                aw_done.eq(0),
+                w_done.eq(0),
+            ]
+        with m.Elif(aw_finished | w_finished):
+            m.d.sync += [
+                aw_done.eq(aw_finished),
+                w_done.eq(w_finished),
+            ]
+        with m.Elif(~self.bus.write_address.valid & ~self.bus.write_data.valid):
+            m.d.sync += w_grant.eq(w_next)
+
+        self._route(m, "write_response")
+
+        return m
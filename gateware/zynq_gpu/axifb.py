@@ -2,6 +2,7 @@ from amaranth import *
 from amaranth.lib import wiring
 from amaranth.lib.wiring import Component, In, Out, Signature
 from .dma import DMA, ControlRegisters, data_stream_signature
+from .rasterizer.types import PixelFormat
 from .zynq_ifaces import SAxiHP
 
 
@@ -21,9 +22,32 @@ class PixelAdapter(Component):
     memory_stream: In(data_stream_signature(64))
     pixel_stream: Out(PixelStream)
 
+    def __init__(self, pixel_format: PixelFormat = PixelFormat.RGB888):
+        self._pixel_format = pixel_format
+        super().__init__()
+
     def elaborate(self, platform):
         m = Module()
 
+        if self._pixel_format != PixelFormat.RGB888:
+            # A whole number of pixels in every word
+            pixels_per_word = 8 // self._pixel_format.bytes_per_pixel
+            ctr = Signal(range(pixels_per_word))
+
+            m.d.comb += [
+                self.pixel_stream.valid.eq(self.memory_stream.valid),
+                self.pixel_stream.pixel.eq(self._pixel_format.unpack(
+                    self.memory_stream.data.word_select(ctr, 8 * self._pixel_format.bytes_per_pixel)
+                )),
+            ]
+            with m.If(self.memory_stream.valid & self.pixel_stream.ready):
+                m.d.sync += ctr.eq(ctr + 1)
+                with m.If(ctr == pixels_per_word - 1):
+                    m.d.comb += self.memory_stream.ready.eq(1)
+                    m.d.sync += ctr.eq(0)
+
+            return m
+
         ctr = Signal(range(4))
         remain = Signal(16)
 
@@ -79,10 +103,14 @@ class AxiFramebuffer(Component):
     control: In(ControlRegisters)
     pixel_stream: Out(PixelStream)
 
+    def __init__(self, pixel_format: PixelFormat = PixelFormat.RGB888):
+        self._pixel_format = pixel_format
+        super().__init__()
+
     def elaborate(self, platform):
         m = Module()
 
-        m.submodules.pixel_adapter = pixel_adapter = PixelAdapter()
+        m.submodules.pixel_adapter = pixel_adapter = PixelAdapter(self._pixel_format)
         m.submodules.dma = dma = DMA(axi_iface_sig=SAxiHP)
 
         wiring.connect(m, dma.axi, wiring.flipped(self.axi))
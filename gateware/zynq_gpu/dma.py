@@ -1,26 +1,54 @@
 from amaranth import *
-from amaranth.lib.fifo import SyncFIFOBuffered
+from amaranth.lib.fifo import SyncFIFO, SyncFIFOBuffered
 from amaranth.lib import wiring
 from amaranth.lib.wiring import Component, In, Out, Signature
 from amaranth.utils import log2_int
 from .zynq_ifaces import SAxiHP
 
 
-__all__ = ["ControlRegisters", "data_stream_signature", "DMA", "DMAFifo", "DMAControl"]
+__all__ = [
+    "ControlRegisters", "RingRegisters", "ChainRegisters", "data_stream_signature", "DMA", "DMAFifo", "DMAControl",
+    "DMARing", "DMAScatterGather",
+]
 
 
 ControlRegisters = Signature({
     "base_addr": Out(26),   # 64-byte aligned base address. The 6 LSBs are filled with zeroes.
-    "words": Out(20),       # How many words of data should be read.
-    "trigger": Out(1),      # Start a transaction. Does nothing if `request_done == 0`.
+    "words": Out(20),       # How many words of data should be read. Must not be zero.
+    "trigger": Out(1),      # Queue a transaction, it starts once the previous ones are sent. Does nothing if
+                            # `queue_space == 0`.
     "idle": In(1),          # Whether the memory side is idle. The FIFO may still have data, but all bursts are done,
                             # so it's safe to modify the buffer.
     "request_done": In(1),  # Whether all requests have been sent. The data might still not have been read,
-                            # so the buffer should not be modified, but a new transfer may be started.
-    "qos": Out(4),          # AXI QOS field.
+                            # so the buffer should not be modified.
+    "queue_space": In(1),   # Whether another transaction can be queued.
+    "transfer_done": In(1), # Pulsed once all bursts of a transaction are done, in the order they were queued.
+    "qos": Out(4),          # AXI QOS field, taken along with the transaction.
 })
 
 
+# Pointers count 64-byte blocks from the start of the ring
+RingRegisters = Signature({
+    "enable": Out(1),       # Read from the ring instead of single transfers. Clearing it resets both pointers.
+    "base_addr": Out(26),   # 64-byte aligned base address of the ring.
+    "blocks": Out(16),      # Size of the ring.
+    "write_ptr": Out(16),   # Blocks up to this one have data to read.
+    "read_ptr": In(16),     # Blocks from `write_ptr` up to this one were read and may be overwritten.
+})
+
+
+# Descriptors are 4 words, 64-byte aligned: the data address, its length in words and the address of the next
+# descriptor, with 0 ending the chain. Addresses are in bytes and 64-byte aligned, the length must not be zero.
+ChainRegisters = Signature({
+    "addr": Out(26),        # 64-byte aligned address of the first descriptor.
+    "trigger": Out(1),      # Start reading the chain once data from previous transactions was read. Does nothing
+                            # unless `idle`.
+    "idle": In(1),          # Whether the whole chain was read.
+})
+
+DESCRIPTOR_WORDS = 4
+
+
 def data_stream_signature(width):
     return Signature({
         "valid": Out(1),
@@ -71,19 +99,26 @@ class DMAFifo(Component):
 
 
 class DMAControl(Component):
-    def __init__(self, *, axi_iface_sig, max_pending_bursts):
+    # With `fifo_depth`, bursts are only requested while the FIFO has room for them and every pending one, so read
+    # data never waits on a shared port.
+    def __init__(self, *, axi_iface_sig, max_pending_bursts, queue_depth=2, fifo_depth=None):
         self._axi_iface_sig = axi_iface_sig
         self._max_pending = max_pending_bursts
+        self._queue_depth = queue_depth
+        self._fifo_depth = fifo_depth
 
         super().__init__()
 
     @property
     def signature(self):
-        return Signature({
+        members = {
             "axi_address": Out(self._axi_iface_sig.members["read_address"].signature),
             "control": In(ControlRegisters),
             "burst_end": In(1),
-        })
+        }
+        if self._fifo_depth is not None:
+            members["fifo_level"] = In(log2_int(self._fifo_depth + 1, need_pow2=False))
+        return Signature(members)
 
     def elaborate(self, platform):
         m = Module()
@@ -102,8 +137,32 @@ class DMAControl(Component):
 
         addr_64 = Signal.like(self.control.base_addr)
         ctr = Signal.like(self.control.words)
+        qos = Signal.like(self.control.qos)
+
+        # Transactions wait here while the previous ones are sent, so there's no gap between their bursts
+        m.submodules.queue = queue = SyncFIFO(width=len(Cat(addr_64, ctr, qos)), depth=self._queue_depth)
+        m.d.comb += [
+            queue.w_data.eq(Cat(self.control.base_addr, self.control.words, self.control.qos)),
+            queue.w_en.eq(self.control.trigger),
+            self.control.queue_space.eq(queue.w_rdy),
+        ]
+
+        # Whether each pending burst is the last one of its transaction
+        m.submodules.last_bursts = last_bursts = SyncFIFO(width=1, depth=self._max_pending)
+        m.d.comb += [
+            last_bursts.r_en.eq(self.burst_end),
+            self.control.transfer_done.eq(self.burst_end & last_bursts.r_data),
+        ]
 
         pending_bursts = Signal(range(self._max_pending))
+        fifo_space = Signal()
+        if self._fifo_depth is not None:
+            m.d.comb += fifo_space.eq(self.fifo_level + (pending_bursts + 1) * 16 <= self._fifo_depth)
+        else:
+            m.d.comb += fifo_space.eq(1)
+        # Beats of pending bursts are counted twice while they arrive, but valid can't drop once it's set
+        address_waiting = Signal()
+        m.d.sync += address_waiting.eq(self.axi_address.valid & ~self.axi_address.ready)
         sent_burst = Signal()
         m.d.sync += pending_bursts.eq(
             pending_bursts +
@@ -113,16 +172,14 @@ class DMAControl(Component):
 
         with m.If(ctr == 0):
             m.d.comb += [
-                self.control.request_done.eq(1),
-                self.control.idle.eq(pending_bursts == 0),
+                self.control.request_done.eq(~queue.r_rdy),
+                self.control.idle.eq(~queue.r_rdy & (pending_bursts == 0)),
+                queue.r_en.eq(1),
             ]
-            with m.If(self.control.trigger):
-                m.d.sync += [
-                    addr_64.eq(self.control.base_addr),
-                    ctr.eq(self.control.words),
-                ]
+            with m.If(queue.r_rdy):
+                m.d.sync += Cat(addr_64, ctr, qos).eq(queue.r_data)
         with m.Else():
-            m.d.comb += self.axi_address.valid.eq(~(pending_bursts.all()))
+            m.d.comb += self.axi_address.valid.eq(~(pending_bursts.all()) & (fifo_space | address_waiting))
 
         burst_len = Signal(4)
         m.d.comb += [
@@ -130,9 +187,12 @@ class DMAControl(Component):
             self.axi_address.burst.eq(0b01),  # INCR
             self.axi_address.addr.eq(Cat(C(0, 6), addr_64)),
             self.axi_address.len.eq(burst_len),
-            self.axi_address.qos.eq(self.control.qos),
+            self.axi_address.qos.eq(qos),
 
             sent_burst.eq(self.axi_address.ready & self.axi_address.valid),
+
+            last_bursts.w_data.eq(ctr <= 16),
+            last_bursts.w_en.eq(sent_burst),
         ]
         with m.If(sent_burst):
             m.d.sync += [
@@ -147,7 +207,9 @@ class DMAControl(Component):
 
 
 class DMA(Component):
-    def __init__(self, axi_iface_sig, max_pending_bursts=64, fifo_depth_bytes=4096):
+    # With `flow_control`, the AXI port can be shared with other masters, see `DMAControl`
+    def __init__(self, axi_iface_sig, max_pending_bursts=64, fifo_depth_bytes=4096, queue_depth=2,
+                 flow_control=False):
         if max_pending_bursts & (max_pending_bursts - 1):
             raise ValueError(f"Max pending bursts must be a power of two, not {max_pending_bursts!r}")
         if fifo_depth_bytes & (fifo_depth_bytes - 1):
@@ -155,6 +217,8 @@ class DMA(Component):
 
         self._axi_iface_sig = axi_iface_sig
         self._max_pending = max_pending_bursts
+        self._queue_depth = queue_depth
+        self._flow_control = flow_control
 
         width = self._axi_iface_sig.members["read"].signature.members["data"].shape
         self._fifo_depth = fifo_depth_bytes // (width // 8)
@@ -169,6 +233,7 @@ class DMA(Component):
             "control": In(ControlRegisters),
             "data_stream": Out(data_stream_signature(width)),
             "fifo_level": Out(log2_int(self._fifo_depth + 1, need_pow2=False)),
+            "burst_end": Out(1),
         })
 
     @property
@@ -180,7 +245,9 @@ class DMA(Component):
 
         m.submodules.fifo = fifo = DMAFifo(axi_iface_sig=self._axi_iface_sig, depth=self._fifo_depth)
         m.submodules.control = control = DMAControl(axi_iface_sig=self._axi_iface_sig,
-                                                    max_pending_bursts=self._max_pending)
+                                                    max_pending_bursts=self._max_pending,
+                                                    queue_depth=self._queue_depth,
+                                                    fifo_depth=self._fifo_depth if self._flow_control else None)
 
         # TODO: reset
         m.d.comb += self.axi.aclk.eq(ClockSignal())
@@ -193,6 +260,196 @@ class DMA(Component):
         m.d.comb += [
             control.burst_end.eq(fifo.burst_end),
             self.fifo_level.eq(fifo.fifo_level),
+            self.burst_end.eq(fifo.burst_end),
+        ]
+        if self._flow_control:
+            m.d.comb += control.fifo_level.eq(fifo.fifo_level)
+
+        return m
+
+
+class DMARing(Component):
+    """
+    Drives a DMA from a circular buffer in memory while `ring.enable` is set, and passes `control` through otherwise.
+
+    Every block between the read and write pointers is read in order, wrapping around at the end of the ring. The
+    read pointer only moves once a burst is done, so it's safe to overwrite blocks up to it. It counts one block per
+    burst, so the DMA must use a 32 bit interface. The ring should only be enabled while the DMA is idle.
+    """
+
+    control: In(ControlRegisters)
+    ring: In(RingRegisters)
+
+    dma: Out(ControlRegisters)
+    burst_end: In(1)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.d.comb += [
+            self.dma.qos.eq(self.control.qos),
+            self.control.transfer_done.eq(self.dma.transfer_done),
         ]
 
+        # Next block to request
+        issue_ptr = Signal.like(self.ring.write_ptr)
+        read_ptr = Signal.like(self.ring.read_ptr)
+        m.d.comb += self.ring.read_ptr.eq(read_ptr)
+
+        with m.If(self.ring.enable):
+            pending = Signal()
+            # Transfers stop at the end of the ring, the next one starts again from its base
+            end = Signal.like(self.ring.blocks)
+            m.d.comb += [
+                pending.eq(issue_ptr != self.ring.write_ptr),
+                end.eq(Mux(self.ring.write_ptr > issue_ptr, self.ring.write_ptr, self.ring.blocks)),
+
+                self.dma.base_addr.eq(self.ring.base_addr + issue_ptr),
+                self.dma.words.eq((end - issue_ptr) << 4),
+                self.dma.trigger.eq(pending & self.dma.queue_space),
+
+                self.control.idle.eq(self.dma.idle & ~pending),
+                self.control.request_done.eq(self.dma.request_done & ~pending),
+            ]
+            with m.If(self.dma.trigger):
+                m.d.sync += issue_ptr.eq(Mux(end == self.ring.blocks, 0, end))
+            with m.If(self.burst_end):
+                m.d.sync += read_ptr.eq(Mux(read_ptr + 1 == self.ring.blocks, 0, read_ptr + 1))
+        with m.Else():
+            m.d.sync += issue_ptr.eq(0), read_ptr.eq(0)
+            m.d.comb += [
+                self.dma.base_addr.eq(self.control.base_addr),
+                self.dma.words.eq(self.control.words),
+                self.dma.trigger.eq(self.control.trigger),
+
+                self.control.idle.eq(self.dma.idle),
+                self.control.request_done.eq(self.dma.request_done),
+                self.control.queue_space.eq(self.dma.queue_space),
+            ]
+
+        return m
+
+
+class DMAScatterGather(Component):
+    """
+    Drives a DMA from a chain of descriptors in memory after `chain.trigger`, and passes `control` through otherwise.
+
+    Each descriptor is read through the DMA along with the data, so the data of one descriptor is followed by the
+    next descriptor without waiting. Only the data is forwarded to `data_stream`. Descriptors are read as 32 bit words,
+    so the DMA must use a 32 bit interface.
+    """
+
+    control: In(ControlRegisters)
+    chain: In(ChainRegisters)
+
+    dma: Out(ControlRegisters)
+    dma_stream: In(data_stream_signature(32))
+    data_stream: Out(data_stream_signature(32))
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.d.comb += self.dma.qos.eq(self.control.qos)
+
+        descriptor_addr = Signal.like(self.chain.addr)
+        data_addr = Signal.like(self.dma.base_addr)
+        data_words = Signal.like(self.dma.words)
+        descriptor_word = Signal(range(DESCRIPTOR_WORDS))
+        remaining = Signal.like(self.dma.words)
+        last = Signal()
+
+        m.d.comb += [
+            self.chain.idle.eq(1),
+            self.data_stream.data.eq(self.dma_stream.data),
+        ]
+
+        def forward():
+            m.d.comb += [
+                self.data_stream.valid.eq(self.dma_stream.valid),
+                self.dma_stream.ready.eq(self.data_stream.ready),
+            ]
+
+        with m.FSM():
+            with m.State("PASSTHROUGH"):
+                forward()
+                m.d.comb += [
+                    self.dma.base_addr.eq(self.control.base_addr),
+                    self.dma.words.eq(self.control.words),
+                    self.dma.trigger.eq(self.control.trigger),
+
+                    self.control.idle.eq(self.dma.idle),
+                    self.control.request_done.eq(self.dma.request_done),
+                    self.control.queue_space.eq(self.dma.queue_space),
+                    self.control.transfer_done.eq(self.dma.transfer_done),
+                ]
+                with m.If(self.chain.trigger):
+                    m.d.sync += descriptor_addr.eq(self.chain.addr)
+                    m.next = "START"
+            with m.State("START"):
+                # Data from previous transactions still goes out first
+                forward()
+                m.d.comb += self.chain.idle.eq(0)
+                with m.If(self.dma.idle & ~self.dma_stream.valid):
+                    m.next = "FETCH"
+            with m.State("FETCH"):
+                m.d.comb += [
+                    self.chain.idle.eq(0),
+                    self.dma.base_addr.eq(descriptor_addr),
+                    self.dma.words.eq(DESCRIPTOR_WORDS),
+                    self.dma.trigger.eq(self.dma.queue_space),
+                ]
+                with m.If(self.dma.trigger):
+                    m.d.sync += descriptor_word.eq(0)
+                    m.next = "DESCRIPTOR"
+            with m.State("DESCRIPTOR"):
+                m.d.comb += [
+                    self.chain.idle.eq(0),
+                    self.dma_stream.ready.eq(1),
+                ]
+                with m.If(self.dma_stream.valid):
+                    m.d.sync += descriptor_word.eq(descriptor_word + 1)
+                    with m.Switch(descriptor_word):
+                        with m.Case(0):
+                            m.d.sync += data_addr.eq(self.dma_stream.data[6:])
+                        with m.Case(1):
+                            m.d.sync += data_words.eq(self.dma_stream.data)
+                        with m.Case(2):
+                            m.d.sync += [
+                                descriptor_addr.eq(self.dma_stream.data[6:]),
+                                last.eq(self.dma_stream.data == 0),
+                            ]
+                        with m.Case(DESCRIPTOR_WORDS - 1):
+                            m.next = "QUEUE_DATA"
+            with m.State("QUEUE_DATA"):
+                m.d.comb += [
+                    self.chain.idle.eq(0),
+                    self.dma.base_addr.eq(data_addr),
+                    self.dma.words.eq(data_words),
+                    self.dma.trigger.eq(self.dma.queue_space),
+                ]
+                with m.If(self.dma.trigger):
+                    m.d.sync += remaining.eq(data_words)
+                    m.next = "QUEUE_NEXT"
+            with m.State("QUEUE_NEXT"):
+                # The next descriptor is read right after the data
+                m.d.comb += [
+                    self.chain.idle.eq(0),
+                    self.dma.base_addr.eq(descriptor_addr),
+                    self.dma.words.eq(DESCRIPTOR_WORDS),
+                    self.dma.trigger.eq(~last & self.dma.queue_space),
+                ]
+                with m.If(last | self.dma.trigger):
+                    m.next = "DATA"
+            with m.State("DATA"):
+                forward()
+                m.d.comb += self.chain.idle.eq(0)
+                with m.If(self.data_stream.valid & self.data_stream.ready):
+                    m.d.sync += remaining.eq(remaining - 1)
+                    with m.If(remaining == 1):
+                        with m.If(last):
+                            m.next = "PASSTHROUGH"
+                        with m.Else():
+                            m.d.sync += descriptor_word.eq(0)
+                            m.next = "DESCRIPTOR"
+
         return m
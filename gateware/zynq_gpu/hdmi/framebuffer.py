@@ -4,6 +4,7 @@ from amaranth import *
 from amaranth.lib import wiring
 from amaranth.lib.wiring import Component, In, Out
 from ..axifb import AxiFramebuffer
+from ..rasterizer.types import PixelFormat
 from ..zynq_ifaces import SAxiHP
 
 
@@ -121,8 +122,9 @@ class HDMIFramebuffer(Component):
     fetch_end_irq: Out(1)
     underrun_irq: Out(1)
 
-    def __init__(self, mode: VideoMode):
+    def __init__(self, mode: VideoMode, pixel_format: PixelFormat = PixelFormat.RGB888):
         self._mode = mode
+        self._pixel_format = pixel_format
         super().__init__()
 
     @property
@@ -133,12 +135,16 @@ class HDMIFramebuffer(Component):
     def height(self):
         return self._mode.height
 
+    @property
+    def pixel_format(self):
+        return self._pixel_format
+
     def elaborate(self, platform):
         m = Module()
 
         reset = Signal()
         m.submodules.tgen = tgen = ResetInserter(reset)(TimingGen(self._mode))
-        m.submodules.fb = fb = ResetInserter(reset)(AxiFramebuffer())
+        m.submodules.fb = fb = ResetInserter(reset)(AxiFramebuffer(self._pixel_format))
 
         en = Signal()
         m.d.pix += en.eq(self.en)
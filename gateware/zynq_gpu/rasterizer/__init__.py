@@ -1,8 +1,11 @@
 from .edge_walker import *
 from .pixel_writer import *
 from .types import *
+from .write_combiner import *
 
 from .rasterizer_sequential import Rasterizer as SequentialRasterizer
 from .rasterizer_pipelined import Rasterizer as PipelinedRasterizer
+from .rasterizer_parallel import Rasterizer as ParallelRasterizer
+from .rasterizer_tiled import Rasterizer as TiledRasterizer
 
 from .texture_buffer import TextureBuffer
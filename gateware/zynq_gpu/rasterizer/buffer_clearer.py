@@ -1,6 +1,6 @@
 from amaranth import *
 from amaranth.lib.wiring import Component, In, Out
-from .types import BufferClearStream
+from .types import BufferClearStream, PixelFormat
 from ..zynq_ifaces import SAxiHP
 
 
@@ -19,6 +19,7 @@ class BufferClearer(Component):
         addr_ctr = Signal.like(self.control.payload.words)
         data_ctr = Signal.like(self.control.payload.words)
         pattern = Signal.like(self.control.payload.pattern)
+        pattern_format = Signal.like(self.control.payload.format)
         pattern_ctr = Signal(range(3))
         burst_ctr = Signal(range(16))
 
@@ -41,6 +42,7 @@ class BufferClearer(Component):
                     addr_ctr.eq(self.control.payload.words),
                     data_ctr.eq(self.control.payload.words),
                     pattern.eq(self.control.payload.pattern),
+                    pattern_format.eq(self.control.payload.format),
                     self.axi.write_address.qos.eq(self.control.payload.qos),
                     pattern_ctr.eq(0),
                     burst_ctr.eq(0),
@@ -78,13 +80,19 @@ class BufferClearer(Component):
             self.axi.write_data.data.eq(write_data),
         ]
 
-        with m.Switch(pattern_ctr):
-            with m.Case(0):
-                m.d.comb += write_data.eq(Cat(pattern, pattern, pattern[:16]))
-            with m.Case(1):
-                m.d.comb += write_data.eq(Cat(pattern[16:], pattern, pattern, pattern[:8]))
-            with m.Case(2):
-                m.d.comb += write_data.eq(Cat(pattern[8:], pattern, pattern))
+        with m.Switch(pattern_format):
+            with m.Case(PixelFormat.RGB888.value):
+                with m.Switch(pattern_ctr):
+                    with m.Case(0):
+                        m.d.comb += write_data.eq(Cat(pattern, pattern, pattern[:16]))
+                    with m.Case(1):
+                        m.d.comb += write_data.eq(Cat(pattern[16:], pattern, pattern, pattern[:8]))
+                    with m.Case(2):
+                        m.d.comb += write_data.eq(Cat(pattern[8:], pattern, pattern))
+            with m.Case(PixelFormat.XRGB8888.value):
+                m.d.comb += write_data.eq(Cat(pattern, C(0, 8)).replicate(2))
+            with m.Case(PixelFormat.RGB565.value):
+                m.d.comb += write_data.eq(pattern[:16].replicate(4))
 
         with m.If(self.axi.write_data.ready & self.axi.write_data.valid):
             m.d.sync += [
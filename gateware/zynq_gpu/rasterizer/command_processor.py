@@ -1,22 +1,32 @@
 from amaranth import *
 from amaranth.lib import wiring
 from amaranth.lib.enum import Enum
+from amaranth.lib.fifo import SyncFIFOBuffered
 from amaranth.lib.wiring import Component, In, Out
-from ..dma import ControlRegisters, DMA
+from ..axi_arbiter import AxiArbiter
+from ..dma import ControlRegisters, RingRegisters, ChainRegisters, data_stream_signature, DMA, DMARing, \
+    DMAScatterGather
 from ..zynq_ifaces import SAxiGP
-from .types import TriangleStream, BufferClearStream, TextureBufferWrite
+from .types import TriangleStream, BufferClearStream, TextureBufferWrite, TileControlStream
 
 
 __all__ = ["Command", "CommandProcessor"]
 
 
 class Command(Enum):
-    # TODO: flags (no z buffering, etc)?
+    # Ignored, pads the command ring up to whole blocks
+    NOP = 0x00
     DRAW_TRIANGLE = 0x01
     READ_TEXTURE = 0x02
     WAIT_IDLE = 0x03
     CLEAR_BUFFER = 0x04
     WAIT_CLEAR_IDLE = 0x05
+    TILE_SETUP = 0x06
+    FLUSH_TILES = 0x07
+    FAST_CLEAR_DEPTH = 0x08
+    CALL = 0x09
+    RETURN = 0x0A
+    FENCE = 0x0B
 
 
 class CommandProcessor(Component):
@@ -24,29 +34,116 @@ class CommandProcessor(Component):
 
     axi: Out(SAxiGP)
     control: In(ControlRegisters)
+    # Commands are read from the ring instead of `control` while it's enabled
+    ring: In(RingRegisters)
+    # Or from a chain of descriptors, while the ring is disabled
+    chain: In(ChainRegisters)
 
     rasterizer_idle: In(1)
     clearer_idle: In(1)
 
+    # Pulsed once the rasterizer is idle by FAST_CLEAR_DEPTH
+    depth_fast_clear: Out(1)
+    # Pulsed for a cycle once a FENCE asking for an IRQ was written
+    fence_irq: Out(1)
+    # Set on cycles where a decoded triangle waits for space in the triangle queue (or for the rasterizer without one)
+    triangle_queue_full: Out(1)
+
     triangles: Out(TriangleStream)
     buffer_clears: Out(BufferClearStream)
     texture_writes: Out(TextureBufferWrite)
+    tile_control: Out(TileControlStream)
+
+    # CALL reads commands from a secondary buffer, at a 64-byte aligned address and with a length in words in the next
+    # two words, until its end or a RETURN. The commands after the CALL are fetched meanwhile, and read once it
+    # returns. Calls don't nest, a CALL from a secondary buffer is ignored.
+    #
+    # FENCE writes the value in its second word to the 4-byte aligned address in its first one, once the rasterizer and
+    # the buffer clearer are done with every previous command. Bit 6 of the command asks for an IRQ after the write.
+    #
+    # With `triangle_queue_depth`, up to that many decoded triangles are queued for the rasterizer, so commands keep
+    # being read while it's busy. Commands that depend on the rasterizer being done with previous triangles (texture
+    # loads, tile control and waiting for idle) wait for the queue to be empty first.
+    def __init__(self, triangle_queue_depth: int = 0):
+        self._triangle_queue_depth = triangle_queue_depth
+        super().__init__()
 
     def elaborate(self, platform):
         m = Module()
 
-        m.submodules.dma = dma = DMA(SAxiGP)
-        wiring.connect(m, dma.axi, wiring.flipped(self.axi))
-        wiring.connect(m, dma.control, wiring.flipped(self.control))
+        # Buffers called from the main command stream are read with their own DMA, both have flow control so neither
+        # can block reads of the other. Fences are written through the same port.
+        m.submodules.dma = dma = DMA(SAxiGP, flow_control=True)
+        m.submodules.call_dma = call_dma = DMA(SAxiGP, flow_control=True)
+        m.submodules.arbiter = arbiter = AxiArbiter(3, SAxiGP)
+        wiring.connect(m, dma.axi, arbiter.masters[0])
+        wiring.connect(m, call_dma.axi, arbiter.masters[1])
+        wiring.connect(m, arbiter.bus, wiring.flipped(self.axi))
+        fence_axi = arbiter.masters[2]
+        m.submodules.ring = ring = DMARing()
+        wiring.connect(m, ring.control, wiring.flipped(self.control))
+        wiring.connect(m, ring.ring, wiring.flipped(self.ring))
+        m.d.comb += ring.burst_end.eq(dma.burst_end)
+
+        m.submodules.scatter_gather = scatter_gather = DMAScatterGather()
+        wiring.connect(m, scatter_gather.control, ring.dma)
+        wiring.connect(m, scatter_gather.chain, wiring.flipped(self.chain))
+        wiring.connect(m, dma.control, scatter_gather.dma)
+        wiring.connect(m, scatter_gather.dma_stream, dma.data_stream)
+
+        # Whether commands come from a called buffer
+        in_call = Signal()
+        call_word = Signal(1)
+        call_addr = Signal.like(call_dma.control.base_addr)
+        call_words = Signal.like(call_dma.control.words)
+
+        data_stream = data_stream_signature(32).create()
+        with m.If(in_call):
+            m.d.comb += [
+                data_stream.valid.eq(call_dma.data_stream.valid),
+                data_stream.data.eq(call_dma.data_stream.data),
+                call_dma.data_stream.ready.eq(data_stream.ready),
+            ]
+        with m.Else():
+            m.d.comb += [
+                data_stream.valid.eq(scatter_gather.data_stream.valid),
+                data_stream.data.eq(scatter_gather.data_stream.data),
+                scatter_gather.data_stream.ready.eq(data_stream.ready),
+            ]
+
+        triangle = Signal.like(self.triangles.payload)
+        triangle_valid = Signal()
+        triangle_ready = Signal()
+        # Decoded triangles that the rasterizer didn't take yet
+        triangles_queued = Signal()
+        if self._triangle_queue_depth:
+            m.submodules.triangle_queue = triangle_queue = SyncFIFOBuffered(
+                width=len(triangle.as_value()), depth=self._triangle_queue_depth)
+            m.d.comb += [
+                triangle_queue.w_data.eq(triangle),
+                triangle_queue.w_en.eq(triangle_valid),
+                triangle_ready.eq(triangle_queue.w_rdy),
+
+                self.triangles.valid.eq(triangle_queue.r_rdy),
+                self.triangles.payload.eq(triangle_queue.r_data),
+                triangle_queue.r_en.eq(self.triangles.ready),
+
+                triangles_queued.eq(triangle_queue.level != 0),
+            ]
+        else:
+            m.d.comb += [
+                self.triangles.valid.eq(triangle_valid),
+                self.triangles.payload.eq(triangle),
+                triangle_ready.eq(self.triangles.ready),
+            ]
 
         vertex_ctr = Signal(range(3))
         vertex_half = Signal()
 
-        vertex = Array([getattr(self.triangles.payload, x) for x in ["v0", "v1", "v2"]])[vertex_ctr]
-        ignore = Signal(2)
-        with m.If(dma.data_stream.valid & dma.data_stream.ready):
+        vertex = Array([getattr(triangle, x) for x in ["v0", "v1", "v2"]])[vertex_ctr]
+        with m.If(data_stream.valid & data_stream.ready):
             m.d.sync += [
-                Cat(vertex, ignore).word_select(vertex_half, 32).eq(dma.data_stream.data),
+                Cat(vertex).word_select(vertex_half, 32).eq(data_stream.data),
                 vertex_half.eq(~vertex_half),
                 vertex_ctr.eq(Mux(vertex_half, Mux(vertex_ctr == 2, 0, vertex_ctr + 1), vertex_ctr)),
             ]
@@ -73,12 +170,12 @@ class CommandProcessor(Component):
         m.d.sync += self.texture_writes.en.eq(0)
         with m.Switch(texture_fsm_state):
             with m.Case(0):
-                m.d.sync += self.texture_writes.data[:32].eq(dma.data_stream.data)
-                with m.If(dma.data_stream.ready & dma.data_stream.valid):
+                m.d.sync += self.texture_writes.data[:32].eq(data_stream.data)
+                with m.If(data_stream.ready & data_stream.valid):
                     m.d.sync += texture_fsm_state.eq(1)
             with m.Case(1):
-                m.d.sync += Cat(self.texture_writes.data[32:], texture_remain).eq(dma.data_stream.data)
-                with m.If(dma.data_stream.ready & dma.data_stream.valid):
+                m.d.sync += Cat(self.texture_writes.data[32:], texture_remain).eq(data_stream.data)
+                with m.If(data_stream.ready & data_stream.valid):
                     m.d.comb += advance_texture.eq(1)
                     m.d.sync += [
                         self.texture_writes.en.eq(texture_en),
@@ -86,8 +183,8 @@ class CommandProcessor(Component):
                         self.texture_writes.addr.eq(Cat(texture_t_half, texture_s)),
                     ]
             with m.Case(2):
-                m.d.sync += self.texture_writes.data.eq(Cat(texture_remain, dma.data_stream.data))
-                with m.If(dma.data_stream.ready & dma.data_stream.valid):
+                m.d.sync += self.texture_writes.data.eq(Cat(texture_remain, data_stream.data))
+                with m.If(data_stream.ready & data_stream.valid):
                     m.d.comb += advance_texture.eq(1)
                     m.d.sync += [
                         self.texture_writes.en.eq(texture_en),
@@ -97,18 +194,39 @@ class CommandProcessor(Component):
 
         buffer_clear_word = Signal(1)
 
+        fence_word = Signal(1)
+        fence_irq_en = Signal()
+        # Word address
+        fence_addr = Signal(30)
+        fence_value = Signal(32)
+        fence_address_done = Signal()
+        fence_data_done = Signal()
+        m.d.comb += [
+            fence_axi.write_address.burst.eq(0b01),  # INCR
+            fence_axi.write_address.size.eq(0b10),   # 4 bytes/beat
+            fence_axi.write_address.addr.eq(Cat(C(0, 2), fence_addr)),
+            fence_axi.write_data.data.eq(fence_value),
+            fence_axi.write_data.strb.eq(0b1111),
+            fence_axi.write_data.last.eq(1),
+        ]
+        m.d.sync += self.fence_irq.eq(0)
+
         with m.FSM():
             with m.State("READ_CMD"):
                 m.d.comb += [
-                    self.idle.eq(~dma.data_stream.valid & dma.control.idle),
-                    dma.data_stream.ready.eq(1),
+                    self.idle.eq(~in_call & ~data_stream.valid & ring.control.idle & ~triangles_queued),
+                    data_stream.ready.eq(1),
                 ]
-                with m.If(dma.data_stream.valid):
-                    with m.Switch(dma.data_stream.data[:6]):
+                # Every command of the called buffer was read
+                with m.If(in_call & ~data_stream.valid & call_dma.control.idle):
+                    m.d.sync += in_call.eq(0)
+                with m.If(data_stream.valid):
+                    with m.Switch(data_stream.data[:6]):
                         with m.Case(Command.DRAW_TRIANGLE):
                             m.d.sync += vertex_ctr.eq(0), vertex_half.eq(0)
-                            m.d.sync += self.triangles.payload.texture_enable.eq(dma.data_stream.data[6])
-                            m.d.sync += self.triangles.payload.texture_buffer.eq(dma.data_stream.data[7:9])
+                            m.d.sync += triangle.texture_enable.eq(data_stream.data[6])
+                            m.d.sync += triangle.texture_buffer.eq(data_stream.data[7:9])
+                            m.d.sync += triangle.depth.eq(data_stream.data[9:14])
                             m.next = "READ_VERTEXES"
                         with m.Case(Command.READ_TEXTURE):
                             s_start = Signal(7)
@@ -116,19 +234,19 @@ class CommandProcessor(Component):
                             t_half_start = Signal(6)
                             t_half_end = Signal(6)
 
-                            s_high = dma.data_stream.data[8]
+                            s_high = data_stream.data[8]
                             m.d.comb += [
-                                s_start.eq(Cat(dma.data_stream.data[9:15], s_high)),
-                                s_end.eq(Cat(dma.data_stream.data[15:21], s_high)),
+                                s_start.eq(Cat(data_stream.data[9:15], s_high)),
+                                s_end.eq(Cat(data_stream.data[15:21], s_high)),
                             ]
-                            t_high = dma.data_stream.data[21]
+                            t_high = data_stream.data[21]
                             m.d.comb += [
-                                t_half_start.eq(Cat(dma.data_stream.data[22:27], t_high)),
-                                t_half_end.eq(Cat(dma.data_stream.data[27:32], t_high)),
+                                t_half_start.eq(Cat(data_stream.data[22:27], t_high)),
+                                t_half_end.eq(Cat(data_stream.data[27:32], t_high)),
                             ]
 
                             m.d.sync += [
-                                self.texture_writes.buffer.eq(dma.data_stream.data[6:8]),
+                                self.texture_writes.buffer.eq(data_stream.data[6:8]),
                                 texture_s.eq(s_start),
                                 texture_s_end.eq(s_end),
 
@@ -143,35 +261,63 @@ class CommandProcessor(Component):
                             m.next = "WAIT_IDLE"
                         with m.Case(Command.CLEAR_BUFFER):
                             m.d.sync += [
-                                self.buffer_clears.payload.pattern.eq(dma.data_stream.data[8:]),
+                                self.buffer_clears.payload.pattern.eq(data_stream.data[8:]),
+                                self.buffer_clears.payload.format.eq(data_stream.data[6:8]),
                             ]
                             m.next = "READ_BUFFER_CLEAR"
                         with m.Case(Command.WAIT_CLEAR_IDLE):
                             m.next = "WAIT_CLEAR_IDLE"
+                        with m.Case(Command.TILE_SETUP):
+                            m.d.sync += [
+                                self.tile_control.payload.flush.eq(0),
+                                self.tile_control.payload.load.eq(data_stream.data[6]),
+                                self.tile_control.payload.clear_color.eq(data_stream.data[8:]),
+                            ]
+                            m.next = "TILE_CONTROL"
+                        with m.Case(Command.FLUSH_TILES):
+                            m.d.sync += [
+                                self.tile_control.payload.flush.eq(1),
+                                self.tile_control.payload.store_depth.eq(data_stream.data[6]),
+                            ]
+                            m.next = "TILE_CONTROL"
+                        with m.Case(Command.FAST_CLEAR_DEPTH):
+                            m.next = "FAST_CLEAR_DEPTH"
+                        with m.Case(Command.CALL):
+                            m.d.sync += call_word.eq(0)
+                            m.next = "READ_CALL"
+                        with m.Case(Command.RETURN):
+                            with m.If(in_call):
+                                m.next = "RETURN"
+                        with m.Case(Command.FENCE):
+                            m.d.sync += fence_word.eq(0), fence_irq_en.eq(data_stream.data[6])
+                            m.next = "READ_FENCE"
             with m.State("READ_VERTEXES"):
-                m.d.comb += dma.data_stream.ready.eq(1)
+                m.d.comb += data_stream.ready.eq(1)
                 with m.If((vertex_ctr == 2) & vertex_half):
                     m.next = "SUBMIT_TRIANGLE"
             with m.State("SUBMIT_TRIANGLE"):
-                m.d.comb += self.triangles.valid.eq(1)
-                with m.If(self.triangles.ready):
+                m.d.comb += triangle_valid.eq(1)
+                with m.If(triangle_ready):
                     m.next = "READ_CMD"
+                with m.Else():
+                    m.d.comb += self.triangle_queue_full.eq(1)
             with m.State("READ_TEXTURE"):
-                m.d.comb += texture_en.eq(1), dma.data_stream.ready.eq(1)
-                with m.If(dma.data_stream.ready & dma.data_stream.valid):
+                # Queued triangles might still use the texture being replaced
+                m.d.comb += texture_en.eq(1), data_stream.ready.eq(~triangles_queued)
+                with m.If(data_stream.ready & data_stream.valid):
                     with m.If((texture_s == texture_s_end) & (texture_t_half == texture_t_end)):
                         m.next = "READ_CMD"
             with m.State("WAIT_IDLE"):
-                with m.If(self.rasterizer_idle):
+                with m.If(self.rasterizer_idle & ~triangles_queued):
                     m.next = "READ_CMD"
             with m.State("READ_BUFFER_CLEAR"):
-                m.d.comb += dma.data_stream.ready.eq(1)
+                m.d.comb += data_stream.ready.eq(1)
                 with m.Switch(buffer_clear_word):
                     with m.Case(0):
-                        m.d.sync += self.buffer_clears.payload.base_addr.eq(dma.data_stream.data)
+                        m.d.sync += self.buffer_clears.payload.base_addr.eq(data_stream.data)
                     with m.Case(1):
-                        m.d.sync += self.buffer_clears.payload.words.eq(dma.data_stream.data)
-                with m.If(dma.data_stream.valid):
+                        m.d.sync += self.buffer_clears.payload.words.eq(data_stream.data)
+                with m.If(data_stream.valid):
                     m.d.sync += buffer_clear_word.eq(buffer_clear_word + 1)
                     with m.If(buffer_clear_word):
                         m.next = "CLEAR_BUFFER"
@@ -182,5 +328,70 @@ class CommandProcessor(Component):
             with m.State("WAIT_CLEAR_IDLE"):
                 with m.If(self.clearer_idle):
                     m.next = "READ_CMD"
+            with m.State("TILE_CONTROL"):
+                # Flushes must come after every queued triangle
+                m.d.comb += self.tile_control.valid.eq(~triangles_queued)
+                with m.If(self.tile_control.valid & self.tile_control.ready):
+                    m.next = "READ_CMD"
+            with m.State("READ_CALL"):
+                m.d.comb += data_stream.ready.eq(1)
+                with m.If(data_stream.valid):
+                    m.d.sync += call_word.eq(call_word + 1)
+                    with m.Switch(call_word):
+                        with m.Case(0):
+                            m.d.sync += call_addr.eq(data_stream.data[6:])
+                        with m.Case(1):
+                            m.d.sync += call_words.eq(data_stream.data)
+                            m.next = "CALL"
+            with m.State("CALL"):
+                m.d.comb += [
+                    call_dma.control.base_addr.eq(call_addr),
+                    call_dma.control.words.eq(call_words),
+                    call_dma.control.trigger.eq(~in_call),
+                ]
+                m.d.sync += in_call.eq(1)
+                m.next = "READ_CMD"
+            with m.State("RETURN"):
+                # Skip the rest of the called buffer
+                m.d.comb += data_stream.ready.eq(1)
+                with m.If(~data_stream.valid & call_dma.control.idle):
+                    m.d.sync += in_call.eq(0)
+                    m.next = "READ_CMD"
+            with m.State("READ_FENCE"):
+                m.d.comb += data_stream.ready.eq(1)
+                with m.If(data_stream.valid):
+                    m.d.sync += fence_word.eq(fence_word + 1)
+                    with m.Switch(fence_word):
+                        with m.Case(0):
+                            m.d.sync += fence_addr.eq(data_stream.data[2:])
+                        with m.Case(1):
+                            m.d.sync += fence_value.eq(data_stream.data)
+                            m.next = "FENCE_WAIT"
+            with m.State("FENCE_WAIT"):
+                with m.If(self.rasterizer_idle & self.clearer_idle & ~triangles_queued):
+                    m.d.sync += fence_address_done.eq(0), fence_data_done.eq(0)
+                    m.next = "FENCE_WRITE"
+            with m.State("FENCE_WRITE"):
+                address_finished = Signal()
+                data_finished = Signal()
+                m.d.comb += [
+                    fence_axi.write_address.valid.eq(~fence_address_done),
+                    fence_axi.write_data.valid.eq(~fence_data_done),
+
+                    address_finished.eq(fence_address_done | fence_axi.write_address.ready),
+                    data_finished.eq(fence_data_done | fence_axi.write_data.ready),
+                ]
+                m.d.sync += fence_address_done.eq(address_finished), fence_data_done.eq(data_finished)
+                with m.If(address_finished & data_finished):
+                    m.next = "FENCE_RESPONSE"
+            with m.State("FENCE_RESPONSE"):
+                m.d.comb += fence_axi.write_response.ready.eq(1)
+                with m.If(fence_axi.write_response.valid):
+                    m.d.sync += self.fence_irq.eq(fence_irq_en)
+                    m.next = "READ_CMD"
+            with m.State("FAST_CLEAR_DEPTH"):
+                with m.If(self.rasterizer_idle & ~triangles_queued):
+                    m.d.comb += self.depth_fast_clear.eq(1)
+                    m.next = "READ_CMD"
 
         return m
@@ -1,11 +1,17 @@
+import enum
 from amaranth import *
 from amaranth.lib import wiring
-from amaranth.lib.data import StructLayout
+from amaranth.lib.data import ArrayLayout, StructLayout
+from amaranth.lib.fifo import SyncFIFOBuffered
 from amaranth.lib.wiring import Component, Signature, In, Out
-from ..utils import Divider
+from amaranth.utils import log2_int
+from ..utils import Divider, Reciprocal
 
 
-__all__ = ["Point", "TriangleStream", "PointStream", "EdgeWalker"]
+__all__ = [
+    "Point", "GuardBandPoint", "TriangleStream", "PointStream", "QuadStream", "Traversal", "EdgeWalker",
+    "QuadSerializer",
+]
 
 
 Point = StructLayout({
@@ -14,13 +20,21 @@ Point = StructLayout({
 })
 
 
+# Vertex coordinates, which can be up to 2048 pixels left of or above the screen. Any triangle inside this range has
+# less than 2**24 of (twice the) area, so the weights of its pixels still fit 24 bits.
+GuardBandPoint = StructLayout({
+    "x": signed(12),
+    "y": signed(12),
+})
+
+
 TriangleStream = Signature({
     "valid": Out(1),
     "ready": In(1),
     "payload": Out(StructLayout({
-        "v0": Point,
-        "v1": Point,
-        "v2": Point,
+        "v0": GuardBandPoint,
+        "v1": GuardBandPoint,
+        "v2": GuardBandPoint,
     })),
 })
 
@@ -34,6 +48,27 @@ PointStream = Signature({
         "w0": unsigned(24),
         "w1": unsigned(24),
         "w2": unsigned(24),
+        # Parity of the triangle the point belongs to, counted in the order triangles were accepted. Lets
+        # consumers keep per-triangle state for both the triangle being walked and the one being set up.
+        "tag": unsigned(1),
+    })),
+})
+
+
+QuadStream = Signature({
+    "valid": Out(1),
+    "ready": In(1),
+    "payload": Out(StructLayout({
+        # Top left pixel of a 2x2 block, always at even coordinates
+        "p": Point,
+        # Lane i is the pixel at (p.x + i % 2, p.y + i // 2), set for covered lanes
+        "mask": unsigned(4),
+        "lanes": ArrayLayout(StructLayout({
+            "w0": unsigned(24),
+            "w1": unsigned(24),
+            "w2": unsigned(24),
+        }), 4),
+        "tag": unsigned(1),
     })),
 })
 
@@ -48,12 +83,17 @@ def max3(a, b, c):
     return Mux(max12 > c, max12, c)
 
 
+def _mul_unit(k, v):
+    """`k * v` without a multiplier, for `k` between -1 and 1"""
+    return Mux(k == 0, 0, Mux(k < 0, -v, v))
+
+
 class Orient2D(Component):
-    a: In(Point)
-    b: In(Point)
-    c: In(Point)
+    a: In(GuardBandPoint)
+    b: In(GuardBandPoint)
+    c: In(GuardBandPoint)
 
-    res: Out(signed(25))
+    res: Out(signed(27))
 
     def elaborate(self, platform):
         m = Module()
@@ -107,6 +147,7 @@ class Orient2D(Component):
 class PassthroughScaler(Component):
     area: In(24)
     area_trigger: In(1)
+    unit_area: In(1)
 
     points: In(PointStream)
     points_scaled: Out(PointStream)
@@ -119,23 +160,35 @@ class PassthroughScaler(Component):
         return m
 
 
+def _area_divider(m, div_unroll: int, pipelined_recip: bool, name: str = "divider"):
+    if pipelined_recip:
+        divider = Reciprocal(24)
+    else:
+        divider = Divider(24, div_unroll)
+        m.d.comb += divider.n.eq(0xFFFFFF)
+    m.submodules[name] = divider
+    return divider
+
+
 class Scaler(Component):
     area: In(24)
     area_trigger: In(1)
+    # The triangle being walked has an area of 1, so its reciprocal is known without triggering the divider
+    unit_area: In(1)
 
     points: In(PointStream)
     points_scaled: Out(PointStream)
 
-    def __init__(self, div_unroll: int):
+    def __init__(self, div_unroll: int, pipelined_recip: bool = False):
         self._div_unroll = div_unroll
+        self._pipelined_recip = pipelined_recip
         super().__init__()
 
     def elaborate(self, platform):
         m = Module()
 
-        m.submodules.divider = divider = Divider(24, self._div_unroll)
+        divider = _area_divider(m, self._div_unroll, self._pipelined_recip)
         m.d.comb += [
-            divider.n.eq(0xFFFFFF),
             divider.d.eq(self.area),
             divider.trigger.eq(self.area_trigger),
         ]
@@ -150,9 +203,17 @@ class Scaler(Component):
         with m.If(self.area_trigger):
             m.d.sync += div_done.eq(0)
 
+        recip_ok = Signal()
+        scale = Signal(24)
+        m.d.comb += [
+            recip_ok.eq(div_done | self.unit_area),
+            scale.eq(Mux(self.unit_area, 0xFFFFFF, area_recip)),
+        ]
+
         stall = Signal()
 
         p = Signal(Point)
+        tag = Signal()
         w0 = Signal(24)
         w1 = Signal(24)
         w2 = Signal(24)
@@ -161,19 +222,21 @@ class Scaler(Component):
         with m.If(~stall):
             m.d.sync += [
                 p.eq(self.points.payload.p),
-                w0.eq(self.points.payload.w0 * area_recip),
-                w1.eq(self.points.payload.w1 * area_recip),
-                w2.eq(self.points.payload.w2 * area_recip),
-                valid.eq(self.points.valid & div_done),
+                tag.eq(self.points.payload.tag),
+                w0.eq(self.points.payload.w0 * scale),
+                w1.eq(self.points.payload.w1 * scale),
+                w2.eq(self.points.payload.w2 * scale),
+                valid.eq(self.points.valid & recip_ok),
             ]
 
         m.d.comb += [
-            self.points.ready.eq(~stall & div_done),
+            self.points.ready.eq(~stall & recip_ok),
             self.points_scaled.valid.eq(valid),
 
             stall.eq(valid & ~self.points_scaled.ready),
 
             self.points_scaled.payload.p.eq(p),
+            self.points_scaled.payload.tag.eq(tag),
             self.points_scaled.payload.w0.eq(w0),
             self.points_scaled.payload.w1.eq(w1),
             self.points_scaled.payload.w2.eq(w2),
@@ -184,43 +247,325 @@ class Scaler(Component):
 
 class FIFOScaler(Component):
     area: In(24)
+    area_tag: In(1)
     area_trigger: In(1)
+    # Whether a new area can be triggered
+    area_ready: Out(1)
+
+    # Whether the reciprocal of the oldest triangle that wasn't retired yet is available
+    recip_valid: Out(1)
+    # The walker is done with the oldest triangle, so its reciprocal can be dropped
+    retire: In(1)
+    # The triangle being walked has an area of 1, its reciprocal is known and was never queued
+    unit_area: In(1)
 
     points: In(PointStream)
     points_scaled: Out(PointStream)
 
-    def __init__(self, div_unroll: int):
+    def __init__(self, div_unroll: int, depth: int = 4, pipelined_recip: bool = False):
         self._div_unroll = div_unroll
+        self._depth = depth
+        self._pipelined_recip = pipelined_recip
         super().__init__()
 
     def elaborate(self, platform):
-        # TODO: figure out how to avoid mixing area reciprocals for different triangles
-        raise Exception("unimplemented")
+        m = Module()
+
+        divider = _area_divider(m, self._div_unroll, self._pipelined_recip)
+        m.d.comb += [
+            divider.d.eq(self.area),
+            divider.trigger.eq(self.area_trigger),
+        ]
 
+        # Reciprocals are queued in the same order as triangles are set up and walked, tagged with the triangle
+        # they belong to so points are never scaled by the reciprocal of another triangle.
+        m.submodules.recips = recips = SyncFIFOBuffered(width=25, depth=self._depth)
+
+        recip = Signal(24)
+        recip_tag = Signal()
+        m.d.comb += Cat(recip, recip_tag).eq(recips.r_data)
+
+        # Only trigger the divider when there's space for its result, counting the ones still being computed.
+        div_pending = Signal(range(self._depth + 1))
+        with m.If(self.area_trigger & ~divider.done):
+            m.d.sync += div_pending.eq(div_pending + 1)
+        with m.Elif(~self.area_trigger & divider.done):
+            m.d.sync += div_pending.eq(div_pending - 1)
+
+        if self._pipelined_recip:
+            # The tags follow the reciprocal pipeline
+            div_tags = Signal(Reciprocal.LATENCY)
+            m.d.sync += div_tags.eq(Cat(self.area_tag, div_tags))
+            div_tag = div_tags[-1]
+            m.d.comb += self.area_ready.eq(recips.level + div_pending < self._depth)
+        else:
+            div_tag = Signal()
+            with m.If(self.area_trigger):
+                m.d.sync += div_tag.eq(self.area_tag)
+            m.d.comb += self.area_ready.eq((div_pending == 0) & recips.w_rdy)
 
-class EdgeWalker(Component):
-    triangle: In(TriangleStream)
-    idle: Out(1)
+        m.d.comb += [
+            recips.w_en.eq(divider.done),
+            recips.w_data.eq(Cat(divider.o, div_tag)),
+
+            self.recip_valid.eq(recips.r_rdy),
+            recips.r_en.eq(self.retire),
+        ]
+
+        recip_ok = Signal()
+        scale = Signal(24)
+        m.d.comb += [
+            recip_ok.eq(self.unit_area | (recips.r_rdy & (recip_tag == self.points.payload.tag))),
+            scale.eq(Mux(self.unit_area, 0xFFFFFF, recip)),
+        ]
+
+        stall = Signal()
+
+        p = Signal(Point)
+        tag = Signal()
+        w0 = Signal(24)
+        w1 = Signal(24)
+        w2 = Signal(24)
+        valid = Signal()
+
+        with m.If(~stall):
+            m.d.sync += [
+                p.eq(self.points.payload.p),
+                tag.eq(self.points.payload.tag),
+                w0.eq(self.points.payload.w0 * scale),
+                w1.eq(self.points.payload.w1 * scale),
+                w2.eq(self.points.payload.w2 * scale),
+                valid.eq(self.points.valid & recip_ok),
+            ]
+
+        m.d.comb += [
+            self.points.ready.eq(~stall & recip_ok),
+            self.points_scaled.valid.eq(valid),
+
+            stall.eq(valid & ~self.points_scaled.ready),
+
+            self.points_scaled.payload.p.eq(p),
+            self.points_scaled.payload.tag.eq(tag),
+            self.points_scaled.payload.w0.eq(w0),
+            self.points_scaled.payload.w1.eq(w1),
+            self.points_scaled.payload.w2.eq(w2),
+        ]
+
+        return m
+
+
+class QuadSerializer(Component):
+    """Splits quads into the points of their covered lanes, one per cycle, dropping the uncovered lanes"""
+
+    quads: In(QuadStream)
     points: Out(PointStream)
 
+    def elaborate(self, platform):
+        m = Module()
+
+        quad = Signal.like(self.quads.payload)
+        remaining = Signal(4)
+
+        lane = Signal(2)
+        for i in reversed(range(4)):
+            with m.If(remaining[i]):
+                m.d.comb += lane.eq(i)
+
+        last = Signal()
+        m.d.comb += [
+            last.eq((remaining & (remaining - 1)) == 0),
+
+            self.points.valid.eq(remaining.any()),
+            self.points.payload.p.x.eq(quad.p.x + lane[0]),
+            self.points.payload.p.y.eq(quad.p.y + lane[1]),
+            self.points.payload.w0.eq(quad.lanes[lane].w0),
+            self.points.payload.w1.eq(quad.lanes[lane].w1),
+            self.points.payload.w2.eq(quad.lanes[lane].w2),
+            self.points.payload.tag.eq(quad.tag),
+
+            self.quads.ready.eq(~self.points.valid | (self.points.ready & last)),
+        ]
+
+        with m.If(self.points.valid & self.points.ready):
+            m.d.sync += remaining.eq(remaining & ~(1 << lane))
+        with m.If(self.quads.valid & self.quads.ready):
+            m.d.sync += [
+                quad.eq(self.quads.payload),
+                remaining.eq(self.quads.payload.mask),
+            ]
+
+        return m
+
+
+class Traversal(enum.Enum):
+    # Visit every pixel of the bounding box, row by row
+    RASTER = enum.auto()
+    # Leave each row as soon as coverage goes from inside to outside, then start the next row from the same column,
+    # walking in alternating directions
+    SERPENTINE = enum.auto()
+    # Test `tile_size`x`tile_size` blocks of the bounding box against the edges, skip the ones fully outside
+    # and walk the remaining ones pixel by pixel
+    TILED = enum.auto()
+
+
+class _PlaneSetup:
+    """
+    One time-multiplexed multiplier per linear function that is set up along with the edge functions (attribute
+    plane equations and normalized weights), modulo 2**40.
+    """
+
+    def __init__(self, m, n: int, area, *, div_unroll: int, pipelined_recip: bool):
+        self._m = m
+        self._n = n
+
+        self.recip_trigger = Signal()
+        self.recip_valid = Signal()
+        self._recip = Signal(24)
+        self._op_a = [Signal(signed(41), name=f"plane{i}_op_a") for i in range(n)]
+        self._op_b = [Signal(signed(26), name=f"plane{i}_op_b") for i in range(n)]
+        self._prod = [Signal(40, name=f"plane{i}_prod") for i in range(n)]
+
+        if not n:
+            return
+
+        divider = _area_divider(m, div_unroll, pipelined_recip, name="plane_divider")
+        m.d.comb += [
+            divider.d.eq(area),
+            divider.trigger.eq(self.recip_trigger),
+        ]
+        with m.If(divider.done):
+            m.d.sync += [
+                self._recip.eq(divider.o),
+                self.recip_valid.eq(1),
+            ]
+        with m.If(self.recip_trigger):
+            m.d.sync += self.recip_valid.eq(0)
+
+        for op_a, op_b, prod in zip(self._op_a, self._op_b, self._prod):
+            m.d.comb += prod.eq((op_a * op_b)[:40])
+
+    def mac(self, i: int, a, b, dest, *, accumulate: bool = False):
+        """Sets `dest` (or adds to it) the product of `a` and `b`, using the multiplier of function `i`"""
+        self._m.d.comb += [
+            self._op_a[i].eq(a),
+            self._op_b[i].eq(b),
+        ]
+        self._m.d.sync += dest.eq(self._prod[i] + dest if accumulate else self._prod[i])
+
+    def scale(self, dest):
+        """Multiplies `dest[i]` by the area reciprocal"""
+        for i in range(self._n):
+            self.mac(i, dest[i], self._recip, dest[i])
+
+
+class EdgeWalker(Component):
     # Whether interpolation weights should be scaled by 1/area
-    def __init__(self, scale_recip: bool = True, *, div_unroll: int = 1, use_fifo: bool = False):
+    #
+    # With `prenormalize`, the edge function steps and starting values are scaled by 1/area once per triangle,
+    # so the weights of every point come out normalized from additions alone instead of a multiplication per point.
+    #
+    # With `quad`, 2x2 blocks of pixels are tested every cycle and output to `quads` instead of `points`, which
+    # needs raster traversal and weights that are either raw or prenormalized.
+    #
+    # With `attributes`, that many 16 bit vertex attributes are interpolated with plane equations computed once
+    # per triangle and stepped along with the edge functions, instead of from the weights of every point.
+    #
+    # With `interleave`, only the rows (or rows of quads) whose index modulo `interleave` is `phase` are walked, so
+    # that many walkers can split the screen between them.
+    #
+    # Vertices are signed, the bounding box of every triangle is clamped to the points that can be output.
+    #
+    # With `clip`, the bounding box of every triangle is intersected with the inclusive `clip_min`/`clip_max`
+    # rectangle, sampled along with the triangle, and triangles entirely outside of it are skipped. With `quad`,
+    # lanes outside of it are left out of the mask.
+    #
+    # With `small_triangles`, triangles whose vertices fit in a 2x2 block of pixels, which have an area of either 1
+    # or none, are set up in one cycle from additions alone, without the orient2d pipeline or dividing by the area.
+    def __init__(self, scale_recip: bool = True, *, div_unroll: int = 1, use_fifo: bool = False,
+                 pipelined_recip: bool = False, traversal: Traversal = Traversal.RASTER, tile_size: int = 8,
+                 attributes: int = 0, prenormalize: bool = False, quad: bool = False, interleave: int = 1,
+                 phase: int = 0, clip: bool = False, small_triangles: bool = False):
+        if not isinstance(traversal, Traversal):
+            raise TypeError(f"Traversal must be a Traversal, not {traversal!r}")
+        if tile_size < 2 or tile_size & (tile_size - 1):
+            raise ValueError(f"Tile size must be a power of two greater than 1, not {tile_size!r}")
+        if prenormalize and not scale_recip:
+            raise ValueError("Prenormalized weights are scaled, scale_recip must be True")
+        if attributes and scale_recip and not prenormalize:
+            raise ValueError("Plane attributes replace scaled weights, scale_recip must be False or prenormalize True")
+        if quad and traversal != Traversal.RASTER:
+            raise ValueError(f"Quads are only supported with raster traversal, not {traversal!r}")
+        if quad and attributes:
+            raise ValueError("Plane attributes are not supported with quads")
+        if quad and scale_recip and not prenormalize:
+            raise ValueError("Quads can't be scaled per point, scale_recip must be False or prenormalize True")
+        if interleave < 1 or interleave & (interleave - 1):
+            raise ValueError(f"Interleave must be a power of two, not {interleave!r}")
+        if not 0 <= phase < interleave:
+            raise ValueError(f"Phase must be between 0 and {interleave - 1}, not {phase!r}")
+        if interleave > 1 and traversal != Traversal.RASTER:
+            raise ValueError(f"Interleaving is only supported with raster traversal, not {traversal!r}")
+
+        self._attributes = attributes
+        self._prenormalize = prenormalize
+        self._quad = quad
+        self._interleave = interleave
+        self._phase = phase
+        self._clip = clip
+        self._small_triangles = small_triangles
         self._scale_recip = scale_recip
         self._div_unroll = div_unroll
         self._use_fifo = use_fifo
+        self._pipelined_recip = pipelined_recip
+        self._traversal = traversal
+        self._tile_size = tile_size
         super().__init__()
 
+    @property
+    def signature(self):
+        members = {
+            "triangle": In(TriangleStream),
+            # Tag the points of the triangle in `triangle` will have. Only triangles that are walked use up a tag,
+            # so attributes kept per tag aren't overwritten by culled or skipped ones.
+            "tag": Out(1),
+            "idle": Out(1),
+        }
+        if self._quad:
+            members["quads"] = Out(QuadStream)
+            # Quads were handed over but their points are still being consumed, e.g. lanes left in a
+            # QuadSerializer. The next triangle waits for them, since the one after it gets their tag.
+            members["quads_pending"] = In(1)
+        else:
+            members["points"] = Out(PointStream)
+        if self._clip:
+            members["clip_min"] = In(Point)
+            members["clip_max"] = In(Point)
+        if self._attributes:
+            # Values at v0/v1/v2 of each attribute, sampled along with the triangle
+            members["attributes"] = In(ArrayLayout(ArrayLayout(16, 3), self._attributes))
+            # Interpolated attributes of the point in `points`
+            members["point_attributes"] = Out(ArrayLayout(16, self._attributes))
+        return Signature(members)
+
     def elaborate(self, platform):
         m = Module()
 
-        if self._scale_recip:
-            if self._use_fifo:
-                scaler = FIFOScaler(self._div_unroll)
+        use_fifo = self._scale_recip and self._use_fifo and not self._prenormalize
+        # Functions set up with a multiplier each, the attributes followed by the normalized weights
+        planes = self._attributes + (3 if self._prenormalize else 0)
+
+        if self._quad:
+            scaler = None
+        elif self._scale_recip and not self._prenormalize:
+            if use_fifo:
+                scaler = FIFOScaler(self._div_unroll, pipelined_recip=self._pipelined_recip)
             else:
-                scaler = Scaler(self._div_unroll)
+                scaler = Scaler(self._div_unroll, pipelined_recip=self._pipelined_recip)
         else:
             scaler = PassthroughScaler()
-        m.submodules.scaler = scaler
+        if scaler is not None:
+            m.submodules.scaler = scaler
+        out = self.quads if self._quad else self.points
 
         _a01 = self.triangle.payload.v0.y - self.triangle.payload.v1.y
         _a12 = self.triangle.payload.v1.y - self.triangle.payload.v2.y
@@ -233,22 +578,73 @@ class EdgeWalker(Component):
         _min_y = min3(self.triangle.payload.v0.y, self.triangle.payload.v1.y, self.triangle.payload.v2.y)
         _max_x = max3(self.triangle.payload.v0.x, self.triangle.payload.v1.x, self.triangle.payload.v2.x)
         _max_y = max3(self.triangle.payload.v0.y, self.triangle.payload.v1.y, self.triangle.payload.v2.y)
+        _small = Signal()
+        if self._small_triangles:
+            m.d.comb += _small.eq((_max_x - _min_x <= 1) & (_max_y - _min_y <= 1))
+        if self._clip:
+            _min_x = Mux(_min_x > self.clip_min.x, _min_x, self.clip_min.x)
+            _min_y = Mux(_min_y > self.clip_min.y, _min_y, self.clip_min.y)
+            _max_x = Mux(_max_x < self.clip_max.x, _max_x, self.clip_max.x)
+            _max_y = Mux(_max_y < self.clip_max.y, _max_y, self.clip_max.y)
+        else:
+            _min_x = Mux(_min_x < 0, 0, _min_x)
+            _min_y = Mux(_min_y < 0, 0, _min_y)
+        # Never negative from here on, a negative maximum means the triangle is skipped
+        _min_x = _min_x.as_unsigned()[:11]
+        _min_y = _min_y.as_unsigned()[:11]
+
+        # Quads are aligned to even coordinates, and with interleaving every row steps over the rows of the other
+        # walkers, so the first row is the first one of this walker in the bounding box.
+        unit_shift = 1 if self._quad else 0
+        row_shift = unit_shift + log2_int(self._interleave)
+
+        _start_y = Signal(12)
+        if row_shift:
+            _first_y = Cat(C(0, unit_shift), _min_y[unit_shift:])
+            _phase_y = Cat(C(self._phase << unit_shift, row_shift), _min_y[row_shift:])
+            m.d.comb += _start_y.eq(Mux(_phase_y < _first_y, _phase_y + (1 << row_shift), _phase_y))
+        else:
+            m.d.comb += _start_y.eq(_min_y)
 
         _p = Point(Signal(Point))
-        m.d.comb += _p.x.eq(_min_x), _p.y.eq(_min_y)
-
-        a01 = Signal.like(_a01)
-        a12 = Signal.like(_a12)
-        a20 = Signal.like(_a20)
-        b01 = Signal.like(_b01)
-        b12 = Signal.like(_b12)
-        b20 = Signal.like(_b20)
-
-        min_x = Signal.like(_min_x)
-        max_x = Signal.like(_max_x)
-        max_y = Signal.like(_max_y)
+        if self._quad:
+            m.d.comb += _p.x.eq(Cat(C(0, 1), _min_x[1:])), _p.y.eq(_start_y)
+        else:
+            m.d.comb += _p.x.eq(_min_x), _p.y.eq(_start_y)
+
+        # Setup of small triangles, where the edge function steps are all between -1 and 1. The twice signed area
+        # is then at most 1, so covered triangles need a reciprocal of 0xFFFFFF, or a negation modulo 2**24.
+        v0, v1, v2 = self.triangle.payload.v0, self.triangle.payload.v1, self.triangle.payload.v2
+        _small_area = _mul_unit(_b01, _a20) - _mul_unit(_a01, _b20)
+        _small_ws = [
+            _mul_unit(_b12, _p.y - v1.y) + _mul_unit(_a12, _p.x - v1.x),
+            _mul_unit(_b20, _p.y - v2.y) + _mul_unit(_a20, _p.x - v2.x),
+            _mul_unit(_b01, _p.y - v0.y) + _mul_unit(_a01, _p.x - v0.x),
+        ]
 
-        p = Signal.like(_p)
+        # Setup results, double buffered with the walker state so the next triangle can be set up while the
+        # current one is walked.
+        setup_a01 = Signal.like(_a01)
+        setup_a12 = Signal.like(_a12)
+        setup_a20 = Signal.like(_a20)
+        setup_b01 = Signal.like(_b01)
+        setup_b12 = Signal.like(_b12)
+        setup_b20 = Signal.like(_b20)
+
+        setup_min_x = Signal.like(_min_x)
+        setup_max_x = Signal.like(_max_x)
+        setup_max_y = Signal.like(_max_y)
+
+        setup_p = Signal.like(_p)
+        # Unaligned top left corner of the bounding box, quads can start before it
+        setup_bound = Point(Signal(Point))
+
+        accept_tag = Signal()
+        m.d.comb += self.tag.eq(accept_tag)
+        setup_tag = Signal()
+        # No rows of this walker in the bounding box, or nothing left of it after clipping
+        setup_skip = Signal()
+        setup_unit_area = Signal()
 
         m.submodules.area_orient2d = area_orient2d = Orient2D()
         m.d.comb += [
@@ -261,104 +657,592 @@ class EdgeWalker(Component):
         m.d.comb += [
             w0_orient2d.a.eq(self.triangle.payload.v1),
             w0_orient2d.b.eq(self.triangle.payload.v2),
-            w0_orient2d.c.eq(p),
+            w0_orient2d.c.x.eq(setup_p.x),
+            w0_orient2d.c.y.eq(setup_p.y),
         ]
 
         m.submodules.w1_orient2d = w1_orient2d = Orient2D()
         m.d.comb += [
             w1_orient2d.a.eq(self.triangle.payload.v2),
             w1_orient2d.b.eq(self.triangle.payload.v0),
-            w1_orient2d.c.eq(p),
+            w1_orient2d.c.x.eq(setup_p.x),
+            w1_orient2d.c.y.eq(setup_p.y),
         ]
 
         m.submodules.w2_orient2d = w2_orient2d = Orient2D()
         m.d.comb += [
             w2_orient2d.a.eq(self.triangle.payload.v0),
             w2_orient2d.b.eq(self.triangle.payload.v1),
-            w2_orient2d.c.eq(p),
+            w2_orient2d.c.x.eq(setup_p.x),
+            w2_orient2d.c.y.eq(setup_p.y),
         ]
 
-        w0_row = Signal.like(w0_orient2d.res)
-        w1_row = Signal.like(w1_orient2d.res)
-        w2_row = Signal.like(w2_orient2d.res)
+        setup_area = Signal.like(area_orient2d.res)
+        setup_w0 = Signal.like(w0_orient2d.res)
+        setup_w1 = Signal.like(w1_orient2d.res)
+        setup_w2 = Signal.like(w2_orient2d.res)
+        setup_done = Signal()
+
+        a01 = Signal.like(setup_a01)
+        a12 = Signal.like(setup_a12)
+        a20 = Signal.like(setup_a20)
+        b01 = Signal.like(setup_b01)
+        b12 = Signal.like(setup_b12)
+        b20 = Signal.like(setup_b20)
+
+        min_x = Signal.like(setup_min_x)
+        max_x = Signal.like(setup_max_x)
+        max_y = Signal.like(setup_max_y)
+
+        p = Signal.like(setup_p)
+        bound = Point(Signal(Point))
+        tag = Signal()
+        unit_area = Signal()
+
+        w0_row = Signal.like(setup_w0)
+        w1_row = Signal.like(setup_w1)
+        w2_row = Signal.like(setup_w2)
 
         w0 = Signal.like(w0_row)
         w1 = Signal.like(w1_row)
         w2 = Signal.like(w2_row)
 
-        m.d.comb += [
-            scaler.points.payload.p.eq(p),
-            scaler.points.payload.w0.eq(w0),
-            scaler.points.payload.w1.eq(w1),
-            scaler.points.payload.w2.eq(w2),
-            scaler.area.eq(area_orient2d.res)
-        ]
-        wiring.connect(m, wiring.flipped(self.points), scaler.points_scaled)
+        # The edge functions come first and decide coverage, anything after them is another linear function of
+        # the position that is stepped along with them.
+        ws = [w0, w1, w2]
+        ws_row = [w0_row, w1_row, w2_row]
+        as_ = [a12, a20, a01]
+        bs = [b12, b20, b01]
+
+        # Plane equations of the attributes, scaled by 2**24 like the weights. Kept modulo 2**40, which is exact
+        # for every point inside the triangle.
+        setup_attrs = Signal.like(self.attributes) if self._attributes else None
+        setup_ls = [Signal(40, name=f"setup_l{i}") for i in range(self._attributes)]
+        setup_ls_dx = [Signal(40, name=f"setup_l{i}_dx") for i in range(self._attributes)]
+        setup_ls_dy = [Signal(40, name=f"setup_l{i}_dy") for i in range(self._attributes)]
+
+        ls = [Signal(40, name=f"l{i}") for i in range(self._attributes)]
+        ls_row = [Signal(40, name=f"l{i}_row") for i in range(self._attributes)]
+        ls_dx = [Signal(40, name=f"l{i}_dx") for i in range(self._attributes)]
+        ls_dy = [Signal(40, name=f"l{i}_dy") for i in range(self._attributes)]
+
+        ws += ls
+        ws_row += ls_row
+        as_ += ls_dx
+        bs += ls_dy
+
+        # Weights scaled by 1/area, kept modulo 2**24, which is exact for every point inside the triangle since
+        # they can't add up to more than 0xFFFFFF there.
+        setup_ns = [Signal(24, name=f"setup_n{i}") for i in range(3 if self._prenormalize else 0)]
+        setup_ns_dx = [Signal(24, name=f"setup_n{i}_dx") for i in range(len(setup_ns))]
+        setup_ns_dy = [Signal(24, name=f"setup_n{i}_dy") for i in range(len(setup_ns))]
+
+        ns = [Signal(24, name=f"n{i}") for i in range(len(setup_ns))]
+        ns_row = [Signal(24, name=f"n{i}_row") for i in range(len(setup_ns))]
+        ns_dx = [Signal(24, name=f"n{i}_dx") for i in range(len(setup_ns))]
+        ns_dy = [Signal(24, name=f"n{i}_dy") for i in range(len(setup_ns))]
+
+        ws += ns
+        ws_row += ns_row
+        as_ += ns_dx
+        bs += ns_dy
+
+        for i, l in enumerate(ls):
+            m.d.comb += self.point_attributes[i].eq((l + (1 << 23))[24:40])
+
+        # Index of the functions that are output as weights
+        weights = 3 if self._prenormalize else 0
+
+        if self._quad:
+            m.d.comb += [
+                self.quads.payload.p.eq(p),
+                self.quads.payload.tag.eq(tag),
+            ]
+            for i in range(4):
+                def lane(j):
+                    return ws[j] + (as_[j] if i & 1 else 0) + (bs[j] if i & 2 else 0)
+                lane_covered = (lane(0) | lane(1) | lane(2)) >= 0
+                if self._clip:
+                    # Quads are aligned, so their lanes can be past the clipped bounding box while still being
+                    # inside the triangle
+                    lane_x = p.x + (i & 1)
+                    lane_y = p.y + (i >> 1)
+                    lane_covered &= (
+                        (lane_x >= bound.x) & (lane_x <= max_x) & (lane_y >= bound.y) & (lane_y <= max_y)
+                    )
+                m.d.comb += [
+                    self.quads.payload.mask[i].eq(lane_covered),
+                    self.quads.payload.lanes[i].w0.eq(lane(weights + 0)),
+                    self.quads.payload.lanes[i].w1.eq(lane(weights + 1)),
+                    self.quads.payload.lanes[i].w2.eq(lane(weights + 2)),
+                ]
+        else:
+            m.d.comb += [
+                scaler.points.payload.p.eq(p),
+                scaler.points.payload.w0.eq(ws[weights + 0]),
+                scaler.points.payload.w1.eq(ws[weights + 1]),
+                scaler.points.payload.w2.eq(ws[weights + 2]),
+                scaler.points.payload.tag.eq(tag),
+            ]
+            wiring.connect(m, wiring.flipped(self.points), scaler.points_scaled)
+            m.d.comb += scaler.unit_area.eq(unit_area)
+
+        walk_idle = Signal()
+        setup_idle = Signal()
+        m.d.comb += self.idle.eq(setup_idle & ~setup_done & walk_idle & ~self.triangle.valid & ~out.valid)
+
+        # With a FIFO, reciprocals are computed ahead of the walker, otherwise the divider is only triggered
+        # once the walker picks up the triangle, since its result is used by every point of the current one.
+        can_setup = Signal()
+        if use_fifo:
+            m.d.comb += [
+                can_setup.eq(~setup_done & (scaler.area_ready | _small)),
+                scaler.area.eq(area_orient2d.res),
+                scaler.area_tag.eq(setup_tag),
+            ]
+        else:
+            m.d.comb += can_setup.eq(~setup_done)
+            if scaler is not None:
+                m.d.comb += scaler.area.eq(setup_area)
+
+        plane = _PlaneSetup(m, planes, area_orient2d.res,
+                            div_unroll=self._div_unroll, pipelined_recip=self._pipelined_recip)
 
-        with m.FSM():
+        def attr_mac(operands, dest, *, accumulate: bool = False):
+            # `operands(c0 - c2, c1 - c2, c2)` gives the factors for each attribute
+            for i in range(self._attributes):
+                c0, c1, c2 = setup_attrs[i][0], setup_attrs[i][1], setup_attrs[i][2]
+                plane.mac(i, *operands(c0 - c2, c1 - c2, c2), dest[i], accumulate=accumulate)
+
+        with m.FSM(name="setup"):
             with m.State("IDLE"):
-                m.d.comb += self.idle.eq(~self.triangle.valid)
-                with m.If(self.triangle.valid):  # area cycle 0, w0/w1/w2 not started
+                m.d.comb += setup_idle.eq(1)
+                with m.If(self.triangle.valid & can_setup):  # area cycle 0, w0/w1/w2 not started
                     m.d.sync += [
-                        a01.eq(_a01),
-                        a12.eq(_a12),
-                        a20.eq(_a20),
-                        b01.eq(_b01),
-                        b12.eq(_b12),
-                        b20.eq(_b20),
-                        p.eq(_p),
-                        min_x.eq(_min_x),
-                        max_x.eq(_max_x),
-                        max_y.eq(_max_y),
+                        setup_a01.eq(_a01),
+                        setup_a12.eq(_a12),
+                        setup_a20.eq(_a20),
+                        setup_b01.eq(_b01),
+                        setup_b12.eq(_b12),
+                        setup_b20.eq(_b20),
+                        setup_p.eq(_p),
+                        setup_bound.x.eq(_min_x),
+                        setup_bound.y.eq(_min_y),
+                        setup_tag.eq(accept_tag),
+                        setup_skip.eq((_start_y > _max_y) | (_min_x > _max_x)),
+                        setup_unit_area.eq(_small),
+                        setup_min_x.eq(_p.x),
+                        setup_max_x.eq(_max_x),
+                        setup_max_y.eq(_max_y),
                     ]
-                    m.next = "ORIENT2D_DELAY1"
+                    if self._attributes:
+                        m.d.sync += setup_attrs.eq(self.attributes)
+                    for n_dx, n_dy, a, b in zip(setup_ns_dx, setup_ns_dy, [_a12, _a20, _a01], [_b12, _b20, _b01]):
+                        m.d.sync += [
+                            n_dx.eq(a),
+                            n_dy.eq(b),
+                        ]
+                    if self._small_triangles:
+                        with m.If(_small):
+                            m.d.sync += setup_skip.eq((_start_y > _max_y) | (_min_x > _max_x) | (_small_area <= 0))
+                            self._setup_small(m, _small_ws, [_a12, _a20, _a01], [_b12, _b20, _b01],
+                                              [setup_w0, setup_w1, setup_w2], setup_ns, setup_ns_dx, setup_ns_dy,
+                                              setup_ls, setup_ls_dx, setup_ls_dy)
+                            m.next = "SMALL"
+                        with m.Else():
+                            m.next = "ORIENT2D_DELAY1"
+                    else:
+                        m.next = "ORIENT2D_DELAY1"
+            if self._small_triangles:
+                with m.State("SMALL"):
+                    m.d.comb += self.triangle.ready.eq(1)
+                    with m.If(~setup_skip):
+                        m.d.sync += setup_done.eq(1)
+                    m.next = "IDLE"
             with m.State("ORIENT2D_DELAY1"):  # area cycle 1, w0/w1/w2 cycle 0
                 # safe to change, values already in the pipeline
                 m.d.comb += self.triangle.ready.eq(1)
+                attr_mac(lambda d0, d1, c2: (d0, setup_a12), setup_ls_dx)
                 m.next = "ORIENT2D_DELAY2"
             with m.State("ORIENT2D_DELAY2"):  # area cycle 2, w0/w1/w2 cycle 1
+                attr_mac(lambda d0, d1, c2: (d1, setup_a20), setup_ls_dx, accumulate=True)
                 m.next = "ORIENT2D_DELAY3"
             with m.State("ORIENT2D_DELAY3"):  # area cycle 3, w0/w1/w2 cycle 2
+                attr_mac(lambda d0, d1, c2: (d0, setup_b12), setup_ls_dy)
                 m.next = "ORIENT2D_DELAY4"
             with m.State("ORIENT2D_DELAY4"):  # area done, w0/w1/w2 cycle 3
-                with m.If(area_orient2d.res <= 0):
+                attr_mac(lambda d0, d1, c2: (d1, setup_b20), setup_ls_dy, accumulate=True)
+                with m.If((area_orient2d.res <= 0) | setup_skip):
                     m.next = "IDLE"
                 with m.Else():
-                    m.d.comb += scaler.area_trigger.eq(1)
+                    if use_fifo:
+                        m.d.comb += scaler.area_trigger.eq(1)
+                    if planes:
+                        m.d.comb += plane.recip_trigger.eq(1)
+                    m.d.sync += setup_area.eq(area_orient2d.res)
                     m.next = "ORIENT2D_DELAY5"
             with m.State("ORIENT2D_DELAY5"):  # w0/w1/w2 done
                 m.d.sync += [
-                    w0_row.eq(w0_orient2d.res),
-                    w1_row.eq(w1_orient2d.res),
-                    w2_row.eq(w2_orient2d.res),
-                    w0.eq(w0_orient2d.res),
-                    w1.eq(w1_orient2d.res),
-                    w2.eq(w2_orient2d.res),
-                    p.x.eq(min_x),
+                    setup_w0.eq(w0_orient2d.res),
+                    setup_w1.eq(w1_orient2d.res),
+                    setup_w2.eq(w2_orient2d.res),
                 ]
-                m.next = "WALK"
-            with m.State("WALK"):
-                with m.If(p.y > max_y):
+                for n, w_orient2d in zip(setup_ns, [w0_orient2d, w1_orient2d, w2_orient2d]):
+                    m.d.sync += n.eq(w_orient2d.res)
+                if self._attributes:
+                    attr_mac(lambda d0, d1, c2: (d0, w0_orient2d.res), setup_ls)
+                    m.next = "PLANE_W1"
+                elif planes:
+                    m.next = "PLANE_RECIP"
+                else:
+                    m.d.sync += setup_done.eq(1)
+                    m.next = "IDLE"
+            if self._attributes:
+                # Attribute plane equations, `c0 * w0 + c1 * w1 + c2 * w2` written as
+                # `(c0 - c2) * w0 + (c1 - c2) * w1 + c2 * area` (the weights add up to the area), then scaled
+                # by the reciprocal of the area along with the normalized weights.
+                with m.State("PLANE_W1"):
+                    attr_mac(lambda d0, d1, c2: (d1, setup_w1), setup_ls, accumulate=True)
+                    m.next = "PLANE_AREA"
+                with m.State("PLANE_AREA"):
+                    attr_mac(lambda d0, d1, c2: (c2, setup_area), setup_ls, accumulate=True)
+                    m.next = "PLANE_RECIP"
+            if planes:
+                with m.State("PLANE_RECIP"):
+                    with m.If(plane.recip_valid):
+                        plane.scale(setup_ls_dx + setup_ns_dx)
+                        m.next = "PLANE_SCALE_DY"
+                with m.State("PLANE_SCALE_DY"):
+                    plane.scale(setup_ls_dy + setup_ns_dy)
+                    m.next = "PLANE_SCALE"
+                with m.State("PLANE_SCALE"):
+                    plane.scale(setup_ls + setup_ns)
+                    m.d.sync += setup_done.eq(1)
                     m.next = "IDLE"
-                with m.Elif(p.x > max_x):
+
+        # Points of the previous triangle must be out of the scaler before starting a new one, so at most two
+        # triangles (the one being walked and the one being set up) are in flight and a 1 bit tag is enough.
+        drained = Signal()
+        if self._quad:
+            m.d.comb += drained.eq(~out.valid & ~self.quads_pending)
+        else:
+            m.d.comb += drained.eq(~out.valid | out.ready)
+        can_walk = Signal()
+        if use_fifo:
+            m.d.comb += can_walk.eq(setup_done & drained & (scaler.recip_valid | setup_unit_area))
+        else:
+            m.d.comb += can_walk.eq(setup_done & drained)
+
+        def done():
+            if use_fifo:
+                m.d.comb += scaler.retire.eq(~unit_area)
+            m.next = "IDLE"
+
+        with m.FSM(name="walk"):
+            with m.State("IDLE"):
+                m.d.comb += walk_idle.eq(1)
+                with m.If(can_walk):
+                    if scaler is not None and not use_fifo:
+                        m.d.comb += scaler.area_trigger.eq(~setup_unit_area)
                     m.d.sync += [
-                        w0_row.eq(w0_row + b12),
-                        w1_row.eq(w1_row + b20),
-                        w2_row.eq(w2_row + b01),
-                        w0.eq(w0_row + b12),
-                        w1.eq(w1_row + b20),
-                        w2.eq(w2_row + b01),
-                        p.x.eq(min_x),
-                        p.y.eq(p.y + 1),
+                        a01.eq(setup_a01),
+                        a12.eq(setup_a12),
+                        a20.eq(setup_a20),
+                        b01.eq(setup_b01),
+                        b12.eq(setup_b12),
+                        b20.eq(setup_b20),
+                        p.eq(setup_p),
+                        bound.eq(setup_bound),
+                        tag.eq(setup_tag),
+                        accept_tag.eq(~setup_tag),
+                        unit_area.eq(setup_unit_area),
+                        min_x.eq(setup_min_x),
+                        max_x.eq(setup_max_x),
+                        max_y.eq(setup_max_y),
+                        w0_row.eq(setup_w0),
+                        w1_row.eq(setup_w1),
+                        w2_row.eq(setup_w2),
+                        w0.eq(setup_w0),
+                        w1.eq(setup_w1),
+                        w2.eq(setup_w2),
+                        setup_done.eq(0),
                     ]
-                with m.Else():
-                    m.d.comb += scaler.points.valid.eq((w0 | w1 | w2) >= 0)
-                    with m.If(~scaler.points.valid | scaler.points.ready):
+                    for l, l_row, l_dx, l_dy, setup_l, setup_l_dx, setup_l_dy in zip(
+                            ls + ns, ls_row + ns_row, ls_dx + ns_dx, ls_dy + ns_dy,
+                            setup_ls + setup_ns, setup_ls_dx + setup_ns_dx, setup_ls_dy + setup_ns_dy):
                         m.d.sync += [
-                            w0.eq(w0 + a12),
-                            w1.eq(w1 + a20),
-                            w2.eq(w2 + a01),
-                            p.x.eq(p.x + 1),
+                            l.eq(setup_l),
+                            l_row.eq(setup_l),
+                            l_dx.eq(setup_l_dx),
+                            l_dy.eq(setup_l_dy),
                         ]
+                    m.next = "WALK"
+            match self._traversal:
+                case Traversal.RASTER if self._quad:
+                    self._walk_quads(m, out, done, p, min_x, max_x, max_y, ws, ws_row, as_, bs, row_shift)
+                case Traversal.RASTER:
+                    self._walk_raster(m, scaler, done, p, min_x, max_x, max_y, ws, ws_row, as_, bs, row_shift)
+                case Traversal.SERPENTINE:
+                    self._walk_serpentine(m, scaler, done, p, min_x, max_x, max_y, ws, as_, bs)
+                case Traversal.TILED:
+                    self._walk_tiled(m, scaler, done, p, min_x, max_x, max_y, ws, ws_row, as_, bs)
 
         return m
+
+    def _setup_small(self, m, ws, as_, bs, setup_ws, setup_ns, setup_ns_dx, setup_ns_dy,
+                     setup_ls, setup_ls_dx, setup_ls_dy):
+        for setup_w, w in zip(setup_ws, ws):
+            m.d.sync += setup_w.eq(w)
+        # Scaled by 0xFFFFFF, which is -1 modulo 2**24
+        for n, n_dx, n_dy, w, a, b in zip(setup_ns, setup_ns_dx, setup_ns_dy, ws, as_, bs):
+            m.d.sync += [
+                n.eq(-w),
+                n_dx.eq(-a),
+                n_dy.eq(-b),
+            ]
+        # Same plane equations as the regular setup with an area of 1, scaled by 0xFFFFFF modulo 2**40. The first
+        # point of a triangle that isn't skipped is next to its vertices, so the weights there fit a few bits.
+        w0, w1 = ws[0][:4].as_signed(), ws[1][:4].as_signed()
+        for i, (l, l_dx, l_dy) in enumerate(zip(setup_ls, setup_ls_dx, setup_ls_dy)):
+            c0, c1, c2 = self.attributes[i][0], self.attributes[i][1], self.attributes[i][2]
+            d0, d1 = c0 - c2, c1 - c2
+            for dest, raw in [
+                (l_dx, _mul_unit(as_[0], d0) + _mul_unit(as_[1], d1)),
+                (l_dy, _mul_unit(bs[0], d0) + _mul_unit(bs[1], d1)),
+                (l, d0 * w0 + d1 * w1 + c2),
+            ]:
+                m.d.sync += dest.eq((raw << 24) - raw)
+
+    @staticmethod
+    def _walk_raster(m, scaler, done, p, min_x, max_x, max_y, ws, ws_row, as_, bs, row_shift):
+        with m.State("WALK"):
+            with m.If(p.y > max_y):
+                done()
+            with m.Elif(p.x > max_x):
+                # Checked before stepping, the next row of an interleaved walker can be past the last row
+                with m.If(p.y + (1 << row_shift) > max_y):
+                    done()
+                with m.Else():
+                    for w, w_row, b in zip(ws, ws_row, bs):
+                        m.d.sync += [
+                            w_row.eq(w_row + (b << row_shift)),
+                            w.eq(w_row + (b << row_shift)),
+                        ]
+                    m.d.sync += [
+                        p.x.eq(min_x),
+                        p.y.eq(p.y + (1 << row_shift)),
+                    ]
+            with m.Else():
+                m.d.comb += scaler.points.valid.eq((ws[0] | ws[1] | ws[2]) >= 0)
+                with m.If(~scaler.points.valid | scaler.points.ready):
+                    for w, a in zip(ws, as_):
+                        m.d.sync += w.eq(w + a)
+                    m.d.sync += p.x.eq(p.x + 1)
+
+    @staticmethod
+    def _walk_quads(m, quads, done, p, min_x, max_x, max_y, ws, ws_row, as_, bs, row_shift):
+        # Moves to the next quad or row in the same cycle, checking the bounds before stepping so coordinates
+        # never go past the bounding box.
+        with m.State("WALK"):
+            m.d.comb += quads.valid.eq(quads.payload.mask.any())
+            with m.If(~quads.valid | quads.ready):
+                with m.If(p.x + 2 <= max_x):
+                    for w, a in zip(ws, as_):
+                        m.d.sync += w.eq(w + (a << 1))
+                    m.d.sync += p.x.eq(p.x + 2)
+                with m.Elif(p.y + (1 << row_shift) <= max_y):
+                    for w, w_row, b in zip(ws, ws_row, bs):
+                        m.d.sync += [
+                            w_row.eq(w_row + (b << row_shift)),
+                            w.eq(w_row + (b << row_shift)),
+                        ]
+                    m.d.sync += [
+                        p.x.eq(min_x),
+                        p.y.eq(p.y + (1 << row_shift)),
+                    ]
+                with m.Else():
+                    done()
+
+    @staticmethod
+    def _walk_serpentine(m, scaler, done, p, min_x, max_x, max_y, ws, as_, bs):
+        left = Signal()
+        # Whether a covered pixel was already found on this row, leaving coverage ends the row
+        entered = Signal()
+        # Whether the row started inside the triangle, so the pixels on the other side of the starting point
+        # still need to be walked
+        back_pending = Signal()
+        ws_saved = [Signal.like(w, name=f"w{i}_saved") for i, w in enumerate(ws)]
+        saved_x = Signal.like(p.x)
+
+        inside = Signal()
+        m.d.comb += inside.eq((ws[0] | ws[1] | ws[2]) >= 0)
+
+        edges = list(zip(ws[:3], as_[:3]))
+
+        # Coverage is convex, so from a point outside of it the edges it is outside of tell in which direction
+        # the covered span of the row is. Edges that need opposite directions, or a violated edge parallel to
+        # the row, mean the row is empty.
+        need_right = Signal()
+        need_left = Signal()
+        row_empty = Signal()
+        m.d.comb += [
+            need_right.eq(Cat((w < 0) & (a > 0) for w, a in edges).any()),
+            need_left.eq(Cat((w < 0) & (a < 0) for w, a in edges).any()),
+            row_empty.eq(Cat((w < 0) & (a == 0) for w, a in edges).any() | (need_right & need_left)),
+        ]
+
+        can_step = Signal()
+        m.d.comb += can_step.eq(Mux(left, p.x > min_x, p.x < max_x))
+
+        def step():
+            for w, a in zip(ws, as_):
+                m.d.sync += w.eq(Mux(left, w - a, w + a))
+            m.d.sync += p.x.eq(Mux(left, p.x - 1, p.x + 1))
+
+        def next_row():
+            for w, b in zip(ws, bs):
+                m.d.sync += w.eq(w + b)
+            m.d.sync += p.y.eq(p.y + 1)
+            m.next = "ROW"
+
+        def end_row():
+            with m.If(back_pending & Mux(left, saved_x < max_x, saved_x > min_x)):
+                # Resume right next to where the row started, going the other way
+                for w, w_saved, a in zip(ws, ws_saved, as_):
+                    m.d.sync += w.eq(Mux(left, w_saved + a, w_saved - a))
+                m.d.sync += [
+                    p.x.eq(Mux(left, saved_x + 1, saved_x - 1)),
+                    left.eq(~left),
+                    back_pending.eq(0),
+                ]
+            with m.Else():
+                next_row()
+
+        with m.State("WALK"):
+            m.d.sync += left.eq(0)
+            m.next = "ROW"
+        with m.State("ROW"):
+            m.d.sync += entered.eq(0)
+            with m.If(p.y > max_y):
+                done()
+            with m.Elif(inside):
+                for w, w_saved in zip(ws, ws_saved):
+                    m.d.sync += w_saved.eq(w)
+                m.d.sync += [
+                    saved_x.eq(p.x),
+                    back_pending.eq(1),
+                ]
+                m.next = "SCAN"
+            with m.Elif(row_empty):
+                next_row()
+            with m.Else():
+                m.d.sync += [
+                    left.eq(need_left),
+                    back_pending.eq(0),
+                ]
+                m.next = "SCAN"
+        with m.State("SCAN"):
+            with m.If(inside):
+                m.d.comb += scaler.points.valid.eq(1)
+                with m.If(scaler.points.ready):
+                    m.d.sync += entered.eq(1)
+                    with m.If(can_step):
+                        step()
+                    with m.Else():
+                        end_row()
+            with m.Elif(entered | ~can_step):
+                end_row()
+            with m.Else():
+                step()
+
+    def _walk_tiled(self, m, scaler, done, p, min_x, max_x, max_y, ws, ws_row, as_, bs):
+        tile_shift = log2_int(self._tile_size)
+
+        # Tile origin, wider than a point so stepping past the last tile can't wrap around
+        tile_x = Signal(12)
+        tile_y = Signal(12)
+        tile_end_x = Signal(12)
+        tile_end_y = Signal(12)
+        m.d.comb += [
+            tile_end_x.eq(Mux(tile_x + self._tile_size - 1 < max_x, tile_x + self._tile_size - 1, max_x)),
+            tile_end_y.eq(Mux(tile_y + self._tile_size - 1 < max_y, tile_y + self._tile_size - 1, max_y)),
+        ]
+
+        # Edge function values at the origin of the current tile and of the first tile of the current tile row
+        ws_tile = [Signal.like(w, name=f"w{i}_tile") for i, w in enumerate(ws)]
+        ws_tile_row = [Signal.like(w, name=f"w{i}_tile_row") for i, w in enumerate(ws)]
+
+        # A tile can only contain covered pixels if, for every edge, the corner of the tile that maximizes
+        # that edge function is not outside of it.
+        tile_outside = Signal()
+        m.d.comb += tile_outside.eq(Cat(
+            (
+                w_tile +
+                Mux(a > 0, (a << tile_shift) - a, 0) +
+                Mux(b > 0, (b << tile_shift) - b, 0)
+            ) < 0
+            for w_tile, a, b in zip(ws_tile[:3], as_[:3], bs[:3])
+        ).any())
+
+        def next_tile():
+            for w_tile, a in zip(ws_tile, as_):
+                m.d.sync += w_tile.eq(w_tile + (a << tile_shift))
+            m.d.sync += tile_x.eq(tile_x + self._tile_size)
+
+        with m.State("WALK"):
+            for w, w_tile, w_tile_row in zip(ws, ws_tile, ws_tile_row):
+                m.d.sync += [
+                    w_tile.eq(w),
+                    w_tile_row.eq(w),
+                ]
+            m.d.sync += [
+                tile_x.eq(min_x),
+                tile_y.eq(p.y),
+            ]
+            m.next = "TILE"
+        with m.State("TILE"):
+            with m.If(tile_y > max_y):
+                done()
+            with m.Elif(tile_x > max_x):
+                for w_tile, w_tile_row, b in zip(ws_tile, ws_tile_row, bs):
+                    m.d.sync += [
+                        w_tile_row.eq(w_tile_row + (b << tile_shift)),
+                        w_tile.eq(w_tile_row + (b << tile_shift)),
+                    ]
+                m.d.sync += [
+                    tile_x.eq(min_x),
+                    tile_y.eq(tile_y + self._tile_size),
+                ]
+            with m.Elif(tile_outside):
+                next_tile()
+            with m.Else():
+                for w, w_row, w_tile in zip(ws, ws_row, ws_tile):
+                    m.d.sync += [
+                        w.eq(w_tile),
+                        w_row.eq(w_tile),
+                    ]
+                m.d.sync += [
+                    p.x.eq(tile_x),
+                    p.y.eq(tile_y),
+                ]
+                m.next = "TILE_WALK"
+        with m.State("TILE_WALK"):
+            with m.If(p.y > tile_end_y):
+                next_tile()
+                m.next = "TILE"
+            with m.Elif(p.x > tile_end_x):
+                for w, w_row, b in zip(ws, ws_row, bs):
+                    m.d.sync += [
+                        w_row.eq(w_row + b),
+                        w.eq(w_row + b),
+                    ]
+                m.d.sync += [
+                    p.x.eq(tile_x),
+                    p.y.eq(p.y + 1),
+                ]
+            with m.Else():
+                m.d.comb += scaler.points.valid.eq((ws[0] | ws[1] | ws[2]) >= 0)
+                with m.If(~scaler.points.valid | scaler.points.ready):
+                    for w, a in zip(ws, as_):
+                        m.d.sync += w.eq(w + a)
+                    m.d.sync += p.x.eq(p.x + 1)
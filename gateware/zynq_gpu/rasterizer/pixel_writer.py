@@ -1,12 +1,16 @@
 from amaranth import *
+from amaranth.lib import wiring
 from amaranth.lib.wiring import Component, In, Out
+from .write_combiner import WriteCombiner
 from ..zynq_ifaces import SAxiHP
 
 
-__all__ = ["PixelWriter"]
+__all__ = ["PixelWriter", "CoalescingPixelWriter"]
 
 
 class PixelWriter(Component):
+    idle: Out(1)
+
     pixel_valid: In(1)
     pixel_ready: Out(1)
     pixel_addr: In(32)
@@ -41,6 +45,7 @@ class PixelWriter(Component):
         with m.FSM():
             with m.State("IDLE"):
                 m.d.comb += [
+                    self.idle.eq(1),
                     self.pixel_ready.eq(self.axi_addr.ready & self.axi_data.ready),
                     self.axi_addr.valid.eq(self.pixel_valid & self.axi_data.ready),
                     self.axi_data.valid.eq(self.pixel_valid & self.axi_addr.ready),
@@ -95,3 +100,64 @@ class PixelWriter(Component):
                     m.next = "IDLE"
 
         return m
+
+
+class CoalescingPixelWriter(Component):
+    """
+    Writes pixels like `PixelWriter`, but pixels written one after the other in the same or consecutive 64-bit words
+    are combined into whole words sent as bursts, see `WriteCombiner`. A pixel that straddles two words takes 2
+    cycles.
+
+    Pixels are `bytes_per_pixel` bytes, the LSBs of `pixel_data`.
+    """
+
+    idle: Out(1)
+    flush: In(1)
+
+    pixel_valid: In(1)
+    pixel_ready: Out(1)
+    pixel_addr: In(32)
+    pixel_data: In(32)
+
+    axi_addr: Out(SAxiHP.members["write_address"].signature)
+    axi_data: Out(SAxiHP.members["write_data"].signature)
+    axi_resp: Out(SAxiHP.members["write_response"].signature)
+
+    def __init__(self, bytes_per_pixel: int = 3):
+        self._bytes_per_pixel = bytes_per_pixel
+        super().__init__()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.combiner = combiner = WriteCombiner()
+        wiring.connect(m, wiring.flipped(self.axi_addr), combiner.write_address)
+        wiring.connect(m, wiring.flipped(self.axi_data), combiner.write_data)
+        wiring.connect(m, wiring.flipped(self.axi_resp), combiner.write_response)
+
+        split_write = Signal()
+        # Only for pixels that aren't aligned
+        m.d.comb += split_write.eq(self.pixel_addr[:3] + self._bytes_per_pixel > 8)
+
+        # Writing the part of a split pixel that's in the second word
+        second = Signal()
+
+        data = Signal(128)
+        strb = Signal(16)
+        m.d.comb += [
+            data.eq(self.pixel_data[:8 * self._bytes_per_pixel] << (8 * self.pixel_addr[:3])),
+            strb.eq(C((1 << self._bytes_per_pixel) - 1, self._bytes_per_pixel) << self.pixel_addr[:3]),
+
+            combiner.valid.eq(self.pixel_valid),
+            combiner.addr.eq(Mux(second, self.pixel_addr + 8, self.pixel_addr)),
+            combiner.data.eq(Mux(second, data[64:], data[:64])),
+            combiner.strb.eq(Mux(second, strb[8:], strb[:8])),
+            combiner.flush.eq(self.flush),
+
+            self.pixel_ready.eq(combiner.ready & (~split_write | second)),
+            self.idle.eq(combiner.idle),
+        ]
+        with m.If(combiner.valid & combiner.ready & split_write):
+            m.d.sync += second.eq(~second)
+
+        return m
@@ -0,0 +1,125 @@
+from amaranth import *
+from amaranth.lib import wiring
+from amaranth.lib.data import ArrayLayout
+from amaranth.lib.fifo import SyncFIFOBuffered
+from amaranth.lib.wiring import Component, In, Out, Signature
+from .edge_walker import Point
+from .rasterizer_pipelined import Rasterizer as PipelinedRasterizer
+from .types import *
+from ..axi_arbiter import AxiArbiter
+from ..zynq_ifaces import SAxiHP
+
+
+__all__ = ["Rasterizer"]
+
+
+class Rasterizer(Component):
+    """
+    Runs `pipelines` pipelined rasterizers side by side, each one drawing an interleaved set of rows.
+
+    Every triangle is sent to all pipelines through a queue per pipeline, and is accepted once all of them have room
+    for it. Memory accesses of all pipelines share the same two ports. Texture reads are `texture_read` for the first
+    pipeline and `texture_read_1`, `texture_read_2`, ... for the others.
+    """
+
+    def __init__(self, pipelines: int = 2, *, triangle_queue_depth: int = 4, **kwargs):
+        if pipelines < 1 or pipelines & (pipelines - 1):
+            raise ValueError(f"Pipeline count must be a power of two, not {pipelines!r}")
+        self._pipelines = pipelines
+        self._triangle_queue_depth = triangle_queue_depth
+        self._kwargs = kwargs
+        super().__init__()
+
+    @property
+    def signature(self):
+        members = {
+            "axi": Out(SAxiHP),
+            "axi2": Out(SAxiHP),
+            "idle": Out(1),
+            "width": In(12),
+            "z_base": In(32),
+            "fb_base": In(32),
+            "scissor_min": In(Point),
+            "scissor_max": In(Point),
+            "depth_invalidate": In(1),
+            "depth_fast_clear": In(1),
+
+            "perf_counters": Out(ArrayLayout(PerfCounters, self._pipelines)),
+
+            "triangles": In(TriangleStream),
+            "texture_read": Out(TextureBufferRead),
+        }
+        for i in range(1, self._pipelines):
+            members[f"texture_read_{i}"] = Out(TextureBufferRead)
+        return Signature(members)
+
+    @property
+    def texture_reads(self):
+        return [self.texture_read] + [getattr(self, f"texture_read_{i}") for i in range(1, self._pipelines)]
+
+    def elaborate(self, platform):
+        m = Module()
+
+        if self._pipelines == 1:
+            m.submodules.rasterizer = rasterizer = PipelinedRasterizer(**self._kwargs)
+            wiring.connect(m, wiring.flipped(self.axi), rasterizer.axi)
+            wiring.connect(m, wiring.flipped(self.axi2), rasterizer.axi2)
+            wiring.connect(m, wiring.flipped(self.triangles), rasterizer.triangles)
+            wiring.connect(m, wiring.flipped(self.texture_read), rasterizer.texture_read)
+            m.d.comb += [
+                rasterizer.width.eq(self.width),
+                rasterizer.z_base.eq(self.z_base),
+                rasterizer.fb_base.eq(self.fb_base),
+                rasterizer.scissor_min.eq(self.scissor_min),
+                rasterizer.scissor_max.eq(self.scissor_max),
+                rasterizer.depth_invalidate.eq(self.depth_invalidate),
+                rasterizer.depth_fast_clear.eq(self.depth_fast_clear),
+                self.perf_counters[0].eq(rasterizer.perf_counters),
+                self.idle.eq(rasterizer.idle),
+            ]
+            return m
+
+        m.submodules.color_arbiter = color_arbiter = AxiArbiter(self._pipelines)
+        m.submodules.depth_arbiter = depth_arbiter = AxiArbiter(self._pipelines)
+        wiring.connect(m, wiring.flipped(self.axi), color_arbiter.bus)
+        wiring.connect(m, wiring.flipped(self.axi2), depth_arbiter.bus)
+
+        fifos_ready = []
+        idles = []
+        for i, texture_read in enumerate(self.texture_reads):
+            rasterizer = PipelinedRasterizer(interleave=self._pipelines, phase=i, **self._kwargs)
+            m.submodules[f"rasterizer_{i}"] = rasterizer
+            wiring.connect(m, rasterizer.axi, color_arbiter.masters[i])
+            wiring.connect(m, rasterizer.axi2, depth_arbiter.masters[i])
+            wiring.connect(m, wiring.flipped(texture_read), rasterizer.texture_read)
+            m.d.comb += [
+                rasterizer.width.eq(self.width),
+                rasterizer.z_base.eq(self.z_base),
+                rasterizer.fb_base.eq(self.fb_base),
+                rasterizer.scissor_min.eq(self.scissor_min),
+                rasterizer.scissor_max.eq(self.scissor_max),
+                rasterizer.depth_invalidate.eq(self.depth_invalidate),
+                rasterizer.depth_fast_clear.eq(self.depth_fast_clear),
+                self.perf_counters[i].eq(rasterizer.perf_counters),
+            ]
+
+            fifo = SyncFIFOBuffered(width=len(self.triangles.payload.as_value()), depth=self._triangle_queue_depth)
+            m.submodules[f"triangle_fifo_{i}"] = fifo
+            m.d.comb += [
+                fifo.w_data.eq(self.triangles.payload),
+                fifo.w_en.eq(self.triangles.valid & self.triangles.ready),
+
+                rasterizer.triangles.payload.eq(fifo.r_data),
+                rasterizer.triangles.valid.eq(fifo.r_rdy),
+                fifo.r_en.eq(rasterizer.triangles.ready),
+            ]
+            fifos_ready.append(fifo.w_rdy)
+            # The level counts a triangle from the cycle after it's taken, r_rdy only a cycle later
+            idles.append(rasterizer.idle & (fifo.level == 0))
+
+        m.d.comb += [
+            self.triangles.ready.eq(Cat(fifos_ready).all()),
+            self.idle.eq(Cat(idles).all() & ~self.triangles.valid),
+        ]
+
+        return m
@@ -1,11 +1,13 @@
 from amaranth import *
 from amaranth.lib import wiring
-from amaranth.lib.data import ArrayLayout
+from amaranth.lib.data import ArrayLayout, StructLayout
 from amaranth.lib.fifo import SyncFIFOBuffered
 from amaranth.lib.wiring import Component, In, Out
+from amaranth.utils import log2_int
 from .edge_walker import *
 from .pixel_writer import *
 from .types import *
+from .write_combiner import *
 from ..zynq_ifaces import SAxiHP
 
 
@@ -21,6 +23,7 @@ class RasterizerInterpolator(Component):
     z: In(ArrayLayout(16, 3))
     texture_buffer: In(2)
     texture_enable: In(1)
+    depth: In(DepthFlags)
 
     idle: Out(1)
 
@@ -31,6 +34,7 @@ class RasterizerInterpolator(Component):
 
     out_ready: In(1)
     out_valid: Out(1)
+    out_p: Out(Point)
     out_p_offset: Out(23)
     out_r: Out(8)
     out_g: Out(8)
@@ -38,6 +42,7 @@ class RasterizerInterpolator(Component):
     out_z: Out(16)
     out_texture_buffer: Out(2)
     out_texture_enable: Out(1)
+    out_depth: Out(DepthFlags)
 
     def elaborate(self, platform):
         m = Module()
@@ -54,6 +59,7 @@ class RasterizerInterpolator(Component):
         c0_ws = Signal.like(self.in_ws, reset_less=True)
         c0_texture_buffer = Signal.like(self.texture_buffer)
         c0_texture_enable = Signal.like(self.texture_enable)
+        c0_depth = Signal.like(self.depth)
         c0_valid = Signal()
 
         with m.If(~stall_input):
@@ -66,6 +72,7 @@ class RasterizerInterpolator(Component):
                 c0_z.eq(self.z),
                 c0_texture_buffer.eq(self.texture_buffer),
                 c0_texture_enable.eq(self.texture_enable),
+                c0_depth.eq(self.depth),
                 c0_valid.eq(self.in_valid),
             ]
 
@@ -77,6 +84,7 @@ class RasterizerInterpolator(Component):
         c1_ws = Signal.like(self.in_ws, reset_less=True)
         c1_texture_buffer = Signal.like(self.texture_buffer)
         c1_texture_enable = Signal.like(self.texture_enable)
+        c1_depth = Signal.like(self.depth)
         c1_valid = Signal()
 
         with m.If(~stall_input):
@@ -89,6 +97,7 @@ class RasterizerInterpolator(Component):
                 c1_z.eq(c0_z),
                 c1_texture_buffer.eq(c0_texture_buffer),
                 c1_texture_enable.eq(c0_texture_enable),
+                c1_depth.eq(c0_depth),
                 c1_valid.eq(c0_valid),
             ]
 
@@ -96,9 +105,11 @@ class RasterizerInterpolator(Component):
         c2_g_scaled = Array(Signal(32, name=f"g_scaled_{i}", reset_less=True) for i in range(3))
         c2_b_scaled = Array(Signal(32, name=f"b_scaled_{i}", reset_less=True) for i in range(3))
         c2_z_scaled = Array(Signal(40, name=f"z_scaled_{i}", reset_less=True) for i in range(3))
+        c2_p = Signal.like(self.in_p, reset_less=True)
         c2_p_offset = Signal(23, reset_less=True)
         c2_texture_buffer = Signal.like(self.texture_buffer)
         c2_texture_enable = Signal.like(self.texture_enable)
+        c2_depth = Signal.like(self.depth)
         c2_valid = Signal()
 
         width_s = Signal(signed(12))
@@ -119,9 +130,11 @@ class RasterizerInterpolator(Component):
                 for i in range(3):
                     m.d.sync += out[i].eq(in_[i] * c1_ws[i])
             m.d.sync += [
+                c2_p.eq(c1_p),
                 c2_p_offset.eq(self.width * c1_p.y + c1_p.x),
                 c2_texture_buffer.eq(c1_texture_buffer),
                 c2_texture_enable.eq(c1_texture_enable),
+                c2_depth.eq(c1_depth),
                 c2_valid.eq(c1_valid),
             ]
 
@@ -129,9 +142,11 @@ class RasterizerInterpolator(Component):
         c3_g = Signal(9, reset_less=True)
         c3_b = Signal(9, reset_less=True)
         c3_z = Signal(17, reset_less=True)
+        c3_p = Signal.like(self.in_p, reset_less=True)
         c3_p_offset = Signal(23, reset_less=True)
         c3_texture_buffer = Signal.like(self.texture_buffer)
         c3_texture_enable = Signal.like(self.texture_enable)
+        c3_depth = Signal.like(self.depth)
         c3_valid = Signal()
 
         with m.If(~stall_c3):
@@ -141,9 +156,11 @@ class RasterizerInterpolator(Component):
             ):
                 m.d.sync += out.eq(sum(in_) >> 23)
             m.d.sync += [
+                c3_p.eq(c2_p),
                 c3_p_offset.eq(c2_p_offset),
                 c3_texture_buffer.eq(c2_texture_buffer),
                 c3_texture_enable.eq(c2_texture_enable),
+                c3_depth.eq(c2_depth),
                 c3_valid.eq(c2_valid),
             ]
 
@@ -155,6 +172,7 @@ class RasterizerInterpolator(Component):
             stall_c3.eq(c3_valid & ~self.out_ready),
 
             self.out_valid.eq(c3_valid),
+            self.out_p.eq(c3_p),
             self.out_p_offset.eq(c3_p_offset),
             self.out_r.eq((c3_r + 1) >> 1),
             self.out_g.eq((c3_g + 1) >> 1),
@@ -162,12 +180,526 @@ class RasterizerInterpolator(Component):
             self.out_z.eq((c3_z + 1) >> 1),
             self.out_texture_buffer.eq(c3_texture_buffer),
             self.out_texture_enable.eq(c3_texture_enable),
+            self.out_depth.eq(c3_depth),
+        ]
+
+        return m
+
+
+class RasterizerPlaneInterpolator(Component):
+    """
+    Interpolator for an edge walker that already interpolates the attributes with plane equations, only
+    computes the pixel offset.
+    """
+
+    width: In(11)
+
+    texture_buffer: In(2)
+    texture_enable: In(1)
+    depth: In(DepthFlags)
+
+    idle: Out(1)
+
+    in_ready: Out(1)
+    in_valid: In(1)
+    in_p: In(Point)
+    in_r: In(8)
+    in_g: In(8)
+    in_b: In(8)
+    in_z: In(16)
+
+    out_ready: In(1)
+    out_valid: Out(1)
+    out_p: Out(Point)
+    out_p_offset: Out(23)
+    out_r: Out(8)
+    out_g: Out(8)
+    out_b: Out(8)
+    out_z: Out(16)
+    out_texture_buffer: Out(2)
+    out_texture_enable: Out(1)
+    out_depth: Out(DepthFlags)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        stall = Signal()
+
+        c0_p = Signal.like(self.in_p, reset_less=True)
+        c0_r = Signal(8, reset_less=True)
+        c0_g = Signal(8, reset_less=True)
+        c0_b = Signal(8, reset_less=True)
+        c0_z = Signal(16, reset_less=True)
+        c0_texture_buffer = Signal.like(self.texture_buffer)
+        c0_texture_enable = Signal.like(self.texture_enable)
+        c0_depth = Signal.like(self.depth)
+        c0_valid = Signal()
+
+        with m.If(~stall):
+            m.d.sync += [
+                c0_p.eq(self.in_p),
+                c0_r.eq(self.in_r),
+                c0_g.eq(self.in_g),
+                c0_b.eq(self.in_b),
+                c0_z.eq(self.in_z),
+                c0_texture_buffer.eq(self.texture_buffer),
+                c0_texture_enable.eq(self.texture_enable),
+                c0_depth.eq(self.depth),
+                c0_valid.eq(self.in_valid),
+            ]
+
+        c1_p = Signal.like(self.in_p, reset_less=True)
+        c1_p_offset = Signal(23, reset_less=True)
+        c1_r = Signal(8, reset_less=True)
+        c1_g = Signal(8, reset_less=True)
+        c1_b = Signal(8, reset_less=True)
+        c1_z = Signal(16, reset_less=True)
+        c1_texture_buffer = Signal.like(self.texture_buffer)
+        c1_texture_enable = Signal.like(self.texture_enable)
+        c1_depth = Signal.like(self.depth)
+        c1_valid = Signal()
+
+        with m.If(~stall):
+            m.d.sync += [
+                c1_p.eq(c0_p),
+                c1_p_offset.eq(self.width * c0_p.y + c0_p.x),
+                c1_r.eq(c0_r),
+                c1_g.eq(c0_g),
+                c1_b.eq(c0_b),
+                c1_z.eq(c0_z),
+                c1_texture_buffer.eq(c0_texture_buffer),
+                c1_texture_enable.eq(c0_texture_enable),
+                c1_depth.eq(c0_depth),
+                c1_valid.eq(c0_valid),
+            ]
+
+        m.d.comb += [
+            self.idle.eq(~c0_valid & ~c1_valid),
+            self.in_ready.eq(~stall),
+
+            stall.eq(c1_valid & ~self.out_ready),
+
+            self.out_valid.eq(c1_valid),
+            self.out_p.eq(c1_p),
+            self.out_p_offset.eq(c1_p_offset),
+            self.out_r.eq(c1_r),
+            self.out_g.eq(c1_g),
+            self.out_b.eq(c1_b),
+            self.out_z.eq(c1_z),
+            self.out_texture_buffer.eq(c1_texture_buffer),
+            self.out_texture_enable.eq(c1_texture_enable),
+            self.out_depth.eq(c1_depth),
+        ]
+
+        return m
+
+
+class RasterizerHierarchicalZ(Component):
+    """
+    Rejects pixels that can't pass the depth test before their depth is read, using a lower bound of the depth of
+    every 8x8 tile of the screen kept in on-chip memory.
+
+    A pixel never ends up with a depth smaller than that of any pixel that went through here for it, whether that one
+    passed the depth test or not, nor smaller than the bound of its tile. Once every pixel of a tile (of the rows
+    drawn by this pipeline) went through here, the bound of the tile is raised to the smallest of those. Tiles are
+    tracked in `cache_entries` registers until then, and start over when evicted. Only the 8 most significant bits
+    of the bound are kept, rounded down.
+
+    Only pixels tested with `DepthFunc.GREATER` are rejected, and only those that also write their depth count
+    towards covering a tile. A pixel that might lower the depth of its own (written with `DepthFunc.LESS` or
+    `DepthFunc.ALWAYS`) resets the bound of its tile to 0 instead.
+
+    `invalidate` resets the bound of every tile to 0, it must be set whenever the depth buffer is written by anything
+    else, such as a buffer clear. Nothing is rejected until that's done.
+    """
+
+    invalidate: In(1)
+    idle: Out(1)
+
+    in_ready: Out(1)
+    in_valid: In(1)
+    in_p: In(Point)
+    in_p_offset: In(23)
+    in_r: In(8)
+    in_g: In(8)
+    in_b: In(8)
+    in_z: In(16)
+    in_texture_buffer: In(2)
+    in_texture_enable: In(1)
+    in_depth: In(DepthFlags)
+
+    out_ready: In(1)
+    out_valid: Out(1)
+    out_p_offset: Out(23)
+    out_r: Out(8)
+    out_g: Out(8)
+    out_b: Out(8)
+    out_z: Out(16)
+    out_texture_buffer: Out(2)
+    out_texture_enable: Out(1)
+    out_depth: Out(DepthFlags)
+
+    # `interleave`, `phase` and `quad` must match the edge walker, so only the rows it draws are tracked.
+    def __init__(self, *, max_height: int = 1080, cache_entries: int = 4, interleave: int = 1, phase: int = 0,
+                 quad: bool = False):
+        if 8 % (interleave << quad):
+            raise ValueError(f"Tiles must have the same rows for every phase, interleave of {interleave!r} doesn't")
+        self._max_height = max_height
+        self._cache_entries = cache_entries
+        self._interleave = interleave
+        self._phase = phase
+        self._quad = quad
+        super().__init__()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # 256 tiles per row for a width of up to 2048 pixels
+        tiles = 256 * ((self._max_height + 7) // 8)
+        mem = Memory(width=8, depth=tiles, name="hiz", attrs={"RAM_STYLE": "BLOCK"})
+        # Transparent, so a pixel sees the bound raised by the one right before it
+        m.submodules.rp = rp = mem.read_port()
+        m.submodules.wp = wp = mem.write_port()
+
+        owned = 0
+        for row in range(8):
+            if (row >> self._quad) % self._interleave == self._phase:
+                owned |= 0xFF << (8 * row)
+
+        stall = Signal()
+
+        s0_p = Signal.like(self.in_p, reset_less=True)
+        s0_p_offset = Signal(23, reset_less=True)
+        s0_r = Signal(8, reset_less=True)
+        s0_g = Signal(8, reset_less=True)
+        s0_b = Signal(8, reset_less=True)
+        s0_z = Signal(16, reset_less=True)
+        s0_texture_buffer = Signal(2)
+        s0_texture_enable = Signal()
+        s0_depth = Signal(DepthFlags)
+        s0_valid = Signal()
+
+        with m.If(~stall):
+            m.d.sync += [
+                s0_p.eq(self.in_p),
+                s0_p_offset.eq(self.in_p_offset),
+                s0_r.eq(self.in_r),
+                s0_g.eq(self.in_g),
+                s0_b.eq(self.in_b),
+                s0_z.eq(self.in_z),
+                s0_texture_buffer.eq(self.in_texture_buffer),
+                s0_texture_enable.eq(self.in_texture_enable),
+                s0_depth.eq(self.in_depth),
+                s0_valid.eq(self.in_valid),
+            ]
+        m.d.comb += [
+            rp.addr.eq(Cat(self.in_p.x[3:], self.in_p.y[3:])),
+            rp.en.eq(~stall),
+        ]
+
+        sweeping = Signal()
+        sweep_addr = Signal(range(tiles))
+
+        s0_tile = Signal(16)
+        s0_bit = Signal(64)
+        s0_bound = Signal(16)
+        s0_greater = Signal()
+        s0_writes = Signal()
+        s0_reject = Signal()
+        # Smallest depth the pixel can have from now on
+        s0_floor = Signal(16)
+        m.d.comb += [
+            s0_tile.eq(Cat(s0_p.x[3:], s0_p.y[3:])),
+            s0_bit.eq(C(1, 64) << Cat(s0_p.x[:3], s0_p.y[:3])),
+            s0_bound.eq(Cat(C(0, 8), rp.data)),
+            s0_greater.eq(~s0_depth.no_test & (s0_depth.func == DepthFunc.GREATER.value)),
+            s0_writes.eq(~s0_depth.no_test & ~s0_depth.no_write),
+            s0_reject.eq(~sweeping & s0_greater & (s0_z <= s0_bound)),
+            s0_floor.eq(Mux(s0_reject, s0_bound, s0_z)),
+        ]
+
+        s1_p_offset = Signal(23, reset_less=True)
+        s1_r = Signal(8, reset_less=True)
+        s1_g = Signal(8, reset_less=True)
+        s1_b = Signal(8, reset_less=True)
+        s1_z = Signal(16, reset_less=True)
+        s1_texture_buffer = Signal(2)
+        s1_texture_enable = Signal()
+        s1_depth = Signal(DepthFlags)
+        s1_valid = Signal()
+
+        with m.If(~stall):
+            m.d.sync += [
+                s1_p_offset.eq(s0_p_offset),
+                s1_r.eq(s0_r),
+                s1_g.eq(s0_g),
+                s1_b.eq(s0_b),
+                s1_z.eq(s0_z),
+                s1_texture_buffer.eq(s0_texture_buffer),
+                s1_texture_enable.eq(s0_texture_enable),
+                s1_depth.eq(s0_depth),
+                s1_valid.eq(s0_valid & ~s0_reject),
+            ]
+
+        # Tiles being covered: pixels seen so far and the smallest depth among them
+        entry_valid = Signal(self._cache_entries)
+        entry_tile = Array(Signal(16, name=f"entry_tile_{i}") for i in range(self._cache_entries))
+        entry_mask = Array(Signal(64, name=f"entry_mask_{i}") for i in range(self._cache_entries))
+        entry_min = Array(Signal(16, name=f"entry_min_{i}") for i in range(self._cache_entries))
+        victim = Signal(range(self._cache_entries))
+
+        hits = Signal(self._cache_entries)
+        m.d.comb += hits.eq(Cat(entry_valid[i] & (entry_tile[i] == s0_tile) for i in range(self._cache_entries)))
+
+        with m.If(self.invalidate):
+            m.d.sync += [
+                sweeping.eq(1),
+                sweep_addr.eq(0),
+                entry_valid.eq(0),
+            ]
+        with m.Elif(sweeping):
+            m.d.comb += [
+                wp.addr.eq(sweep_addr),
+                wp.data.eq(0),
+                wp.en.eq(1),
+            ]
+            m.d.sync += sweep_addr.eq(sweep_addr + 1)
+            with m.If(sweep_addr == tiles - 1):
+                m.d.sync += sweeping.eq(0)
+        with m.Elif(s0_valid & ~stall & s0_writes &
+                    ((s0_depth.func == DepthFunc.LESS.value) | (s0_depth.func == DepthFunc.ALWAYS.value))):
+            m.d.comb += [
+                wp.addr.eq(s0_tile),
+                wp.data.eq(0),
+                wp.en.eq(1),
+            ]
+            for i in range(self._cache_entries):
+                with m.If(hits[i]):
+                    m.d.sync += entry_valid[i].eq(0)
+        with m.Elif(s0_valid & ~stall & s0_greater & s0_writes):
+            for i in range(self._cache_entries):
+                with m.If(hits[i]):
+                    new_mask = entry_mask[i] | s0_bit
+                    new_min = Mux(s0_floor < entry_min[i], s0_floor, entry_min[i])
+                    with m.If((new_mask | C(~owned & (2**64 - 1), 64)).all()):
+                        m.d.comb += [
+                            wp.addr.eq(s0_tile),
+                            wp.data.eq(Mux(new_min[8:] > rp.data, new_min[8:], rp.data)),
+                            wp.en.eq(1),
+                        ]
+                        m.d.sync += entry_valid[i].eq(0)
+                    with m.Else():
+                        m.d.sync += [
+                            entry_mask[i].eq(new_mask),
+                            entry_min[i].eq(new_min),
+                        ]
+            with m.If(~hits.any()):
+                m.d.sync += [
+                    entry_valid.bit_select(victim, 1).eq(1),
+                    entry_tile[victim].eq(s0_tile),
+                    entry_mask[victim].eq(s0_bit),
+                    entry_min[victim].eq(s0_floor),
+                    victim.eq(Mux(victim == self._cache_entries - 1, 0, victim + 1)),
+                ]
+
+        m.d.comb += [
+            self.idle.eq(~s0_valid & ~s1_valid),
+            self.in_ready.eq(~stall),
+
+            stall.eq(s1_valid & ~self.out_ready),
+
+            self.out_valid.eq(s1_valid),
+            self.out_p_offset.eq(s1_p_offset),
+            self.out_r.eq(s1_r),
+            self.out_g.eq(s1_g),
+            self.out_b.eq(s1_b),
+            self.out_z.eq(s1_z),
+            self.out_texture_buffer.eq(s1_texture_buffer),
+            self.out_texture_enable.eq(s1_texture_enable),
+            self.out_depth.eq(s1_depth),
+        ]
+
+        return m
+
+
+class RasterizerFastClear(Component):
+    """
+    Keeps a bit for every 64 pixel block of the depth buffer in on-chip memory, set for blocks cleared to 0 that
+    weren't written to memory since, so clearing takes a write for every 32 blocks instead of writing the whole
+    buffer.
+
+    `clear` sets the bit of every block, it must only be set while idle. Depth reads go through `*_read_*`, which
+    outputs whether the pixel is in a cleared block. Depth writes go through `*_write_*` to a `WriteCombiner`, the
+    first one to a cleared block writes 0 to the whole block before it. Reads of a block filled since the writer was
+    last idle wait for it to be, so they never see the memory from before the fill.
+
+    `base` must be 128 byte aligned and the screen `width` a multiple of 64, so every block is in a single row.
+    """
+
+    clear: In(1)
+    idle: Out(1)
+    base: In(32)
+    writer_idle: In(1)
+
+    in_read_ready: Out(1)
+    in_read_valid: In(1)
+    in_read_p_offset: In(23)
+
+    out_read_ready: In(1)
+    out_read_valid: Out(1)
+    out_read_p_offset: Out(23)
+    out_read_cleared: Out(1)
+
+    in_write_ready: Out(1)
+    in_write_valid: In(1)
+    in_write_p_offset: In(23)
+    in_write_z: In(16)
+
+    out_write_ready: In(1)
+    out_write_valid: Out(1)
+    out_write_addr: Out(32)
+    out_write_data: Out(64)
+    out_write_strb: Out(8)
+
+    # `pending_fills` is how many blocks can be filled before waiting for the writer to be idle.
+    def __init__(self, *, max_height: int = 1080, pending_fills: int = 4):
+        self._max_height = max_height
+        self._pending_fills = pending_fills
+        super().__init__()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # 32 blocks per word, a word per 2048 pixels
+        words = self._max_height
+        mem = Memory(width=32, depth=words, name="fast_clear", attrs={"RAM_STYLE": "BLOCK"})
+        # Transparent, so both sides see a bit cleared by a fill right away
+        m.submodules.read_rp = read_rp = mem.read_port()
+        m.submodules.write_rp = write_rp = mem.read_port()
+        m.submodules.wp = wp = mem.write_port()
+
+        sweeping = Signal()
+        sweep_addr = Signal(range(words))
+
+        with m.If(self.clear):
+            m.d.sync += [
+                sweeping.eq(1),
+                sweep_addr.eq(0),
+            ]
+        with m.Elif(sweeping):
+            m.d.comb += [
+                wp.addr.eq(sweep_addr),
+                wp.data.eq(0xFFFF_FFFF),
+                wp.en.eq(1),
+            ]
+            m.d.sync += sweep_addr.eq(sweep_addr + 1)
+            with m.If(sweep_addr == words - 1):
+                m.d.sync += sweeping.eq(0)
+
+        # Blocks filled since the writer was last idle
+        pending_valid = Signal(self._pending_fills)
+        pending_block = Array(Signal(17, name=f"pending_block_{i}") for i in range(self._pending_fills))
+
+        # ================================
+
+        r_stall = Signal()
+        r_p_offset = Signal(23)
+        r_valid = Signal()
+
+        with m.If(~r_stall):
+            m.d.sync += [
+                r_p_offset.eq(self.in_read_p_offset),
+                r_valid.eq(self.in_read_valid & ~sweeping),
+            ]
+        m.d.comb += read_rp.addr.eq(Mux(r_stall, r_p_offset[11:], self.in_read_p_offset[11:]))
+
+        r_cleared = Signal()
+        r_wait = Signal()
+        m.d.comb += [
+            r_cleared.eq(read_rp.data.bit_select(r_p_offset[6:11], 1)),
+            r_wait.eq(~r_cleared & Cat(
+                pending_valid[i] & (pending_block[i] == r_p_offset[6:]) for i in range(self._pending_fills)
+            ).any()),
+
+            self.out_read_valid.eq(r_valid & ~r_wait),
+            self.out_read_p_offset.eq(r_p_offset),
+            self.out_read_cleared.eq(r_cleared),
+
+            r_stall.eq(r_valid & (r_wait | ~self.out_read_ready)),
+            self.in_read_ready.eq(~r_stall & ~sweeping),
+        ]
+
+        # ================================
+
+        w_stall = Signal()
+        w_p_offset = Signal(23)
+        w_z = Signal(16)
+        w_valid = Signal()
+
+        with m.If(~w_stall):
+            m.d.sync += [
+                w_p_offset.eq(self.in_write_p_offset),
+                w_z.eq(self.in_write_z),
+                w_valid.eq(self.in_write_valid & ~sweeping),
+            ]
+        m.d.comb += write_rp.addr.eq(Mux(w_stall, w_p_offset[11:], self.in_write_p_offset[11:]))
+
+        w_cleared = Signal()
+        fill_beat = Signal(4)
+        free_slot = Signal(range(self._pending_fills))
+        m.d.comb += w_cleared.eq(write_rp.data.bit_select(w_p_offset[6:11], 1))
+        for i in reversed(range(self._pending_fills)):
+            with m.If(~pending_valid[i]):
+                m.d.comb += free_slot.eq(i)
+
+        with m.If(w_valid & w_cleared):
+            # Whole words of 0 over the block, then the pixel once its bit is clear
+            m.d.comb += [
+                self.out_write_valid.eq(~pending_valid.all()),
+                self.out_write_addr.eq(self.base + Cat(C(0, 3), fill_beat, w_p_offset[6:])),
+                self.out_write_data.eq(0),
+                self.out_write_strb.eq(0xFF),
+                w_stall.eq(1),
+            ]
+            with m.If(self.out_write_valid & self.out_write_ready):
+                m.d.sync += fill_beat.eq(fill_beat + 1)
+                with m.If(fill_beat == 15):
+                    m.d.comb += [
+                        wp.addr.eq(w_p_offset[11:]),
+                        wp.data.eq(write_rp.data & ~(C(1, 32) << w_p_offset[6:11])),
+                        wp.en.eq(1),
+                    ]
+                    m.d.sync += [
+                        pending_valid.bit_select(free_slot, 1).eq(1),
+                        pending_block[free_slot].eq(w_p_offset[6:]),
+                    ]
+        with m.Else():
+            m.d.comb += [
+                self.out_write_valid.eq(w_valid),
+                self.out_write_addr.eq(self.base + w_p_offset * 2),
+                self.out_write_data.eq(w_z.replicate(4)),
+                self.out_write_strb.eq(0b11 << (w_p_offset[:2] * 2)),
+                w_stall.eq(w_valid & ~self.out_write_ready),
+            ]
+
+        with m.If(self.clear | (self.writer_idle & ~self.out_write_valid)):
+            m.d.sync += pending_valid.eq(0)
+
+        m.d.comb += [
+            self.in_write_ready.eq(~w_stall & ~sweeping),
+            self.idle.eq(~sweeping & ~r_valid & ~w_valid),
         ]
 
         return m
 
 
 class RasterizerDepthTester(Component):
+    """
+    Tests pixels against the depth read for them from `zst_*`, in order. Pixels that don't need the depth in memory
+    (`DepthFlags.no_test` or `DepthFunc.ALWAYS`) weren't sent to the reader, so they don't wait for it. Pixels that
+    pass are sent to `out_*` even with `DepthFlags.no_color`, `out_color_write` tells whether the color is drawn.
+    """
+
     idle: Out(1)
 
     in_ready: Out(1)
@@ -179,6 +711,7 @@ class RasterizerDepthTester(Component):
     in_z: In(16)
     in_texture_buffer: In(2)
     in_texture_enable: In(1)
+    in_depth: In(DepthFlags)
 
     out_ready: In(1)
     out_valid: Out(1)
@@ -189,6 +722,10 @@ class RasterizerDepthTester(Component):
     out_z: Out(16)
     out_texture_buffer: Out(2)
     out_texture_enable: Out(1)
+    # The depth of the pixel must be written
+    out_depth_write: Out(1)
+    # The color of the pixel must be written
+    out_color_write: Out(1)
 
     zst_ready: Out(1)
     zst_valid: In(1)
@@ -199,6 +736,9 @@ class RasterizerDepthTester(Component):
 
         stall = Signal()
 
+        in_read = Signal()
+        m.d.comb += in_read.eq(~self.in_depth.no_test & (self.in_depth.func != DepthFunc.ALWAYS.value))
+
         p_offset = Signal(23, reset_less=True)
         r = Signal(8, reset_less=True)
         g = Signal(8, reset_less=True)
@@ -207,11 +747,12 @@ class RasterizerDepthTester(Component):
         fetched_z = Signal(16, reset_less=True)
         texture_buffer = Signal(2)
         texture_enable = Signal()
+        depth = Signal(DepthFlags)
         valid_data = Signal()
 
         with m.If(~stall):
             m.d.comb += [
-                self.zst_ready.eq(self.in_valid),
+                self.zst_ready.eq(self.in_valid & in_read),
             ]
             m.d.sync += [
                 p_offset.eq(self.in_p_offset),
@@ -222,18 +763,19 @@ class RasterizerDepthTester(Component):
                 fetched_z.eq(self.zst_z),
                 texture_buffer.eq(self.in_texture_buffer),
                 texture_enable.eq(self.in_texture_enable),
-                valid_data.eq(self.zst_ready & self.zst_valid),
+                depth.eq(self.in_depth),
+                valid_data.eq(self.in_valid & (self.zst_valid | ~in_read)),
             ]
 
         valid = Signal()
         m.d.comb += [
-            valid.eq(valid_data & (fetched_z < z))
+            valid.eq(valid_data & (depth.no_test | DepthFunc.compare(depth.func, z, fetched_z)))
         ]
 
         m.d.comb += [
             self.idle.eq(~valid_data),
 
-            self.in_ready.eq(~stall & self.zst_valid),
+            self.in_ready.eq(~stall & (self.zst_valid | ~in_read)),
             stall.eq(valid & ~self.out_ready),
 
             self.out_valid.eq(valid),
@@ -245,12 +787,27 @@ class RasterizerDepthTester(Component):
             self.out_z.eq(z),
             self.out_texture_buffer.eq(texture_buffer),
             self.out_texture_enable.eq(texture_enable),
+            self.out_depth_write.eq(~depth.no_test & ~depth.no_write),
+            self.out_color_write.eq(~depth.no_color),
         ]
 
         return m
 
 
 class ZReader(Component):
+    """
+    Reads the depth of every pixel, through a 2-way set associative cache of `sets` 64-bit words.
+
+    Lookups happen in order, hits and reads of one of the last two words looked up don't go to memory. Words are
+    added to the cache when their read completes, replacing the least recently used way. Misses wait for the read
+    of an earlier miss in the same set to complete, so a word is never filled over the updates of an earlier fill.
+    Depth written to memory must also be sent to `write_*`, which updates the word if it's cached. `invalidate`
+    empties the cache, for when the depth buffer is written by something else.
+
+    Lookups with `in_cleared` set are of pixels known to have a depth of 0 (see `RasterizerFastClear`), they neither
+    go to memory nor use the cache.
+    """
+
     idle: Out(1)
 
     read_address: Out(SAxiHP.members["read_address"].signature)
@@ -259,14 +816,35 @@ class ZReader(Component):
     in_addr_ready: Out(1)
     in_addr_valid: In(1)
     in_addr: In(32)
+    in_cleared: In(1)
 
     out_z_ready: In(1)
     out_z_valid: Out(1)
     out_z: Out(16)
 
+    write_valid: In(1)
+    write_addr: In(32)
+    write_z: In(16)
+
+    invalidate: In(1)
+
+    # Strobes, for each lookup
+    hit: Out(1)
+    miss: Out(1)
+    evict: Out(1)
+
+    def __init__(self, sets: int = 64):
+        if sets < 2 or sets & (sets - 1):
+            raise ValueError(f"Set count must be a power of two, not {sets!r}")
+        self._sets = sets
+        super().__init__()
+
     def elaborate(self, platform):
         m = Module()
 
+        set_bits = log2_int(self._sets)
+        tag_bits = 29 - set_bits
+
         m.d.comb += [
             self.read_address.burst.eq(0b01),    # INCR
             self.read_address.size.eq(0b11),     # 8 bytes/beat
@@ -274,29 +852,84 @@ class ZReader(Component):
             self.read_address.cache.eq(0b1111),
         ]
 
+        tags = [Memory(width=tag_bits, depth=self._sets, name=f"tags_{i}") for i in range(2)]
+        words = [Memory(width=64, depth=self._sets, name=f"words_{i}", attrs={"RAM_STYLE": "BLOCK"})
+                 for i in range(2)]
+        valid = [Signal(self._sets, name=f"valid_{i}") for i in range(2)]
+        lru = Signal(self._sets)
+
+        w_set = Signal(set_bits)
+        w_tag = Signal(tag_bits)
+        w_offset = Signal(2)
+        w_z = Signal(16)
+        w_valid = Signal()
+
         stall_c0 = Signal()
         stall_c1 = Signal()
         stall_c2 = Signal()
 
+        # Last two different words looked up, pixels of quads alternate between the words of two rows
         last_addr = Signal(32, reset=1)
+        prev_addr = Signal(32, reset=1)
+
+        # Sets with a read in flight
+        pending = Signal(self._sets)
 
         in_addr_word = Signal(32)
         m.d.comb += in_addr_word.eq(Cat(C(0, 3), self.in_addr[3:]))
 
         c0_addr = Signal(32)
         c0_offset = Signal(2)
+        c0_cleared = Signal()
         c0_valid = Signal()
 
         with m.If(~stall_c0):
             m.d.sync += [
                 c0_addr.eq(in_addr_word),
                 c0_offset.eq(self.in_addr[1:3]),
+                c0_cleared.eq(self.in_cleared),
                 c0_valid.eq(self.in_addr_valid),
             ]
 
+        c0_set = Signal(set_bits)
+        c0_tag = Signal(tag_bits)
+        m.d.comb += Cat(c0_set, c0_tag).eq(c0_addr[3:])
+
+        # Lookups read the set of the pixel in c0 while it's stalled, so fills and writes made meanwhile are seen
+        c0_tags = []
+        c0_words = []
+        for i in range(2):
+            m.submodules[f"tags_read_{i}"] = tags_read = tags[i].read_port()
+            m.submodules[f"words_read_{i}"] = words_read = words[i].read_port()
+            m.d.comb += [
+                tags_read.addr.eq(Mux(stall_c0, c0_set, in_addr_word[3:])),
+                words_read.addr.eq(Mux(stall_c0, c0_set, in_addr_word[3:])),
+            ]
+            c0_tags.append(tags_read.data)
+            c0_words.append(words_read.data)
+
+        c0_way_hit = Signal(2)
+        c0_victim = Signal()
+        c0_miss = Signal()
+        c0_conflict = Signal()
+        m.d.comb += [
+            c0_way_hit.eq(Cat(valid[i].bit_select(c0_set, 1) & (c0_tags[i] == c0_tag) for i in range(2))),
+            c0_miss.eq(c0_valid & ~c0_cleared & ~c0_way_hit.any() & (c0_addr != last_addr) & (c0_addr != prev_addr)),
+            c0_conflict.eq(c0_miss & pending.bit_select(c0_set, 1)),
+            c0_victim.eq(Mux(
+                valid[0].bit_select(c0_set, 1),
+                Mux(valid[1].bit_select(c0_set, 1), lru.bit_select(c0_set, 1), 1),
+                0,
+            )),
+        ]
+
         c1_addr = Signal(32)
         c1_offset = Signal(2)
         c1_same_addr = Signal()
+        c1_same_prev = Signal()
+        c1_hit = Signal()
+        c1_way = Signal()
+        c1_word = Signal(64)
         c1_valid = Signal()
 
         with m.If(~stall_c1):
@@ -304,68 +937,200 @@ class ZReader(Component):
                 c1_addr.eq(c0_addr),
                 c1_offset.eq(c0_offset),
                 c1_same_addr.eq(c0_addr == last_addr),
-                c1_valid.eq(c0_valid),
+                c1_same_prev.eq(c0_addr == prev_addr),
+                # Cleared words are zero without being cached
+                c1_hit.eq(c0_way_hit.any() | c0_cleared),
+                c1_way.eq(Mux(c0_way_hit.any(), c0_way_hit[1], c0_victim)),
+                c1_word.eq(Mux(c0_cleared, 0, Mux(c0_way_hit[1], c0_words[1], c0_words[0]))),
+                c1_valid.eq(c0_valid & ~c0_conflict),
             ]
-            with m.If(c0_valid):
-                m.d.sync += last_addr.eq(c0_addr)
+            with m.If(c0_valid & ~c0_conflict & (c0_addr != last_addr)):
+                m.d.sync += [
+                    last_addr.eq(c0_addr),
+                    prev_addr.eq(last_addr),
+                ]
+            with m.If(c0_miss & ~c0_conflict):
+                m.d.sync += pending.bit_select(c0_set, 1).eq(1)
+            with m.If(c0_valid & ~c0_conflict & ~c0_cleared):
+                # The word before the last one can still be waiting for its read, leave the set alone then
+                with m.If(c0_way_hit.any() | c0_miss):
+                    m.d.sync += lru.bit_select(c0_set, 1).eq(~Mux(c0_way_hit.any(), c0_way_hit[1], c0_victim))
+                # Reads of the same word as the previous pixel don't count, the word before it is a hit
+                with m.If(c0_addr != last_addr):
+                    m.d.comb += [
+                        self.hit.eq(~c0_miss),
+                        self.miss.eq(c0_miss),
+                        self.evict.eq(c0_miss & Mux(c0_victim, valid[1], valid[0]).bit_select(c0_set, 1)),
+                    ]
 
         # TODO: replace this dirty hack with a proper skid buffer
-        fifo_input = Cat(c1_addr, c1_offset, c1_same_addr)
+        fifo_input = Cat(c1_addr, c1_offset, c1_same_addr, c1_same_prev, c1_hit, c1_way, c1_word)
         m.submodules.c1c2_fifo = c1c2_fifo = SyncFIFOBuffered(width=len(fifo_input), depth=2)
 
         c1c2_addr = Signal(32)
         c1c2_offset = Signal(2)
         c1c2_same_addr = Signal()
+        c1c2_same_prev = Signal()
+        c1c2_hit = Signal()
+        c1c2_way = Signal()
+        c1c2_word = Signal(64)
         c1c2_valid = Signal()
 
         m.d.comb += [
             c1c2_fifo.w_data.eq(fifo_input),
             c1c2_fifo.w_en.eq(c1_valid),
 
-            Cat(c1c2_addr, c1c2_offset, c1c2_same_addr).eq(c1c2_fifo.r_data),
+            Cat(c1c2_addr, c1c2_offset, c1c2_same_addr, c1c2_same_prev, c1c2_hit, c1c2_way, c1c2_word).eq(
+                c1c2_fifo.r_data
+            ),
             c1c2_fifo.r_en.eq(~stall_c2),
             c1c2_valid.eq(c1c2_fifo.r_rdy),
         ]
 
-        m.submodules.load_queue = load_queue = SyncFIFOBuffered(width=3, depth=64)
+        load_input = Cat(c1c2_same_addr, c1c2_same_prev, c1c2_hit, c1c2_offset, c1c2_way, c1c2_addr[3:], c1c2_word)
+        m.submodules.load_queue = load_queue = SyncFIFOBuffered(width=len(load_input), depth=64)
 
         with m.If(~stall_c2):
             m.d.comb += [
-                self.read_address.valid.eq(c1c2_valid & ~c1c2_same_addr),
+                self.read_address.valid.eq(c1c2_valid & ~c1c2_same_addr & ~c1c2_same_prev & ~c1c2_hit),
                 self.read_address.addr.eq(c1c2_addr),
                 load_queue.w_en.eq(c1c2_valid),
-                load_queue.w_data.eq(Cat(c1c2_same_addr, c1c2_offset)),
+                load_queue.w_data.eq(load_input),
             ]
 
         m.d.comb += [
-            self.idle.eq(~c0_valid & ~c1_valid & ~load_queue.r_rdy),
+            self.idle.eq(~c0_valid & ~c1_valid & (c1c2_fifo.level == 0) & (load_queue.level == 0) & ~w_valid),
             self.in_addr_ready.eq(~stall_c0),
-            stall_c0.eq(c0_valid & stall_c1),
+            stall_c0.eq(c0_valid & (stall_c1 | c0_conflict)),
             stall_c1.eq(c1_valid & ~c1c2_fifo.w_rdy),
             stall_c2.eq(~load_queue.w_rdy | ~self.read_address.ready),
         ]
 
         # ================================
 
+        # Updates of cached words take a cycle to look up the tag, reads that fill the same way wait for them since
+        # both write the same port.
+
+        m.d.sync += [
+            Cat(w_offset, w_set, w_tag).eq(self.write_addr[1:]),
+            w_z.eq(self.write_z),
+            w_valid.eq(self.write_valid & ~self.invalidate),
+        ]
+
+        w_match = Signal(2)
+
         last_word = Signal(64)
+        prev_word = Signal(64)
 
         load_same_addr = Signal()
+        load_same_prev = Signal()
+        load_hit = Signal()
         load_offset = Signal(2)
+        load_way = Signal()
+        load_set = Signal(set_bits)
+        load_tag = Signal(tag_bits)
+        load_word = Signal(64)
         m.d.comb += [
-            Cat(load_same_addr, load_offset).eq(load_queue.r_data),
+            Cat(load_same_addr, load_same_prev, load_hit, load_offset, load_way, load_set, load_tag, load_word).eq(
+                load_queue.r_data
+            ),
 
-            self.read.ready.eq((load_queue.r_rdy & ~load_same_addr) & self.out_z_ready),
+            self.read.ready.eq(
+                (load_queue.r_rdy & ~load_same_addr & ~load_same_prev & ~load_hit) & self.out_z_ready &
+                ~w_match.bit_select(load_way, 1)
+            ),
             load_queue.r_en.eq(self.out_z_ready & self.out_z_valid),
+        ]
 
-            self.out_z.eq(Mux(
-                load_same_addr,
-                last_word.word_select(load_offset, 16),
-                self.read.data.word_select(load_offset, 16),
+        word = Signal(64)
+        with m.If(load_same_addr):
+            m.d.comb += word.eq(last_word)
+        with m.Elif(load_same_prev):
+            m.d.comb += word.eq(prev_word)
+        with m.Elif(load_hit):
+            m.d.comb += word.eq(load_word)
+        with m.Else():
+            m.d.comb += word.eq(self.read.data)
+
+        m.d.comb += [
+            self.out_z.eq(word.word_select(load_offset, 16)),
+            self.out_z_valid.eq(load_queue.r_rdy & (
+                load_same_addr | load_same_prev | load_hit | (self.read.valid & ~w_match.bit_select(load_way, 1))
             )),
-            self.out_z_valid.eq(load_queue.r_rdy & (self.read.valid | load_same_addr)),
         ]
+        # The last two words stand in for the cache, so they're updated by writes as well
+        last_word_addr = Signal(29)
+        prev_word_addr = Signal.like(last_word_addr)
+        next_last_word = Signal.like(last_word)
+        next_prev_word = Signal.like(prev_word)
+        next_last_word_addr = Signal.like(last_word_addr)
+        next_prev_word_addr = Signal.like(prev_word_addr)
+        m.d.comb += [
+            next_last_word.eq(last_word),
+            next_prev_word.eq(prev_word),
+            next_last_word_addr.eq(last_word_addr),
+            next_prev_word_addr.eq(prev_word_addr),
+        ]
+        with m.If(load_queue.r_en & ~load_same_addr):
+            m.d.comb += [
+                next_last_word.eq(word),
+                next_prev_word.eq(last_word),
+                next_last_word_addr.eq(Cat(load_set, load_tag)),
+                next_prev_word_addr.eq(last_word_addr),
+            ]
+        with m.If(w_valid):
+            with m.If(next_last_word_addr == Cat(w_set, w_tag)):
+                m.d.comb += next_last_word.word_select(w_offset, 16).eq(w_z)
+            with m.If(next_prev_word_addr == Cat(w_set, w_tag)):
+                m.d.comb += next_prev_word.word_select(w_offset, 16).eq(w_z)
+        m.d.sync += [
+            last_word.eq(next_last_word),
+            prev_word.eq(next_prev_word),
+            last_word_addr.eq(next_last_word_addr),
+            prev_word_addr.eq(next_prev_word_addr),
+        ]
+
         with m.If(self.read.ready & self.read.valid):
-            m.d.sync += last_word.eq(self.read.data)
+            m.d.sync += pending.bit_select(load_set, 1).eq(0)
+
+        fill = Signal()
+        m.d.comb += fill.eq(self.read.ready & self.read.valid & ~self.invalidate)
+
+        for i in range(2):
+            m.submodules[f"tags_check_{i}"] = tags_check = tags[i].read_port()
+            m.submodules[f"tags_write_{i}"] = tags_write = tags[i].write_port()
+            m.submodules[f"words_write_{i}"] = words_write = words[i].write_port(granularity=16)
+
+            m.d.comb += [
+                tags_check.addr.eq(self.write_addr[3:]),
+
+                tags_write.addr.eq(load_set),
+                tags_write.data.eq(load_tag),
+                tags_write.en.eq(fill & (load_way == i)),
+
+                w_match[i].eq(w_valid & valid[i].bit_select(w_set, 1) & (tags_check.data == w_tag)),
+            ]
+            with m.If(fill & (load_way == i)):
+                m.d.comb += [
+                    words_write.addr.eq(load_set),
+                    words_write.data.eq(self.read.data),
+                    words_write.en.eq(0b1111),
+                ]
+                m.d.sync += valid[i].bit_select(load_set, 1).eq(1)
+            with m.Elif(w_match[i]):
+                m.d.comb += [
+                    words_write.addr.eq(w_set),
+                    words_write.data.eq(w_z.replicate(4)),
+                    words_write.en.eq(C(1, 4) << w_offset),
+                ]
+
+        with m.If(self.invalidate):
+            m.d.sync += [
+                valid[0].eq(0),
+                valid[1].eq(0),
+                last_addr.eq(last_addr.reset),
+                prev_addr.eq(prev_addr.reset),
+            ]
 
         return m
 
@@ -394,7 +1159,11 @@ class RasterizerTextureMapper(Component):
     def elaborate(self, platform):
         m = Module()
 
-        stall = Signal()
+        # The texture buffer read pipeline can't be stalled, so s0/s1 always advance and results go into a
+        # queue with room for everything in flight.
+        m.submodules.out_fifo = out_fifo = SyncFIFOBuffered(width=23 + 24, depth=4)
+
+        accept = Signal()
 
         s0_p_offset = Signal(23)
         s0_r = Signal(8)
@@ -410,15 +1179,14 @@ class RasterizerTextureMapper(Component):
             self.texture_read.t.eq(self.in_g[1:]),
         ]
 
-        with m.If(~stall):
-            m.d.sync += [
-                s0_p_offset.eq(self.in_p_offset),
-                s0_r.eq(self.in_r),
-                s0_g.eq(self.in_g),
-                s0_b.eq(self.in_b),
-                s0_texture_enable.eq(self.in_texture_enable),
-                s0_valid.eq(self.in_valid),
-            ]
+        m.d.sync += [
+            s0_p_offset.eq(self.in_p_offset),
+            s0_r.eq(self.in_r),
+            s0_g.eq(self.in_g),
+            s0_b.eq(self.in_b),
+            s0_texture_enable.eq(self.in_texture_enable),
+            s0_valid.eq(accept),
+        ]
 
         s1_p_offset = Signal(23)
         s1_r = Signal(8)
@@ -427,27 +1195,32 @@ class RasterizerTextureMapper(Component):
         s1_texture_enable = Signal()
         s1_valid = Signal()
 
-        with m.If(~stall):
-            m.d.sync += [
-                s1_p_offset.eq(s0_p_offset),
-                s1_r.eq(s0_r),
-                s1_g.eq(s0_g),
-                s1_b.eq(s0_b),
-                s1_texture_enable.eq(s0_texture_enable),
-                s1_valid.eq(s0_valid),
-            ]
+        m.d.sync += [
+            s1_p_offset.eq(s0_p_offset),
+            s1_r.eq(s0_r),
+            s1_g.eq(s0_g),
+            s1_b.eq(s0_b),
+            s1_texture_enable.eq(s0_texture_enable),
+            s1_valid.eq(s0_valid),
+        ]
 
         m.d.comb += [
-            self.idle.eq(~s0_valid & ~s1_valid),
+            self.idle.eq(~s0_valid & ~s1_valid & ~out_fifo.r_rdy),
 
-            self.in_ready.eq(~stall),
-            stall.eq((s0_valid | s1_valid) & ~self.out_ready),
+            self.in_ready.eq(out_fifo.level + s0_valid + s1_valid < out_fifo.depth),
+            accept.eq(self.in_valid & self.in_ready),
 
-            self.out_valid.eq(s1_valid),
-            self.out_p_offset.eq(s1_p_offset),
-            self.out_r.eq(Mux(s1_texture_enable, self.texture_read.color[0:8], s1_r)),
-            self.out_g.eq(Mux(s1_texture_enable, self.texture_read.color[8:16], s1_g)),
-            self.out_b.eq(Mux(s1_texture_enable, self.texture_read.color[16:24], s1_b)),
+            out_fifo.w_en.eq(s1_valid),
+            out_fifo.w_data.eq(Cat(
+                s1_p_offset,
+                Mux(s1_texture_enable, self.texture_read.color[0:8], s1_r),
+                Mux(s1_texture_enable, self.texture_read.color[8:16], s1_g),
+                Mux(s1_texture_enable, self.texture_read.color[16:24], s1_b),
+            )),
+
+            self.out_valid.eq(out_fifo.r_rdy),
+            out_fifo.r_en.eq(self.out_ready),
+            Cat(self.out_p_offset, self.out_r, self.out_g, self.out_b).eq(out_fifo.r_data),
         ]
 
         return m
@@ -457,6 +1230,8 @@ class RasterizerWriter(Component):
     fb_base: In(32)
 
     idle: Out(1)
+    # Nothing else will be written for now
+    flush: In(1)
 
     ready: Out(1)
     valid: In(1)
@@ -467,10 +1242,14 @@ class RasterizerWriter(Component):
 
     axi: Out(SAxiHP)
 
+    def __init__(self, pixel_format: PixelFormat = PixelFormat.RGB888):
+        self._pixel_format = pixel_format
+        super().__init__()
+
     def elaborate(self, platform):
         m = Module()
 
-        m.submodules.writer = writer = PixelWriter()
+        m.submodules.writer = writer = CoalescingPixelWriter(self._pixel_format.bytes_per_pixel)
         m.d.comb += self.axi.aclk.eq(ClockSignal())
         wiring.connect(m, wiring.flipped(self.axi.write_address), writer.axi_addr)
         wiring.connect(m, wiring.flipped(self.axi.write_data), writer.axi_data)
@@ -486,7 +1265,7 @@ class RasterizerWriter(Component):
 
         with m.If(~s0_stall):
             m.d.sync += [
-                s0_addr.eq(self.fb_base + self.p_offset * 3),
+                s0_addr.eq(self.fb_base + self.p_offset * self._pixel_format.bytes_per_pixel),
                 s0_r.eq(self.r),
                 s0_g.eq(self.g),
                 s0_b.eq(self.b),
@@ -494,13 +1273,16 @@ class RasterizerWriter(Component):
             ]
 
         m.d.comb += [
-            writer.pixel_data.eq(Cat(s0_b, s0_g, s0_r)),
+            writer.pixel_data.eq(self._pixel_format.pack(s0_r, s0_g, s0_b)),
             writer.pixel_addr.eq(s0_addr),
             writer.pixel_valid.eq(s0_valid),
+            writer.flush.eq(self.flush & ~s0_valid),
         ]
 
         m.d.comb += [
-            self.idle.eq(~s0_valid & writer.pixel_ready),
+            # Not `pixel_ready`, which follows the AXI ready signals and those might never be high while nothing is
+            # being written, such as when the port is shared.
+            self.idle.eq(~s0_valid & writer.idle),
             self.ready.eq(~s0_stall),
             s0_stall.eq(s0_valid & ~writer.pixel_ready),
         ]
@@ -515,26 +1297,97 @@ class Rasterizer(Component):
     width: In(12)
     z_base: In(32)
     fb_base: In(32)
+    # Only pixels inside this inclusive rectangle are drawn
+    scissor_min: In(Point)
+    scissor_max: In(Point)
+    # Held while the depth buffer is written by something else, for `hierarchical_z` and the depth cache
+    depth_invalidate: In(1)
+    # Pulsed while idle to clear the depth buffer to 0 with `fast_clear`
+    depth_fast_clear: In(1)
 
     perf_counters: Out(PerfCounters)
 
     triangles: In(TriangleStream)
     texture_read: Out(TextureBufferRead)
 
+    # With `plane_interpolation`, attributes are interpolated by the edge walker from plane equations computed
+    # once per triangle, instead of from the barycentric weights of every pixel.
+    #
+    # With `prenormalize`, the edge walker outputs weights that are already scaled by 1/area instead of
+    # multiplying them for every pixel.
+    #
+    # With `quad`, the edge walker tests 2x2 blocks of pixels every cycle, and only the covered pixels of each
+    # block are sent down the pipeline. Implies `prenormalize`.
+    #
+    # With `interleave`, only the rows (or rows of quads) whose index modulo `interleave` is `phase` are drawn, for
+    # running that many rasterizers in parallel.
+    #
+    # With `hierarchical_z`, pixels behind every pixel of their 8x8 tile are rejected before their depth is read,
+    # for screens up to `max_height` pixels high.
+    #
+    # Depth is read through a cache of `depth_cache_sets` sets of 2 words.
+    #
+    # With `fast_clear`, `depth_fast_clear` marks every block of 64 pixels of the depth buffer as cleared in on-chip
+    # memory instead of writing it, for screens up to `max_height` pixels high and with a width multiple of 64.
+    #
+    # Pixels are written to the framebuffer in `pixel_format`.
+    def __init__(self, *, plane_interpolation: bool = False, prenormalize: bool = False, quad: bool = False,
+                 interleave: int = 1, phase: int = 0, hierarchical_z: bool = False, max_height: int = 1080,
+                 depth_cache_sets: int = 64, fast_clear: bool = False,
+                 pixel_format: PixelFormat = PixelFormat.RGB888):
+        if plane_interpolation and quad:
+            raise ValueError("Plane interpolation is not supported with quads")
+        self._plane_interpolation = plane_interpolation
+        self._prenormalize = prenormalize
+        self._quad = quad
+        self._interleave = interleave
+        self._phase = phase
+        self._hierarchical_z = hierarchical_z
+        self._max_height = max_height
+        self._depth_cache_sets = depth_cache_sets
+        self._fast_clear = fast_clear
+        self._pixel_format = pixel_format
+        super().__init__()
+
     def elaborate(self, platform):
         m = Module()
 
-        m.submodules.walker = walker = EdgeWalker()
-        m.submodules.interpolator = interpolator = RasterizerInterpolator()
-        m.submodules.z_reader = z_reader = ZReader()
+        if self._plane_interpolation:
+            m.submodules.walker = walker = EdgeWalker(False, pipelined_recip=True, attributes=4, clip=True,
+                                                      interleave=self._interleave, phase=self._phase,
+                                                      small_triangles=True)
+            m.submodules.interpolator = interpolator = RasterizerPlaneInterpolator()
+        elif self._quad:
+            m.submodules.walker = walker = EdgeWalker(pipelined_recip=True, prenormalize=True, quad=True, clip=True,
+                                                      interleave=self._interleave, phase=self._phase,
+                                                      small_triangles=True)
+            m.submodules.interpolator = interpolator = RasterizerInterpolator()
+        else:
+            m.submodules.walker = walker = EdgeWalker(use_fifo=True, pipelined_recip=True,
+                                                      prenormalize=self._prenormalize, clip=True,
+                                                      interleave=self._interleave, phase=self._phase,
+                                                      small_triangles=True)
+            m.submodules.interpolator = interpolator = RasterizerInterpolator()
+        m.submodules.z_reader = z_reader = ZReader(self._depth_cache_sets)
         m.submodules.depth_tester = depth_tester = RasterizerDepthTester()
+        m.submodules.depth_writer = depth_writer = WriteCombiner()
         m.submodules.texture_mapper = texture_mapper = RasterizerTextureMapper()
-        m.submodules.writer = writer = RasterizerWriter()
+        m.submodules.writer = writer = RasterizerWriter(self._pixel_format)
+
+        if self._quad:
+            m.submodules.quad_serializer = quad_serializer = QuadSerializer()
+            wiring.connect(m, walker.quads, quad_serializer.quads)
+            m.d.comb += walker.quads_pending.eq(quad_serializer.points.valid)
+            points = quad_serializer.points
+        else:
+            points = walker.points
 
         m.d.sync += self.perf_counters.busy.eq(~self.idle)
         m.d.comb += self.axi2.aclk.eq(ClockSignal())
 
         fifo_empty = Signal()
+        hiz_idle = Signal(reset=1)
+        fast_clear_idle = Signal(reset=1)
         tx_wr_fifo_empty = Signal()
         m.d.comb += [
             interpolator.width.eq(self.width),
@@ -543,18 +1396,25 @@ class Rasterizer(Component):
         wiring.connect(m, wiring.flipped(self.axi), writer.axi)
         wiring.connect(m, wiring.flipped(self.axi2.read_address), z_reader.read_address)
         wiring.connect(m, wiring.flipped(self.axi2.read), z_reader.read)
+        wiring.connect(m, wiring.flipped(self.axi2.write_address), depth_writer.write_address)
+        wiring.connect(m, wiring.flipped(self.axi2.write_data), depth_writer.write_data)
+        wiring.connect(m, wiring.flipped(self.axi2.write_response), depth_writer.write_response)
         wiring.connect(m, wiring.flipped(self.texture_read), texture_mapper.texture_read)
 
         idle0 = Signal()
-        m.d.sync += idle0.eq(walker.idle & interpolator.idle & fifo_empty)
+        m.d.sync += idle0.eq(walker.idle & ~points.valid & interpolator.idle & hiz_idle & fifo_empty)
         idle1 = Signal()
-        m.d.sync += idle1.eq(z_reader.idle & depth_tester.idle & texture_mapper.idle & tx_wr_fifo_empty & writer.idle)
+        m.d.sync += idle1.eq(z_reader.idle & depth_tester.idle & depth_writer.idle & texture_mapper.idle &
+                             tx_wr_fifo_empty & writer.idle & fast_clear_idle)
         idle_ctr = Signal(4)
-        with m.If(idle0 & idle1):
+        # An offered triangle drops idle right away and restarts the count, idle0 only sees it a few cycles later
+        with m.If(idle0 & idle1 & ~self.triangles.valid):
             m.d.sync += idle_ctr.eq(Mux(idle_ctr == 15, 15, idle_ctr + 1))
         with m.Else():
             m.d.sync += idle_ctr.eq(0)
-        m.d.sync += self.idle.eq(idle_ctr == 15)
+        idle = Signal()
+        m.d.sync += idle.eq((idle_ctr == 15) & ~self.triangles.valid)
+        m.d.comb += self.idle.eq(idle & ~self.triangles.valid)
 
         for vertex_idx in range(3):
             walker_vertex = getattr(walker.triangle.payload, f"v{vertex_idx}")
@@ -565,31 +1425,96 @@ class Rasterizer(Component):
         m.d.comb += [
             self.triangles.ready.eq(walker.triangle.ready),
             walker.triangle.valid.eq(self.triangles.valid),
+            walker.clip_min.eq(self.scissor_min),
+            walker.clip_max.eq(self.scissor_max),
         ]
+        # The walker sets up the next triangle while the current one is walked, so keep attributes for both,
+        # indexed by the tag of each point. Culled triangles leave their tag to the next one, which overwrites them.
+        attrs = Array(Signal(StructLayout({
+            "r": ArrayLayout(8, 3),
+            "g": ArrayLayout(8, 3),
+            "b": ArrayLayout(8, 3),
+            "z": ArrayLayout(16, 3),
+            "texture_buffer": interpolator.texture_buffer.shape(),
+            "texture_enable": interpolator.texture_enable.shape(),
+            "depth": DepthFlags,
+        }), name=f"attrs_{i}") for i in range(2))
+
         with m.If(self.triangles.ready & self.triangles.valid):
             for vertex_idx in range(3):
                 input_vertex = getattr(self.triangles.payload, f"v{vertex_idx}")
                 for sig in "rgbz":
-                    m.d.sync += getattr(interpolator, sig)[vertex_idx].eq(getattr(input_vertex, sig))
+                    m.d.sync += getattr(attrs[walker.tag], sig)[vertex_idx].eq(getattr(input_vertex, sig))
             m.d.sync += [
-                interpolator.texture_buffer.eq(self.triangles.payload.texture_buffer),
-                interpolator.texture_enable.eq(self.triangles.payload.texture_enable),
+                attrs[walker.tag].texture_buffer.eq(self.triangles.payload.texture_buffer),
+                attrs[walker.tag].texture_enable.eq(self.triangles.payload.texture_enable),
+                attrs[walker.tag].depth.eq(self.triangles.payload.depth),
             ]
 
+        point_attrs = attrs[points.payload.tag]
+        m.d.comb += [
+            interpolator.texture_buffer.eq(point_attrs.texture_buffer),
+            interpolator.texture_enable.eq(point_attrs.texture_enable),
+            interpolator.depth.eq(point_attrs.depth),
+        ]
+
         m.d.sync += [
-            self.perf_counters.stalls.walker_searching.eq(~walker.idle & ~walker.points.valid & walker.points.ready),
+            self.perf_counters.stalls.walker_searching.eq(~walker.idle & ~points.valid & points.ready),
         ]
         m.d.comb += [
-            walker.points.ready.eq(interpolator.in_ready),
-            interpolator.in_valid.eq(walker.points.valid),
+            points.ready.eq(interpolator.in_ready),
+            interpolator.in_valid.eq(points.valid),
 
-            interpolator.in_p.eq(walker.points.payload.p),
-            interpolator.in_ws[0].eq(walker.points.payload.w0),
-            interpolator.in_ws[1].eq(walker.points.payload.w1),
-            interpolator.in_ws[2].eq(walker.points.payload.w2),
+            interpolator.in_p.eq(points.payload.p),
         ]
 
-        m.submodules.fifo = fifo = SyncFIFOBuffered(width=23 + 3 * 8 + 16 + 3, depth=64)
+        if self._plane_interpolation:
+            for vertex_idx in range(3):
+                input_vertex = getattr(self.triangles.payload, f"v{vertex_idx}")
+                for attr_idx, sig in enumerate("rgbz"):
+                    m.d.comb += walker.attributes[attr_idx][vertex_idx].eq(getattr(input_vertex, sig))
+            m.d.comb += [
+                interpolator.in_r.eq(walker.point_attributes[0]),
+                interpolator.in_g.eq(walker.point_attributes[1]),
+                interpolator.in_b.eq(walker.point_attributes[2]),
+                interpolator.in_z.eq(walker.point_attributes[3]),
+            ]
+        else:
+            m.d.comb += [
+                interpolator.r.eq(point_attrs.r),
+                interpolator.g.eq(point_attrs.g),
+                interpolator.b.eq(point_attrs.b),
+                interpolator.z.eq(point_attrs.z),
+
+                interpolator.in_ws[0].eq(points.payload.w0),
+                interpolator.in_ws[1].eq(points.payload.w1),
+                interpolator.in_ws[2].eq(points.payload.w2),
+            ]
+
+        if self._hierarchical_z:
+            m.submodules.hiz = hiz = RasterizerHierarchicalZ(max_height=self._max_height, interleave=self._interleave,
+                                                             phase=self._phase, quad=self._quad)
+            m.d.comb += [
+                hiz.invalidate.eq(self.depth_invalidate | self.depth_fast_clear),
+                hiz_idle.eq(hiz.idle),
+
+                interpolator.out_ready.eq(hiz.in_ready),
+                hiz.in_valid.eq(interpolator.out_valid),
+                hiz.in_p.eq(interpolator.out_p),
+                hiz.in_p_offset.eq(interpolator.out_p_offset),
+                hiz.in_r.eq(interpolator.out_r),
+                hiz.in_g.eq(interpolator.out_g),
+                hiz.in_b.eq(interpolator.out_b),
+                hiz.in_z.eq(interpolator.out_z),
+                hiz.in_texture_buffer.eq(interpolator.out_texture_buffer),
+                hiz.in_texture_enable.eq(interpolator.out_texture_enable),
+                hiz.in_depth.eq(interpolator.out_depth),
+            ]
+            fragments = hiz
+        else:
+            fragments = interpolator
+
+        m.submodules.fifo = fifo = SyncFIFOBuffered(width=23 + 3 * 8 + 16 + 3 + DepthFlags.size, depth=64)
         m.d.comb += fifo_empty.eq(~fifo.r_rdy)
 
         assert self.perf_counters.depth_fifo_bucket.shape() == fifo.level[3:].shape(), \
@@ -601,27 +1526,63 @@ class Rasterizer(Component):
         accept_interp = Signal()
 
         m.d.sync += [
-            self.perf_counters.stalls.depth_load_addr.eq(interpolator.out_valid & ~z_reader.in_addr_ready),
-            self.perf_counters.stalls.depth_fifo.eq(interpolator.out_valid & ~fifo.r_rdy),
+            self.perf_counters.stalls.depth_load_addr.eq(fragments.out_valid & ~z_reader.in_addr_ready),
+            self.perf_counters.stalls.depth_fifo.eq(fragments.out_valid & ~fifo.r_rdy),
             self.perf_counters.stalls.depth_load_data.eq(z_reader.read.ready & ~z_reader.read.valid),
+
+            self.perf_counters.depth_cache.hit.eq(z_reader.hit),
+            self.perf_counters.depth_cache.miss.eq(z_reader.miss),
+            self.perf_counters.depth_cache.evict.eq(z_reader.evict),
         ]
+        m.d.comb += z_reader.invalidate.eq(self.depth_invalidate | self.depth_fast_clear)
+
+        # Pixels that pass regardless of the depth in memory skip the reader, the tester knows not to wait for them
+        depth_read = Signal()
+        m.d.comb += depth_read.eq(
+            ~fragments.out_depth.no_test & (fragments.out_depth.func != DepthFunc.ALWAYS.value)
+        )
+
+        if self._fast_clear:
+            m.submodules.fast_clear = fast_clear = RasterizerFastClear(max_height=self._max_height)
+            m.d.comb += [
+                fast_clear.clear.eq(self.depth_fast_clear),
+                fast_clear.base.eq(self.z_base),
+                fast_clear.writer_idle.eq(depth_writer.idle),
+                fast_clear_idle.eq(fast_clear.idle),
+
+                # Depth of fragments is looked up a cycle after they're queued, the FIFO keeps them in order
+                fast_clear.in_read_valid.eq(fragments.out_valid & fifo.w_rdy & depth_read),
+                fast_clear.in_read_p_offset.eq(fragments.out_p_offset),
+
+                fast_clear.out_read_ready.eq(z_reader.in_addr_ready),
+                z_reader.in_addr_valid.eq(fast_clear.out_read_valid),
+                z_reader.in_addr.eq(self.z_base + fast_clear.out_read_p_offset*2),
+                z_reader.in_cleared.eq(fast_clear.out_read_cleared),
+            ]
+            depth_read_ready = fast_clear.in_read_ready | ~depth_read
+        else:
+            m.d.comb += [
+                z_reader.in_addr_valid.eq(fragments.out_valid & fifo.w_rdy & depth_read),
+                z_reader.in_addr.eq(self.z_base + fragments.out_p_offset*2),
+            ]
+            depth_read_ready = z_reader.in_addr_ready | ~depth_read
+
         m.d.comb += [
-            accept_interp.eq(fifo.w_rdy & z_reader.in_addr_ready),
-            z_reader.in_addr.eq(self.z_base + interpolator.out_p_offset*2),
+            accept_interp.eq(fifo.w_rdy & depth_read_ready),
 
-            interpolator.out_ready.eq(accept_interp),
+            fragments.out_ready.eq(accept_interp),
 
-            fifo.w_en.eq(interpolator.out_valid & z_reader.in_addr_ready),
-            z_reader.in_addr_valid.eq(interpolator.out_valid & fifo.w_rdy),
+            fifo.w_en.eq(fragments.out_valid & depth_read_ready),
 
             fifo.w_data.eq(Cat(
-                interpolator.out_b,
-                interpolator.out_g,
-                interpolator.out_r,
-                interpolator.out_z,
-                interpolator.out_p_offset,
-                interpolator.out_texture_buffer,
-                interpolator.out_texture_enable,
+                fragments.out_b,
+                fragments.out_g,
+                fragments.out_r,
+                fragments.out_z,
+                fragments.out_p_offset,
+                fragments.out_texture_buffer,
+                fragments.out_texture_enable,
+                fragments.out_depth,
             ))
         ]
 
@@ -636,6 +1597,7 @@ class Rasterizer(Component):
                 depth_tester.in_p_offset,
                 depth_tester.in_texture_buffer,
                 depth_tester.in_texture_enable,
+                depth_tester.in_depth,
             ).eq(fifo.r_data),
 
             depth_tester.zst_valid.eq(z_reader.out_z_valid),
@@ -645,36 +1607,52 @@ class Rasterizer(Component):
 
         accept_pix = Signal()
 
+        # Pixels of depth-only passes never reach the texture mapper, so they don't touch `axi`
+        color_write_ready = Signal()
+        m.d.comb += color_write_ready.eq(texture_mapper.in_ready | ~depth_tester.out_color_write)
+
+        if self._fast_clear:
+            m.d.comb += [
+                fast_clear.in_write_valid.eq(depth_tester.out_valid & depth_tester.out_depth_write &
+                                             color_write_ready),
+                fast_clear.in_write_p_offset.eq(depth_tester.out_p_offset),
+                fast_clear.in_write_z.eq(depth_tester.out_z),
+
+                fast_clear.out_write_ready.eq(depth_writer.ready),
+                depth_writer.valid.eq(fast_clear.out_write_valid),
+                depth_writer.addr.eq(fast_clear.out_write_addr),
+                depth_writer.data.eq(fast_clear.out_write_data),
+                depth_writer.strb.eq(fast_clear.out_write_strb),
+            ]
+            depth_write_ready = fast_clear.in_write_ready | ~depth_tester.out_depth_write
+        else:
+            m.d.comb += [
+                depth_writer.valid.eq(depth_tester.out_valid & depth_tester.out_depth_write &
+                                      color_write_ready),
+                depth_writer.addr.eq(self.z_base + depth_tester.out_p_offset*2),
+                depth_writer.data.eq(depth_tester.out_z.replicate(4)),
+                depth_writer.strb.eq(0b11 << (depth_tester.out_p_offset[:2] * 2)),
+            ]
+            depth_write_ready = depth_writer.ready | ~depth_tester.out_depth_write
+
         m.d.sync += [
-            self.perf_counters.stalls.depth_store_addr.eq(depth_tester.out_valid & ~self.axi2.write_address.ready),
-            self.perf_counters.stalls.depth_store_data.eq(depth_tester.out_valid & ~self.axi2.write_data.ready),
+            self.perf_counters.stalls.depth_store_addr.eq(
+                depth_writer.write_address.valid & ~depth_writer.write_address.ready
+            ),
+            self.perf_counters.stalls.depth_store_data.eq(depth_tester.out_valid & ~depth_write_ready),
         ]
         m.d.comb += [
-            self.axi2.write_address.addr.eq(Cat(C(0, 3), (self.z_base + depth_tester.out_p_offset*2)[3:])),
-            self.axi2.write_address.burst.eq(0b01),    # INCR
-            self.axi2.write_address.size.eq(0b11),     # 8 bytes/beat
-            self.axi2.write_address.len.eq(0),
-            self.axi2.write_address.cache.eq(0b1111),
-
-            self.axi2.write_data.data.eq(depth_tester.out_z.replicate(4)),
-            self.axi2.write_data.strb.eq(0b11 << (depth_tester.out_p_offset[:2] * 2)),
-            self.axi2.write_data.last.eq(1),
-
-            self.axi2.write_response.ready.eq(1),
-
-            accept_pix.eq(texture_mapper.in_ready & self.axi2.write_data.ready & self.axi2.write_address.ready),
+            # Nothing else will be written until more triangles come
+            depth_writer.flush.eq(idle0 & z_reader.idle & depth_tester.idle & fast_clear_idle),
 
-            self.axi2.write_address.valid.eq(
-                depth_tester.out_valid & texture_mapper.in_ready & self.axi2.write_data.ready
-            ),
-            self.axi2.write_data.valid.eq(
-                depth_tester.out_valid & texture_mapper.in_ready & self.axi2.write_address.ready
-            ),
+            accept_pix.eq(color_write_ready & depth_write_ready),
 
             depth_tester.out_ready.eq(accept_pix),
-            texture_mapper.in_valid.eq(
-                depth_tester.out_valid & self.axi2.write_data.ready & self.axi2.write_address.ready
-            ),
+
+            z_reader.write_valid.eq(depth_tester.out_valid & depth_tester.out_depth_write & accept_pix),
+            z_reader.write_addr.eq(self.z_base + depth_tester.out_p_offset*2),
+            z_reader.write_z.eq(depth_tester.out_z),
+            texture_mapper.in_valid.eq(depth_tester.out_valid & depth_tester.out_color_write & depth_write_ready),
 
             texture_mapper.in_p_offset.eq(depth_tester.out_p_offset),
             texture_mapper.in_r.eq(depth_tester.out_r),
@@ -702,6 +1680,8 @@ class Rasterizer(Component):
                 texture_mapper.out_p_offset
             )),
 
+            writer.flush.eq(idle0 & z_reader.idle & depth_tester.idle & texture_mapper.idle & tx_wr_fifo_empty),
+
             tx_wr_fifo.r_en.eq(writer.ready),
             writer.valid.eq(tx_wr_fifo.r_rdy),
             Cat(
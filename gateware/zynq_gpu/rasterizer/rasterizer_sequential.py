@@ -17,6 +17,8 @@ class Rasterizer(Component):
     width: In(12)
     z_base: In(32)
     fb_base: In(32)
+    scissor_min: In(Point)
+    scissor_max: In(Point)
 
     # Unused, but keeps signature compatible with pipelined
     perf_counters: Out(PerfCounters)
@@ -29,7 +31,7 @@ class Rasterizer(Component):
         m.d.comb += self.axi.aclk.eq(ClockSignal())
         m.d.comb += self.axi2.aclk.eq(ClockSignal())
 
-        m.submodules.walker = walker = EdgeWalker()
+        m.submodules.walker = walker = EdgeWalker(clip=True, small_triangles=True)
         m.submodules.writer = writer = PixelWriter()
 
         for vertex_idx in range(3):
@@ -37,6 +39,10 @@ class Rasterizer(Component):
             input_vertex = getattr(self.triangles.payload, f"v{vertex_idx}")
             for sig in ["x", "y"]:
                 m.d.comb += getattr(walker_vertex, sig).eq(getattr(input_vertex, sig))
+        m.d.comb += [
+            walker.clip_min.eq(self.scissor_min),
+            walker.clip_max.eq(self.scissor_max),
+        ]
 
         rs = Array(Signal(8) for _ in range(3))
         gs = Array(Signal(8) for _ in range(3))
@@ -0,0 +1,833 @@
+from amaranth import *
+from amaranth.lib import wiring
+from amaranth.lib.data import ArrayLayout, StructLayout
+from amaranth.lib.fifo import SyncFIFOBuffered
+from amaranth.lib.wiring import Component, In, Out, Signature
+from amaranth.utils import log2_int
+from .edge_walker import *
+from .edge_walker import min3, max3
+from .rasterizer_pipelined import RasterizerInterpolator, RasterizerTextureMapper
+from .types import *
+from ..zynq_ifaces import SAxiHP
+
+
+__all__ = ["Rasterizer"]
+
+
+class _RowBursts(Component):
+    """
+    Splits `rows` rows of `row_beats` 8 byte beats, the first one at `base` and every other one `stride` bytes after
+    the previous, into INCR bursts of at most 16 beats that don't cross 4KiB boundaries. Parameters are sampled on
+    `start`.
+    """
+
+    start: In(1)
+    base: In(32)
+    stride: In(32)
+    rows: In(12)
+    row_beats: In(12)
+
+    idle: Out(1)
+
+    valid: Out(1)
+    ready: In(1)
+    addr: Out(32)
+    len: Out(4)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        busy = Signal()
+        addr = Signal(32)
+        row_addr = Signal(32)
+        stride = Signal(32)
+        rows = Signal(12)
+        row_beats = Signal(12)
+        remaining = Signal(12)
+
+        page_beats = Signal(10)
+        row_left = Signal(5)
+        beats = Signal(5)
+        m.d.comb += [
+            page_beats.eq((0x1000 - addr[:12]) >> 3),
+            row_left.eq(Mux(remaining < 16, remaining, 16)),
+            beats.eq(Mux(page_beats < row_left, page_beats, row_left)),
+
+            self.idle.eq(~busy),
+            self.valid.eq(busy),
+            self.addr.eq(addr),
+            self.len.eq(beats - 1),
+        ]
+
+        with m.If(self.start):
+            m.d.sync += [
+                busy.eq((self.rows != 0) & (self.row_beats != 0)),
+                addr.eq(self.base),
+                row_addr.eq(self.base),
+                stride.eq(self.stride),
+                rows.eq(self.rows),
+                row_beats.eq(self.row_beats),
+                remaining.eq(self.row_beats),
+            ]
+        with m.Elif(self.valid & self.ready):
+            with m.If(remaining == beats):
+                m.d.sync += [
+                    addr.eq(row_addr + stride),
+                    row_addr.eq(row_addr + stride),
+                    remaining.eq(row_beats),
+                    rows.eq(rows - 1),
+                ]
+                with m.If(rows == 1):
+                    m.d.sync += busy.eq(0)
+            with m.Else():
+                m.d.sync += [
+                    addr.eq(addr + (beats << 3)),
+                    remaining.eq(remaining - beats),
+                ]
+
+        return m
+
+
+class _Repacker(Component):
+    """Repacks a stream of `in_bytes` byte words into `out_bytes` byte words, least significant byte first."""
+
+    def __init__(self, in_bytes: int, out_bytes: int):
+        self._in_bytes = in_bytes
+        self._out_bytes = out_bytes
+        super().__init__()
+
+    @property
+    def signature(self):
+        return Signature({
+            "empty": Out(1),
+
+            "in_valid": In(1),
+            "in_ready": Out(1),
+            "in_data": In(8 * self._in_bytes),
+
+            "out_valid": Out(1),
+            "out_ready": In(1),
+            "out_data": Out(8 * self._out_bytes),
+        })
+
+    def elaborate(self, platform):
+        m = Module()
+
+        size = self._in_bytes + self._out_bytes
+        buf = Signal(8 * size)
+        level = Signal(range(size + 1))
+
+        # State after the output word of this cycle is taken, which the input word is appended to
+        buf_after = Signal.like(buf)
+        level_after = Signal.like(level)
+        m.d.comb += [
+            self.empty.eq(level == 0),
+            self.out_valid.eq(level >= self._out_bytes),
+            self.out_data.eq(buf[:8 * self._out_bytes]),
+
+            buf_after.eq(Mux(self.out_ready & self.out_valid, buf >> (8 * self._out_bytes), buf)),
+            level_after.eq(Mux(self.out_ready & self.out_valid, level - self._out_bytes, level)),
+
+            self.in_ready.eq(level_after + self._in_bytes <= size),
+        ]
+
+        with m.If(self.in_valid & self.in_ready):
+            m.d.sync += [
+                buf.eq(buf_after | (self.in_data << (level_after * 8))),
+                level.eq(level_after + self._in_bytes),
+            ]
+        with m.Else():
+            m.d.sync += [
+                buf.eq(buf_after),
+                level.eq(level_after),
+            ]
+
+        return m
+
+
+class _TileReader(Component):
+    """
+    Reads rows of `pixel_bytes` byte pixels in bursts, outputting one pixel per cycle. Rows must be 8 byte aligned.
+    """
+
+    def __init__(self, pixel_bytes: int):
+        self._pixel_bytes = pixel_bytes
+        super().__init__()
+
+    @property
+    def signature(self):
+        return Signature({
+            "start": In(1),
+            "base": In(32),
+            "stride": In(32),
+            "rows": In(12),
+            "row_beats": In(12),
+
+            "idle": Out(1),
+
+            "out_valid": Out(1),
+            "out_data": Out(8 * self._pixel_bytes),
+
+            "read_address": Out(SAxiHP.members["read_address"].signature),
+            "read": Out(SAxiHP.members["read"].signature),
+        })
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.bursts = bursts = _RowBursts()
+        m.submodules.unpacker = unpacker = _Repacker(8, self._pixel_bytes)
+
+        pending_bursts = Signal(range(64))
+        sent_burst = Signal()
+        got_burst = Signal()
+
+        m.d.comb += [
+            bursts.start.eq(self.start),
+            bursts.base.eq(self.base),
+            bursts.stride.eq(self.stride),
+            bursts.rows.eq(self.rows),
+            bursts.row_beats.eq(self.row_beats),
+
+            self.read_address.valid.eq(bursts.valid & ~pending_bursts.all()),
+            self.read_address.addr.eq(bursts.addr),
+            self.read_address.len.eq(bursts.len),
+            self.read_address.burst.eq(0b01),  # INCR
+            self.read_address.size.eq(0b11),   # 8 bytes/beat
+            bursts.ready.eq(self.read_address.ready & ~pending_bursts.all()),
+
+            unpacker.in_valid.eq(self.read.valid),
+            unpacker.in_data.eq(self.read.data),
+            self.read.ready.eq(unpacker.in_ready),
+
+            # BRAM writes never stall
+            unpacker.out_ready.eq(1),
+            self.out_valid.eq(unpacker.out_valid),
+            self.out_data.eq(unpacker.out_data),
+
+            sent_burst.eq(self.read_address.valid & self.read_address.ready),
+            got_burst.eq(self.read.valid & self.read.ready & self.read.last),
+
+            self.idle.eq(bursts.idle & (pending_bursts == 0) & unpacker.empty),
+        ]
+
+        with m.If(sent_burst & ~got_burst):
+            m.d.sync += pending_bursts.eq(pending_bursts + 1)
+        with m.Elif(~sent_burst & got_burst):
+            m.d.sync += pending_bursts.eq(pending_bursts - 1)
+
+        return m
+
+
+class _TileWriter(Component):
+    """Writes rows of `pixel_bytes` byte pixels in bursts, taking one pixel per cycle. Rows must be 8 byte aligned."""
+
+    def __init__(self, pixel_bytes: int):
+        self._pixel_bytes = pixel_bytes
+        super().__init__()
+
+    @property
+    def signature(self):
+        return Signature({
+            "start": In(1),
+            "base": In(32),
+            "stride": In(32),
+            "rows": In(12),
+            "row_beats": In(12),
+
+            # Every pixel has been sent
+            "done": Out(1),
+            # And every write has been acknowledged
+            "idle": Out(1),
+
+            "in_valid": In(1),
+            "in_ready": Out(1),
+            "in_data": In(8 * self._pixel_bytes),
+
+            "write_address": Out(SAxiHP.members["write_address"].signature),
+            "write_data": Out(SAxiHP.members["write_data"].signature),
+            "write_response": Out(SAxiHP.members["write_response"].signature),
+        })
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.bursts = bursts = _RowBursts()
+        m.submodules.packer = packer = _Repacker(self._pixel_bytes, 8)
+        # Lengths of the bursts whose address has been sent, for the `last` flag of their data
+        m.submodules.lens = lens = SyncFIFOBuffered(width=4, depth=4)
+
+        pending_bursts = Signal(range(64))
+        sent_burst = Signal()
+        beat = Signal(4)
+
+        m.d.comb += [
+            bursts.start.eq(self.start),
+            bursts.base.eq(self.base),
+            bursts.stride.eq(self.stride),
+            bursts.rows.eq(self.rows),
+            bursts.row_beats.eq(self.row_beats),
+
+            self.write_address.valid.eq(bursts.valid & lens.w_rdy & ~pending_bursts.all()),
+            self.write_address.addr.eq(bursts.addr),
+            self.write_address.len.eq(bursts.len),
+            self.write_address.burst.eq(0b01),  # INCR
+            self.write_address.size.eq(0b11),   # 8 bytes/beat
+            bursts.ready.eq(self.write_address.ready & lens.w_rdy & ~pending_bursts.all()),
+            sent_burst.eq(self.write_address.valid & self.write_address.ready),
+            lens.w_en.eq(sent_burst),
+            lens.w_data.eq(bursts.len),
+
+            packer.in_valid.eq(self.in_valid),
+            packer.in_data.eq(self.in_data),
+            self.in_ready.eq(packer.in_ready),
+
+            self.write_data.valid.eq(packer.out_valid & lens.r_rdy),
+            self.write_data.data.eq(packer.out_data),
+            self.write_data.strb.eq(0b11111111),
+            self.write_data.last.eq(beat == lens.r_data),
+            packer.out_ready.eq(self.write_data.ready & lens.r_rdy),
+            lens.r_en.eq(self.write_data.valid & self.write_data.ready & self.write_data.last),
+
+            self.write_response.ready.eq(1),
+
+            self.done.eq(bursts.idle & ~lens.r_rdy & packer.empty),
+            self.idle.eq(self.done & (pending_bursts == 0)),
+        ]
+
+        with m.If(self.write_data.valid & self.write_data.ready):
+            m.d.sync += beat.eq(Mux(self.write_data.last, 0, beat + 1))
+
+        with m.If(sent_burst & ~self.write_response.valid):
+            m.d.sync += pending_bursts.eq(pending_bursts + 1)
+        with m.Elif(~sent_burst & self.write_response.valid):
+            m.d.sync += pending_bursts.eq(pending_bursts - 1)
+
+        return m
+
+
+class Rasterizer(Component):
+    """
+    Tile based deferred rasterizer.
+
+    Triangles are kept in on-chip memory until a flush is requested through `tile_control`, then the screen is drawn
+    one `tile_size` x `tile_size` tile at a time, walking only the triangles whose bounding box touches the tile. Depth
+    testing and color writes of a tile happen in on-chip memory, which is written to memory in bursts once the tile is
+    done, so memory is only accessed once per pixel instead of once per fragment (plus once per read).
+
+    Setup requests (`flush` clear) set whether the tiles of the next frame start cleared to `clear_color` and depth 0,
+    or with the contents of memory (`load`). Flush requests draw the stored triangles and end the frame, optionally
+    also writing depth back to memory (`store_depth`). If more than `batch_size` triangles are submitted between
+    flushes, the stored ones are drawn with depth written back, and the rest of the frame loads it again.
+
+    Pixels are stored in memory in `pixel_format`. `width` must be a multiple of 8. Only pixels inside the inclusive
+    `scissor_min`/`scissor_max` rectangle are drawn, tiles are still loaded and stored whole.
+    """
+
+    axi: Out(SAxiHP)
+    axi2: Out(SAxiHP)
+    idle: Out(1)
+    width: In(12)
+    height: In(12)
+    z_base: In(32)
+    fb_base: In(32)
+    scissor_min: In(Point)
+    scissor_max: In(Point)
+
+    perf_counters: Out(PerfCounters)
+
+    triangles: In(TriangleStream)
+    tile_control: In(TileControlStream)
+    texture_read: Out(TextureBufferRead)
+
+    def __init__(self, *, tile_size: int = 32, batch_size: int = 256,
+                 pixel_format: PixelFormat = PixelFormat.RGB888):
+        if tile_size < 8 or tile_size & (tile_size - 1):
+            raise ValueError(f"Tile size must be a power of two and at least 8, not {tile_size!r}")
+        self._tile_size = tile_size
+        self._batch_size = batch_size
+        self._pixel_format = pixel_format
+        super().__init__()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        tile_size = self._tile_size
+        tile_bits = log2_int(tile_size)
+        tile_pixels = tile_size * tile_size
+        pixel_format = self._pixel_format
+        bpp = pixel_format.bytes_per_pixel
+
+        m.submodules.walker = walker = EdgeWalker(use_fifo=True, pipelined_recip=True, clip=True, small_triangles=True)
+        m.submodules.interpolator = interpolator = RasterizerInterpolator()
+        m.submodules.texture_mapper = texture_mapper = RasterizerTextureMapper()
+
+        m.submodules.color_reader = color_reader = _TileReader(bpp)
+        m.submodules.depth_reader = depth_reader = _TileReader(2)
+        m.submodules.color_writer = color_writer = _TileWriter(bpp)
+        m.submodules.depth_writer = depth_writer = _TileWriter(2)
+
+        m.d.comb += [
+            self.axi.aclk.eq(ClockSignal()),
+            self.axi2.aclk.eq(ClockSignal()),
+        ]
+        wiring.connect(m, wiring.flipped(self.axi.read_address), color_reader.read_address)
+        wiring.connect(m, wiring.flipped(self.axi.read), color_reader.read)
+        wiring.connect(m, wiring.flipped(self.axi.write_address), color_writer.write_address)
+        wiring.connect(m, wiring.flipped(self.axi.write_data), color_writer.write_data)
+        wiring.connect(m, wiring.flipped(self.axi.write_response), color_writer.write_response)
+        wiring.connect(m, wiring.flipped(self.axi2.read_address), depth_reader.read_address)
+        wiring.connect(m, wiring.flipped(self.axi2.read), depth_reader.read)
+        wiring.connect(m, wiring.flipped(self.axi2.write_address), depth_writer.write_address)
+        wiring.connect(m, wiring.flipped(self.axi2.write_data), depth_writer.write_data)
+        wiring.connect(m, wiring.flipped(self.axi2.write_response), depth_writer.write_response)
+        wiring.connect(m, wiring.flipped(self.texture_read), texture_mapper.texture_read)
+
+        triangle_mem = Memory(width=len(self.triangles.payload.as_value()), depth=self._batch_size,
+                              name="triangles", attrs={"RAM_STYLE": "BLOCK"})
+        m.submodules.triangle_rp = triangle_rp = triangle_mem.read_port(transparent=False)
+        m.submodules.triangle_wp = triangle_wp = triangle_mem.write_port()
+        color_mem = Memory(width=8 * bpp, depth=tile_pixels, name="tile_color", attrs={"RAM_STYLE": "BLOCK"})
+        m.submodules.color_rp = color_rp = color_mem.read_port(transparent=False)
+        m.submodules.color_wp = color_wp = color_mem.write_port()
+        depth_mem = Memory(width=16, depth=tile_pixels, name="tile_depth", attrs={"RAM_STYLE": "BLOCK"})
+        m.submodules.depth_rp = depth_rp = depth_mem.read_port(transparent=False)
+        m.submodules.depth_wp = depth_wp = depth_mem.write_port()
+
+        triangle_count = Signal(range(self._batch_size + 1))
+
+        setup_load = Signal()
+        setup_clear_color = Signal(8 * bpp)
+        # Set after the first pass of a frame, so the ones after it (from too many triangles) load what it stored
+        frame_started = Signal()
+        pass_load = Signal()
+        pass_store_depth = Signal()
+        pass_flush = Signal()
+
+        # Current tile, and the pixels of it inside the screen
+        tile_x = Signal(12)
+        tile_y = Signal(12)
+        tile_offset = Signal(24)
+        cols_left = Signal(12)
+        rows_left = Signal(12)
+        cols = Signal(range(tile_size + 1))
+        rows = Signal(range(tile_size + 1))
+        tile_max = Signal(Point)
+        m.d.comb += [
+            cols_left.eq(self.width - tile_x),
+            rows_left.eq(self.height - tile_y),
+            cols.eq(Mux(cols_left < tile_size, cols_left, tile_size)),
+            rows.eq(Mux(rows_left < tile_size, rows_left, tile_size)),
+            tile_max.x.eq(tile_x + cols - 1),
+            tile_max.y.eq(tile_y + rows - 1),
+        ]
+
+        # Same rows for loads and stores
+        for port in [color_reader, color_writer]:
+            m.d.comb += [
+                port.base.eq(self.fb_base + tile_offset * bpp),
+                port.stride.eq(self.width * bpp),
+                port.rows.eq(rows),
+                port.row_beats.eq((cols * bpp) >> 3),
+            ]
+        for port in [depth_reader, depth_writer]:
+            m.d.comb += [
+                port.base.eq(self.z_base + tile_offset * 2),
+                port.stride.eq(self.width * 2),
+                port.rows.eq(rows),
+                port.row_beats.eq(cols >> 2),
+            ]
+
+        # ==========================================
+        # Triangles of the tile
+
+        triangle = Signal(self.triangles.payload.shape())
+        feed_idx = Signal(range(self._batch_size + 1))
+        feed_fetched = Signal()
+        feed_overlaps = Signal()
+        m.d.comb += [
+            triangle_rp.addr.eq(feed_idx),
+            triangle.eq(triangle_rp.data),
+
+            walker.clip_min.x.eq(Mux(tile_x > self.scissor_min.x, tile_x, self.scissor_min.x)),
+            walker.clip_min.y.eq(Mux(tile_y > self.scissor_min.y, tile_y, self.scissor_min.y)),
+            walker.clip_max.x.eq(Mux(tile_max.x < self.scissor_max.x, tile_max.x, self.scissor_max.x)),
+            walker.clip_max.y.eq(Mux(tile_max.y < self.scissor_max.y, tile_max.y, self.scissor_max.y)),
+
+            feed_overlaps.eq(
+                (max3(triangle.v0.x, triangle.v1.x, triangle.v2.x) >= tile_x) &
+                (min3(triangle.v0.x, triangle.v1.x, triangle.v2.x) <= tile_max.x) &
+                (max3(triangle.v0.y, triangle.v1.y, triangle.v2.y) >= tile_y) &
+                (min3(triangle.v0.y, triangle.v1.y, triangle.v2.y) <= tile_max.y)
+            ),
+        ]
+        for vertex_idx in range(3):
+            walker_vertex = getattr(walker.triangle.payload, f"v{vertex_idx}")
+            input_vertex = getattr(triangle, f"v{vertex_idx}")
+            for sig in ["x", "y"]:
+                m.d.comb += getattr(walker_vertex, sig).eq(getattr(input_vertex, sig))
+
+        # The walker sets up the next triangle while the current one is walked, so keep attributes for both,
+        # indexed by the tag of each point. Culled triangles leave their tag to the next one, which overwrites them.
+        attrs = Array(Signal(StructLayout({
+            "r": ArrayLayout(8, 3),
+            "g": ArrayLayout(8, 3),
+            "b": ArrayLayout(8, 3),
+            "z": ArrayLayout(16, 3),
+            "texture_buffer": interpolator.texture_buffer.shape(),
+            "texture_enable": interpolator.texture_enable.shape(),
+            "depth": DepthFlags,
+        }), name=f"attrs_{i}") for i in range(2))
+
+        with m.If(walker.triangle.ready & walker.triangle.valid):
+            for vertex_idx in range(3):
+                input_vertex = getattr(triangle, f"v{vertex_idx}")
+                for sig in "rgbz":
+                    m.d.sync += getattr(attrs[walker.tag], sig)[vertex_idx].eq(getattr(input_vertex, sig))
+            m.d.sync += [
+                attrs[walker.tag].texture_buffer.eq(triangle.texture_buffer),
+                attrs[walker.tag].texture_enable.eq(triangle.texture_enable),
+                attrs[walker.tag].depth.eq(triangle.depth),
+            ]
+
+        # ==========================================
+        # Pixels of the tile, addressed by their offset inside it
+
+        points = walker.points
+        point_attrs = attrs[points.payload.tag]
+        m.d.comb += [
+            interpolator.width.eq(tile_size),
+
+            points.ready.eq(interpolator.in_ready),
+            interpolator.in_valid.eq(points.valid),
+            interpolator.in_p.x.eq(points.payload.p.x[:tile_bits]),
+            interpolator.in_p.y.eq(points.payload.p.y[:tile_bits]),
+            interpolator.in_ws[0].eq(points.payload.w0),
+            interpolator.in_ws[1].eq(points.payload.w1),
+            interpolator.in_ws[2].eq(points.payload.w2),
+
+            interpolator.r.eq(point_attrs.r),
+            interpolator.g.eq(point_attrs.g),
+            interpolator.b.eq(point_attrs.b),
+            interpolator.z.eq(point_attrs.z),
+            interpolator.texture_buffer.eq(point_attrs.texture_buffer),
+            interpolator.texture_enable.eq(point_attrs.texture_enable),
+            interpolator.depth.eq(point_attrs.depth),
+        ]
+
+        # Depth test against the tile memory, the value read is one cycle late for a pixel right after one that
+        # wrote to the same offset, so that write is forwarded.
+        m.submodules.depth_fifo = depth_fifo = SyncFIFOBuffered(width=tile_bits * 2 + 3 * 8 + 3, depth=4)
+
+        d0_valid = Signal()
+        d0_offset = Signal(tile_bits * 2)
+        d0_z = Signal(16)
+        d0_r = Signal(8)
+        d0_g = Signal(8)
+        d0_b = Signal(8)
+        d0_texture_buffer = Signal(2)
+        d0_texture_enable = Signal()
+        d0_depth = Signal(DepthFlags)
+
+        last_write = Signal()
+        last_write_offset = Signal(tile_bits * 2)
+        last_write_z = Signal(16)
+
+        d0_fetched_z = Signal(16)
+        d0_pass = Signal()
+        d0_write = Signal()
+        accept_interp = Signal()
+
+        m.d.comb += [
+            # Never stalls once a pixel is accepted, so only take one if there's room left for it
+            accept_interp.eq(depth_fifo.level + d0_valid < depth_fifo.depth),
+            interpolator.out_ready.eq(accept_interp),
+
+            d0_fetched_z.eq(Mux(last_write & (last_write_offset == d0_offset), last_write_z, depth_rp.data)),
+            d0_pass.eq(d0_valid & (d0_depth.no_test | DepthFunc.compare(d0_depth.func, d0_z, d0_fetched_z))),
+            d0_write.eq(d0_pass & ~d0_depth.no_test & ~d0_depth.no_write),
+
+            depth_fifo.w_en.eq(d0_pass & ~d0_depth.no_color),
+            depth_fifo.w_data.eq(Cat(d0_b, d0_g, d0_r, d0_offset, d0_texture_buffer, d0_texture_enable)),
+
+            depth_fifo.r_en.eq(texture_mapper.in_ready),
+            texture_mapper.in_valid.eq(depth_fifo.r_rdy),
+            Cat(
+                texture_mapper.in_b,
+                texture_mapper.in_g,
+                texture_mapper.in_r,
+                texture_mapper.in_p_offset[:tile_bits * 2],
+                texture_mapper.in_texture_buffer,
+                texture_mapper.in_texture_enable,
+            ).eq(depth_fifo.r_data),
+
+            # Color writes never stall
+            texture_mapper.out_ready.eq(1),
+        ]
+        m.d.sync += [
+            d0_valid.eq(interpolator.out_valid & accept_interp),
+            d0_offset.eq(interpolator.out_p_offset),
+            d0_z.eq(interpolator.out_z),
+            d0_r.eq(interpolator.out_r),
+            d0_g.eq(interpolator.out_g),
+            d0_b.eq(interpolator.out_b),
+            d0_texture_buffer.eq(interpolator.out_texture_buffer),
+            d0_texture_enable.eq(interpolator.out_texture_enable),
+            d0_depth.eq(interpolator.out_depth),
+
+            last_write.eq(d0_write),
+            last_write_offset.eq(d0_offset),
+            last_write_z.eq(d0_z),
+        ]
+
+        drained = Signal()
+        drain_ctr = Signal(2)
+        m.d.comb += drained.eq(
+            walker.idle & ~points.valid & interpolator.idle & ~d0_valid & (depth_fifo.level == 0) &
+            texture_mapper.idle
+        )
+        # Some stages only report data a cycle after taking it
+        with m.If(drained):
+            m.d.sync += drain_ctr.eq(Mux(drain_ctr == 3, 3, drain_ctr + 1))
+        with m.Else():
+            m.d.sync += drain_ctr.eq(0)
+
+        # ==========================================
+        # Loads, one pixel per cycle from each reader
+
+        load_color_col = Signal(tile_bits)
+        load_color_row = Signal(tile_bits)
+        load_depth_col = Signal(tile_bits)
+        load_depth_row = Signal(tile_bits)
+
+        for reader, col, row in [
+            (color_reader, load_color_col, load_color_row),
+            (depth_reader, load_depth_col, load_depth_row),
+        ]:
+            with m.If(reader.out_valid):
+                with m.If(col == cols - 1):
+                    m.d.sync += [
+                        col.eq(0),
+                        row.eq(row + 1),
+                    ]
+                with m.Else():
+                    m.d.sync += col.eq(col + 1)
+
+        # ==========================================
+        # Stores, reading the whole tile memory once and clearing it for the next tile
+
+        m.submodules.color_queue = color_queue = SyncFIFOBuffered(width=8 * bpp, depth=4)
+        m.submodules.depth_queue = depth_queue = SyncFIFOBuffered(width=16, depth=4)
+
+        store_idx = Signal(range(tile_pixels + 1))
+        store_room = Signal()
+        store_read = Signal()
+        store_pending = Signal()
+        store_done = Signal()
+        m.d.comb += [
+            store_room.eq(
+                (store_idx != tile_pixels) &
+                (color_queue.level + store_pending < color_queue.depth) &
+                (depth_queue.level + store_pending < depth_queue.depth)
+            ),
+
+            color_queue.w_en.eq(store_pending),
+            color_queue.w_data.eq(color_rp.data),
+            depth_queue.w_en.eq(store_pending & pass_store_depth),
+            depth_queue.w_data.eq(depth_rp.data),
+
+            color_writer.in_valid.eq(color_queue.r_rdy),
+            color_writer.in_data.eq(color_queue.r_data),
+            color_queue.r_en.eq(color_writer.in_ready),
+            depth_writer.in_valid.eq(depth_queue.r_rdy),
+            depth_writer.in_data.eq(depth_queue.r_data),
+            depth_queue.r_en.eq(depth_writer.in_ready),
+
+            color_rp.addr.eq(store_idx),
+
+            store_done.eq(
+                (store_idx == tile_pixels) & ~store_pending & (color_queue.level == 0) & (depth_queue.level == 0) &
+                color_writer.done & depth_writer.done
+            ),
+        ]
+        # Only pixels inside the screen are stored
+        m.d.sync += store_pending.eq(
+            store_read & (store_idx[tile_bits:] < rows) & (store_idx[:tile_bits] < cols)
+        )
+
+        # ==========================================
+
+        m.d.sync += [
+            self.perf_counters.busy.eq(~self.idle),
+            self.perf_counters.stalls.walker_searching.eq(~walker.idle & ~points.valid & points.ready),
+            self.perf_counters.stalls.pixel_store.eq(color_writer.in_valid & ~color_writer.in_ready),
+        ]
+
+        clear_idx = Signal(range(tile_pixels))
+
+        with m.FSM():
+            with m.State("IDLE"):
+                m.d.comb += [
+                    self.idle.eq(color_writer.idle & depth_writer.idle),
+
+                    self.triangles.ready.eq(triangle_count != self._batch_size),
+                    self.tile_control.ready.eq(1),
+
+                    triangle_wp.addr.eq(triangle_count),
+                    triangle_wp.data.eq(self.triangles.payload),
+                    triangle_wp.en.eq(self.triangles.valid & self.triangles.ready),
+                ]
+                with m.If(self.triangles.valid & self.triangles.ready):
+                    m.d.sync += triangle_count.eq(triangle_count + 1)
+
+                start = Signal()
+                with m.If(self.tile_control.valid):
+                    with m.If(self.tile_control.payload.flush):
+                        m.d.comb += start.eq(1)
+                        m.d.sync += [
+                            pass_flush.eq(1),
+                            pass_store_depth.eq(self.tile_control.payload.store_depth),
+                        ]
+                    with m.Else():
+                        m.d.sync += [
+                            setup_load.eq(self.tile_control.payload.load),
+                            setup_clear_color.eq(pixel_format.pack(
+                                self.tile_control.payload.clear_color[16:24],
+                                self.tile_control.payload.clear_color[8:16],
+                                self.tile_control.payload.clear_color[0:8],
+                            )),
+                        ]
+                with m.Elif(self.triangles.valid & ~self.triangles.ready):
+                    # Out of room, draw what's there and keep depth for the rest of the frame
+                    m.d.comb += start.eq(1)
+                    m.d.sync += [
+                        pass_flush.eq(0),
+                        pass_store_depth.eq(1),
+                    ]
+
+                with m.If(start):
+                    m.d.sync += [
+                        pass_load.eq(frame_started | setup_load),
+                        frame_started.eq(1),
+                        tile_x.eq(0),
+                        tile_y.eq(0),
+                        clear_idx.eq(0),
+                    ]
+                    with m.If(frame_started | setup_load):
+                        m.next = "TILE"
+                    with m.Else():
+                        m.next = "CLEAR"
+
+            with m.State("CLEAR"):
+                # Later tiles are cleared as the previous one is stored
+                m.d.comb += [
+                    color_wp.addr.eq(clear_idx),
+                    color_wp.data.eq(setup_clear_color),
+                    color_wp.en.eq(1),
+                    depth_wp.addr.eq(clear_idx),
+                    depth_wp.data.eq(0),
+                    depth_wp.en.eq(1),
+                ]
+                m.d.sync += clear_idx.eq(clear_idx + 1)
+                with m.If(clear_idx == tile_pixels - 1):
+                    m.next = "TILE"
+
+            with m.State("TILE"):
+                m.d.sync += [
+                    tile_offset.eq(tile_y * self.width + tile_x),
+                    feed_idx.eq(0),
+                    feed_fetched.eq(0),
+                    load_color_col.eq(0),
+                    load_color_row.eq(0),
+                    load_depth_col.eq(0),
+                    load_depth_row.eq(0),
+                ]
+                m.next = "TILE_START"
+
+            with m.State("TILE_START"):
+                with m.If(pass_load):
+                    m.d.comb += [
+                        color_reader.start.eq(1),
+                        depth_reader.start.eq(1),
+                    ]
+                    m.next = "LOAD"
+                with m.Else():
+                    m.next = "RASTER"
+
+            with m.State("LOAD"):
+                m.d.comb += [
+                    color_wp.addr.eq(Cat(load_color_col, load_color_row)),
+                    color_wp.data.eq(color_reader.out_data),
+                    color_wp.en.eq(color_reader.out_valid),
+                    depth_wp.addr.eq(Cat(load_depth_col, load_depth_row)),
+                    depth_wp.data.eq(depth_reader.out_data),
+                    depth_wp.en.eq(depth_reader.out_valid),
+                ]
+                with m.If(color_reader.idle & depth_reader.idle):
+                    m.next = "RASTER"
+
+            with m.State("RASTER"):
+                m.d.comb += [
+                    depth_rp.addr.eq(interpolator.out_p_offset),
+                    depth_wp.addr.eq(d0_offset),
+                    depth_wp.data.eq(d0_z),
+                    depth_wp.en.eq(d0_write),
+
+                    color_wp.addr.eq(texture_mapper.out_p_offset),
+                    color_wp.data.eq(pixel_format.pack(
+                        texture_mapper.out_r, texture_mapper.out_g, texture_mapper.out_b,
+                    )),
+                    color_wp.en.eq(texture_mapper.out_valid),
+                ]
+
+                # The triangle memory has a cycle of latency, then the triangle is sent if it touches the tile
+                with m.If(feed_idx != triangle_count):
+                    with m.If(~feed_fetched):
+                        m.d.sync += feed_fetched.eq(1)
+                    with m.Else():
+                        m.d.comb += walker.triangle.valid.eq(feed_overlaps)
+                        with m.If(~feed_overlaps | walker.triangle.ready):
+                            m.d.sync += [
+                                feed_idx.eq(feed_idx + 1),
+                                feed_fetched.eq(0),
+                            ]
+                with m.Elif(drain_ctr == 3):
+                    m.d.comb += [
+                        color_writer.start.eq(1),
+                        depth_writer.start.eq(pass_store_depth),
+                    ]
+                    m.d.sync += store_idx.eq(0)
+                    m.next = "STORE"
+
+            with m.State("STORE"):
+                m.d.comb += [
+                    store_read.eq(store_room),
+                    depth_rp.addr.eq(store_idx),
+                    color_wp.addr.eq(store_idx),
+                    color_wp.data.eq(setup_clear_color),
+                    color_wp.en.eq(store_read),
+                    depth_wp.addr.eq(store_idx),
+                    depth_wp.data.eq(0),
+                    depth_wp.en.eq(store_read),
+                ]
+                with m.If(store_read):
+                    m.d.sync += store_idx.eq(store_idx + 1)
+
+                with m.If(store_done):
+                    with m.If(tile_x + tile_size < self.width):
+                        m.d.sync += tile_x.eq(tile_x + tile_size)
+                        m.next = "TILE"
+                    with m.Elif(tile_y + tile_size < self.height):
+                        m.d.sync += [
+                            tile_x.eq(0),
+                            tile_y.eq(tile_y + tile_size),
+                        ]
+                        m.next = "TILE"
+                    with m.Else():
+                        m.d.sync += [
+                            triangle_count.eq(0),
+                            frame_started.eq(~pass_flush),
+                        ]
+                        m.next = "IDLE"
+
+        return m
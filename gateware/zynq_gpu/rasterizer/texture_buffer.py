@@ -1,5 +1,5 @@
 from amaranth import *
-from amaranth.lib.wiring import Component, In
+from amaranth.lib.wiring import Component, In, Signature
 from .types import TextureBufferRead, TextureBufferWrite
 
 
@@ -7,53 +7,71 @@ __all__ = ["TextureBuffer"]
 
 
 class TextureBuffer(Component):
-    write: In(TextureBufferWrite)
-    read: In(TextureBufferRead)
-
-    def __init__(self):
+    # With more than one read port, ports after the first are `read_1`, `read_2`, ... and every port gets its own
+    # copy of the memories.
+    def __init__(self, read_ports: int = 1):
+        if read_ports < 1:
+            raise ValueError(f"Read port count must be at least 1, not {read_ports!r}")
+        self._read_ports = read_ports
         super().__init__()
 
+    @property
+    def signature(self):
+        members = {
+            "write": In(TextureBufferWrite),
+            "read": In(TextureBufferRead),
+        }
+        for i in range(1, self._read_ports):
+            members[f"read_{i}"] = In(TextureBufferRead)
+        return Signature(members)
+
+    @property
+    def reads(self):
+        return [self.read] + [getattr(self, f"read_{i}") for i in range(1, self._read_ports)]
+
     def elaborate(self, platform):
         m = Module()
 
         side = 128
         n_pixels = side * side
 
-        pixel_idx = Signal(14)
-        read_buffer_0 = Signal(2)
-        read_buffer_1 = Signal(2)
-        sel_0 = Signal()
-        sel_1 = Signal()
-        m.d.comb += [
-            pixel_idx.eq(Cat(self.read.t, self.read.s)),
-        ]
-        m.d.sync += [
-            sel_0.eq(pixel_idx[0]),
-            sel_1.eq(sel_0),
+        for port, read in enumerate(self.reads):
+            pixel_idx = Signal(14, name=f"pixel_idx_{port}")
+            read_buffer_0 = Signal(2, name=f"read_buffer_0_{port}")
+            read_buffer_1 = Signal(2, name=f"read_buffer_1_{port}")
+            sel_0 = Signal(name=f"sel_0_{port}")
+            sel_1 = Signal(name=f"sel_1_{port}")
+            m.d.comb += [
+                pixel_idx.eq(Cat(read.t, read.s)),
+            ]
+            m.d.sync += [
+                sel_0.eq(pixel_idx[0]),
+                sel_1.eq(sel_0),
 
-            read_buffer_0.eq(self.read.buffer),
-            read_buffer_1.eq(read_buffer_0),
-        ]
+                read_buffer_0.eq(read.buffer),
+                read_buffer_1.eq(read_buffer_0),
+            ]
 
-        for i in range(4):
-            mem = Memory(width=48, depth=n_pixels // 2, name=f"texture_{i}", attrs={"RAM_STYLE": "BLOCK"})
+            for i in range(4):
+                suffix = f"{i}" if port == 0 else f"{i}_{port}"
+                mem = Memory(width=48, depth=n_pixels // 2, name=f"texture_{suffix}", attrs={"RAM_STYLE": "BLOCK"})
 
-            m.submodules[f"rp_{i}"] = rp = mem.read_port(transparent=False)
-            m.submodules[f"wp_{i}"] = wp = mem.write_port()
+                m.submodules[f"rp_{suffix}"] = rp = mem.read_port(transparent=False)
+                m.submodules[f"wp_{suffix}"] = wp = mem.write_port()
 
-            pipeline_reg = Signal.like(rp.data, name=f"pipeline_reg_{i}")
+                pipeline_reg = Signal.like(rp.data, name=f"pipeline_reg_{suffix}")
 
-            m.d.comb += [
-                wp.addr.eq(self.write.addr),
-                wp.data.eq(self.write.data),
-                wp.en.eq(self.write.en & (self.write.buffer == i)),
+                m.d.comb += [
+                    wp.addr.eq(self.write.addr),
+                    wp.data.eq(self.write.data),
+                    wp.en.eq(self.write.en & (self.write.buffer == i)),
 
-                rp.addr.eq(pixel_idx[1:]),
-                rp.en.eq(self.read.en & (self.read.buffer == i)),
-            ]
-            m.d.sync += pipeline_reg.eq(rp.data)
+                    rp.addr.eq(pixel_idx[1:]),
+                    rp.en.eq(read.en & (read.buffer == i)),
+                ]
+                m.d.sync += pipeline_reg.eq(rp.data)
 
-            with m.If(read_buffer_1 == i):
-                m.d.comb += self.read.color.eq(pipeline_reg.word_select(sel_1, 24)),
+                with m.If(read_buffer_1 == i):
+                    m.d.comb += read.color.eq(pipeline_reg.word_select(sel_1, 24)),
 
         return m
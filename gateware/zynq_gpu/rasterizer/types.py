@@ -1,15 +1,72 @@
+import enum
 from amaranth import *
 from amaranth.lib.data import StructLayout
 from amaranth.lib.wiring import In, Out, Signature
 from amaranth.utils import log2_int
 
 
-__all__ = ["Vertex", "TriangleStream", "TextureBufferRead", "TextureBufferWrite", "BufferClearStream", "PerfCounters"]
+__all__ = [
+    "PixelFormat", "DepthFunc", "DepthFlags", "Vertex", "TriangleStream", "TextureBufferRead", "TextureBufferWrite",
+    "BufferClearStream", "TileControlStream", "PerfCounters",
+]
 
 
+# Values are what's used in commands and registers
+class PixelFormat(enum.Enum):
+    RGB888 = 0      # Packed, 3 bytes/pixel
+    XRGB8888 = 1    # 4 bytes/pixel, the top byte is unused
+    RGB565 = 2      # 2 bytes/pixel
+
+    @property
+    def bytes_per_pixel(self) -> int:
+        return {PixelFormat.RGB888: 3, PixelFormat.XRGB8888: 4, PixelFormat.RGB565: 2}[self]
+
+    def pack(self, r: Value, g: Value, b: Value) -> Value:
+        match self:
+            case PixelFormat.RGB888:
+                return Cat(b, g, r)
+            case PixelFormat.XRGB8888:
+                return Cat(b, g, r, C(0, 8))
+            case PixelFormat.RGB565:
+                return Cat(b[3:], g[2:], r[3:])
+
+    # Returns the 24-bit BGR value of a pixel
+    def unpack(self, pixel: Value) -> Value:
+        match self:
+            case PixelFormat.RGB888 | PixelFormat.XRGB8888:
+                return pixel[:24]
+            case PixelFormat.RGB565:
+                b, g, r = pixel[:5], pixel[5:11], pixel[11:16]
+                # Repeat the MSBs in the LSBs, so that the full range is covered
+                return Cat(b[2:], b, g[4:], g, r[2:], r)
+
+
+# Values are what's used in commands, a pixel passes when its depth is <func> than the one in the depth buffer
+class DepthFunc(enum.Enum):
+    GREATER = 0
+    LESS = 1
+    EQUAL = 2
+    ALWAYS = 3
+
+    # Whether a pixel of depth `z` passes over `fetched_z` with the `func` of a triangle
+    @staticmethod
+    def compare(func: Value, z: Value, fetched_z: Value) -> Value:
+        return Array([z > fetched_z, z < fetched_z, z == fetched_z, C(1)])[func]
+
+
+# All zeroes is testing with `DepthFunc.GREATER` and writing the depth and color of pixels that pass
+DepthFlags = StructLayout({
+    "func": 2,          # `DepthFunc`
+    "no_test": 1,       # Every pixel passes, depth is neither read nor written
+    "no_write": 1,      # Depth of pixels that pass isn't written
+    "no_color": 1,      # Color of pixels that pass isn't written, for depth-only passes
+})
+
+
+# x/y are signed, up to 2048 pixels left of or above the screen, pixels outside of the scissor rectangle are not drawn
 Vertex = StructLayout({
-    "x": unsigned(11),
-    "y": unsigned(11),
+    "x": signed(12),
+    "y": signed(12),
     "z": unsigned(16),
     "r": unsigned(8),
     "g": unsigned(8),
@@ -26,6 +83,7 @@ TriangleStream = Signature({
         "v2": Vertex,
         "texture_buffer": 2,
         "texture_enable": 1,
+        "depth": DepthFlags,
     })),
 })
 
@@ -57,6 +115,20 @@ BufferClearStream = Signature({
         "words": 20,       # How many words of data should be written.
         "pattern": 24,     # Works for both depth and frame buffers
         "qos": 4,          # AXI QOS field.
+        "format": 2,       # `PixelFormat` the pattern is repeated as.
+    }))
+})
+
+
+TileControlStream = Signature({
+    "ready": In(1),
+    "valid": Out(1),
+
+    "payload": Out(StructLayout({
+        "flush": 1,         # Draw the stored triangles and end the frame, otherwise set up the next frame.
+        "load": 1,          # Setup: tiles start with the buffers in memory instead of cleared.
+        "store_depth": 1,   # Flush: also write the depth buffer to memory.
+        "clear_color": 24,  # Setup: color tiles are cleared to, depth is cleared to 0.
     }))
 })
 
@@ -73,5 +145,10 @@ PerfCounters = StructLayout({
         "depth_store_data": 1,
         "pixel_store": 1,
     }),
+    "depth_cache": StructLayout({
+        "hit": 1,
+        "miss": 1,
+        "evict": 1,
+    }),
     "depth_fifo_bucket": log2_int(9, need_pow2=False),
 })
@@ -0,0 +1,151 @@
+from amaranth import *
+from amaranth.lib.fifo import SyncFIFOBuffered
+from amaranth.lib.wiring import Component, In, Out
+from ..zynq_ifaces import SAxiHP
+
+
+__all__ = ["WriteCombiner"]
+
+
+class WriteCombiner(Component):
+    """
+    Combines writes to the same and to consecutive 64-bit words into INCR bursts of up to 16 beats that don't cross
+    4KiB boundaries. Bytes not written by anything are left unchanged.
+
+    A burst is sent when a write doesn't continue it, when nothing was written for `timeout` cycles or while `flush`
+    is set. Bursts aren't sent before all of their data is known, so write data is never sent ahead of its address.
+    `idle` is only set once every write was acknowledged.
+    """
+
+    idle: Out(1)
+    flush: In(1)
+
+    ready: Out(1)
+    valid: In(1)
+    addr: In(32)    # The 3 LSBs are ignored
+    data: In(64)
+    strb: In(8)
+
+    write_address: Out(SAxiHP.members["write_address"].signature)
+    write_data: Out(SAxiHP.members["write_data"].signature)
+    write_response: Out(SAxiHP.members["write_response"].signature)
+
+    def __init__(self, timeout: int = 16):
+        self._timeout = timeout
+        super().__init__()
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.addr_fifo = addr_fifo = SyncFIFOBuffered(width=29 + 4, depth=4)
+        m.submodules.data_fifo = data_fifo = SyncFIFOBuffered(width=64 + 8 + 1, depth=32)
+
+        m.d.comb += [
+            self.write_address.burst.eq(0b01),    # INCR
+            self.write_address.size.eq(0b11),     # 8 bytes/beat
+            self.write_address.cache.eq(0b1111),
+            self.write_response.ready.eq(1),
+        ]
+
+        # Word being combined, and the start of the burst it's part of
+        word_valid = Signal()
+        word_addr = Signal(29)
+        word_data = Signal(64)
+        word_strb = Signal(8)
+        burst_addr = Signal(29)
+        burst_beats = Signal(4)
+
+        in_word = Signal(29)
+        m.d.comb += in_word.eq(self.addr[3:])
+
+        accept = Signal()
+        m.d.comb += [
+            # Enough room for whichever of the cases below happens
+            self.ready.eq(addr_fifo.w_rdy & data_fifo.w_rdy),
+            accept.eq(self.ready & self.valid),
+        ]
+
+        timer = Signal(range(self._timeout + 1))
+        with m.If(accept):
+            m.d.sync += timer.eq(0)
+        with m.Elif(word_valid & (timer != self._timeout)):
+            m.d.sync += timer.eq(timer + 1)
+
+        same_word = Signal()
+        next_word = Signal()
+        m.d.comb += [
+            same_word.eq(word_valid & (in_word == word_addr)),
+            next_word.eq(word_valid & (in_word == word_addr + 1) & (burst_beats != 15) & (in_word[:9] != 0)),
+        ]
+
+        end_word = Signal()
+        end_burst = Signal()
+
+        with m.If(accept):
+            with m.If(same_word):
+                m.d.sync += [
+                    word_data.eq(Cat(
+                        Mux(self.strb[i], self.data.word_select(i, 8), word_data.word_select(i, 8)) for i in range(8)
+                    )),
+                    word_strb.eq(word_strb | self.strb),
+                ]
+            with m.Else():
+                m.d.comb += [
+                    end_word.eq(word_valid),
+                    end_burst.eq(word_valid & ~next_word),
+                ]
+                m.d.sync += [
+                    word_valid.eq(1),
+                    word_addr.eq(in_word),
+                    word_data.eq(self.data),
+                    word_strb.eq(self.strb),
+                    burst_beats.eq(Mux(next_word, burst_beats + 1, 0)),
+                ]
+                with m.If(~next_word):
+                    m.d.sync += burst_addr.eq(in_word)
+        with m.Elif(word_valid & addr_fifo.w_rdy & data_fifo.w_rdy & (self.flush | (timer == self._timeout))):
+            m.d.comb += [
+                end_word.eq(1),
+                end_burst.eq(1),
+            ]
+            m.d.sync += word_valid.eq(0)
+
+        m.d.comb += [
+            data_fifo.w_en.eq(end_word),
+            data_fifo.w_data.eq(Cat(word_data, word_strb, end_burst)),
+            addr_fifo.w_en.eq(end_burst),
+            addr_fifo.w_data.eq(Cat(burst_addr, burst_beats)),
+        ]
+
+        # Beats of bursts whose address was queued
+        ready_beats = Signal(range(data_fifo.depth + 1))
+        m.d.sync += ready_beats.eq(
+            ready_beats
+            + Mux(end_burst, burst_beats + 1, 0)
+            - (self.write_data.valid & self.write_data.ready)
+        )
+
+        pending_bursts = Signal(range(64))
+        sent_burst = Signal()
+
+        m.d.comb += [
+            self.write_address.valid.eq(addr_fifo.r_rdy & ~pending_bursts.all()),
+            self.write_address.addr.eq(Cat(C(0, 3), addr_fifo.r_data[:29])),
+            self.write_address.len.eq(addr_fifo.r_data[29:]),
+            addr_fifo.r_en.eq(self.write_address.ready & ~pending_bursts.all()),
+
+            self.write_data.valid.eq(data_fifo.r_rdy & (ready_beats != 0)),
+            Cat(self.write_data.data, self.write_data.strb, self.write_data.last).eq(data_fifo.r_data),
+            data_fifo.r_en.eq(self.write_data.ready & (ready_beats != 0)),
+
+            sent_burst.eq(self.write_address.valid & self.write_address.ready),
+
+            self.idle.eq(~word_valid & (addr_fifo.level == 0) & (data_fifo.level == 0) & (pending_bursts == 0)),
+        ]
+
+        with m.If(sent_burst & ~self.write_response.valid):
+            m.d.sync += pending_bursts.eq(pending_bursts + 1)
+        with m.Elif(~sent_burst & self.write_response.valid):
+            m.d.sync += pending_bursts.eq(pending_bursts - 1)
+
+        return m
@@ -1,6 +1,7 @@
 from amaranth import *
 from amaranth.lib import wiring
 from ..hdmi import HDMIFramebuffer, VideoMode
+from ..rasterizer.types import PixelFormat
 from ..zynq_ifaces import SAxiHP
 from .peripheral import Peripheral
 
@@ -9,10 +10,11 @@ __all__ = ["Framebuffer"]
 
 
 class Framebuffer(Peripheral):
-    def __init__(self, mode: VideoMode, *, name=None, src_loc_at=1):
+    def __init__(self, mode: VideoMode, *, pixel_format: PixelFormat = PixelFormat.RGB888, name=None, src_loc_at=1):
         super().__init__(name=name, src_loc_at=src_loc_at)
 
         self._mode = mode
+        self._pixel_format = pixel_format
 
         self.axi = SAxiHP.create()
         self.data_enable = Signal(1)
@@ -27,6 +29,7 @@ class Framebuffer(Peripheral):
         self._addr = self.csr(20, "rw")
         self._words = self.csr(20, "rw")
         self._en = self.csr(1, "rw")
+        self._format = self.csr(2, "r")
 
         self._fetch_start = self.irq()
         self._fetch_end = self.irq()
@@ -40,12 +43,13 @@ class Framebuffer(Peripheral):
         m = Module()
 
         m.submodules.bridge = self._bridge
-        m.submodules.framebuffer = framebuffer = HDMIFramebuffer(self._mode)
+        m.submodules.framebuffer = framebuffer = HDMIFramebuffer(self._mode, self._pixel_format)
         wiring.connect(m, framebuffer.axi, wiring.flipped(self.axi))
 
         m.d.comb += [
             self._width.r_data.eq(framebuffer.width),
             self._height.r_data.eq(framebuffer.height),
+            self._format.r_data.eq(framebuffer.pixel_format.value),
 
             self.data_enable.eq(framebuffer.data_enable),
             self.hsync.eq(framebuffer.hsync),
@@ -1,6 +1,7 @@
 from amaranth import *
 from amaranth.lib import wiring
-from ..rasterizer import PipelinedRasterizer as Rasterizer, PerfCounters
+from ..rasterizer import ParallelRasterizer as Rasterizer, TiledRasterizer, PerfCounters
+from ..rasterizer.types import PixelFormat
 from ..rasterizer.buffer_clearer import BufferClearer
 from ..rasterizer.command_processor import CommandProcessor
 from ..rasterizer.texture_buffer import TextureBuffer
@@ -12,10 +13,56 @@ __all__ = ["Raster"]
 
 
 class Raster(Peripheral):
-    def __init__(self, width: int, *, name=None, src_loc_at=1):
+    # With more than one pipeline, each one draws an interleaved set of rows. Idle and performance counters cover all
+    # pipelines, with stalls counted once per stalled pipeline.
+    #
+    # With `tiled`, triangles are drawn by the tiled rasterizer when flushed by the command stream, which needs the
+    # `height` of the screen too.
+    #
+    # With `hierarchical_z`, pixels hidden behind whole 8x8 tiles are rejected without reading their depth, which
+    # needs the `height` of the screen too. Depth is only tracked for writes from the rasterizer and the buffer
+    # clearer, the CPU must not write to the depth buffer.
+    #
+    # With `fast_depth_clear`, the FAST_CLEAR_DEPTH command clears the depth buffer at `z_base` by marking blocks of it
+    # as cleared in on-chip memory, which needs the `height` of the screen too and a width multiple of 64.
+    #
+    # Pixels are written to the framebuffer in `pixel_format`, which must match the one it's scanned out in.
+    #
+    # Only pixels inside the inclusive scissor rectangle are drawn, which starts out as the whole screen. Vertices can
+    # be up to 2048 pixels left of or above the screen, so triangles only need clipping against the guard band.
+    #
+    # Up to `triangle_queue_depth` decoded triangles wait for the rasterizer, so commands keep being read while it's
+    # busy with a big triangle.
+    #
+    # Commands are either read from single buffers, queued while previous ones are read, or from a ring while it's
+    # enabled. Ring pointers count 64-byte blocks, commands up to the write pointer are read and the read pointer
+    # follows once they're fetched. While the ring is disabled, commands can also be read from a chain of descriptors
+    # in memory, see `DMAScatterGather`.
+    def __init__(self, width: int, *, height: int = None, pipelines: int = 1, tiled: bool = False,
+                 hierarchical_z: bool = False, fast_depth_clear: bool = False,
+                 pixel_format: PixelFormat = PixelFormat.RGB888, triangle_queue_depth: int = 16, name=None,
+                 src_loc_at=1):
         super().__init__(name=name, src_loc_at=src_loc_at)
 
+        if tiled and pipelines != 1:
+            raise ValueError("The tiled rasterizer only has one pipeline")
+        if tiled and hierarchical_z:
+            raise ValueError("The tiled rasterizer doesn't read depth from memory")
+        if tiled and fast_depth_clear:
+            raise ValueError("The tiled rasterizer clears depth on chip")
+        if (tiled or hierarchical_z or fast_depth_clear) and height is None:
+            raise ValueError("The screen height is needed for the tiled rasterizer, hierarchical Z and fast clears")
+        if fast_depth_clear and width % 64:
+            raise ValueError(f"Fast depth clears need a width multiple of 64, not {width!r}")
+
         self._width = width
+        self._height = height
+        self._pipelines = pipelines
+        self._tiled = tiled
+        self._hierarchical_z = hierarchical_z
+        self._fast_depth_clear = fast_depth_clear
+        self._pixel_format = pixel_format
+        self._triangle_queue_depth = triangle_queue_depth
 
         self.axi1 = SAxiHP.create()
         self.axi2 = SAxiHP.create()
@@ -31,25 +78,52 @@ class Raster(Peripheral):
         self._cmd_dma_idle = self.csr(1, "r")
         self._cmd_idle = self.csr(1, "r")
 
-        self._perf_counters = perf_counters = PerfCounters(Signal(PerfCounters))
+        self._perf_counters = perf_counters = [
+            PerfCounters(Signal(PerfCounters, name=f"perf_counters_{i}")) for i in range(pipelines)
+        ]
 
         self._stall_ctrs = {
-            0: (self.csr(32, "r", name="perf_counter_busy_cycles"), perf_counters.busy),
+            0: (self.csr(32, "r", name="perf_counter_busy_cycles"), [Cat(pc.busy for pc in perf_counters).any()]),
         }
         for i, r in enumerate(["walker_searching", "depth_load_addr", "depth_fifo", "depth_load_data",
                                "depth_store_addr", "depth_store_data", "pixel_store"]):
             self._stall_ctrs[len(self._stall_ctrs)] = (
                 self.csr(32, "r", name=f"perf_counter_stall_{r}"),
-                getattr(perf_counters.stalls, r),
+                [getattr(pc.stalls, r) for pc in perf_counters],
             )
         self._stall_fifo_buckets = {}
         for i in range(9):
             level = f"{8*i}_{8*(i+1)-1}" if i < 8 else "full"
             self._stall_fifo_buckets[len(self._stall_fifo_buckets)] = (
                 self.csr(32, "r", name=f"perf_counter_fifo_level_bucket_{level}"))
+        self._depth_cache_ctrs = {}
+        for r in ["hit", "miss", "evict"]:
+            self._depth_cache_ctrs[len(self._depth_cache_ctrs)] = (
+                self.csr(32, "r", name=f"perf_counter_depth_cache_{r}"),
+                [getattr(pc.depth_cache, r) for pc in perf_counters],
+            )
+
+        # x in the 11 LSBs, y in the 11 bits above it
+        self._scissor_min = self.csr(22, "rw")
+        self._scissor_max = self.csr(22, "rw")
+
+        self._triangle_queue_full = self.csr(32, "r", name="perf_counter_triangle_queue_full")
+
+        self._cmd_ring_base = self.csr(26, "rw")
+        self._cmd_ring_blocks = self.csr(16, "rw")
+        self._cmd_ring_ctrl = self.csr(1, "rw")
+        self._cmd_ring_write_ptr = self.csr(16, "rw")
+        self._cmd_ring_read_ptr = self.csr(16, "r")
+
+        self._cmd_dma_queue_space = self.csr(1, "r")
+
+        self._cmd_chain_addr = self.csr(26, "rw")
+        self._cmd_chain_ctrl = self.csr(1, "rw")
 
         self._cmd_done = self.irq()
         self._cmd_dma_done = self.irq()
+        self._cmd_dma_transfer_done = self.irq()
+        self._cmd_fence = self.irq()
 
         self._bridge = self.bridge()
         self.bus = self._bridge.bus
@@ -59,19 +133,35 @@ class Raster(Peripheral):
         m = Module()
 
         m.submodules.bridge = self._bridge
-        m.submodules.rasterizer = rasterizer = Rasterizer()
+        if self._tiled:
+            m.submodules.rasterizer = rasterizer = TiledRasterizer(pixel_format=self._pixel_format)
+        else:
+            kwargs = {"hierarchical_z": True, "max_height": self._height} if self._hierarchical_z else {}
+            if self._fast_depth_clear:
+                kwargs.update(fast_clear=True, max_height=self._height)
+            kwargs["pixel_format"] = self._pixel_format
+            m.submodules.rasterizer = rasterizer = Rasterizer(self._pipelines, **kwargs)
         wiring.connect(m, rasterizer.axi, wiring.flipped(self.axi1))
         wiring.connect(m, rasterizer.axi2, wiring.flipped(self.axi2))
 
         m.d.comb += rasterizer.width.eq(self._width)
 
-        m.submodules.command_processor = command_processor = CommandProcessor()
+        m.submodules.command_processor = command_processor = CommandProcessor(self._triangle_queue_depth)
         wiring.connect(m, command_processor.axi, wiring.flipped(self.axi_cmd))
         wiring.connect(m, command_processor.triangles, rasterizer.triangles)
 
-        m.submodules.texture_buffer = texture_buffer = TextureBuffer()
+        m.submodules.texture_buffer = texture_buffer = TextureBuffer(self._pipelines)
         wiring.connect(m, command_processor.texture_writes, texture_buffer.write)
-        wiring.connect(m, rasterizer.texture_read, texture_buffer.read)
+
+        if self._tiled:
+            m.d.comb += rasterizer.height.eq(self._height)
+            wiring.connect(m, command_processor.tile_control, rasterizer.tile_control)
+            wiring.connect(m, rasterizer.texture_read, texture_buffer.read)
+        else:
+            # Nothing to flush, every triangle is drawn right away
+            m.d.comb += command_processor.tile_control.ready.eq(1)
+            for texture_read, buffer_read in zip(rasterizer.texture_reads, texture_buffer.reads):
+                wiring.connect(m, texture_read, buffer_read)
 
         m.submodules.buffer_clearer = buffer_clearer = BufferClearer()
         wiring.connect(m, buffer_clearer.axi, wiring.flipped(self.axi3))
@@ -81,12 +171,28 @@ class Raster(Peripheral):
             command_processor.rasterizer_idle.eq(rasterizer.idle),
             command_processor.clearer_idle.eq(buffer_clearer.idle),
         ]
+        if not self._tiled:
+            # Any clear might be of the depth buffer
+            m.d.sync += rasterizer.depth_invalidate.eq(~buffer_clearer.idle | self._z_base.w_stb)
+            m.d.comb += rasterizer.depth_fast_clear.eq(command_processor.depth_fast_clear)
+
+        scissor_min = Signal(22)
+        scissor_max = Signal(22, reset=(self._width - 1) | (((self._height or 2048) - 1) << 11))
+        m.d.comb += [
+            rasterizer.scissor_min.eq(scissor_min),
+            rasterizer.scissor_max.eq(scissor_max),
+        ]
 
         for reg, field in zip(
-                [self._fb_base, self._z_base, self._cmd_addr_64, self._cmd_words],
+                [self._fb_base, self._z_base, self._cmd_addr_64, self._cmd_words, self._scissor_min,
+                 self._scissor_max, self._cmd_ring_base, self._cmd_ring_blocks, self._cmd_ring_ctrl,
+                 self._cmd_ring_write_ptr, self._cmd_chain_addr],
                 [
                     rasterizer.fb_base, rasterizer.z_base,
-                    command_processor.control.base_addr, command_processor.control.words
+                    command_processor.control.base_addr, command_processor.control.words,
+                    scissor_min, scissor_max,
+                    command_processor.ring.base_addr, command_processor.ring.blocks, command_processor.ring.enable,
+                    command_processor.ring.write_ptr, command_processor.chain.addr,
                 ],
         ):
             m.d.comb += reg.r_data.eq(field)
@@ -94,8 +200,9 @@ class Raster(Peripheral):
                 m.d.sync += field.eq(reg.w_data)
 
         for a, b in zip(
-                [self._idle, self._cmd_dma_idle, self._cmd_idle],
-                [rasterizer.idle, command_processor.control.idle, command_processor.idle],
+                [self._idle, self._cmd_dma_idle, self._cmd_idle, self._cmd_ring_read_ptr, self._cmd_dma_queue_space],
+                [rasterizer.idle, command_processor.control.idle, command_processor.idle,
+                 command_processor.ring.read_ptr, command_processor.control.queue_space],
         ):
             m.d.comb += a.r_data.eq(b)
 
@@ -108,12 +215,28 @@ class Raster(Peripheral):
         m.d.sync += ctrl_last.eq(ctrl)
         m.d.comb += command_processor.control.trigger.eq(ctrl_last ^ ctrl)
 
-        m.d.comb += self._perf_counters.eq(rasterizer.perf_counters)
-        for i, (r, bit) in self._stall_ctrs.items():
-            m.d.sync += r.r_data.eq(r.r_data + bit)
+        chain_ctrl = Signal()
+        m.d.comb += self._cmd_chain_ctrl.r_data.eq(chain_ctrl)
+        with m.If(self._cmd_chain_ctrl.w_stb):
+            m.d.sync += chain_ctrl.eq(self._cmd_chain_ctrl.w_data)
+
+        chain_ctrl_last = Signal()
+        m.d.sync += chain_ctrl_last.eq(chain_ctrl)
+        m.d.comb += command_processor.chain.trigger.eq(chain_ctrl_last ^ chain_ctrl)
+
+        if self._tiled:
+            m.d.comb += self._perf_counters[0].eq(rasterizer.perf_counters)
+        else:
+            for i, perf_counters in enumerate(self._perf_counters):
+                m.d.comb += perf_counters.eq(rasterizer.perf_counters[i])
+        for i, (r, bits) in self._stall_ctrs.items():
+            m.d.sync += r.r_data.eq(r.r_data + sum(bits))
+        for i, (r, bits) in self._depth_cache_ctrs.items():
+            m.d.sync += r.r_data.eq(r.r_data + sum(bits))
         for i, r in self._stall_fifo_buckets.items():
-            with m.If(self._perf_counters.depth_fifo_bucket == i):
-                m.d.sync += r.r_data.eq(r.r_data + 1)
+            m.d.sync += r.r_data.eq(r.r_data + sum(pc.depth_fifo_bucket == i for pc in self._perf_counters))
+        m.d.sync += self._triangle_queue_full.r_data.eq(
+            self._triangle_queue_full.r_data + command_processor.triangle_queue_full)
 
         cmd_idle_prev = Signal()
         m.d.sync += cmd_idle_prev.eq(command_processor.idle)
@@ -123,4 +246,7 @@ class Raster(Peripheral):
         m.d.sync += cmd_dma_idle_prev.eq(command_processor.control.idle)
         m.d.comb += self._cmd_dma_done.eq(command_processor.control.idle & ~cmd_dma_idle_prev)
 
+        m.d.comb += self._cmd_dma_transfer_done.eq(command_processor.control.transfer_done)
+        m.d.comb += self._cmd_fence.eq(command_processor.fence_irq)
+
         return m
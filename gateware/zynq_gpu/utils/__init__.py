@@ -1 +1,2 @@
 from .div import *
+from .recip import *
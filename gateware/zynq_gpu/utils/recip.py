@@ -0,0 +1,158 @@
+from amaranth import *
+from amaranth.lib.wiring import Component, In, Out, Signature
+
+
+__all__ = ["Reciprocal"]
+
+
+class Reciprocal(Component):
+    """
+    Computes `(2**width - 1) // d`, bit-exact with `Divider` for that numerator.
+
+    Fully pipelined: a new `d` can be triggered every cycle, and `done` is set `LATENCY` cycles after the
+    corresponding `trigger`, with the result in `o` for that cycle only.
+
+    The divisor is normalized to [0.5, 1), its reciprocal is estimated from a small seed table, refined by two
+    Newton-Raphson iterations (which converge from below, so the quotient estimate is never too big) and the
+    quotient is then corrected using the remainder.
+    """
+
+    LATENCY = 10
+
+    # Bits of the normalized divisor (after the leading one) used to index the seed table
+    SEED_INDEX_BITS = 6
+    # Significant bits of each seed table entry
+    SEED_BITS = 9
+
+    def __init__(self, width: int = 24):
+        self._width = width
+        # Fractional bits of the reciprocal estimate, which is in (1, 2]
+        self._frac = width + 2
+        super().__init__()
+
+    @property
+    def signature(self):
+        return Signature({
+            "d": In(unsigned(self._width)),
+            "trigger": In(1),
+
+            "o": Out(unsigned(self._width)),
+            "done": Out(1),
+        })
+
+    @classmethod
+    def seed_table(cls, width: int) -> list[int]:
+        table = []
+        for i in range(1 << cls.SEED_INDEX_BITS):
+            # Middle of the range of normalized divisors that map to this entry
+            lo = (1 << (width - 1)) + (i << (width - 1 - cls.SEED_INDEX_BITS))
+            mid = lo + (1 << (width - 2 - cls.SEED_INDEX_BITS))
+            # Rounded 2**(width + SEED_BITS - 1) / mid, the top SEED_BITS bits of the reciprocal
+            table.append(((1 << (width + cls.SEED_BITS)) + mid) // (2 * mid))
+        return table
+
+    def elaborate(self, platform):
+        m = Module()
+
+        width = self._width
+        frac = self._frac
+        n = (1 << width) - 1
+
+        valid = Signal(self.LATENCY)
+        m.d.sync += valid.eq(Cat(self.trigger, valid))
+        m.d.comb += self.done.eq(valid[-1])
+
+        # Cycle 0
+
+        c0_d = Signal(width)
+        m.d.sync += c0_d.eq(self.d)
+
+        # Cycle 1: normalize to [2**(width - 1), 2**width)
+
+        _lz = Signal(range(width))
+        for i in range(width):
+            with m.If(c0_d[i]):
+                m.d.comb += _lz.eq(width - 1 - i)
+
+        c1_d = Signal(width)
+        c1_dn = Signal(width)
+        c1_lz = Signal(range(width))
+        m.d.sync += [
+            c1_d.eq(c0_d),
+            c1_dn.eq(c0_d << _lz),
+            c1_lz.eq(_lz),
+        ]
+
+        # Cycle 2: seed lookup
+
+        seeds = Array(Const(s, self.SEED_BITS) for s in self.seed_table(width))
+
+        c2_d = Signal(width)
+        c2_dn = Signal(width)
+        c2_lz = Signal(range(width))
+        c2_x = Signal(frac + 2)
+        m.d.sync += [
+            c2_d.eq(c1_d),
+            c2_dn.eq(c1_dn),
+            c2_lz.eq(c1_lz),
+            c2_x.eq(seeds[c1_dn[width - 1 - self.SEED_INDEX_BITS:width - 1]] << (frac + 1 - self.SEED_BITS)),
+        ]
+
+        # Cycles 3-6: x = x * (2 - dn * x), twice
+
+        d = c2_d
+        dn = c2_dn
+        lz = c2_lz
+        x = c2_x
+        for i in range(2):
+            t = Signal(frac + 2, name=f"c{3 + 2 * i}_t")
+            t_d = Signal(width, name=f"c{3 + 2 * i}_d")
+            t_dn = Signal(width, name=f"c{3 + 2 * i}_dn")
+            t_lz = Signal(range(width), name=f"c{3 + 2 * i}_lz")
+            t_x = Signal(frac + 2, name=f"c{3 + 2 * i}_x")
+            m.d.sync += [
+                t.eq((dn * x) >> width),
+                t_d.eq(d),
+                t_dn.eq(dn),
+                t_lz.eq(lz),
+                t_x.eq(x),
+            ]
+
+            new_x = Signal(frac + 2, name=f"c{4 + 2 * i}_x")
+            x_d = Signal(width, name=f"c{4 + 2 * i}_d")
+            x_dn = Signal(width, name=f"c{4 + 2 * i}_dn")
+            x_lz = Signal(range(width), name=f"c{4 + 2 * i}_lz")
+            m.d.sync += [
+                new_x.eq((t_x * (C(1 << (frac + 1), frac + 2) - t)) >> frac),
+                x_d.eq(t_d),
+                x_dn.eq(t_dn),
+                x_lz.eq(t_lz),
+            ]
+
+            d, dn, lz, x = x_d, x_dn, x_lz, new_x
+
+        # Cycle 7: quotient estimate, at most 1 below the exact one
+
+        c7_d = Signal(width)
+        c7_q = Signal(width)
+        m.d.sync += [
+            c7_d.eq(d),
+            c7_q.eq(((((x << width) - x) << lz) >> (frac + width))[:width]),
+        ]
+
+        # Cycle 8: remainder
+
+        c8_d = Signal(width)
+        c8_q = Signal(width)
+        c8_r = Signal(2 * width)
+        m.d.sync += [
+            c8_d.eq(c7_d),
+            c8_q.eq(c7_q),
+            c8_r.eq(n - c7_q * c7_d),
+        ]
+
+        # Cycle 9: correction, matching Divider for d = 0
+
+        m.d.sync += self.o.eq(Mux(c8_d == 0, n, c8_q + (c8_r >= c8_d)))
+
+        return m
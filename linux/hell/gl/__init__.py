@@ -1,4 +1,4 @@
-from .common import GouraudVertex, TextureVertex, CullMode, FrontFace
+from .common import GouraudVertex, TextureVertex, CullMode, FrontFace, DepthFunc
 from .hw import Gl as HardwareGl, TextureBuffer as HardwareTextureBuffer
 
 Gl = HardwareGl
@@ -1,30 +1,34 @@
+import abc
 from ..hal.alloc import Alloc
+from ..hal.display_controller import PixelFormat
+from ..hal.fence import Fence
 from ..hal.mmio import u32
 from ..hal.rasterizer import Rasterizer
-from .common import ScreenVertex
+from .common import DepthFunc, ScreenVertex
 
 
-__all__ = ["CommandBuffer"]
+__all__ = ["CommandBuffer", "SecondaryBuffer"]
 
 
-BUFFER_SIZE_WORDS = 8192
-BUFFER_COUNT = 2
+# The ring is read in 64-byte blocks
+BLOCK_WORDS = 16
+RING_BLOCKS = 1024
+RING_WORDS = RING_BLOCKS * BLOCK_WORDS
 
 
-class CommandBuffer:
-    def __init__(self, rasterizer: Rasterizer, alloc: Alloc):
-        self._rasterizer = rasterizer
-        self._buffers = list(Buffer(alloc) for _ in range(BUFFER_COUNT))
-        self._current_buffer = 0
-        self._current_pos = 0
-
-        self._buffers[self._current_buffer].reset()
-
-    async def draw_triangle(self, texture: int | None, v0: ScreenVertex, v1: ScreenVertex, v2: ScreenVertex):
+# Encodes commands, subclasses decide where the words go
+class Commands(abc.ABC):
+    async def draw_triangle(self, texture: int | None, v0: ScreenVertex, v1: ScreenVertex, v2: ScreenVertex, *,
+                            depth_func: DepthFunc = DepthFunc.GREATER, depth_test: bool = True,
+                            depth_write: bool = True, color_write: bool = True):
         await self.write_raw(
             0x01 |
             ((1 if texture is not None else 0) << 6) |
-            ((texture if texture is not None else 0) << 7)
+            ((texture if texture is not None else 0) << 7) |
+            (depth_func.value << 9) |
+            ((0 if depth_test else 1) << 11) |
+            ((0 if depth_write else 1) << 12) |
+            ((0 if color_write else 1) << 13)
         )
         for v in [v0, v1, v2]:
             bits = v.pack()
@@ -70,81 +74,159 @@ class CommandBuffer:
     async def wait_idle(self):
         await self.write_raw(0x03)
 
-    async def clear_buffer(self, addr: int, words: int, pattern: int):
+    async def clear_buffer(self, addr: int, words: int, pattern: int,
+                           pattern_format: PixelFormat = PixelFormat.RGB888):
         assert addr & 0x7f == 0
 
-        await self.write_raw(0x04 | (pattern << 8))
+        await self.write_raw(0x04 | (int(pattern_format) << 6) | (pattern << 8))
         await self.write_raw(addr >> 7)
         await self.write_raw(words)
 
     async def wait_clear_idle(self):
         await self.write_raw(0x05)
 
+    async def setup_tiles(self, load: bool, clear_color: int):
+        assert 0 <= clear_color < (1 << 24)
+
+        await self.write_raw(0x06 | (int(load) << 6) | (clear_color << 8))
+
+    async def flush_tiles(self, store_depth: bool):
+        await self.write_raw(0x07 | (int(store_depth) << 6))
+
+    async def fast_clear_depth(self):
+        await self.write_raw(0x08)
+
+    # Writes the fence once every previous command is done
+    async def fence(self, fence: Fence, irq: bool = True):
+        assert fence.addr & 0x3 == 0
+
+        await self.write_raw(0x0B | (int(irq) << 6))
+        await self.write_raw(fence.addr)
+        await self.write_raw(fence.seq)
+
+    @abc.abstractmethod
     async def write_raw(self, word: int):
-        await self._maybe_flip()
-        self._buf().write(word)
+        ...
+
+    @abc.abstractmethod
+    async def write_slice(self, data: bytearray):
+        ...
+
+
+# Commands are appended to a ring the command processor keeps reading from, flushing only moves its write pointer
+class CommandBuffer(Commands):
+    def __init__(self, rasterizer: Rasterizer, alloc: Alloc):
+        self._rasterizer = rasterizer
+        self._ring = Ring(alloc)
+        # Next word to write
+        self._pos = 0
+        # Blocks before it were handed to the command processor
+        self._write_ptr = 0
+        # Last read pointer seen, only refreshed once the ring looks full
+        self._read_ptr = 0
+
+        self._rasterizer.setup_cmd_ring(self._ring.phys_addr, RING_BLOCKS)
+        self._ring.dma_buf.sync_start()
+
+    # The secondary buffer must be kept alive until the command processor is done with it
+    async def call(self, secondary: "SecondaryBuffer"):
+        assert secondary.phys_addr is not None
+
+        await self.write_raw(0x09)
+        await self.write_raw(secondary.phys_addr)
+        await self.write_raw(secondary.words)
+
+    async def write_raw(self, word: int):
+        await self._reserve()
+        self._ring.write(self._pos, word)
+        self._pos = (self._pos + 1) % RING_WORDS
 
     async def write_slice(self, data: bytearray):
         assert len(data) % 4 == 0
         while len(data) > 0:
-            await self._maybe_flip()
-            written = self._buf().write_bytes(data)
-            data = data[written:]
+            await self._reserve()
+            words = min(BLOCK_WORDS - self._pos % BLOCK_WORDS, len(data) // 4)
+            self._ring.write_bytes(self._pos, data[:words*4])
+            self._pos = (self._pos + words) % RING_WORDS
+            data = data[words*4:]
 
     async def flush(self):
-        buf = self._buf()
-        if buf.empty():
+        if self._pos == self._write_ptr * BLOCK_WORDS:
             return
 
-        await self._rasterizer.wait_cmd_dma()
-        self._rasterizer.submit_command(buf.phys_addr, buf.finish())
+        # The command processor ignores NOPs, it only reads whole blocks
+        while self._pos % BLOCK_WORDS:
+            await self.write_raw(0x00)
+        self._ring_doorbell()
 
-        self._current_buffer = (self._current_buffer + 1) % BUFFER_COUNT
-        self._buf().reset()
+    async def _reserve(self):
+        if self._pos % BLOCK_WORDS:
+            return
 
-    async def _maybe_flip(self):
-        if self._buf().full():
-            await self.flush()
+        # The write pointer can't catch up with the read pointer, the ring would look empty
+        next_block = (self._pos // BLOCK_WORDS + 1) % RING_BLOCKS
+        while next_block == self._read_ptr:
+            self._read_ptr = self._rasterizer.cmd_ring_read_ptr
+            if next_block != self._read_ptr:
+                break
 
-    def _buf(self):
-        return self._buffers[self._current_buffer]
+            # Full, hand over everything written and wait for the command processor to read it
+            self._ring_doorbell()
+            await self._rasterizer.wait_cmd_dma()
 
+    def _ring_doorbell(self):
+        write_ptr = self._pos // BLOCK_WORDS
+        if write_ptr == self._write_ptr:
+            return
 
-class Buffer:
+        self._ring.dma_buf.sync_end()
+        self._rasterizer.ring_cmd_doorbell(write_ptr)
+        self._write_ptr = write_ptr
+        self._ring.dma_buf.sync_start()
+
+
+class Ring:
     def __init__(self, alloc: Alloc):
-        self.dma_buf, self.phys_addr = alloc.alloc(4 * BUFFER_SIZE_WORDS)
+        self.dma_buf, self.phys_addr = alloc.alloc(4 * RING_WORDS)
         self._map = self.dma_buf.map()
-        self._pos = 0
 
-    def empty(self):
-        return self._pos == 0
+    def write(self, pos: int, val: int):
+        byte_pos = pos * 4
+        self._map[byte_pos:byte_pos+4] = u32(val)
 
-    def full(self):
-        return self._pos == BUFFER_SIZE_WORDS
+    def write_bytes(self, pos: int, vals: bytearray):
+        assert pos + len(vals) // 4 <= RING_WORDS
 
-    def reset(self):
-        self.dma_buf.sync_start()
-        self._pos = 0
+        byte_pos = pos * 4
+        self._map[byte_pos:byte_pos+len(vals)] = vals
 
-    def finish(self):
-        self.dma_buf.sync_end()
-        return self._pos
 
-    def write(self, val: int):
-        assert not self.full()
+# Commands recorded once and read from primary command buffers with `CommandBuffer.call`, without writing them again
+class SecondaryBuffer(Commands):
+    def __init__(self):
+        self._data = bytearray()
+        self.dma_buf = None
+        self.phys_addr = None
 
-        byte_pos = self._pos * 4
-        self._map[byte_pos:byte_pos+4] = u32(val)
-        self._pos += 1
+    @property
+    def words(self) -> int:
+        return len(self._data) // 4
 
-    def write_bytes(self, vals: bytearray) -> int:
-        assert len(vals) % 4 == 0
-        assert not self.full()
+    async def write_raw(self, word: int):
+        assert self.dma_buf is None
+        self._data += u32(word)
 
-        write = min(BUFFER_SIZE_WORDS - self._pos, len(vals) // 4)
+    async def write_slice(self, data: bytearray):
+        assert self.dma_buf is None
+        assert len(data) % 4 == 0
+        self._data += data
 
-        byte_pos = self._pos * 4
-        self._map[byte_pos:byte_pos+write*4] = vals[:write*4]
-        self._pos += write
+    # Copies the commands where the command processor can read them, nothing can be recorded after this
+    def finish(self, alloc: Alloc):
+        assert self.dma_buf is None
+        assert 0 < self.words < (1 << 20)
 
-        return write * 4
+        self.dma_buf, self.phys_addr = alloc.alloc(len(self._data))
+        self.dma_buf.sync_start()
+        self.dma_buf.map()[:len(self._data)] = self._data
+        self.dma_buf.sync_end()
@@ -1,10 +1,11 @@
 import enum
+import math
 from dataclasses import dataclass
 from typing import Callable, Iterable, Mapping, Optional, Tuple, TypeVar
 from ..hal import Alloc, DisplayController, Uio
 import glm
 
-__all__ = ["GouraudVertex", "TextureVertex", "CullMode", "FrontFace", "ScreenVertex", "GlCommon"]
+__all__ = ["GouraudVertex", "TextureVertex", "CullMode", "FrontFace", "DepthFunc", "ScreenVertex", "GlCommon"]
 
 
 @dataclass(slots=True)
@@ -37,6 +38,14 @@ class FrontFace(enum.Enum):
     COUNTER_CLOCKWISE = enum.auto()
 
 
+# Compared in screen space, where closer pixels have a greater depth. Values are what's used in commands.
+class DepthFunc(enum.Enum):
+    GREATER = 0
+    LESS = 1
+    EQUAL = 2
+    ALWAYS = 3
+
+
 CLIP_NEG_X = 0x01
 CLIP_POS_X = 0x02
 CLIP_NEG_Y = 0x04
@@ -44,6 +53,9 @@ CLIP_POS_Y = 0x08
 CLIP_NEG_Z = 0x10
 CLIP_POS_Z = 0x20
 
+# Lowest and highest x, then y, in normalized device coordinates
+GuardBand = Tuple[Tuple[float, float], Tuple[float, float]]
+
 
 @dataclass(slots=True)
 class ClipVertex:
@@ -63,15 +75,17 @@ class ClipVertex:
             case 3: return self.w
             case _: raise IndexError()
 
-    def classify(self) -> int:
+    # `guard_band` is the lowest and highest x and y, ((-1.0, 1.0), (-1.0, 1.0)) is the edges of the screen
+    def classify(self, guard_band: GuardBand = ((-1.0, 1.0), (-1.0, 1.0))) -> int:
+        (min_x, max_x), (min_y, max_y) = guard_band
         code = 0
-        if self.x < -self.w:
+        if self.x < self.w * min_x:
             code |= CLIP_NEG_X
-        if self.x > self.w:
+        if self.x > self.w * max_x:
             code |= CLIP_POS_X
-        if self.y < -self.w:
+        if self.y < self.w * min_y:
             code |= CLIP_NEG_Y
-        if self.y > self.w:
+        if self.y > self.w * max_y:
             code |= CLIP_POS_Y
         if self.z < -self.w:
             code |= CLIP_NEG_Z
@@ -90,15 +104,18 @@ class ScreenVertex:
     b: int
 
     def __post_init__(self):
-        assert 0 <= self.x < (1 << 11)
-        assert 0 <= self.y < (1 << 11)
+        assert -(1 << 11) <= self.x < (1 << 11)
+        assert -(1 << 11) <= self.y < (1 << 11)
         assert 0 <= self.z < (1 << 16)
         assert 0 <= self.r_s < (1 << 8)
         assert 0 <= self.g_t < (1 << 8)
         assert 0 <= self.b < (1 << 8)
 
     def pack(self):
-        return self.x | (self.y << 11) | (self.z << 22) | (self.r_s << 38) | (self.g_t << 46) | (self.b << 54)
+        return (
+            (self.x & 0xFFF) | ((self.y & 0xFFF) << 12) | (self.z << 24) |
+            (self.r_s << 40) | (self.g_t << 48) | (self.b << 56)
+        )
 
 
 _V = TypeVar("_V")
@@ -141,7 +158,7 @@ def _orientation(t: (ClipVertex, ClipVertex, ClipVertex)):
     return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
 
 
-def _clip_against_plane(vertices: list[ClipVertex], plane: int) -> list[ClipVertex]:
+def _clip_against_plane(vertices: list[ClipVertex], plane: int, guard_band: GuardBand) -> list[ClipVertex]:
     sign, index = {
         CLIP_NEG_X: (-1.0, 0),
         CLIP_POS_X: (1.0, 0),
@@ -150,6 +167,7 @@ def _clip_against_plane(vertices: list[ClipVertex], plane: int) -> list[ClipVert
         CLIP_NEG_Z: (-1.0, 2),
         CLIP_POS_Z: (1.0, 2),
     }[plane]
+    scale = sign * guard_band[index][0 if sign < 0 else 1] if index < 2 else 1.0
 
     res = []
     for i, vertex in enumerate(vertices):
@@ -157,9 +175,9 @@ def _clip_against_plane(vertices: list[ClipVertex], plane: int) -> list[ClipVert
         v1 = vertex
 
         p0 = v0.pos(index) * sign
-        w0 = v0.w
+        w0 = v0.w * scale
         p1 = v1.pos(index) * sign
-        w1 = v1.w
+        w1 = v1.w * scale
 
         if p0 < w0:
             res.append(v0)
@@ -182,7 +200,12 @@ def _clip_against_plane(vertices: list[ClipVertex], plane: int) -> list[ClipVert
     return res
 
 
-def _clip(t: (ClipVertex, ClipVertex, ClipVertex)) -> Iterable[Tuple[ClipVertex, ClipVertex, ClipVertex]]:
+# The rasterizer only draws inside the screen, so triangles are only clipped against the near/far planes and the x/y
+# planes of `guard_band` (the range of vertex coordinates it accepts) that they cross.
+def _clip(
+        t: (ClipVertex, ClipVertex, ClipVertex),
+        guard_band: GuardBand,
+) -> Iterable[Tuple[ClipVertex, ClipVertex, ClipVertex]]:
     c0 = t[0].classify()
     c1 = t[1].classify()
     c2 = t[2].classify()
@@ -190,11 +213,16 @@ def _clip(t: (ClipVertex, ClipVertex, ClipVertex)) -> Iterable[Tuple[ClipVertex,
         return
 
     vertices = list(t)
-    if (c0 | c1 | c2) != 0:
+    crossed = t[0].classify(guard_band) | t[1].classify(guard_band) | t[2].classify(guard_band)
+    if crossed != 0:
         for plane in [CLIP_NEG_X, CLIP_POS_X, CLIP_NEG_Y, CLIP_POS_Y, CLIP_NEG_Z, CLIP_POS_Z]:
-            vertices = _clip_against_plane(vertices, plane)
+            if crossed & plane:
+                vertices = _clip_against_plane(vertices, plane, guard_band)
 
-        if len(vertices) > 0 and ((vertices[0].classify() & vertices[1].classify() & vertices[2].classify()) != 0):
+        outside = CLIP_NEG_X | CLIP_POS_X | CLIP_NEG_Y | CLIP_POS_Y | CLIP_NEG_Z | CLIP_POS_Z
+        for v in vertices:
+            outside &= v.classify()
+        if len(vertices) > 0 and outside != 0:
             return
 
     for i in range(2, len(vertices) + 1):
@@ -208,8 +236,9 @@ def _to_screen(
 ) -> ScreenVertex:
     r_s, g_t, b = screen_attr_map(v.r_s, v.g_t, v.b)
     rv = ScreenVertex(
-        int(((v.x / v.w) * 0.5 + 0.5) * scale_device[0]),
-        int(((v.y / v.w) * -0.5 + 0.5) * scale_device[1]),
+        # Rounded down and clamped, the guard band already holds them within a rounding error of the 12 bit range
+        min(max(math.floor(((v.x / v.w) * 0.5 + 0.5) * scale_device[0]), -2048), 2047),
+        min(max(math.floor(((v.y / v.w) * -0.5 + 0.5) * scale_device[1]), -2048), 2047),
         int(((v.z / v.w) * -0.5 + 0.5) * scale_device[2]),
         r_s,
         g_t,
@@ -235,10 +264,16 @@ class GlCommon:
         self._projection_view = glm.identity(glm.fmat4x4)
         self._model = glm.identity(glm.fmat4x4)
         self._scale_device = glm.vec3(self._dc.width - 1, self._dc.height - 1, 65535.0)
+        # Screen coordinates from -2048 to 2047 in both directions, which is lopsided around the screen, with y
+        # flipped
+        self._guard_band = (
+            (2 * -2048 / (self._dc.width - 1) - 1, 2 * 2047 / (self._dc.width - 1) - 1),
+            (1 - 2 * 2047 / (self._dc.height - 1), 1 + 2 * 2048 / (self._dc.height - 1)),
+        )
 
         alloc = Alloc()
 
-        fb_size = self._dc.width * self._dc.height * 3
+        fb_size = self._dc.width * self._dc.height * self._dc.pixel_format.bytes_per_pixel
         fb_size = (fb_size + 4095) // 4096 * 4096
 
         self._frame_buffers = list(alloc.alloc(fb_size) for _ in range(3))
@@ -246,6 +281,11 @@ class GlCommon:
 
         self.cull_mode = CullMode.DISABLED
         self.front_face = FrontFace.COUNTER_CLOCKWISE
+        self.depth_func = DepthFunc.GREATER
+        # Without depth test, depth is neither read nor written
+        self.depth_test = True
+        self.depth_write = True
+        self.color_write = True
 
     @property
     def width(self):
@@ -324,7 +364,7 @@ class GlCommon:
             trig = self._cull(trig)
             if not trig:
                 continue
-            for final_trig in _clip(trig):
+            for final_trig in _clip(trig, self._guard_band):
                 yield tuple(map(lambda v: _to_screen(v, self._scale_device, screen_attr_map), final_trig))
 
     def _cull(
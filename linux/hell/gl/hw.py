@@ -1,7 +1,8 @@
+from dataclasses import dataclass
 from typing import Iterable, Mapping
 from .command import CommandBuffer
-from .common import GlCommon, GouraudVertex, TextureVertex
-from ..hal import Alloc, Rasterizer, Uio
+from .common import DepthFunc, GlCommon, GouraudVertex, ScreenVertex, TextureVertex
+from ..hal import Alloc, FenceTimeline, Rasterizer, Uio
 
 __all__ = ["Gl", "TextureBuffer"]
 
@@ -10,10 +11,11 @@ class TextureBuffer:
     def __init__(self, *, _id: int):
         self._id = _id
         self._data = bytearray(128*128*3)
-        self._dirty = True
 
     def load(self, data: bytearray):
         assert len(data) == len(self._data)
+        # Replaced instead of written over, draws waiting for the color pass keep the data they were issued with
+        self._data = bytearray(len(self._data))
         for q in range(4):
             dst_base = 64 * 64 * q
             sx, sy = 64 * (q & 1), 64 * (q >> 1)
@@ -21,18 +23,42 @@ class TextureBuffer:
                 dst_offset = (dst_base + y * 64) * 3
                 src_offset = ((sy + y) * 128 + sx) * 3
                 self._data[dst_offset:dst_offset + 64*3] = data[src_offset:src_offset + 64 * 3]
-        self._dirty = True
+
+
+@dataclass(slots=True)
+class _ColorPassDraw:
+    texture_data: bytearray | None
+    triangles: list[tuple[ScreenVertex, ScreenVertex, ScreenVertex]]
+    color_write: bool
 
 
 class Gl(GlCommon):
-    def __init__(self):
+    def __init__(self, *, fast_depth_clear: bool = False, alternate_depth: bool = False, depth_prepass: bool = False):
         super().__init__()
 
+        assert not (fast_depth_clear and alternate_depth)
+
+        # Requires gateware built with `fast_depth_clear`, which only needs a single depth buffer
+        self._fast_depth_clear = fast_depth_clear
+        # Never clears the depth buffer after the first frame. Even frames use the upper half of the depth range and
+        # odd frames the lower half reversed, with the compare direction flipped, so every pixel drawn is in front of
+        # anything left from the previous frame. Costs a bit of depth precision, and every frame must cover the whole
+        # screen, otherwise depth left from two frames ago can hide pixels.
+        self._alternate_depth = alternate_depth
+        self._depth_frame = -1
+        # Draws only depth as they're issued, then draws color at the end of the frame with `DepthFunc.EQUAL`, so each
+        # pixel's color is written once. Draws that don't write depth are tested against the depth at the point
+        # they're issued, so the color of everything before them is drawn first and they're drawn right away.
+        self._depth_prepass = depth_prepass
+        self._color_pass: list[_ColorPassDraw] = []
+
         self._rast = Rasterizer(Uio("rasterizer"))
+        self._rast.set_scissor(0, 0, self.width - 1, self.height - 1)
 
         alloc = Alloc()
 
         self._cmd = CommandBuffer(self._rast, alloc)
+        self._fences = FenceTimeline(self._rast, alloc)
 
         z_size = self.width * self.height * 2
         z_size = (z_size + 4095) // 4096 * 4096
@@ -41,7 +67,8 @@ class Gl(GlCommon):
         self._depth_buffer_idx = 0
 
         self._next_texture_buffer_id = 1
-        self._loaded_texture_buffers = [0, 0, 0, 0]
+        # Data of the texture loaded in each hardware buffer
+        self._loaded_texture_data: list[bytearray | None] = [None, None, None, None]
         self._next_buffer_replace = 0
 
     def create_texture_buffer(self):
@@ -50,6 +77,20 @@ class Gl(GlCommon):
         return TextureBuffer(_id=i)
 
     async def begin_frame(self):
+        if self._alternate_depth:
+            db, addr = self._depth_buffers[0]
+            self._rast.set_buffers(self._frame_buffers[self._frame_buffer_idx][1], addr)
+            self._depth_frame += 1
+            if self._depth_frame == 0:
+                await self._cmd.clear_buffer(addr, db.size // 8, 0)
+                await self._cmd.wait_clear_idle()
+            return
+
+        if self._fast_depth_clear:
+            self._rast.set_buffers(self._frame_buffers[self._frame_buffer_idx][1], self._depth_buffers[0][1])
+            await self._cmd.fast_clear_depth()
+            return
+
         self._rast.set_buffers(
             self._frame_buffers[self._frame_buffer_idx][1],
             self._depth_buffers[self._depth_buffer_idx][1],
@@ -62,13 +103,17 @@ class Gl(GlCommon):
         await self._cmd.clear_buffer(addr, db.size // 8, 0)
 
     async def end_frame(self, draw: bool):
+        await self._flush_color_pass()
+
         next_fb_idx = (self._frame_buffer_idx + 1) % len(self._frame_buffers)
         fb, fb_addr = self._frame_buffers[next_fb_idx]
-        await self._cmd.clear_buffer(fb_addr, fb.size // 8, 0xFFFFFF)
+        pixel_format = self._dc.pixel_format
+        await self._cmd.clear_buffer(fb_addr, fb.size // 8, pixel_format.pack(0xFF, 0xFF, 0xFF), pixel_format)
 
-        await self._cmd.wait_idle()
+        fence = self._fences.next()
+        await self._cmd.fence(fence)
         await self._cmd.flush()
-        await self._rast.wait_cmd()
+        await fence
 
         await super()._end_frame(draw)
 
@@ -77,8 +122,7 @@ class Gl(GlCommon):
             vertex_buffer: Mapping[int, GouraudVertex] | list[GouraudVertex],
             index_buffer: Iterable[int],
     ):
-        for v0, v1, v2 in self._transform_gouraud(vertex_buffer, index_buffer):
-            await self._cmd.draw_triangle(None, v0, v1, v2)
+        await self._draw_triangles(None, self._transform_gouraud(vertex_buffer, index_buffer))
 
     async def draw_texture(
             self,
@@ -86,25 +130,69 @@ class Gl(GlCommon):
             vertex_buffer: Mapping[int, TextureVertex] | list[TextureVertex],
             index_buffer: Iterable[int],
     ):
+        await self._draw_triangles(texture_buffer, self._transform_texture(vertex_buffer, index_buffer))
+
+    # `TextureBuffer.load` replaces the data, so data already in a hardware buffer is still current
+    async def _load_texture(self, buf: bytearray) -> int:
+        for hw_buf_id, loaded in enumerate(self._loaded_texture_data):
+            if loaded is buf:
+                return hw_buf_id
+
+        hw_buf_id = self._next_buffer_replace
+        self._next_buffer_replace = (self._next_buffer_replace + 1) % 4
+        qs = 64 * 64 * 3
+        await self._cmd.load_texture(hw_buf_id, 0, 63, 0, 63, buf[:qs])
+        await self._cmd.load_texture(hw_buf_id, 0, 63, 64, 127, buf[qs:2*qs])
+        await self._cmd.load_texture(hw_buf_id, 64, 127, 0, 63, buf[2*qs:3*qs])
+        await self._cmd.load_texture(hw_buf_id, 64, 127, 64, 127, buf[3*qs:])
+        self._loaded_texture_data[hw_buf_id] = buf
+
+        return hw_buf_id
+
+    async def _flush_color_pass(self):
+        for d in self._color_pass:
+            if not d.color_write:
+                continue
+            hw_buf_id = await self._load_texture(d.texture_data) if d.texture_data is not None else None
+            for v0, v1, v2 in d.triangles:
+                await self._cmd.draw_triangle(hw_buf_id, v0, v1, v2, depth_func=DepthFunc.EQUAL, depth_write=False)
+        self._color_pass.clear()
+
+    async def _draw_triangles(self, texture_buffer: TextureBuffer | None,
+                              triangles: Iterable[tuple[ScreenVertex, ScreenVertex, ScreenVertex]]):
+        depth_func = self.depth_func
+        if self._alternate_depth and self._depth_frame % 2 == 1:
+            depth_func = {
+                DepthFunc.GREATER: DepthFunc.LESS,
+                DepthFunc.LESS: DepthFunc.GREATER,
+            }.get(depth_func, depth_func)
+
+        if self._depth_prepass:
+            if self.depth_test and self.depth_write:
+                # noinspection PyProtectedMember
+                draw = _ColorPassDraw(texture_buffer._data if texture_buffer is not None else None, [],
+                                      self.color_write)
+                self._color_pass.append(draw)
+                for v0, v1, v2 in triangles:
+                    self._remap_depth(v0, v1, v2)
+                    draw.triangles.append((v0, v1, v2))
+                    await self._cmd.draw_triangle(None, v0, v1, v2, depth_func=depth_func, color_write=False)
+                return
+            await self._flush_color_pass()
+
         # noinspection PyProtectedMember
-        buf_id = texture_buffer._id
-        if buf_id in self._loaded_texture_buffers:
-            hw_buf_id = self._loaded_texture_buffers.index(buf_id)
-            # noinspection PyProtectedMember
-            load = texture_buffer._dirty
+        hw_buf_id = await self._load_texture(texture_buffer._data) if texture_buffer is not None else None
+        for v0, v1, v2 in triangles:
+            self._remap_depth(v0, v1, v2)
+            await self._cmd.draw_triangle(hw_buf_id, v0, v1, v2, depth_func=depth_func, depth_test=self.depth_test,
+                                          depth_write=self.depth_write, color_write=self.color_write)
+
+    def _remap_depth(self, *vertices: ScreenVertex):
+        if not self._alternate_depth:
+            return
+        if self._depth_frame % 2 == 0:
+            for v in vertices:
+                v.z = 0x8000 | (v.z >> 1)
         else:
-            hw_buf_id = self._next_buffer_replace
-            self._next_buffer_replace = (self._next_buffer_replace + 1) % 4
-            load = True
-        if load:
-            qs = 64 * 64 * 3
-            # noinspection PyProtectedMember
-            buf = texture_buffer._data
-            await self._cmd.load_texture(hw_buf_id, 0, 63, 0, 63, buf[:qs])
-            await self._cmd.load_texture(hw_buf_id, 0, 63, 64, 127, buf[qs:2*qs])
-            await self._cmd.load_texture(hw_buf_id, 64, 127, 0, 63, buf[2*qs:3*qs])
-            await self._cmd.load_texture(hw_buf_id, 64, 127, 64, 127, buf[3*qs:])
-            texture_buffer._dirty = False
-
-        for v0, v1, v2 in self._transform_texture(vertex_buffer, index_buffer):
-            await self._cmd.draw_triangle(hw_buf_id, v0, v1, v2)
+            for v in vertices:
+                v.z = 0x7FFF - (v.z >> 1)
@@ -1,4 +1,5 @@
 from .alloc import Alloc
-from .display_controller import DisplayController
+from .display_controller import DisplayController, PixelFormat
+from .fence import Fence, FenceTimeline
 from .rasterizer import Rasterizer
 from .uio import Uio
@@ -1,9 +1,10 @@
 import asyncio
+import enum
 from .uio import Uio
 from .mmio import u32
 
 
-__all__ = ["DisplayController"]
+__all__ = ["DisplayController", "PixelFormat"]
 
 
 IRQ_STATUS = slice(0x00, 0x04)
@@ -13,6 +14,22 @@ HEIGHT = slice(0x0C, 0x10)
 PAGE_ADDR = slice(0x10, 0x14)
 WORDS = slice(0x14, 0x18)
 CTRL = slice(0x18, 0x1C)
+FORMAT = slice(0x1C, 0x20)
+
+
+class PixelFormat(enum.IntEnum):
+    RGB888 = 0
+    XRGB8888 = 1
+    RGB565 = 2
+
+    @property
+    def bytes_per_pixel(self) -> int:
+        return {PixelFormat.RGB888: 3, PixelFormat.XRGB8888: 4, PixelFormat.RGB565: 2}[self]
+
+    def pack(self, r: int, g: int, b: int) -> int:
+        if self == PixelFormat.RGB565:
+            return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+        return (r << 16) | (g << 8) | b
 
 
 class DisplayController:
@@ -22,7 +39,7 @@ class DisplayController:
         self._draw_done = asyncio.Event()
         asyncio.get_event_loop().create_task(self._handle_irq())
 
-        fb_size = self.width * self.height * 3
+        fb_size = self.width * self.height * self.pixel_format.bytes_per_pixel
         assert fb_size % 8 == 0
         self._map[CTRL] = u32(0)
         self._map[WORDS] = u32(fb_size // 8)
@@ -39,6 +56,10 @@ class DisplayController:
     def height(self) -> int:
         return u32(self._map[HEIGHT])
 
+    @property
+    def pixel_format(self) -> PixelFormat:
+        return PixelFormat(u32(self._map[FORMAT]))
+
     async def wait_end_of_frame(self):
         await self._draw_done.wait()
         self._draw_done.clear()
@@ -0,0 +1,67 @@
+from .alloc import Alloc
+from .mmio import u32
+from .rasterizer import Rasterizer
+
+
+__all__ = ["Fence", "FenceTimeline"]
+
+
+# Fences of a timeline share one word in memory, which the command processor sets to each one's sequence number
+class FenceTimeline:
+    def __init__(self, rasterizer: Rasterizer, alloc: Alloc):
+        self._rasterizer = rasterizer
+        self._dma_buf, self.phys_addr = alloc.alloc(4)
+        self._map = self._dma_buf.map()
+        self._seq = 0
+
+        self._dma_buf.sync_start()
+        self._map[0:4] = u32(0)
+        self._dma_buf.sync_end()
+
+    def next(self) -> "Fence":
+        self._seq = (self._seq + 1) & 0xFFFF_FFFF
+        return Fence(self, self._seq)
+
+    # Sequence number of the last fence written
+    @property
+    def value(self) -> int:
+        self._dma_buf.sync_start()
+        value = u32(self._map[0:4])
+        self._dma_buf.sync_end()
+        return value
+
+    @property
+    def rasterizer(self) -> Rasterizer:
+        return self._rasterizer
+
+
+# Signaled once the FENCE command for it was executed, which happens after every command before it is done
+class Fence:
+    def __init__(self, timeline: FenceTimeline, seq: int):
+        self._timeline = timeline
+        self._seq = seq
+
+    @property
+    def addr(self) -> int:
+        return self._timeline.phys_addr
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    @property
+    def signaled(self) -> bool:
+        # Sequence numbers wrap around
+        return (self._timeline.value - self._seq) & 0xFFFF_FFFF < (1 << 31)
+
+    # The command must ask for an IRQ
+    async def wait(self):
+        while True:
+            # Taken before checking, so an IRQ right after the check isn't missed
+            irq = self._timeline.rasterizer.fence_event
+            if self.signaled:
+                return
+            await irq.wait()
+
+    def __await__(self):
+        return self.wait().__await__()
@@ -4,7 +4,7 @@ from .mmio import u32
 from .uio import Uio
 
 
-__all__ = ["Rasterizer"]
+__all__ = ["Rasterizer", "pack_cmd_descriptor"]
 
 
 IRQ_STATUS = slice(0x00, 0x04)
@@ -17,6 +17,26 @@ CMD_WORDS = slice(0x18, 0x1C)
 CMD_CTRL = slice(0x1C, 0x20)
 CMD_DMA_IDLE = slice(0x20, 0x24)
 CMD_IDLE = slice(0x24, 0x28)
+# Performance counters in between
+SCISSOR_MIN = slice(0x78, 0x7C)
+SCISSOR_MAX = slice(0x7C, 0x80)
+PERF_TRIANGLE_QUEUE_FULL = slice(0x80, 0x84)
+CMD_RING_BASE = slice(0x84, 0x88)
+CMD_RING_BLOCKS = slice(0x88, 0x8C)
+CMD_RING_CTRL = slice(0x8C, 0x90)
+CMD_RING_WRITE_PTR = slice(0x90, 0x94)
+CMD_RING_READ_PTR = slice(0x94, 0x98)
+CMD_DMA_QUEUE_SPACE = slice(0x98, 0x9C)
+CMD_CHAIN_ADDR = slice(0x9C, 0xA0)
+CMD_CHAIN_CTRL = slice(0xA0, 0xA4)
+
+
+# Descriptors of a command chain must be 64-byte aligned, the chain ends at one without `next_addr`
+def pack_cmd_descriptor(addr: int, words: int, next_addr: int | None) -> bytes:
+    assert addr & 0x3F == 0
+    assert 0 < words < (1 << 20)
+    assert next_addr is None or (next_addr != 0 and next_addr & 0x3F == 0)
+    return u32(addr) + u32(words) + u32(next_addr or 0) + u32(0)
 
 
 class Rasterizer:
@@ -25,10 +45,12 @@ class Rasterizer:
         self._map = uio.map(0)
         self._cmd_done = asyncio.Event()
         self._cmd_dma_done = asyncio.Event()
+        self._cmd_transfer_done = asyncio.Event()
+        self._fence = asyncio.Event()
 
         asyncio.get_event_loop().create_task(self._handle_irq())
 
-        self._map[IRQ_MASK] = u32(0b11)
+        self._map[IRQ_MASK] = u32(0b1111)
 
     async def wait_cmd_dma(self):
         await self._cmd_dma_done.wait()
@@ -38,9 +60,25 @@ class Rasterizer:
         await self._cmd_done.wait()
         self._cmd_done.clear()
 
+    # Set each time all of a submitted buffer was read
+    async def wait_cmd_transfer(self):
+        await self._cmd_transfer_done.wait()
+        self._cmd_transfer_done.clear()
+
+    # Set on the next fence IRQ
+    @property
+    def fence_event(self) -> asyncio.Event:
+        return self._fence
+
+    @property
+    def cmd_queue_space(self) -> bool:
+        return u32(self._map[CMD_DMA_QUEUE_SPACE]) == 1
+
+    # Starts once previously submitted buffers were read
     def submit_command(self, buffer: int, words: int):
-        assert u32(self._map[CMD_DMA_IDLE]) == 1
+        assert self.cmd_queue_space
         assert buffer & 0x3F == 0
+        assert words > 0
         self._cmd_done.clear()
         self._cmd_dma_done.clear()
 
@@ -48,12 +86,56 @@ class Rasterizer:
         self._map[CMD_WORDS] = u32(words)
         self._map[CMD_CTRL] = u32(u32(self._map[CMD_CTRL]) ^ 1)
 
+    # Commands are read from the ring of 64-byte blocks instead of single buffers after this
+    def setup_cmd_ring(self, buffer: int, blocks: int):
+        assert u32(self._map[CMD_DMA_IDLE]) == 1
+        assert buffer & 0x3F == 0
+        assert 1 < blocks < (1 << 16)
+        self._map[CMD_RING_CTRL] = u32(0)
+        self._map[CMD_RING_BASE] = u32(buffer >> 6)
+        self._map[CMD_RING_BLOCKS] = u32(blocks)
+        self._map[CMD_RING_WRITE_PTR] = u32(0)
+        self._map[CMD_RING_CTRL] = u32(1)
+
+    # Blocks before `write_ptr` are ready to be read
+    def ring_cmd_doorbell(self, write_ptr: int):
+        self._cmd_done.clear()
+        self._cmd_dma_done.clear()
+        self._map[CMD_RING_WRITE_PTR] = u32(write_ptr)
+
+    # Blocks from the last write pointer up to this one may be overwritten
+    @property
+    def cmd_ring_read_ptr(self) -> int:
+        return u32(self._map[CMD_RING_READ_PTR])
+
+    # Reads the buffers of each descriptor in order, starting from the one at `descriptor`
+    def submit_chain(self, descriptor: int):
+        assert u32(self._map[CMD_DMA_IDLE]) == 1
+        assert descriptor & 0x3F == 0
+        self._cmd_done.clear()
+        self._cmd_dma_done.clear()
+
+        self._map[CMD_CHAIN_ADDR] = u32(descriptor >> 6)
+        self._map[CMD_CHAIN_CTRL] = u32(u32(self._map[CMD_CHAIN_CTRL]) ^ 1)
+
     def set_buffers(self, fb: int, zb: int):
         assert fb & 0x7f == 0
         assert zb & 0x7f == 0
         self._map[FB_BASE] = u32(fb)
         self._map[Z_BASE] = u32(zb)
 
+    # Inclusive, must only be changed while idle
+    def set_scissor(self, min_x: int, min_y: int, max_x: int, max_y: int):
+        assert 0 <= min_x <= max_x < (1 << 11)
+        assert 0 <= min_y <= max_y < (1 << 11)
+        self._map[SCISSOR_MIN] = u32(min_x | (min_y << 11))
+        self._map[SCISSOR_MAX] = u32(max_x | (max_y << 11))
+
+    # Cycles where a decoded triangle waited for space in the triangle queue
+    @property
+    def triangle_queue_full_cycles(self) -> int:
+        return u32(self._map[PERF_TRIANGLE_QUEUE_FULL])
+
     async def _handle_irq(self):
         while True:
             self._uio.enable_irq()
@@ -66,4 +148,10 @@ class Rasterizer:
                 self._cmd_done.set()
             if irq_status & 0b10:
                 self._cmd_dma_done.set()
+            if irq_status & 0b100:
+                self._cmd_transfer_done.set()
+            if irq_status & 0b1000:
+                # Every waiter wakes up, later ones get a new event
+                self._fence.set()
+                self._fence = asyncio.Event()
 
@@ -169,8 +169,9 @@ pub(crate) struct ScreenVertex {
 }
 
 impl ScreenVertex {
-    const X: Pack64 = Pack64::least_significant(11);
-    const Y: Pack64 = Self::X.next(11);
+    // Signed in hardware, but vertices are always clipped to the screen here
+    const X: Pack64 = Pack64::least_significant(12);
+    const Y: Pack64 = Self::X.next(12);
     const Z: Pack64 = Self::Y.next(16);
     const R_S: Pack64 = Self::Z.next(8);
     const G_T: Pack64 = Self::R_S.next(8);